@@ -0,0 +1,206 @@
+'''Low-memory BaseRow representation for pipeline steps that hold many rows in
+memory.
+
+A BaseRow stores its key, data, date and source in three separate dictionaries
+per row. When millions of rows are held at once, the per-row dictionary
+overhead and the duplicated dimension strings dominate the memory used.
+
+CompactBaseRow has the same public API as BaseRow but stores:
+- The row key as a tuple of (dimension, value) pairs held in an intern table
+  shared by all rows of the type. Rows with the same key reference the same
+  tuple, and every dimension name and value string is stored only once.
+- The data field names (and their value types) as a shared schema, also held in
+  the intern table. Rows with the same set of fields reference the same schema.
+- The data values in a typed array of doubles. Integer values are restored as
+  ints when the data is read. Values that cannot be stored exactly as doubles
+  (like bools or very large ints) are stored in a tuple instead.
+
+Each type built by `build_compact_row_type` owns its own intern table. The
+owner of the type (like an aggregator holding rows during rollup) should call
+`clear_intern_table` once the rows are no longer needed so that the interned
+values are released. Existing rows keep working after the table is cleared.
+
+NOTE: The `key` and `data` properties build a new dictionary each time they are
+accessed. Modifying the returned dictionary will not change the row. The
+modified dictionary must be assigned back to the row:
+
+data = row.data
+data['field'] += 1
+row.data = data
+'''
+
+from array import array
+
+from data.pipeline.datatypes.base_row import BaseRow
+
+# Largest magnitude an integer can have and still be stored exactly as a double.
+_MAX_EXACT_INT = 2 ** 53
+
+
+class InternTable:
+    '''Table of interned dimension strings, row keys and data schemas.'''
+
+    def __init__(self):
+        self.values = {}
+        self.schemas = {}
+
+    def clear(self):
+        self.values.clear()
+        self.schemas.clear()
+
+    def intern(self, value):
+        return self.values.setdefault(value, value)
+
+    def intern_string(self, value):
+        # NOTE: Only strings are interned since equal values of different types
+        # (like 1, 1.0 and True) would otherwise share the same table entry.
+        if type(value) is str:
+            return self.values.setdefault(value, value)
+        return value
+
+    def intern_key(self, key):
+        items = []
+        interned = True
+        intern_string = self.intern_string
+        for dimension, value in key.items():
+            if value is not None and type(value) is not str:
+                interned = False
+            items.append((intern_string(dimension), intern_string(value)))
+
+        items = tuple(items)
+        return self.intern(items) if interned else items
+
+    def get_schema(self, fields, value_types=None):
+        '''Return the shared schema for the data fields. If no value types are
+        provided, the schema stores the values in a tuple.
+        '''
+        schema_key = (fields, value_types)
+        schema = self.schemas.get(schema_key)
+        if schema is not None:
+            return schema
+
+        int_positions = ()
+        packed = False
+        if value_types is not None:
+            int_positions = tuple(
+                idx for idx, value_type in enumerate(value_types) if value_type is int
+            )
+            packed = all(value_type in (int, float) for value_type in value_types)
+        schema = (tuple(map(self.intern_string, fields)), int_positions, packed)
+        self.schemas[schema_key] = schema
+        return schema
+
+    def pack_data(self, data):
+        '''Convert the data dictionary into an interned schema and compact
+        values.
+
+        The schema is a tuple of (field names, positions of int values, whether
+        the values are stored in a double array).
+        '''
+        values = tuple(data.values())
+        schema = self.get_schema(tuple(data), tuple(map(type, values)))
+        (fields, int_positions, packed) = schema
+        if packed:
+            for idx in int_positions:
+                if not -_MAX_EXACT_INT <= values[idx] <= _MAX_EXACT_INT:
+                    packed = False
+                    break
+
+        if packed:
+            return (schema, array('d', values))
+        return (self.get_schema(fields), values)
+
+
+class CompactBaseRow(BaseRow):
+    __slots__ = ('_key', '_schema', '_values', '_date', '_source')
+
+    INTERN_TABLE = InternTable()
+
+    # pylint: disable=super-init-not-called
+    def __init__(
+        self,
+        key_dict: dict = None,
+        data_dict: dict = None,
+        date: str = '',
+        source: str = '',
+    ):
+        self.key = key_dict or {}
+        self.data = data_dict or {}
+        self.date = date
+        self.source = source
+
+    @classmethod
+    def from_base_row(cls, row):
+        return cls(row.key, row.data, row.date, row.source)
+
+    @classmethod
+    def clear_intern_table(cls):
+        '''Release the values interned by the rows of this type.'''
+        cls.INTERN_TABLE.clear()
+
+    @property
+    def data(self):
+        (fields, int_positions, _) = self._schema
+        if not int_positions:
+            return dict(zip(fields, self._values))
+
+        values = self._values.tolist()
+        for idx in int_positions:
+            values[idx] = int(values[idx])
+        return dict(zip(fields, values))
+
+    @data.setter
+    def data(self, value: dict):
+        assert isinstance(
+            value, dict
+        ), 'Data must be a dictionary type. New value being set: %s' % type(value)
+        self._schema, self._values = self.INTERN_TABLE.pack_data(value)
+
+    @property
+    def key(self):
+        return dict(self._key)
+
+    @key.setter
+    def key(self, value):
+        if not value:
+            value = {}
+        self._key = self.INTERN_TABLE.intern_key(value)
+
+    @property
+    def date(self):
+        return self._date
+
+    @date.setter
+    def date(self, value):
+        self._date = self.INTERN_TABLE.intern_string(value)
+
+    @property
+    def source(self):
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        self._source = self.INTERN_TABLE.intern_string(value)
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'data': self.data,
+            self.DATE_FIELD: self._date,
+            self.SOURCE_FIELD: self._source,
+        }
+
+
+def build_compact_row_type(base_row_cls):
+    '''Return a CompactBaseRow type that shares the class attributes (like
+    MAPPING_KEYS and UNMAPPED_KEYS) of the BaseRow type provided. The type owns
+    a new intern table.
+    '''
+    if issubclass(base_row_cls, CompactBaseRow):
+        return base_row_cls
+
+    return type(
+        'Compact%s' % base_row_cls.__name__,
+        (CompactBaseRow, base_row_cls),
+        {'__slots__': (), 'INTERN_TABLE': InternTable()},
+    )
@@ -0,0 +1,272 @@
+'''Compiled, memory-mappable version of the canonical dimension mapping held by a
+FullRowDimensionDataCollector.
+
+Building a FullRowDimensionDataCollector requires reading and combining the
+metadata and canonical mapping CSVs, which can take a long time for large
+mappings. Every process that needs the mapping (like each `fill_dimension_data.py`
+run) repeats this work and holds its own copy of the mapping in memory.
+
+The compiled lookup file is built once from a collector. It stores the canonical
+data for each cleaned dimension key in an open addressing hash table that is
+read directly from a memory mapped file, so loading the file only reads a small
+header. Since the file is mapped read-only, the operating system shares its pages
+between all processes (including forked workers) that use it.
+
+The CompiledDimensionLookup reading the file only provides the lookup methods of
+the collector (`get_data_for_row`, `canonical_row_has_metadata`), so it can be
+used anywhere a built collector is only read from.
+
+File layout:
+    header: magic, format version, offset and length of the config block
+    config block: JSON with the collector's dimensions and prefixes, the
+        non-hierarchical dimension mappings and the location of each table
+    tables: arrays of fixed size slots holding the hash of a key and the offset
+        and length of the entry for that key
+    entries: JSON encoded [key, value] pairs
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+from functools import lru_cache
+
+from data.pipeline.datatypes.util import build_key_from_dimensions
+
+MAGIC = b'ZDLK'
+
+# Increment when the file layout changes so that old files are rejected.
+FORMAT_VERSION = 1
+
+# Magic, format version, config block offset, config block length.
+_HEADER = struct.Struct('<4sIQQ')
+
+# Key hash, entry offset, entry length. A key hash of 0 marks an empty slot.
+_SLOT = struct.Struct('<QQI')
+
+# Table mapping the cleaned dimension key to the canonical dimension values and
+# metadata for that key.
+CLEAN_TO_CANONICAL_TABLE = 'clean_to_canonical'
+
+# Table containing the canonical dimension keys that have metadata stored.
+CANONICAL_METADATA_TABLE = 'canonical_with_metadata'
+
+# Default number of decoded entries to keep in memory per process.
+DEFAULT_CACHE_SIZE = 50000
+
+
+def _hash_key(key):
+    # NOTE: Python's builtin `hash` is randomized per process, so a stable hash
+    # is needed for the values stored in the file.
+    key_hash = int.from_bytes(
+        hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little'
+    )
+    return key_hash or 1
+
+
+def _get_slot_count(entry_count):
+    # Keep the table at most half full so that probe sequences stay short.
+    slot_count = 8
+    while slot_count < entry_count * 2:
+        slot_count *= 2
+    return slot_count
+
+
+def _build_table(entries, entry_offset):
+    '''Build the slots and serialized entries of a hash table. Return the table
+    bytes, the entry bytes and the number of slots in the table.
+    '''
+    slot_count = _get_slot_count(len(entries))
+    slots = [None] * slot_count
+    entry_parts = []
+    for key, value in entries.items():
+        serialized = json.dumps([key, value], separators=(',', ':')).encode('utf-8')
+        key_hash = _hash_key(key)
+        slot = key_hash & (slot_count - 1)
+        while slots[slot] is not None:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = (key_hash, entry_offset, len(serialized))
+        entry_parts.append(serialized)
+        entry_offset += len(serialized)
+
+    table = bytearray(slot_count * _SLOT.size)
+    for idx, slot_value in enumerate(slots):
+        if slot_value is not None:
+            _SLOT.pack_into(table, idx * _SLOT.size, *slot_value)
+    return (bytes(table), b''.join(entry_parts), slot_count)
+
+
+def write_compiled_dimension_lookup(collector, filename):
+    '''Compile the canonical mapping stored in the FullRowDimensionDataCollector
+    into a lookup file. The file is written to a temporary path and moved into
+    place once complete.
+    '''
+    metadata_mapping = collector.hierarchical_canonical_to_metadata_mapping
+    tables = {
+        CLEAN_TO_CANONICAL_TABLE: collector.hierarchical_clean_to_canonical_mapping,
+        CANONICAL_METADATA_TABLE: {
+            key: True for key, metadata in metadata_mapping.items() if metadata
+        },
+    }
+
+    # Tables are written directly after the header, followed by the entries of
+    # every table, followed by the config block.
+    offset = _HEADER.size
+    table_parts = []
+    entry_parts = []
+    table_locations = {}
+    entry_offset = offset + sum(
+        _get_slot_count(len(entries)) * _SLOT.size for entries in tables.values()
+    )
+    for name, entries in tables.items():
+        (table, serialized_entries, slot_count) = _build_table(entries, entry_offset)
+        table_locations[name] = {
+            'offset': offset,
+            'slot_count': slot_count,
+            'entry_count': len(entries),
+        }
+        table_parts.append(table)
+        entry_parts.append(serialized_entries)
+        offset += len(table)
+        entry_offset += len(serialized_entries)
+
+    config = json.dumps(
+        {
+            'canonical_prefix': collector.canonical_prefix,
+            'cleaned_prefix': collector.cleaned_prefix,
+            'hierarchical_dimensions': collector.hierarchical_dimensions,
+            'non_hierarchical_dimensions': collector.non_hierarchical_dimensions,
+            'non_hierarchical_clean_to_canonical_mapping': (
+                collector.non_hierarchical_clean_to_canonical_mapping
+            ),
+            'tables': table_locations,
+        }
+    ).encode('utf-8')
+
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as output_file:
+            output_file.write(
+                _HEADER.pack(MAGIC, FORMAT_VERSION, entry_offset, len(config))
+            )
+            for table in table_parts:
+                output_file.write(table)
+            for serialized_entries in entry_parts:
+                output_file.write(serialized_entries)
+            output_file.write(config)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+class _MappedTable:
+    '''Read-only view of a hash table stored in a memory mapped lookup file.'''
+
+    def __init__(self, buffer, offset, slot_count, entry_count):
+        self._buffer = buffer
+        self._offset = offset
+        self._mask = slot_count - 1
+        self._entry_count = entry_count
+
+    def __len__(self):
+        return self._entry_count
+
+    def get(self, key):
+        '''Return the value stored for the key, or None if the key is not in the
+        table.
+        '''
+        buffer = self._buffer
+        key_hash = _hash_key(key)
+        slot = key_hash & self._mask
+        while True:
+            (slot_hash, entry_offset, entry_length) = _SLOT.unpack_from(
+                buffer, self._offset + slot * _SLOT.size
+            )
+            if not slot_hash:
+                return None
+            if slot_hash == key_hash:
+                (entry_key, value) = json.loads(
+                    buffer[entry_offset : entry_offset + entry_length]
+                )
+                if entry_key == key:
+                    return value
+            slot = (slot + 1) & self._mask
+
+
+class CompiledDimensionLookup:
+    '''Read-only canonical mapping loaded from a compiled lookup file. It
+    returns the same values as the lookup methods of the
+    FullRowDimensionDataCollector the file was built from, without building the
+    mapping from the mapping CSVs.
+
+    Decoded entries are cached per process so that repeated lookups of the same
+    dimensions do not decode the entry again.
+    '''
+
+    def __init__(self, filename, cache_size=DEFAULT_CACHE_SIZE):
+        with open(filename, 'rb') as input_file:
+            self._buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, config_offset, config_length) = _HEADER.unpack_from(
+            self._buffer, 0
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Unsupported dimension lookup file: %s' % filename)
+
+        config = json.loads(self._buffer[config_offset : config_offset + config_length])
+        self.canonical_prefix = config['canonical_prefix']
+        self.cleaned_prefix = config['cleaned_prefix']
+        self.hierarchical_dimensions = config['hierarchical_dimensions']
+        self.non_hierarchical_dimensions = config['non_hierarchical_dimensions']
+        self.non_hierarchical_clean_to_canonical_mapping = config[
+            'non_hierarchical_clean_to_canonical_mapping'
+        ]
+
+        tables = {
+            name: _MappedTable(
+                self._buffer,
+                location['offset'],
+                location['slot_count'],
+                location['entry_count'],
+            )
+            for name, location in config['tables'].items()
+        }
+        self._clean_to_canonical = tables[CLEAN_TO_CANONICAL_TABLE]
+        self._canonical_with_metadata = tables[CANONICAL_METADATA_TABLE]
+        self._get_clean_data = lru_cache(maxsize=cache_size)(self._read_clean_data)
+
+    def _read_clean_data(self, key):
+        return self._clean_to_canonical.get(key) or {}
+
+    def get_data_for_row(self, row):
+        '''Takes in row data with cleaned dimension values, and returns relevant
+        canonical values and metadata.
+        '''
+        key = build_key_from_dimensions(row, self.hierarchical_dimensions)
+        dimension_data = self._get_clean_data(key)
+        if self.non_hierarchical_dimensions:
+            # only copy dimension data if there are non-hierarchical dimensions
+            dimension_data = dict(dimension_data)
+            for dimension in self.non_hierarchical_dimensions:
+                dimension_map = self.non_hierarchical_clean_to_canonical_mapping[
+                    dimension
+                ]
+                if dimension in row:
+                    dimension_data[dimension] = dimension_map.get(row[dimension], '')
+
+        return dimension_data
+
+    def canonical_row_has_metadata(self, row):
+        '''Determine if the row provided has metadata stored for its canonical
+        values.
+        '''
+        key = build_key_from_dimensions(row, self.hierarchical_dimensions)
+        return bool(self._canonical_with_metadata.get(key))
+
+    @property
+    def clean_row_count(self):
+        return len(self._clean_to_canonical)
@@ -1,6 +1,7 @@
 # pylint: disable=invalid-name
 
 from builtins import object
+from data.pipeline.datatypes.compiled_dimension_lookup import CompiledDimensionLookup
 from data.pipeline.datatypes.dimension_cleaner import DimensionCleaner
 from data.pipeline.datatypes.dimension_collector import DimensionCollector
 from data.pipeline.datatypes.full_dimension_data_collector import (
@@ -197,3 +198,22 @@ class DimensionFactory(object):
                     collector.collect_non_hierarchical_canonical_dimensions(row)
 
         return collector
+
+    def load_compiled_metadata_collector(self, compiled_lookup_filename):
+        '''Load a read-only CompiledDimensionLookup from a lookup file built by
+        `compile_dimension_lookup.py`. It provides the same lookups as a
+        FullRowDimensionDataCollector. The file must have been built with the
+        same dimension config as this factory.
+        '''
+        collector = CompiledDimensionLookup(compiled_lookup_filename)
+        if (
+            collector.hierarchical_dimensions != self.hierarchical_dimensions
+            or collector.non_hierarchical_dimensions != self.non_hierarchical_dimensions
+            or collector.canonical_prefix != self.canonical_prefix
+            or collector.cleaned_prefix != self.clean_prefix
+        ):
+            raise ValueError(
+                'Dimension lookup file was built with a different dimension config: '
+                '%s' % compiled_lookup_filename
+            )
+        return collector
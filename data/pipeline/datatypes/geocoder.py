@@ -1,10 +1,156 @@
 from builtins import object
 import csv
+import json
+import math
+
+import numpy as np
+
+# Mean radius of the Earth in kilometers.
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _to_unit_vectors(lats, lons):
+    '''Convert lat/lon coordinates in degrees into points on the unit sphere.
+    The straight line distance between two points increases with the great circle
+    distance between them, so nearest neighbors can be found using the points.
+    '''
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lats = np.cos(lats)
+    return np.column_stack(
+        (cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats))
+    )
+
+
+def _chord_to_km(chord_length):
+    return 2 * math.asin(min(chord_length / 2, 1.0)) * EARTH_RADIUS_KM
+
+
+class GeoSpatialIndex(object):
+    '''Index for finding the nearest reference location to a lat/lon point.
+
+    The reference locations are stored in a balanced k-d tree built over their
+    position on the unit sphere. The tree is stored implicitly: the node for the
+    range of points [start, end) is the point in the middle of the range, the
+    points before it are in its left subtree and the points after it are in its
+    right subtree. A nearest location query visits O(log n) nodes instead of
+    measuring the distance to every reference location.
+
+    Args:
+        keys: List of location keys (like the tuple of canonical location names)
+            identifying each reference location.
+        lats: Latitude of each reference location.
+        lons: Longitude of each reference location.
+    '''
+
+    def __init__(self, keys, lats, lons):
+        assert len(keys) == len(lats) == len(lons), 'Mismatched location data'
+        points = _to_unit_vectors(lats, lons)
+        order = np.arange(len(keys))
+        axes = np.zeros(len(keys), dtype=np.int8)
+        stack = [(0, len(keys))]
+        while stack:
+            (start, end) = stack.pop()
+            if end - start <= 1:
+                continue
+            # Split on the axis where the points in the range are most spread out.
+            segment_points = points[order[start:end]]
+            axis = int(np.argmax(np.ptp(segment_points, axis=0)))
+            middle = (end - start) // 2
+            partition = np.argpartition(segment_points[:, axis], middle)
+            order[start:end] = order[start:end][partition]
+            axes[start + middle] = axis
+            stack.append((start, start + middle))
+            stack.append((start + middle + 1, end))
+
+        self.keys = [tuple(keys[idx]) for idx in order]
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+        self.lons = np.asarray(lons, dtype=np.float64)[order]
+        self._axes = axes.tolist()
+        # NOTE: The tree is searched one point at a time, which is much faster
+        # with Python lists than with numpy arrays.
+        self._points = points[order].tolist()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nearest(self, lat, lon):
+        '''Return the key of the reference location nearest to the point along
+        with the distance to it in kilometers. Return (None, None) if the index
+        is empty.
+        '''
+        if not self.keys:
+            return (None, None)
+
+        query = _to_unit_vectors([lat], [lon])[0].tolist()
+        points = self._points
+        axes = self._axes
+        best_idx = -1
+        best_distance = float('inf')
+        # Each entry is a range of points to search, along with the minimum
+        # squared distance from the query to any point in that range.
+        stack = [(0, len(points), 0.0)]
+        while stack:
+            (start, end, min_distance) = stack.pop()
+            if start >= end or min_distance >= best_distance:
+                continue
+
+            node = (start + end) // 2
+            point = points[node]
+            distance = (
+                (query[0] - point[0]) ** 2
+                + (query[1] - point[1]) ** 2
+                + (query[2] - point[2]) ** 2
+            )
+            if distance < best_distance:
+                best_idx = node
+                best_distance = distance
+
+            axis = axes[node]
+            split_distance = query[axis] - point[axis]
+            near = (start, node) if split_distance < 0 else (node + 1, end)
+            far = (node + 1, end) if split_distance < 0 else (start, node)
+            # Search the side of the split containing the query first. The other
+            # side can only contain a closer point if the split is closer than
+            # the best point found.
+            stack.append((far[0], far[1], split_distance * split_distance))
+            stack.append((near[0], near[1], 0.0))
+
+        return (self.keys[best_idx], _chord_to_km(math.sqrt(best_distance)))
+
+    def save(self, filename):
+        '''Store the index in a file so that it can be loaded without being
+        rebuilt.
+        '''
+        with open(filename, 'wb') as output_file:
+            np.savez(
+                output_file,
+                keys=np.array([json.dumps(key) for key in self.keys]),
+                lats=self.lats,
+                lons=self.lons,
+                axes=np.array(self._axes, dtype=np.int8),
+            )
+
+    @classmethod
+    def load(cls, filename):
+        '''Load an index stored with `save`.'''
+        with np.load(filename) as stored:
+            index = cls.__new__(cls)
+            index.keys = [tuple(json.loads(key)) for key in stored['keys'].tolist()]
+            index.lats = stored['lats']
+            index.lons = stored['lons']
+            index._axes = stored['axes'].tolist()
+            index._points = _to_unit_vectors(index.lats, index.lons).tolist()
+        return index
 
 
 class Geocoder(object):
     '''Collect all the lat/lon coordinates that apply for a canonical location.
 
+    Reverse geocoding (finding the location nearest to a lat/lon point) is
+    supported through a GeoSpatialIndex built with `build_spatial_index`. The
+    index can be saved to disk and loaded to avoid rebuilding it for each run.
+
     Args:
         mapping_files: Dictionary mapping a dimension to its canonical locations
             file location.
@@ -39,6 +185,42 @@ class Geocoder(object):
         '''
         return self._table.get(self._build_key(location_dict), {})
 
+    def build_spatial_index(self, dimension):
+        '''Build a spatial index over the locations of the given geo dimension
+        that have coordinates. Locations with missing coordinates (stored as
+        0, 0) are not included.
+        '''
+        level = self.geo_order.index(dimension)
+        (lat_dimension, lon_dimension) = self.geo_to_latlng[dimension]
+        keys = []
+        lats = []
+        lons = []
+        for key, geo_data in self._table.items():
+            # Only include locations whose most specific level is this dimension.
+            if not key[level] or any(key[level + 1 :]):
+                continue
+
+            lat = geo_data[lat_dimension]
+            lon = geo_data[lon_dimension]
+            if lat or lon:
+                keys.append(key)
+                lats.append(lat)
+                lons.append(lon)
+        return GeoSpatialIndex(keys, lats, lons)
+
+    def reverse_geocode(self, spatial_index, lat, lon, max_distance_km=None):
+        '''Find the location in the spatial index nearest to the point. Return
+        a dictionary with the canonical location names and lat/lon values of that
+        location, or an empty dictionary if no location is close enough.
+        '''
+        (key, distance) = spatial_index.nearest(lat, lon)
+        if key is None or (max_distance_km is not None and distance > max_distance_km):
+            return {}
+
+        location = dict(zip(self.geo_order, key))
+        location.update(self._table.get(key, {}))
+        return location
+
     def _process_file(self, filename, dimension):
         '''Capture and store the lat/lon data for this dimension.'''
         with open(filename, 'r') as input_file:
@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+import pytest
+
+from data.pipeline.datatypes.base_row import BaseRow
+from data.pipeline.datatypes.compact_base_row import (
+    CompactBaseRow,
+    build_compact_row_type,
+)
+
+
+class CompactBaseRowTestCase(TestCase):
+    def setUp(self) -> None:
+        self.key = {'StateName': 'State', 'MunicipalityName': 'City', 'Age': None}
+        self.data = {'int_field': 5, 'float_field': 2.5, 'zero_field': 0}
+        self.base_row = BaseRow(self.key, self.data, '2020-08-24', 'source')
+        self.compact_row = CompactBaseRow(self.key, self.data, '2020-08-24', 'source')
+
+    def test_accessors(self):
+        self.assertDictEqual(self.key, self.compact_row.key)
+        self.assertDictEqual(self.data, self.compact_row.data)
+        self.assertEqual('2020-08-24', self.compact_row.date)
+        self.assertEqual('source', self.compact_row.source)
+        self.assertIs(int, type(self.compact_row.data['int_field']))
+
+    def test_serialization_matches_base_row(self):
+        self.assertEqual(self.base_row.to_json(True), self.compact_row.to_json(True))
+        self.assertEqual(
+            list(self.base_row.to_druid_json_iterator()),
+            list(self.compact_row.to_druid_json_iterator()),
+        )
+        self.assertEqual(
+            self.base_row.to_nested_druid_json(),
+            self.compact_row.to_nested_druid_json(),
+        )
+
+    def test_from_json(self):
+        row = CompactBaseRow.from_json(self.base_row.to_json())
+        self.assertIsInstance(row, CompactBaseRow)
+        self.assertEqual(self.base_row.to_json(), row.to_json())
+
+    def test_unpackable_values(self):
+        data = {'bool_field': True, 'big_field': 2 ** 60 + 1, 'float_field': 1.5}
+        row = CompactBaseRow(data_dict=data)
+        self.assertDictEqual(data, row.data)
+        self.assertIs(bool, type(row.data['bool_field']))
+
+    def test_key_and_schema_are_shared(self):
+        other_row = CompactBaseRow(dict(self.key), {'int_field': 1.0})
+        self.assertIs(self.compact_row._key, other_row._key)
+        self.assertIsNot(self.compact_row._schema, other_row._schema)
+        self.assertIs(
+            self.compact_row._schema,
+            CompactBaseRow(
+                data_dict={'int_field': 1, 'float_field': 1.0, 'zero_field': 0}
+            )._schema,
+        )
+
+    def test_data_must_be_reassigned(self):
+        data = self.compact_row.data
+        data['int_field'] += 1
+        self.assertEqual(5, self.compact_row.data['int_field'])
+        self.compact_row.data = data
+        self.assertEqual(6, self.compact_row.data['int_field'])
+
+    def test_set_data_validate_requires_dict(self):
+        with pytest.raises(AssertionError):
+            self.compact_row.data = 'test'
+
+    def test_build_compact_row_type(self):
+        base_row_cls = type('TestRow', (BaseRow,), {'MAPPING_KEYS': ['StateName']})
+        row_cls = build_compact_row_type(base_row_cls)
+        self.assertIs(row_cls, build_compact_row_type(row_cls))
+        row = row_cls(self.key, self.data, '2020-08-24')
+        self.assertIsInstance(row, base_row_cls)
+        self.assertEqual('State__2020-08-24', row.row_id)
+
+    def test_intern_table_is_owned_by_type(self):
+        row_cls = build_compact_row_type(BaseRow)
+        other_row_cls = build_compact_row_type(BaseRow)
+        row = row_cls(self.key, self.data, '2020-08-24', 'source')
+        self.assertIsNot(row._key, other_row_cls(self.key)._key)
+        self.assertIs(row._key, row_cls(dict(self.key))._key)
+        self.assertIn('source', row_cls.INTERN_TABLE.values)
+        self.assertNotIn('source', other_row_cls.INTERN_TABLE.values)
+
+        # Rows keep their values after the intern table is released.
+        row_cls.clear_intern_table()
+        self.assertFalse(row_cls.INTERN_TABLE.values)
+        self.assertFalse(row_cls.INTERN_TABLE.schemas)
+        self.assertEqual(self.base_row.to_json(), row.to_json())
@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+from unittest import TestCase
+
+from data.pipeline.datatypes.compiled_dimension_lookup import (
+    CompiledDimensionLookup,
+    write_compiled_dimension_lookup,
+)
+from data.pipeline.datatypes.full_dimension_data_collector import (
+    FullRowDimensionDataCollector,
+)
+
+HIERARCHICAL_DIMENSIONS = ['RegionName', 'DistrictName']
+NON_HIERARCHICAL_DIMENSIONS = ['Sex']
+
+
+class CompiledDimensionLookupTestCase(TestCase):
+    def setUp(self):
+        self.collector = FullRowDimensionDataCollector(
+            'Canonical', 'Clean', HIERARCHICAL_DIMENSIONS, NON_HIERARCHICAL_DIMENSIONS
+        )
+        self.collector.collect_metadata(
+            {'RegionName': 'North', 'DistrictName': 'Hill', 'Lat': '1.5'}
+        )
+        for idx in range(100):
+            self.collector.collect_hierarchical_canonical_dimensions(
+                {
+                    'CleanRegionName': 'north',
+                    'CleanDistrictName': 'hill %d' % idx,
+                    'CanonicalRegionName': 'North',
+                    'CanonicalDistrictName': 'Hill' if idx % 2 else 'Valley',
+                }
+            )
+        self.collector.collect_non_hierarchical_canonical_dimensions(
+            {'dimension': 'Sex', 'Clean': 'f', 'Canonical': 'Female'}
+        )
+
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+        write_compiled_dimension_lookup(self.collector, self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_get_data_for_row(self):
+        compiled = CompiledDimensionLookup(self.filename)
+        self.assertEqual(compiled.clean_row_count, self.collector.clean_row_count)
+        rows = [
+            {'RegionName': 'north', 'DistrictName': 'hill %d' % idx, 'Sex': 'f'}
+            for idx in range(100)
+        ]
+        rows.append({'RegionName': 'north', 'DistrictName': 'unknown', 'Sex': 'm'})
+        rows.append({'RegionName': 'north', 'DistrictName': 'hill 1'})
+        for row in rows:
+            self.assertEqual(
+                compiled.get_data_for_row(row), self.collector.get_data_for_row(row)
+            )
+
+    def test_canonical_row_has_metadata(self):
+        compiled = CompiledDimensionLookup(self.filename)
+        for district in ('Hill', 'Valley', ''):
+            row = {'RegionName': 'North', 'DistrictName': district}
+            self.assertEqual(
+                compiled.canonical_row_has_metadata(row),
+                self.collector.canonical_row_has_metadata(row),
+            )
+
+    def test_read_only(self):
+        # The compiled lookup does not expose the methods that build the mapping.
+        compiled = CompiledDimensionLookup(self.filename)
+        for method in (
+            'collect_metadata',
+            'collect_hierarchical_canonical_dimensions',
+            'collect_non_hierarchical_canonical_dimensions',
+            'store_data_for_row',
+        ):
+            self.assertFalse(hasattr(compiled, method), method)
@@ -0,0 +1,126 @@
+import csv
+import os
+import random
+import tempfile
+
+from unittest import TestCase
+
+from data.pipeline.datatypes.geocoder import (
+    Geocoder,
+    GeoSpatialIndex,
+    _chord_to_km,
+    _to_unit_vectors,
+)
+
+
+def _find_nearest(keys, lats, lons, lat, lon):
+    points = _to_unit_vectors(lats, lons)
+    query = _to_unit_vectors([lat], [lon])[0]
+    distances = ((points - query) ** 2).sum(axis=1)
+    idx = int(distances.argmin())
+    return (keys[idx], _chord_to_km(distances[idx] ** 0.5))
+
+
+class GeoSpatialIndexTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.keys = [('Region %d' % idx,) for idx in range(2000)]
+        self.lats = [rng.uniform(-90, 90) for _ in self.keys]
+        self.lons = [rng.uniform(-180, 180) for _ in self.keys]
+        self.queries = [
+            (rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)
+        ]
+        # Include points that are exactly on a reference location and points
+        # across the antimeridian from one.
+        self.queries.append((self.lats[0], self.lons[0]))
+        self.queries.append((0.0, 179.999))
+        self.queries.append((0.0, -179.999))
+
+    def _assert_matches_linear_search(self, index):
+        for lat, lon in self.queries:
+            (key, distance) = index.nearest(lat, lon)
+            (expected_key, expected_distance) = _find_nearest(
+                self.keys, self.lats, self.lons, lat, lon
+            )
+            self.assertEqual(key, expected_key)
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_nearest(self):
+        index = GeoSpatialIndex(self.keys, self.lats, self.lons)
+        self._assert_matches_linear_search(index)
+        self.assertEqual(GeoSpatialIndex([], [], []).nearest(0, 0), (None, None))
+
+    def test_save_and_load(self):
+        index = GeoSpatialIndex(self.keys, self.lats, self.lons)
+        (fd, filename) = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            index.save(filename)
+            loaded_index = GeoSpatialIndex.load(filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual(len(loaded_index), len(index))
+        self._assert_matches_linear_search(loaded_index)
+
+
+class GeocoderReverseGeocodeTestCase(TestCase):
+    def test_reverse_geocode(self):
+        rows = {
+            'RegionName': [
+                {'RegionName': 'North', 'RegionLat': '10', 'RegionLon': '10'},
+                {'RegionName': 'South', 'RegionLat': '-10', 'RegionLon': '10'},
+            ],
+            'DistrictName': [
+                {
+                    'RegionName': 'North',
+                    'DistrictName': 'Hill',
+                    'DistrictLat': '11',
+                    'DistrictLon': '11',
+                },
+                {
+                    'RegionName': 'South',
+                    'DistrictName': 'Valley',
+                    'DistrictLat': '',
+                    'DistrictLon': '',
+                },
+            ],
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mapping_files = {}
+            for dimension, dimension_rows in rows.items():
+                mapping_files[dimension] = os.path.join(temp_dir, dimension)
+                with open(mapping_files[dimension], 'w') as mapping_file:
+                    writer = csv.DictWriter(mapping_file, dimension_rows[0].keys())
+                    writer.writeheader()
+                    writer.writerows(dimension_rows)
+            geocoder = Geocoder(
+                mapping_files,
+                ['RegionName', 'DistrictName'],
+                {
+                    'RegionName': ('RegionLat', 'RegionLon'),
+                    'DistrictName': ('DistrictLat', 'DistrictLon'),
+                },
+            )
+
+        region_index = geocoder.build_spatial_index('RegionName')
+        self.assertEqual(
+            geocoder.reverse_geocode(region_index, -8, 9)['RegionName'], 'South'
+        )
+
+        # Districts without coordinates cannot be found.
+        district_index = geocoder.build_spatial_index('DistrictName')
+        self.assertEqual(len(district_index), 1)
+        self.assertEqual(
+            geocoder.reverse_geocode(district_index, -8, 9),
+            {
+                'RegionName': 'North',
+                'DistrictName': 'Hill',
+                'RegionLat': 10.0,
+                'RegionLon': 10.0,
+                'DistrictLat': 11.0,
+                'DistrictLon': 11.0,
+            },
+        )
+        self.assertEqual(
+            geocoder.reverse_geocode(district_index, -8, 9, max_distance_km=100), {}
+        )
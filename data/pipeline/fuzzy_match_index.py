@@ -0,0 +1,265 @@
+'''Index for finding the best fuzzy matches for a string in a fixed list of
+choices.
+
+`fuzzywuzzy.process.extract` scores the query against every choice using
+`fuzz.WRatio`, which runs multiple SequenceMatcher comparisons per choice. When
+the same list of choices is searched many times, most of this work is wasted on
+choices that have no chance of being a top result.
+
+FuzzyMatchIndex precomputes, for each choice:
+- the processed string that WRatio compares
+- the number of times each character occurs in the processed string
+- the lengths of the token based strings WRatio builds
+- an inverted index from token to the choices containing that token
+
+Every ratio WRatio computes is bounded by the number of characters the two
+strings have in common. Using the character counts and the token index, an
+upper bound on the WRatio score of every choice is computed at once for a query.
+Choices are then scored in order of decreasing upper bound, and the search stops
+once no remaining choice can score high enough to be a top result. The results
+are identical to `process.extract` with the default processor and scorer,
+including the order of choices with equal scores.
+'''
+
+import heapq
+
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+import numpy as np
+
+from fuzzywuzzy import fuzz, utils
+
+# Scaling factors applied by fuzz.WRatio.
+_UNBASE_SCALE = 0.95
+_PARTIAL_SCALE = 0.9
+_LONG_PARTIAL_SCALE = 0.6
+
+# Scores are rounded at multiple stages inside WRatio. This margin ensures the
+# score bound is never lower than the rounded score.
+_ROUNDING_MARGIN = 1.01
+
+
+def _process_choice(choice):
+    # NOTE: This matches the processing `process.extract` applies to each
+    # choice when using the default processor and scorer.
+    return utils.full_process(choice, force_ascii=True)
+
+
+def _process_query(query):
+    # NOTE: This matches the processing `process.extract` applies to the query
+    # when using the default processor and scorer.
+    return utils.full_process(utils.full_process(query), force_ascii=True)
+
+
+def _joined_length(tokens):
+    '''Length of the string built by joining the tokens with a space.'''
+    if not tokens:
+        return 0
+    return sum(len(token) for token in tokens) + len(tokens) - 1
+
+
+def _ratio_bound(length_1, length_2, matches):
+    '''Upper bound on the SequenceMatcher ratio of two strings with the given
+    lengths and number of characters in common.
+    '''
+    total = length_1 + length_2
+    matches = np.minimum(matches, np.minimum(length_1, length_2))
+    return np.divide(2 * matches, total, out=np.zeros_like(total), where=total > 0)
+
+
+def _partial_ratio_bound(length_1, length_2, matches):
+    '''Upper bound on the partial ratio of two strings with the given lengths and
+    number of characters in common. The shorter string is compared to
+    substrings of the longer string that are at most as long as the shorter
+    string.
+    '''
+    shorter_length = np.minimum(length_1, length_2)
+    matches = np.minimum(matches, shorter_length)
+    total = shorter_length + matches
+    return np.divide(2 * matches, total, out=np.zeros_like(total), where=total > 0)
+
+
+class FuzzyMatchIndex:
+    def __init__(self, choices):
+        self.choices = list(choices)
+        self._processed = [_process_choice(choice) for choice in self.choices]
+
+        char_columns = {}
+        char_counts = []
+        token_postings = defaultdict(list)
+        lengths = []
+        sorted_token_lengths = []
+        unique_token_lengths = []
+        for idx, processed in enumerate(self._processed):
+            counts = Counter(processed)
+            for char in counts:
+                char_columns.setdefault(char, len(char_columns))
+            char_counts.append(counts)
+
+            tokens = processed.split()
+            unique_tokens = set(tokens)
+            for token in unique_tokens:
+                token_postings[token].append(idx)
+            lengths.append(len(processed))
+            sorted_token_lengths.append(_joined_length(tokens))
+            unique_token_lengths.append(_joined_length(unique_tokens))
+
+        # Store the character counts with one row per character so that the
+        # counts for the characters in a query can be selected quickly.
+        self._char_columns = char_columns
+        self._char_counts = np.zeros(
+            (len(char_columns), len(self.choices)), dtype=np.int32
+        )
+        for idx, counts in enumerate(char_counts):
+            for char, count in counts.items():
+                self._char_counts[char_columns[char], idx] = count
+
+        self._token_postings = {
+            token: np.array(indices, dtype=np.int64)
+            for (token, indices) in token_postings.items()
+        }
+        self._lengths = np.array(lengths, dtype=np.float64)
+        self._sorted_token_lengths = np.array(sorted_token_lengths, dtype=np.float64)
+        self._unique_token_lengths = np.array(unique_token_lengths, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.choices)
+
+    def _compute_score_bounds(self, processed_query):
+        '''Compute an upper bound on the WRatio score between the processed
+        query and every choice.
+        '''
+        num_choices = len(self.choices)
+        query_counts = Counter(processed_query)
+        columns = []
+        counts = []
+        for char, count in query_counts.items():
+            column = self._char_columns.get(char)
+            if column is not None:
+                columns.append(column)
+                counts.append(count)
+
+        matches = np.zeros(num_choices, dtype=np.float64)
+        if columns:
+            matches += np.minimum(
+                self._char_counts[columns], np.array(counts)[:, None]
+            ).sum(axis=0)
+
+        query_tokens = processed_query.split()
+        shares_token = np.zeros(num_choices, dtype=bool)
+        for token in set(query_tokens):
+            postings = self._token_postings.get(token)
+            if postings is not None:
+                shares_token[postings] = True
+
+        query_length = float(len(processed_query))
+        query_sorted_length = float(_joined_length(query_tokens))
+        query_unique_length = float(_joined_length(set(query_tokens)))
+        lengths = self._lengths
+        sorted_lengths = self._sorted_token_lengths
+        unique_lengths = self._unique_token_lengths
+
+        base = _ratio_bound(query_length, lengths, matches)
+
+        # Bound on the ratio between the intersection of tokens and the
+        # combined tokens of either string, which is only non-zero when the
+        # strings share a token.
+        intersection_matches = np.minimum(
+            matches, np.minimum(query_unique_length, unique_lengths)
+        )
+        intersection_bound = np.where(
+            shares_token,
+            np.maximum(
+                _ratio_bound(
+                    intersection_matches, query_unique_length, intersection_matches
+                ),
+                _ratio_bound(
+                    intersection_matches, unique_lengths, intersection_matches
+                ),
+            ),
+            0,
+        )
+        token_sort = _UNBASE_SCALE * _ratio_bound(
+            query_sorted_length, sorted_lengths, matches
+        )
+        token_set = _UNBASE_SCALE * np.maximum(
+            _ratio_bound(query_unique_length, unique_lengths, matches),
+            intersection_bound,
+        )
+        full_bound = np.maximum.reduce([base, token_sort, token_set])
+
+        # The partial token set ratio is 100 when the strings share a token
+        # since the sorted intersection is a prefix of the combined tokens.
+        partial_scale = np.where(
+            np.maximum(query_length, lengths) > 8 * np.minimum(query_length, lengths),
+            _LONG_PARTIAL_SCALE,
+            _PARTIAL_SCALE,
+        )
+        partial = _partial_ratio_bound(query_length, lengths, matches)
+        partial_token_sort = _UNBASE_SCALE * _partial_ratio_bound(
+            query_sorted_length, sorted_lengths, matches
+        )
+        partial_token_set = _UNBASE_SCALE * np.where(
+            shares_token,
+            1,
+            _partial_ratio_bound(query_unique_length, unique_lengths, matches),
+        )
+        partial_bound = np.maximum(
+            base,
+            partial_scale
+            * np.maximum.reduce([partial, partial_token_sort, partial_token_set]),
+        )
+
+        # NOTE: This mirrors the length ratio computation in WRatio exactly so
+        # that the same branch is chosen.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            length_ratio = np.maximum(query_length, lengths) / np.minimum(
+                query_length, lengths
+            )
+        bounds = 100 * np.where(length_ratio < 1.5, full_bound, partial_bound)
+        bounds += _ROUNDING_MARGIN
+
+        # WRatio returns 0 when either processed string is empty.
+        if not query_length:
+            bounds[:] = 0
+        bounds[lengths == 0] = 0
+        return bounds
+
+    def extract(self, query, limit=5):
+        '''Return the `limit` choices that best match the query as a list of
+        (choice, score) tuples. This is equivalent to calling
+        `process.extract(query, choices, limit=limit)`.
+        '''
+        if not self.choices or limit <= 0:
+            return []
+
+        processed_query = _process_query(query)
+        bounds = self._compute_score_bounds(processed_query)
+        order = np.argsort(-bounds, kind='stable')
+        sorted_bounds = bounds[order]
+
+        top_scores = []
+        scored = []
+        for position, idx in enumerate(order.tolist()):
+            # Choices with a lower bound than the lowest top score cannot be a
+            # top result, even if they are earlier in the list of choices.
+            if len(top_scores) == limit and sorted_bounds[position] < top_scores[0]:
+                break
+
+            score = fuzz.WRatio(
+                processed_query, self._processed[idx], full_process=False
+            )
+            scored.append((idx, score))
+            if len(top_scores) < limit:
+                heapq.heappush(top_scores, score)
+            elif score > top_scores[0]:
+                heapq.heapreplace(top_scores, score)
+
+        # Select the top results in the original order of the choices so that
+        # ties are resolved the same way as `process.extract`.
+        scored.sort(key=itemgetter(0))
+        return [
+            (self.choices[idx], score)
+            for (idx, score) in heapq.nlargest(limit, scored, key=itemgetter(1))
+        ]
@@ -0,0 +1,396 @@
+'''Compact binary storage format for BaseRow streams.
+
+Pipeline steps normally store BaseRows as one JSON object per line. Steps that
+only pass rows along spend most of their time encoding and decoding this JSON.
+The binary format avoids this cost:
+- The file starts with a magic header.
+- Every string (dimension names and values, field names, dates and sources),
+  list of dimension values (from multi-value dimensions), row key and set of
+  data fields is stored once per file in a dictionary record. Later records
+  reference the entry by its index in the file's dictionary.
+- Each row is stored in a length-prefixed record that references its date,
+  source, row key and data fields. Data values are stored as typed 64-bit
+  integers, doubles or booleans. Integers that do not fit in 64 bits are stored
+  as decimal strings in the string dictionary.
+
+The format is written to and read from binary file objects, so it can be stored
+inside the LZ4 and gzip file wrappers.
+
+Example usage:
+
+with BaseRowFileWriter('/tmp/rows.lz4', 'binary') as writer:
+    for row in rows:
+        writer.write_row(row)
+
+with BaseRowFileReader('/tmp/rows.lz4') as input_rows:
+    for row in input_rows:
+        print(row.key)
+'''
+
+import struct
+
+from contextlib import contextmanager
+
+from data.pipeline.datatypes.base_row import BaseRow
+from util.file.compression.lz4 import LZ4Reader, LZ4Writer
+from util.file.compression.pigz import PigzReader, PigzWriter
+
+MAGIC = b'ZBR\x01'
+
+ROW_FORMATS = ('json', 'binary')
+
+# Every record starts with a type code and the length of the record's content.
+_RECORD_HEADER = struct.Struct('<cI')
+_RECORD_HEADER_SIZE = _RECORD_HEADER.size
+
+# Dictionary records. Each new entry is assigned the next index in its
+# dictionary.
+# String: UTF-8 encoded string.
+_STRING_RECORD = b'S'
+# List: string indices of the values of a multi-value dimension.
+_LIST_RECORD = b'L'
+# Dimensions: string indices of the (dimension, value) pairs of a row key. A
+# value index with the list flag set references a list entry instead.
+_DIMENSIONS_RECORD = b'D'
+# Fields: struct codes of the data value types followed by the string indices of
+# the data fields.
+_FIELDS_RECORD = b'F'
+
+# Value type code of integers that do not fit in 64 bits. They are stored as the
+# string index of their decimal representation.
+_BIG_INT_TYPE = 'N'
+_BIG_INT_STRUCT_CODE = 'I'
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+
+# Row: date, source, dimensions and fields indices, followed by the data values
+# packed using the fields entry's struct codes.
+_ROW_RECORD = b'R'
+_ROW_HEADER = struct.Struct('<IIII')
+_ROW_HEADER_SIZE = _ROW_HEADER.size
+
+# Index 0 in the string dictionary is reserved for None values.
+_NONE_INDEX = 0
+
+# Flag set on a dimension value index that references the list dictionary.
+_LIST_INDEX_FLAG = 1 << 31
+
+# Number of bytes read from the input file at a time.
+READ_SIZE = 1024 * 1024
+
+
+def _value_type(field, value):
+    value_type = type(value)
+    # NOTE(stephen): bool is a subclass of int, so it must be checked first.
+    if value_type is bool:
+        return '?'
+    if value_type is int or isinstance(value, int):
+        return 'q' if _INT64_MIN <= value <= _INT64_MAX else _BIG_INT_TYPE
+    if value_type is float or isinstance(value, float):
+        return 'd'
+    raise ValueError(
+        'Unsupported data value type for field "%s": %s' % (field, value_type)
+    )
+
+
+def _build_values_struct(value_types):
+    '''Build the struct that packs the data values of a fields entry, and the
+    positions of the values stored as big integers.
+    '''
+    big_int_positions = tuple(
+        idx for (idx, code) in enumerate(value_types) if code == _BIG_INT_TYPE
+    )
+    struct_codes = value_types.replace(_BIG_INT_TYPE, _BIG_INT_STRUCT_CODE)
+    return (struct.Struct('<%s' % struct_codes), big_int_positions)
+
+
+def _pack_indices(indices):
+    return struct.pack('<%dI' % len(indices), *indices)
+
+
+class BaseRowJsonWriter:
+    '''Write BaseRows as JSON lines to a text file object.'''
+
+    def __init__(self, output_file):
+        self._output_file = output_file
+
+    def write_row(self, row):
+        self._output_file.write(row.to_json(True))
+
+    def write_serialized_row(self, row_str):
+        '''Write a row that has already been serialized as a JSON line.'''
+        self._output_file.write(row_str)
+
+
+class BaseRowBinaryWriter:
+    '''Write BaseRows in the binary format to a binary file object.'''
+
+    def __init__(self, output_file, base_row_cls=BaseRow):
+        self._output_file = output_file
+        self._base_row_cls = base_row_cls
+        self._string_indices = {None: _NONE_INDEX}
+        self._list_indices = {}
+        self._dimensions_indices = {}
+        self._fields_indices = {}
+        output_file.write(MAGIC)
+
+    def _write_record(self, record_type, content):
+        self._output_file.write(
+            _RECORD_HEADER.pack(record_type, len(content)) + content
+        )
+
+    def _get_string_index(self, value):
+        index = self._string_indices.get(value)
+        if index is not None:
+            return index
+
+        if not isinstance(value, str):
+            raise ValueError('Unsupported dimension value type: %s' % type(value))
+
+        index = len(self._string_indices)
+        self._string_indices[value] = index
+        self._write_record(_STRING_RECORD, value.encode('utf-8'))
+        return index
+
+    def _get_list_index(self, values):
+        index = self._list_indices.get(values)
+        if index is not None:
+            return index
+
+        indices = [self._get_string_index(value) for value in values]
+        index = len(self._list_indices) | _LIST_INDEX_FLAG
+        self._list_indices[values] = index
+        self._write_record(_LIST_RECORD, _pack_indices(indices))
+        return index
+
+    def _get_dimensions_index(self, key):
+        dimensions = tuple(key.items())
+        try:
+            index = self._dimensions_indices.get(dimensions)
+        except TypeError:
+            # Multi-value dimensions store a list of values, which cannot be used
+            # as a dictionary key. Store them as tuples instead.
+            dimensions = tuple(
+                (dimension, tuple(value) if isinstance(value, list) else value)
+                for dimension, value in dimensions
+            )
+            index = self._dimensions_indices.get(dimensions)
+        if index is not None:
+            return index
+
+        get_string_index = self._get_string_index
+        indices = []
+        for dimension, value in dimensions:
+            indices.append(get_string_index(dimension))
+            if isinstance(value, tuple):
+                indices.append(self._get_list_index(value))
+            else:
+                indices.append(get_string_index(value))
+
+        index = len(self._dimensions_indices)
+        self._dimensions_indices[dimensions] = index
+        self._write_record(_DIMENSIONS_RECORD, _pack_indices(indices))
+        return index
+
+    def _get_fields_index(self, data):
+        value_types = ''.join(map(_value_type, data, data.values()))
+        fields_key = (tuple(data), value_types)
+        entry = self._fields_indices.get(fields_key)
+        if entry is not None:
+            return entry
+
+        indices = [self._get_string_index(field) for field in data]
+        entry = (len(self._fields_indices), *_build_values_struct(value_types))
+        self._fields_indices[fields_key] = entry
+        self._write_record(
+            _FIELDS_RECORD,
+            struct.pack('<H', len(indices))
+            + value_types.encode('ascii')
+            + _pack_indices(indices),
+        )
+        return entry
+
+    def write_row(self, row):
+        data = row.data
+        (fields_index, values_struct, big_int_positions) = self._get_fields_index(
+            data
+        )
+        values = data.values()
+        if big_int_positions:
+            values = list(values)
+            for idx in big_int_positions:
+                values[idx] = self._get_string_index(str(values[idx]))
+        self._write_record(
+            _ROW_RECORD,
+            _ROW_HEADER.pack(
+                self._get_string_index(row.date),
+                self._get_string_index(row.source),
+                self._get_dimensions_index(row.key),
+                fields_index,
+            )
+            + values_struct.pack(*values),
+        )
+
+    def write_serialized_row(self, row_str):
+        '''Write a row that has already been serialized as a JSON line.'''
+        self.write_row(self._base_row_cls.from_json(row_str))
+
+
+class BaseRowBinaryReader:
+    '''Iterate over the BaseRows stored in the binary format inside a binary file
+    object.
+    '''
+
+    def __init__(self, input_file, base_row_cls=BaseRow):
+        self._input_file = input_file
+        self._base_row_cls = base_row_cls
+
+    def __iter__(self):
+        input_file = self._input_file
+        buf = input_file.read(READ_SIZE)
+        if not buf.startswith(MAGIC):
+            raise ValueError('Input file is not a binary BaseRow file.')
+
+        base_row_cls = self._base_row_cls
+        strings = [None]
+        lists = []
+        dimensions_list = []
+        fields_list = []
+        offset = len(MAGIC)
+        while True:
+            buf_size = len(buf)
+            while offset + _RECORD_HEADER_SIZE <= buf_size:
+                (record_type, length) = _RECORD_HEADER.unpack_from(buf, offset)
+                start = offset + _RECORD_HEADER_SIZE
+                end = start + length
+                if end > buf_size:
+                    break
+
+                offset = end
+                if record_type == _ROW_RECORD:
+                    (
+                        date_index,
+                        source_index,
+                        dimensions_index,
+                        fields_index,
+                    ) = _ROW_HEADER.unpack_from(buf, start)
+                    (fields, values_struct, big_int_positions) = fields_list[
+                        fields_index
+                    ]
+                    values = values_struct.unpack_from(buf, start + _ROW_HEADER_SIZE)
+                    if big_int_positions:
+                        values = list(values)
+                        for idx in big_int_positions:
+                            values[idx] = int(strings[values[idx]])
+                    (dimensions, has_lists) = dimensions_list[dimensions_index]
+                    key = dict(dimensions)
+                    if has_lists:
+                        # Each row receives its own copy of the list values.
+                        key = {
+                            dimension: list(value) if type(value) is tuple else value
+                            for (dimension, value) in dimensions
+                        }
+                    yield base_row_cls(
+                        key,
+                        dict(zip(fields, values)),
+                        strings[date_index],
+                        strings[source_index],
+                    )
+                elif record_type == _STRING_RECORD:
+                    strings.append(buf[start:end].decode('utf-8'))
+                elif record_type == _LIST_RECORD:
+                    indices = _unpack_indices(buf, start, end)
+                    lists.append(tuple(strings[index] for index in indices))
+                elif record_type == _DIMENSIONS_RECORD:
+                    indices = _unpack_indices(buf, start, end)
+                    has_lists = any(index & _LIST_INDEX_FLAG for index in indices[1::2])
+                    values = [
+                        lists[index ^ _LIST_INDEX_FLAG]
+                        if index & _LIST_INDEX_FLAG
+                        else strings[index]
+                        for index in indices
+                    ]
+                    dimensions_list.append(
+                        (list(zip(values[::2], values[1::2])), has_lists)
+                    )
+                elif record_type == _FIELDS_RECORD:
+                    (count,) = struct.unpack_from('<H', buf, start)
+                    value_types = buf[start + 2 : start + 2 + count].decode('ascii')
+                    indices = _unpack_indices(buf, start + 2 + count, end)
+                    fields_list.append(
+                        (
+                            [strings[index] for index in indices],
+                            *_build_values_struct(value_types),
+                        )
+                    )
+                else:
+                    raise ValueError('Unknown record type: %s' % record_type)
+
+            # Carry the partial record over to the next read.
+            new_data = input_file.read(READ_SIZE)
+            if not new_data:
+                break
+            buf = buf[offset:] + new_data
+            offset = 0
+
+        assert offset == len(buf), 'Binary BaseRow file ended with a partial record.'
+
+
+def _unpack_indices(buf, start, end):
+    return struct.unpack_from('<%dI' % ((end - start) // 4), buf, start)
+
+
+def _open_file(filename, mode):
+    if filename.endswith('.lz4'):
+        opener = LZ4Reader if mode[0] == 'r' else LZ4Writer
+    elif filename.endswith('.gz'):
+        opener = PigzReader if mode[0] == 'r' else PigzWriter
+    else:
+        opener = open
+    return opener(filename, mode=mode)
+
+
+def is_binary_row_file(filename):
+    '''Determine if the file stores BaseRows in the binary format.'''
+    with _open_file(filename, 'rb') as input_file:
+        return input_file.read(len(MAGIC)) == MAGIC
+
+
+def _read_json_rows(input_file, base_row_cls):
+    deserialize_fn = base_row_cls.from_json
+    for line in input_file:
+        yield deserialize_fn(line)
+
+
+# pylint: disable=invalid-name
+@contextmanager
+def BaseRowFileReader(filename, base_row_cls=BaseRow):
+    '''Open a file of BaseRows stored in either the JSON line format or the binary
+    format and yield an iterator over the deserialized rows. The compression is
+    detected from the filename suffix. This can be used as the file opener for a
+    ShardReader.
+    '''
+    binary_format = is_binary_row_file(filename)
+    with _open_file(filename, 'rb' if binary_format else 'r') as input_file:
+        if binary_format:
+            yield iter(BaseRowBinaryReader(input_file, base_row_cls))
+        else:
+            yield _read_json_rows(input_file, base_row_cls)
+
+
+# pylint: disable=invalid-name
+@contextmanager
+def BaseRowFileWriter(filename, row_format='json', base_row_cls=BaseRow):
+    '''Open a file to write BaseRows to in the row format provided ("json" or
+    "binary") and yield a writer with a `write_row(row)` method. The compression
+    is detected from the filename suffix.
+    '''
+    if row_format not in ROW_FORMATS:
+        raise ValueError('Unsupported row format: %s' % row_format)
+
+    if row_format == 'json':
+        with _open_file(filename, 'w') as output_file:
+            yield BaseRowJsonWriter(output_file)
+    else:
+        with _open_file(filename, 'wb') as output_file:
+            yield BaseRowBinaryWriter(output_file, base_row_cls)
@@ -1,7 +1,9 @@
 import json
+import multiprocessing
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime
+from itertools import islice
 
 from log import LOG
 
@@ -24,6 +26,9 @@ except ImportError:
 INFINITY = float('inf')
 NAN = float('nan')
 
+# Number of input rows each worker task converts when running in parallel.
+DEFAULT_TASK_SIZE = 100000
+
 
 class RowMetaData:
     def __init__(self):
@@ -38,6 +43,13 @@ class RowMetaData:
         if row.date > self.end_date:
             self.end_date = row.date
 
+    def merge(self, other):
+        self.count += other.count
+        if other.start_date < self.start_date:
+            self.start_date = other.start_date
+        if other.end_date > self.end_date:
+            self.end_date = other.end_date
+
 
 class ErrorHandler:
     '''Class to log and optionally raise errors that are found during conversion
@@ -87,6 +99,21 @@ class ErrorHandler:
         key = frozenset(list(input_dimensions.items()))
         self.failed_matches[key] += 1
 
+    def create_empty_copy(self):
+        '''Create a new ErrorHandler with the same settings and no errors.'''
+        return ErrorHandler(
+            self.allow_missing_date,
+            self.allow_empty_data,
+            self.allow_missing_canonical_match,
+        )
+
+    def merge(self, other):
+        '''Add the errors collected by another ErrorHandler to this handler.'''
+        self.missing_date_count += other.missing_date_count
+        self.empty_data_count += other.empty_data_count
+        for key, count in other.failed_matches.items():
+            self.failed_matches[key] += count
+
     def print_stats(self):
         if self.missing_date_count:
             LOG.info('Rows missing a date: %s', self.missing_date_count)
@@ -123,6 +150,10 @@ class DruidWriter:
         use_optimizations=True,
         error_handler=None,
         output_metadata_digest_writer=None,
+        num_workers=1,
+        output_file_factory=None,
+        task_size=DEFAULT_TASK_SIZE,
+        parsed_input=False,
     ):
         '''Convert rows stored in `input_file` into Druid output rows and store
         them in `output_file`.
@@ -130,9 +161,10 @@ class DruidWriter:
         Args:
             base_row_cls: The concrete BaseRow subclass input rows are stored
                 as. Example: BaseEthiopiaRow
-            metadata_collector: A FullRowDimensionDataCollector instance that
-                can convert the dimensions stored in an input row into canonical
-                dimensions to store in the Druid output row.
+            metadata_collector: A FullRowDimensionDataCollector (or a
+                CompiledDimensionLookup) instance that can convert the
+                dimensions stored in an input row into canonical dimensions to
+                store in the Druid output row.
             input_file: A file handle that serialized input rows will be read
                 from.
             output_file: A file-like handle (supports `write(str)`) that output
@@ -143,6 +175,20 @@ class DruidWriter:
             error_handler: Optional. An ErrorHandler instance that will collect
                 and optionally raise issue found when converint an input row
                 into Druid row format.
+            output_metadata_digest_writer: Optional. A csv.DictWriter that the
+                per-field row count and date range will be written to.
+            num_workers: Optional. When greater than 1, input rows are split
+                into tasks of `task_size` rows that are converted by a pool of
+                worker processes.
+            output_file_factory: Required if `num_workers` is greater than 1.
+                A function that takes the task number and returns a
+                context-manageable file-like handle that the Druid rows produced
+                by that task will be written to. `output_file` is unused.
+            task_size: Optional. Number of input rows converted per task when
+                running in parallel.
+            parsed_input: Optional. If enabled, `input_file` yields BaseRow
+                instances (like rows read from the binary row format) instead
+                of serialized JSON rows.
         '''
         error_handler = error_handler or ErrorHandler()
 
@@ -163,6 +209,34 @@ class DruidWriter:
             # it again.
             (parse_row, write_output_rows) = Parser.optimized_parser(base_row_cls)
 
+        if parsed_input:
+            (parse_row, write_output_rows) = Parser.parsed_row_parser(base_row_cls)
+
+        if num_workers > 1:
+            assert output_file_factory, 'Parallel mode requires an output_file_factory.'
+            if parsed_input:
+                # NOTE(stephen): BaseRow types are generated at runtime and cannot
+                # be pickled, so parsed rows are sent to the workers as plain
+                # values.
+                input_file = (
+                    (row.key, row.data, row.date, row.source) for row in input_file
+                )
+                (parse_row, write_output_rows) = Parser.row_values_parser(
+                    base_row_cls
+                )
+            return cls._run_parallel(
+                base_row_cls,
+                metadata_collector,
+                input_file,
+                output_file_factory,
+                error_handler,
+                parse_row,
+                write_output_rows,
+                output_metadata_digest_writer,
+                num_workers,
+                task_size,
+            )
+
         return cls._run(
             base_row_cls,
             metadata_collector,
@@ -187,12 +261,114 @@ class DruidWriter:
         output_metadata_digest_writer,
     ):
         LOG.info('Starting processing')
+        datasource_field_metadata = defaultdict(RowMetaData)
+        (input_row_count, output_row_count) = cls._convert_rows(
+            base_row_cls,
+            metadata_collector,
+            input_file,
+            output_file,
+            error_handler,
+            parse_row,
+            write_output_rows,
+            datasource_field_metadata,
+        )
+        cls._finish(
+            input_row_count,
+            output_row_count,
+            datasource_field_metadata,
+            error_handler,
+            output_metadata_digest_writer,
+        )
+
+    @classmethod
+    def _run_parallel(
+        cls,
+        base_row_cls,
+        metadata_collector,
+        input_file,
+        output_file_factory,
+        error_handler,
+        parse_row,
+        write_output_rows,
+        output_metadata_digest_writer,
+        num_workers,
+        task_size,
+    ):
+        LOG.info('Starting processing with %s workers', num_workers)
+
+        # Workers are forked from this process and inherit the metadata
+        # collector and parsers, so the canonical lookup is not rebuilt or
+        # serialized for every task.
+        global _WORKER_STATE  # pylint: disable=global-statement
+        _WORKER_STATE = (
+            cls,
+            base_row_cls,
+            metadata_collector,
+            output_file_factory,
+            error_handler.create_empty_copy(),
+            parse_row,
+            write_output_rows,
+        )
 
+        input_row_count = output_row_count = 0
+        datasource_field_metadata = defaultdict(RowMetaData)
+
+        def merge_result(result):
+            nonlocal input_row_count, output_row_count
+            input_row_count += result[0]
+            output_row_count += result[1]
+            for field, metadata in result[2].items():
+                datasource_field_metadata[field].merge(metadata)
+            error_handler.merge(result[3])
+            LOG.info('Rows processed: %s', input_row_count)
+
+        # Results are merged in task order so that the metadata digest lists
+        # fields in the same order as the single process conversion. Only a
+        # limited number of tasks are queued at once to bound memory use.
+        context = multiprocessing.get_context('fork')
+        try:
+            with context.Pool(num_workers) as pool:
+                pending = deque()
+                tasks = iter(lambda: list(islice(input_file, task_size)), [])
+                for task_id, input_rows in enumerate(tasks):
+                    pending.append(
+                        pool.apply_async(_convert_task, ((task_id, input_rows),))
+                    )
+                    if len(pending) > num_workers * 2:
+                        merge_result(pending.popleft().get())
+                while pending:
+                    merge_result(pending.popleft().get())
+        finally:
+            _WORKER_STATE = None
+
+        cls._finish(
+            input_row_count,
+            output_row_count,
+            datasource_field_metadata,
+            error_handler,
+            output_metadata_digest_writer,
+        )
+
+    @classmethod
+    def _convert_rows(
+        cls,
+        base_row_cls,
+        metadata_collector,
+        input_rows,
+        output_file,
+        error_handler,
+        parse_row,
+        write_output_rows,
+        datasource_field_metadata,
+        log_progress=True,
+    ):
+        '''Convert the input rows into Druid rows and write them to the output
+        file. Returns the number of input rows processed and output rows written.
+        '''
         input_row_count = output_row_count = 0
         unmapped_keys = base_row_cls.UNMAPPED_KEYS
         has_unmapped_keys = bool(unmapped_keys)
-        datasource_field_metadata = defaultdict(RowMetaData)
-        for input_row in input_file:
+        for input_row in input_rows:
             (row, has_data, parsed_extras) = parse_row(input_row)
             input_row_count += 1
             if not row.date:
@@ -233,8 +409,19 @@ class DruidWriter:
             rows_written = write_output_rows(row, output_file, parsed_extras)
             output_row_count += rows_written
 
-            if (input_row_count % 20000) == 0:
+            if log_progress and (input_row_count % 20000) == 0:
                 LOG.info('Rows processed: %s', input_row_count)
+        return (input_row_count, output_row_count)
+
+    @classmethod
+    def _finish(
+        cls,
+        input_row_count,
+        output_row_count,
+        datasource_field_metadata,
+        error_handler,
+        output_metadata_digest_writer,
+    ):
         if output_metadata_digest_writer:
             output_metadata_digest_writer.writeheader()
             for field in datasource_field_metadata:
@@ -253,6 +440,48 @@ class DruidWriter:
         error_handler.print_stats()
 
 
+# State used by the DruidWriter worker processes. It is set by the parent process
+# before the worker pool is forked.
+_WORKER_STATE = None
+
+
+def _convert_task(task):
+    '''Convert a task's input rows into Druid rows that are written to the task's
+    own output file. Returns the row counts, field metadata and errors collected
+    so the parent can merge them.
+    '''
+    (task_id, input_rows) = task
+    (
+        writer_cls,
+        base_row_cls,
+        metadata_collector,
+        output_file_factory,
+        empty_error_handler,
+        parse_row,
+        write_output_rows,
+    ) = _WORKER_STATE
+    error_handler = empty_error_handler.create_empty_copy()
+    datasource_field_metadata = defaultdict(RowMetaData)
+    with output_file_factory(task_id) as output_file:
+        (input_row_count, output_row_count) = writer_cls._convert_rows(
+            base_row_cls,
+            metadata_collector,
+            input_rows,
+            output_file,
+            error_handler,
+            parse_row,
+            write_output_rows,
+            datasource_field_metadata,
+            log_progress=False,
+        )
+    return (
+        input_row_count,
+        output_row_count,
+        dict(datasource_field_metadata),
+        error_handler,
+    )
+
+
 class Parser:
     '''Class providing the various serialization/deserialization methods that
     are supported.
@@ -281,6 +510,29 @@ class Parser:
 
         return (parse_row, write_output_rows)
 
+    @staticmethod
+    def parsed_row_parser(base_row_cls):
+        '''Parser for input rows that have already been deserialized into
+        BaseRows.
+        '''
+        (_, write_output_rows) = Parser.safe_parser(base_row_cls)
+
+        def parse_row(base_row):
+            return (base_row, bool(base_row.data), None)
+
+        return (parse_row, write_output_rows)
+
+    @staticmethod
+    def row_values_parser(base_row_cls):
+        '''Parser for input rows stored as (key, data, date, source) tuples.'''
+        (_, write_output_rows) = Parser.safe_parser(base_row_cls)
+
+        def parse_row(row_values):
+            base_row = base_row_cls(*row_values)
+            return (base_row, bool(base_row.data), None)
+
+        return (parse_row, write_output_rows)
+
     @staticmethod
     def optimized_parser(base_row_cls):
         deserialize_fn = base_row_cls.from_json
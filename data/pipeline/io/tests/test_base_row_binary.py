@@ -0,0 +1,146 @@
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+import pytest
+
+from data.pipeline.datatypes.base_row import BaseRow
+from data.pipeline.io.base_row_binary import (
+    BaseRowBinaryReader,
+    BaseRowBinaryWriter,
+    BaseRowFileReader,
+    BaseRowFileWriter,
+    is_binary_row_file,
+)
+
+
+class BaseRowBinaryTestCase(TestCase):
+    def setUp(self) -> None:
+        self.rows = [
+            BaseRow(
+                {'RegionName': 'North', 'Gender': 'f'},
+                {'a': 1, 'b': 2.5},
+                '2020-01-01',
+                'src',
+            ),
+            BaseRow(
+                {'RegionName': 'North', 'Gender': 'f'},
+                {'a': 0, 'b': -1.0},
+                '2020-01-02',
+                'src',
+            ),
+            BaseRow(
+                {'RegionName': 'Sul', 'Gender': None}, {'ç': 2**40}, '2020-01-01', 'src'
+            ),
+            BaseRow({}, {}, '', ''),
+        ]
+
+    def _round_trip(self, rows):
+        output_file = io.BytesIO()
+        writer = BaseRowBinaryWriter(output_file)
+        for row in rows:
+            writer.write_row(row)
+        output_file.seek(0)
+        return list(BaseRowBinaryReader(output_file))
+
+    def test_round_trip(self):
+        result = self._round_trip(self.rows)
+        self.assertEqual(
+            [row.to_json() for row in self.rows], [row.to_json() for row in result]
+        )
+
+    def test_round_trip_preserves_value_types(self):
+        result = self._round_trip(self.rows)
+        self.assertIsInstance(result[0].data['a'], int)
+        self.assertIsInstance(result[0].data['b'], float)
+
+    def test_round_trip_does_not_share_dictionaries(self):
+        result = self._round_trip(self.rows[:2])
+        result[0].key['RegionName'] = 'South'
+        self.assertEqual('North', result[1].key['RegionName'])
+
+    def test_round_trip_multi_value_dimension(self):
+        rows = [
+            BaseRow(
+                {'RegionName': 'North', 'Symptoms': ['cold', 'fever']},
+                {'a': 1},
+                '2020-01-01',
+                'src',
+            ),
+            BaseRow(
+                {'RegionName': 'North', 'Symptoms': ['cold', 'fever']},
+                {'a': 2},
+                '2020-01-02',
+                'src',
+            ),
+            BaseRow(
+                {'RegionName': 'South', 'Symptoms': []}, {'a': 3}, '2020-01-01', 'src'
+            ),
+            BaseRow(
+                {'RegionName': 'South', 'Symptoms': ['fever', None]},
+                {'a': 4},
+                '2020-01-01',
+                'src',
+            ),
+            self.rows[0],
+        ]
+        result = self._round_trip(rows)
+        self.assertEqual(
+            [row.to_json() for row in rows], [row.to_json() for row in result]
+        )
+        self.assertIsInstance(result[0].key['Symptoms'], list)
+
+        # Rows sharing a row key receive their own copy of the list values.
+        result[0].key['Symptoms'].append('cough')
+        self.assertEqual(['cold', 'fever'], result[1].key['Symptoms'])
+
+    def test_round_trip_bool_values(self):
+        rows = [
+            BaseRow({}, {'a': True, 'b': False, 'c': 1}, '2020-01-01', 'src'),
+            BaseRow({}, {'a': 1, 'b': 0, 'c': True}, '2020-01-01', 'src'),
+        ]
+        result = self._round_trip(rows)
+        self.assertEqual([row.data for row in rows], [row.data for row in result])
+        self.assertIs(True, result[0].data['a'])
+        self.assertIs(False, result[0].data['b'])
+        self.assertIs(1, result[1].data['a'])
+        self.assertIs(True, result[1].data['c'])
+
+    def test_round_trip_large_int_values(self):
+        values = [2**63 - 1, 2**63, -(2**63), -(2**63) - 1, 10**30, -(10**30)]
+        rows = [
+            BaseRow({}, {'a': value, 'b': 2.5}, '2020-01-01', 'src')
+            for value in values
+        ]
+        result = self._round_trip(rows)
+        self.assertEqual(values, [row.data['a'] for row in result])
+        self.assertEqual([2.5] * len(values), [row.data['b'] for row in result])
+        for row in result:
+            self.assertIsInstance(row.data['a'], int)
+
+    def test_unsupported_data_value(self):
+        writer = BaseRowBinaryWriter(io.BytesIO())
+        with pytest.raises(ValueError):
+            writer.write_row(BaseRow({}, {'a': 'value'}, '2020-01-01', 'src'))
+        with pytest.raises(ValueError, match='"a"'):
+            writer.write_row(BaseRow({}, {'a': None}, '2020-01-01', 'src'))
+
+    def test_invalid_file(self):
+        with pytest.raises(ValueError):
+            list(BaseRowBinaryReader(io.BytesIO(b'{"key": {}}\n')))
+
+    def test_file_reader_detects_format(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for row_format in ('json', 'binary'):
+                filename = os.path.join(temp_dir, 'rows_%s.lz4' % row_format)
+                with BaseRowFileWriter(filename, row_format) as writer:
+                    for row in self.rows:
+                        writer.write_row(row)
+
+                self.assertEqual(row_format == 'binary', is_binary_row_file(filename))
+                with BaseRowFileReader(filename) as input_rows:
+                    self.assertEqual(
+                        [row.to_json() for row in self.rows],
+                        [row.to_json() for row in input_rows],
+                    )
@@ -0,0 +1,132 @@
+import csv
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+from config.datatypes import BaseRowType
+from data.pipeline.io import druid_writer
+from data.pipeline.io.druid_writer import DruidWriter, ErrorHandler
+
+REGIONS = ['North', 'South', 'East', 'Unknown']
+
+
+class FakeMetadataCollector:
+    '''Map the RegionName dimension to a canonical name. Rows for unknown
+    regions have no canonical match.
+    '''
+
+    def get_data_for_row(self, row_dimensions):
+        region = row_dimensions.get('RegionName')
+        if region == 'Unknown':
+            return None
+        return {'RegionName': 'Canonical %s' % region}
+
+
+def _build_rows():
+    rows = []
+    for idx in range(250):
+        date = '2020-%02d-%02d' % (idx % 12 + 1, idx % 28 + 1) if idx % 17 else ''
+        data = {'field_%d' % (idx % 5): idx, 'other': idx / 4} if idx % 13 else {}
+        rows.append(
+            BaseRowType(
+                {'RegionName': REGIONS[idx % 4], 'Gender': 'mf'[idx % 2]},
+                data,
+                date,
+                'test',
+            )
+        )
+    return rows
+
+
+def _build_error_handler():
+    return ErrorHandler(
+        allow_missing_date=True,
+        allow_empty_data=True,
+        allow_missing_canonical_match=True,
+    )
+
+
+class DruidWriterTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.rows = _build_rows()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _run(self, num_workers, parsed_input=False, use_optimizations=True):
+        output_dir = tempfile.mkdtemp(dir=self.temp_dir.name)
+
+        def build_output_file(task_id):
+            return open(os.path.join(output_dir, 'task_%04d.json' % task_id), 'w')
+
+        if parsed_input:
+            input_rows = [BaseRowType.from_json(row.to_json()) for row in self.rows]
+        else:
+            input_rows = [row.to_json(True) for row in self.rows]
+        error_handler = _build_error_handler()
+        metadata_digest = io.StringIO()
+        with build_output_file(0) as output_file:
+            DruidWriter.run(
+                BaseRowType,
+                FakeMetadataCollector(),
+                iter(input_rows),
+                output_file,
+                use_optimizations,
+                error_handler,
+                csv.DictWriter(
+                    metadata_digest,
+                    fieldnames=['indicator_id', 'count', 'start_date', 'end_date'],
+                ),
+                num_workers,
+                build_output_file,
+                task_size=40,
+                parsed_input=parsed_input,
+            )
+
+        output_rows = []
+        for filename in sorted(os.listdir(output_dir)):
+            with open(os.path.join(output_dir, filename)) as output_file:
+                output_rows.extend(output_file.readlines())
+        return (
+            output_rows,
+            metadata_digest.getvalue(),
+            error_handler.missing_date_count,
+            error_handler.empty_data_count,
+            dict(error_handler.failed_matches),
+        )
+
+    def test_parallel_matches_serial(self):
+        for (parsed_input, use_optimizations) in (
+            (False, False),
+            (False, True),
+            (True, True),
+        ):
+            expected = self._run(1, parsed_input, use_optimizations)
+            (output_rows, _, *errors) = expected
+            self.assertTrue(output_rows)
+            self.assertTrue(all(errors))
+
+            result = self._run(3, parsed_input, use_optimizations)
+            self.assertEqual(expected, result)
+            self.assertIsNone(druid_writer._WORKER_STATE)
+
+    def test_worker_state_reset_on_error(self):
+        def build_output_file(task_id):
+            return open(os.path.join(self.temp_dir.name, '%s.json' % task_id), 'w')
+
+        input_rows = [row.to_json(True) for row in self.rows] + ['{"key": \n']
+        with self.assertRaises(ValueError):
+            DruidWriter.run(
+                BaseRowType,
+                FakeMetadataCollector(),
+                iter(input_rows),
+                None,
+                False,
+                _build_error_handler(),
+                num_workers=2,
+                output_file_factory=build_output_file,
+                task_size=40,
+            )
+        self.assertIsNone(druid_writer._WORKER_STATE)
@@ -1,8 +1,7 @@
 from csv import DictReader, DictWriter
 from collections import defaultdict
 
-from fuzzywuzzy import process
-
+from data.pipeline.fuzzy_match_index import FuzzyMatchIndex
 from log import LOG
 
 
@@ -34,39 +33,53 @@ class MatchingSuggestionBuilder:
         self.hierarchy_by_level = defaultdict(set)
         self.unmatched_locations = []
         self.seen_unmatched_location_keys = set()
+        self._candidate_indexes = {}
 
-    def get_sibling_suggestions(self, unmatched_id, name, parent_key):
-        parent_id = self.canonical_id_lookup[parent_key]
-        potential_name_lookup = {
-            self.name_lookup[i]: i for i in self.hierarchy[parent_id]
-        }
-        suggested_names = (
-            process.extract(name.strip(), list(potential_name_lookup.keys()), limit=5)
-            if len(potential_name_lookup.keys())
-            else []
+    def _get_candidate_index(self, scope, location_ids):
+        '''Return the name lookup and fuzzy match index for the canonical
+        locations in the given scope (a parent location or a hierarchy level).
+        The index is built once per scope and reused for all unmatched
+        locations searched in that scope.
+        '''
+        cached = self._candidate_indexes.get(scope)
+        # NOTE: Canonical locations are only ever added to a scope, so the index
+        # is still valid if the scope has the same number of locations.
+        if cached and cached[0] == len(location_ids):
+            return cached[1], cached[2]
+
+        potential_name_lookup = {self.name_lookup[i]: i for i in location_ids}
+        index = FuzzyMatchIndex(potential_name_lookup.keys())
+        self._candidate_indexes[scope] = (
+            len(location_ids),
+            potential_name_lookup,
+            index,
         )
+        return potential_name_lookup, index
+
+    def _build_suggestions(self, unmatched_id, name, scope, location_ids):
+        potential_name_lookup, index = self._get_candidate_index(scope, location_ids)
+        suggested_names = index.extract(name.strip(), limit=5)
         suggested_ids = [potential_name_lookup[sn[0]] for sn in suggested_names]
         suggestions = []
         for s_id in suggested_ids:
             suggestions.append({'canonical_id': s_id, 'unmatched_id': unmatched_id})
         return suggestions
 
+    def get_sibling_suggestions(self, unmatched_id, name, parent_key):
+        parent_id = self.canonical_id_lookup[parent_key]
+        return self._build_suggestions(
+            unmatched_id, name, ('parent', parent_id), self.hierarchy[parent_id]
+        )
+
     def get_suggestions(self, unmatched_id, name, dimension):
         # If an unmatched location doesnt have a matched parent, then search all
         # locations at that heierarchy level for suggestions.
-        potential_name_lookup = {
-            self.name_lookup[i]: i for i in self.hierarchy_by_level[dimension]
-        }
-        suggested_names = (
-            process.extract(name.strip(), list(potential_name_lookup.keys()), limit=5)
-            if len(potential_name_lookup.keys())
-            else []
+        return self._build_suggestions(
+            unmatched_id,
+            name,
+            ('level', dimension),
+            self.hierarchy_by_level[dimension],
         )
-        suggested_ids = [potential_name_lookup[sn[0]] for sn in suggested_names]
-        suggestions = []
-        for s_id in suggested_ids:
-            suggestions.append({'canonical_id': s_id, 'unmatched_id': unmatched_id})
-        return suggestions
 
     def get_location_types(self):
         return [
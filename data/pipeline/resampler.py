@@ -1,17 +1,33 @@
 #!/usr/bin/env python
+import heapq
 import json
+import os
+import shutil
+import tempfile
 
+from contextlib import ExitStack
 from datetime import datetime, timedelta
+from operator import itemgetter
+
+from log import LOG
+from util.file.compression.lz4 import LZ4Reader, LZ4Writer
 
 # Reuse the same encoder/decoder instead of using loads and dumps since those
 # versions construct a new encoder/decoder each time they are called.
 _JSON_ENCODER = json.JSONEncoder(
     ensure_ascii=True, check_circular=False, allow_nan=False
 )
+_DECODE_JSON = json.JSONDecoder().decode
 FIELD_COLUMN = 'field'
 DATA_COLUMN = 'data'
 VALUE_COLUMN = 'val'
 
+# Default number of parsed rows the StreamingResampler holds in memory before
+# spilling them to a sorted run on disk.
+DEFAULT_MAX_ROWS_IN_MEMORY = 1000000
+
+ONE_DAY = timedelta(days=1)
+
 
 class Resampler:
     def __init__(self, fields, date_field, date_format, dimensions, last_date):
@@ -57,46 +73,55 @@ class Resampler:
     def _compare_date(self, raw_date):
         return self._convert_date_str(raw_date) < self.last_date
 
+    def _parse_line(self, line):
+        '''Parse a JSON line and yield a tuple of
+        (row key, date, field, value, json line) for each field in the line.
+        '''
+        json_line = _DECODE_JSON(line)
+
+        # Handle different ways that data is stored for druid.
+        # If there is a field key in the json line, it is *not nested*.
+        data = {}
+        if json_line.get(FIELD_COLUMN):
+            field = json_line[FIELD_COLUMN]
+            value = json_line[VALUE_COLUMN]
+
+            # If the field is storing a list of values then it is operating as a
+            # multi-value dimension where all the fields should receive the same
+            # value. This generally only happens when multiple fields have a value
+            # of 0 for the same date and dimensions.
+            if isinstance(field, list):
+                for f in field:
+                    data[f] = value
+            else:
+                # Common case: field is a string and value is a number.
+                data[field] = value
+        else:
+            # Otherwise, we should have a `data` dictionary containing the
+            # nested values.
+            data.update(json_line[DATA_COLUMN])
+            del json_line[DATA_COLUMN]
+
+        row_key_prefix = self._build_row_key_prefix(json_line)
+        raw_date = json_line[self.date_field]
+        for field, value in data.items():
+            row_key = '%s__%s' % (row_key_prefix, field)
+            yield (row_key, raw_date, field, value, json_line)
+
+    def _should_resample(self, field, raw_date):
+        return field in self.fields and self._compare_date(raw_date)
+
     def read_lines(self, lines):
         # Read in all the lines if a line has a field we are
         # resampling then add the line to the _data grouped with
         # other lines that have the same key.
         for line in lines:
-            json_line = json.loads(line)
-
-            # Handle different ways that data is stored for druid.
-            # If there is a field key in the json line, it is *not nested*.
-            data = {}
-            if json_line.get(FIELD_COLUMN):
-                field = json_line[FIELD_COLUMN]
-                value = json_line[VALUE_COLUMN]
-
-                # If the field is storing a list of values then it is operating as a
-                # multi-value dimension where all the fields should receive the same
-                # value. This generally only happens when multiple fields have a value
-                # of 0 for the same date and dimensions.
-                if isinstance(field, list):
-                    for f in field:
-                        data[f] = value
-                else:
-                    # Common case: field is a string and value is a number.
-                    data[field] = value
-            else:
-                # Otherwise, we should have a `data` dictionary containing the
-                # nested values.
-                data.update(json_line[DATA_COLUMN])
-                del json_line[DATA_COLUMN]
-
-            row_key_prefix = self._build_row_key_prefix(json_line)
-            raw_date = json_line[self.date_field]
-            for field, value in data.items():
-                row_key = '%s__%s' % (row_key_prefix, field)
-
+            for (row_key, raw_date, field, value, json_line) in self._parse_line(line):
                 # If this field is not part of the set of fields we should resample,
                 # then it will be collected differently.
                 collection = (
                     self._rows_to_resample
-                    if field in self.fields and self._compare_date(raw_date)
+                    if self._should_resample(field, raw_date)
                     else self._non_resampled_rows
                 )
                 if row_key not in collection:
@@ -140,7 +165,6 @@ class Resampler:
             yield row + line_ending
 
         # upsample the rows to a daily rate for each key, until the last_date specified.
-        one_day = timedelta(days=1)
         for date_to_row_dict in self._rows_to_resample.values():
             # Sort rows from smallest to largest date. We want to copy rows between
             # dates that are missing.
@@ -149,25 +173,177 @@ class Resampler:
 
             # `rows` contains a list of rows for the given dimension key, sorted by date.
             for i, item in enumerate(rows):
-                # JSON serialization is very costly. Reuse the serialized row
-                # since we the only thing changing each time is the date.
-                raw_output_row = self._build_raw_output_row(item)
-
                 # Build new rows that will cover all the dates up to the next row.
-                cur_date = self._convert_date_str(item[self.date_field])
                 end_date = alternate_end_date_function(
                     item,
                     self._convert_date_str(rows[i + 1][self.date_field])
                     if i < row_count
-                    else (self.last_date + one_day),
+                    else (self.last_date + ONE_DAY),
                 )
+                yield from self._build_resampled_rows(item, end_date, line_ending)
+
+    def _build_resampled_rows(self, item, end_date, line_ending):
+        # JSON serialization is very costly. Reuse the serialized row
+        # since we the only thing changing each time is the date.
+        raw_output_row = self._build_raw_output_row(item)
+        cur_date = self._convert_date_str(item[self.date_field])
+        while cur_date < end_date:
+            # Format the date for json serialization.
+            yield '%s, "%s": "%s"}%s' % (
+                raw_output_row,
+                self.date_field,
+                self._get_date_str(cur_date),
+                line_ending,
+            )
+            cur_date += ONE_DAY
+
+
+def _read_run(run_file):
+    for line in run_file:
+        yield _DECODE_JSON(line)
+
+
+class StreamingResampler(Resampler):
+    '''Resampler that holds a bounded number of rows in memory.
+
+    Parsed rows are buffered and, once `max_rows_in_memory` is reached, sorted
+    by (resampled, row key, date) and spilled to a compressed run on disk. When
+    building output rows, the runs are combined with a k-way merge so that all
+    rows of a series (a unique `dimension + field` combination) arrive together
+    and in date order. Resampled rows for a date range are emitted as soon as
+    the next row of the series is seen, so only the active series is held in
+    memory while output rows are built.
+
+    The output contains the same rows as the Resampler. Non-resampled rows are
+    still emitted first, but rows are ordered by series key instead of the
+    order their series was first seen.
+
+    Args:
+        max_rows_in_memory: Maximum number of parsed rows to hold in memory
+            before spilling them to disk.
+        temp_dir: Directory where run files are written. Defaults to the system
+            temp directory.
+    '''
+
+    def __init__(
+        self,
+        fields,
+        date_field,
+        date_format,
+        dimensions,
+        last_date,
+        max_rows_in_memory=DEFAULT_MAX_ROWS_IN_MEMORY,
+        temp_dir=None,
+    ):
+        super().__init__(fields, date_field, date_format, dimensions, last_date)
+        self.max_rows_in_memory = max_rows_in_memory
+        self.temp_dir = temp_dir
+        self._buffer = {}
+        self._runs = []
+        self._work_dir = None
+
+    def read_lines(self, lines):
+        for line in lines:
+            for (row_key, raw_date, field, value, json_line) in self._parse_line(line):
+                key = (int(self._should_resample(field, raw_date)), row_key, raw_date)
+
+                # Accumulate the values of rows with the same `dimension + field`
+                # combination and date that are already in memory.
+                row = self._buffer.get(key)
+                if row is not None:
+                    row[VALUE_COLUMN] += value
+                else:
+                    self._buffer[key] = {
+                        **json_line,
+                        FIELD_COLUMN: field,
+                        VALUE_COLUMN: value,
+                    }
+            if len(self._buffer) >= self.max_rows_in_memory:
+                self._spill()
+
+    def _sorted_buffer(self):
+        buffer = sorted(self._buffer.items(), key=itemgetter(0))
+        self._buffer = {}
+        return [[*key, row] for (key, row) in buffer]
+
+    def _spill(self):
+        if not self._work_dir:
+            self._work_dir = tempfile.mkdtemp(prefix='resample_', dir=self.temp_dir)
 
-                while cur_date < end_date:
-                    # Format the date for json serialization.
-                    yield '%s, "%s": "%s"}%s' % (
-                        raw_output_row,
-                        self.date_field,
-                        self._get_date_str(cur_date),
+        path = os.path.join(self._work_dir, 'run_%d.lz4' % len(self._runs))
+        rows = self._sorted_buffer()
+        with LZ4Writer(path) as run_file:
+            for row in rows:
+                run_file.write(_JSON_ENCODER.encode(row))
+                run_file.write('\n')
+        self._runs.append(path)
+        LOG.info('Spilled %d rows to disk', len(rows))
+
+    def _iter_collapsed_rows(self):
+        '''Yield (resampled, row key, date, row) for each unique row key and
+        date in sorted order, accumulating the values of duplicate rows.
+        '''
+        with ExitStack() as exit_stack:
+            # NOTE: heapq.merge yields equal keys in run order, and runs are
+            # written in the order rows were read.
+            sources = [
+                _read_run(exit_stack.enter_context(LZ4Reader(path)))
+                for path in self._runs
+            ]
+            sources.append(self._sorted_buffer())
+            current = None
+            for item in heapq.merge(*sources, key=itemgetter(0, 1, 2)):
+                if current and current[:3] == item[:3]:
+                    current[3][VALUE_COLUMN] += item[3][VALUE_COLUMN]
+                    continue
+
+                if current:
+                    yield current
+                current = item
+
+            if current:
+                yield current
+
+    def build_output_rows(
+        self, newline=True, alternate_end_date_function=lambda y, x: x
+    ):
+        line_ending = '\n' if newline else ''
+        series_key = None
+        series_row = None
+        try:
+            for (resample, row_key, raw_date, row) in self._iter_collapsed_rows():
+                # Rows that should not be resampled are sorted first and are
+                # output unmodified in their original form.
+                if not resample:
+                    yield _JSON_ENCODER.encode(row) + line_ending
+                    continue
+
+                # The previous row of the series covers all dates up to this
+                # row. If this row starts a new series, the previous series
+                # is complete and its last row covers all dates up to the
+                # last_date specified.
+                if series_row is not None:
+                    end_date = (
+                        self._convert_date_str(raw_date)
+                        if row_key == series_key
+                        else self.last_date + ONE_DAY
+                    )
+                    yield from self._build_resampled_rows(
+                        series_row,
+                        alternate_end_date_function(series_row, end_date),
                         line_ending,
                     )
-                    cur_date += one_day
+                series_key = row_key
+                series_row = row
+
+            if series_row is not None:
+                yield from self._build_resampled_rows(
+                    series_row,
+                    alternate_end_date_function(series_row, self.last_date + ONE_DAY),
+                    line_ending,
+                )
+        finally:
+            if self._work_dir:
+                shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+            self._runs = []
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''Compile the canonical dimension mapping and metadata files into a lookup file
+that `fill_dimension_data.py` can load quickly and share between processes.
+
+Usage:
+compile_dimension_lookup.py \
+  --location_mapping_file mapped_locations.csv \
+  --metadata_file metadata_mapped.csv \
+  --output_file dimension_lookup.bin
+'''
+import sys
+
+from pylib.base.flags import Flags
+
+from config.datatypes import DimensionFactoryType
+from data.pipeline.datatypes.compiled_dimension_lookup import (
+    write_compiled_dimension_lookup,
+)
+from log import LOG
+
+
+def main():
+    Flags.PARSER.add_argument(
+        '--location_mapping_file',
+        type=str,
+        required=True,
+        help='Canonical location mappings',
+    )
+    Flags.PARSER.add_argument(
+        '--non_hierarchical_mapping_file',
+        type=str,
+        required=bool(DimensionFactoryType.non_hierarchical_dimensions),
+        help='Canonical non-hierarchical dimension mapping, only required if the '
+        'deployment uses non-hierarchical dimensions',
+    )
+    Flags.PARSER.add_argument(
+        '--metadata_file',
+        type=str,
+        required=True,
+        help='Location of metadata mapping file',
+    )
+    Flags.PARSER.add_argument(
+        '--output_file',
+        type=str,
+        required=True,
+        help='File to write the compiled dimension lookup to',
+    )
+    Flags.InitArgs()
+
+    LOG.info('Building canonical dimension mapping')
+    collector = DimensionFactoryType.create_metadata_collector(
+        Flags.ARGS.metadata_file,
+        Flags.ARGS.location_mapping_file,
+        Flags.ARGS.non_hierarchical_mapping_file,
+    )
+    LOG.info('Writing %s mapped rows', collector.clean_row_count)
+    write_compiled_dimension_lookup(collector, Flags.ARGS.output_file)
+    LOG.info('Finished writing compiled dimension lookup')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
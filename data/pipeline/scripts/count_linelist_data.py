@@ -1,7 +1,20 @@
 #!/usr/bin/env python
 '''Convert a line-list into a csv with two fields:
-1. a counts field that stores the number of cases per day
-2. a cumulative field that stores the cumulative number of cases per day
+1. a counts field that stores the number of cases per time bucket
+2. a cumulative field that stores the cumulative number of cases per time bucket
+
+Time buckets can be days, weeks (starting on Monday), months or quarters. Each
+output row is dated with the first day of its bucket. Using a coarser
+granularity greatly reduces the number of rows that need to be processed and
+indexed.
+
+The line-list is streamed and aggregated in a single pass, so only the counts
+per dimension combination and time bucket are held in memory. This still grows
+with the number of dimension combinations times the number of time buckets. If
+the line-list is sorted by date, use `sorted_input` so that the rows of each
+time bucket are written as soon as the input moves past it. Only the counts of
+the current time bucket and one running total per dimension combination are
+then held in memory.
 
 The input csv must be of the following format (column headers in any order):
     ------------------------------------------------------------------------------------
@@ -25,19 +38,16 @@ The output CSV is in a format that is ready to be processed by a process_csv ste
 Where 'field' can only be one of two values: the `count_field` or the
 `cumulative_field` arguments passed into the script.
 
-NOTE(pablo): at the moment, this script can only aggregate counts daily. This
-script will need to be updated to support other time granularities (such as
-weekly or monthly).
-
 Args:
     input_file: the linelist csv file
     output_file: the output csv file
     dimension_class: (optional) the Dimension class to load, for example:
         'config.mz.datatypes.Dimension'
     count_field: (optional) the field name to store the counts of each case. If none
-        is provided then no counts will be generated per day.
+        is provided then no counts will be generated per time bucket.
     cumulative_field: (optional) the field name to store the cumulative counts of each case.
-        If none is provided then no cumulative counts will be generated per day.
+        If none is provided then no cumulative counts will be generated per time
+        bucket.
     dimensions: (optional) the list of dimensions to collect. By default this
         script will pull all column names from the csv that match a dimension
         in `DimensionClass`. You can override this behavior by passing in your
@@ -57,6 +67,10 @@ Args:
         several fields in one CSV (e.g. cholera, malaria, measles), but if we only
         wanted to aggregate cholera, we'd set `field_to_aggregate="cholera"`, and
         all other rows would be ignored.
+    granularity: (optional) the time granularity to aggregate counts to. One of
+        'day', 'week', 'month' or 'quarter'. Defaults to 'day'.
+    sorted_input: (optional) if set, the linelist must be sorted by date and the
+        rows of each time bucket are written once the input has moved past it.
 
 Returns:
     A csv stored in `output_file` that is ready to be processed by a process_csv
@@ -70,16 +84,45 @@ from pylib.base.flags import Flags
 from log import LOG
 from util.file.unicode_csv import UnicodeDictReader, UnicodeDictWriter
 from config.system import STANDARD_DATA_DATE_FORMAT
-from config.zen.datatypes import Dimension
 
 
-def _get_dates_between_ranges(start_date, end_date):
-    '''Get all dates (inclusive) between two dates.
+GRANULARITIES = ('day', 'week', 'month', 'quarter')
+
+
+def _get_bucket_start(date, granularity):
+    '''Get the first day of the time bucket that the date falls in.'''
+    if granularity == 'day':
+        return date
+    if granularity == 'week':
+        return date - timedelta(date.weekday())
+    if granularity == 'month':
+        return date.replace(day=1)
+    if granularity == 'quarter':
+        return date.replace(month=date.month - (date.month - 1) % 3, day=1)
+    raise ValueError('Unsupported granularity: %s' % granularity)
+
+
+def _get_next_bucket_start(bucket_start, granularity):
+    if granularity == 'day':
+        return bucket_start + timedelta(1)
+    if granularity == 'week':
+        return bucket_start + timedelta(7)
+
+    months = 1 if granularity == 'month' else 3
+    month_idx = bucket_start.month - 1 + months
+    return bucket_start.replace(
+        year=bucket_start.year + month_idx // 12, month=month_idx % 12 + 1
+    )
+
+
+def _get_dates_between_ranges(start_date, end_date, granularity='day'):
+    '''Get the start dates of all time buckets (inclusive) between two dates.
     Args:
         start_date: either a string or datetime object.
             If a string, must be in '%Y-%m-%d' format.
         end_date: either a string or datetime object
             If a string, must be in '%Y-%m-%d' format.
+        granularity: the time bucket size. One of `GRANULARITIES`.
 
     Returns:
         A list of datetime objects.
@@ -91,20 +134,57 @@ def _get_dates_between_ranges(start_date, end_date):
     if isinstance(end, str):
         end = datetime.strptime(end, '%Y-%m-%d')
     dates = []
-    curr_date = start
-    for _ in range(int((end - start).days) + 1):
+    curr_date = _get_bucket_start(start, granularity)
+    while curr_date <= end:
         dates.append(curr_date)
-        curr_date += timedelta(1)
+        curr_date = _get_next_bucket_start(curr_date, granularity)
     return dates
 
 
+class DateBucketer:
+    '''Convert date strings into the date string of the start of their time
+    bucket. Conversions are cached since line-lists contain few distinct dates.
+    '''
+
+    def __init__(self, granularity='day'):
+        if granularity not in GRANULARITIES:
+            raise ValueError('Unsupported granularity: %s' % granularity)
+        self.granularity = granularity
+        self._cache = {}
+
+    def get_bucket(self, date_str):
+        if self.granularity == 'day':
+            return date_str
+
+        bucket = self._cache.get(date_str)
+        if bucket is None:
+            date = datetime.strptime(date_str, STANDARD_DATA_DATE_FORMAT)
+            bucket = datetime.strftime(
+                _get_bucket_start(date, self.granularity), STANDARD_DATA_DATE_FORMAT
+            )
+            self._cache[date_str] = bucket
+        return bucket
+
+
 class DimensionNode:
+    # NOTE: A node is created for every distinct combination of dimension
+    # values, so use slots to keep the tree small.
+    __slots__ = (
+        'children_dict',
+        'dimension_id',
+        'dimension_value',
+        'parent',
+        'is_leaf',
+        'counts',
+        'first_date',
+        'flushed_count',
+    )
+
     def __init__(self, dimension_id=None, dimension_value=None):
-        self.children = []
         self.children_dict = {}
         self.dimension_id = dimension_id
         self.dimension_value = dimension_value
-        self.parent_dimensions = []
+        self.parent = None
 
         # these should only be used if the node is a leaf node. Only
         # the leaf nodes should store information about the counts per date.
@@ -112,6 +192,27 @@ class DimensionNode:
         self.counts = {}
         self.first_date = None
 
+        # total count of the time buckets that were removed by `pop_count_rows`
+        self.flushed_count = 0
+
+    @property
+    def children(self):
+        return list(self.children_dict.values())
+
+    @property
+    def parent_dimensions(self):
+        '''The (dimension_id, dimension_value) pairs of the nodes leading to
+        this node, excluding dimensions that are None (like the root's).
+        '''
+        dimensions = []
+        node = self.parent
+        while node is not None:
+            if node.dimension_id is not None:
+                dimensions.append((node.dimension_id, node.dimension_value))
+            node = node.parent
+        dimensions.reverse()
+        return dimensions
+
     def has_dimension(self, dimension_val):
         return dimension_val in self.children_dict
 
@@ -120,15 +221,8 @@ class DimensionNode:
 
     def add_child(self, child_node):
         self.is_leaf = False
-        self.children.append(child_node)
         self.children_dict[child_node.dimension_value] = child_node
-
-        # make the child point store references to the parent dimensions, unless
-        # the current dimension is None
-        if self.dimension_id is not None:
-            child_node.parent_dimensions = self.parent_dimensions + [
-                (self.dimension_id, self.dimension_value)
-            ]
+        child_node.parent = self
 
     def add_count(self, date_str, count):
         self.is_leaf = True
@@ -139,27 +233,61 @@ class DimensionNode:
         else:
             self.counts[date_str] = count
 
-    def generate_count_rows(self, last_date, count_field=None, cumulative_field=None):
-        '''Take the counts per date in this node and convert it into rows
-        representing the counts of cases per date, and the cumulative counts.
-
-        If either count_field or cumulative_field is None, it means we should ignore
-        adding rows for those fields.
-        '''
-        if not self.is_leaf:
-            raise Exception('Can only call `generate_count_rows` on a leaf node')
-
+    def _get_dimension_path(self):
         # get the dimensions leading to this node, including this node's dimensions
         dimension_path = self.parent_dimensions
         if self.dimension_id and self.dimension_value:
-            dimension_path += [(self.dimension_id, self.dimension_value)]
+            dimension_path.append((self.dimension_id, self.dimension_value))
+        return dimension_path
 
-        output_count_rows = []
-        output_cumulative_rows = []
-        dates = _get_dates_between_ranges(self.first_date, last_date)
-        date_strs = [datetime.strftime(d, STANDARD_DATA_DATE_FORMAT) for d in dates]
-        curr_count = 0
+    def iter_count_rows(
+        self, last_date, count_field=None, cumulative_field=None, granularity='day'
+    ):
+        '''Take the counts per date in this node and convert them into rows
+        representing the counts of cases per date, and the cumulative counts.
+        Yields tuples of (count_row, cumulative_row) for each date between this
+        node's first date and `last_date`. `count_row` is None on dates that
+        have no cases or when `count_field` is None, and `cumulative_row` is
+        None when `cumulative_field` is None.
+        '''
+        if not self.is_leaf:
+            raise Exception('Can only call `iter_count_rows` on a leaf node')
+
+        dates = _get_dates_between_ranges(self.first_date, last_date, granularity)
+        date_strs = [
+            datetime.strftime(date, STANDARD_DATA_DATE_FORMAT) for date in dates
+        ]
+        return self._iter_rows(date_strs, count_field, cumulative_field)
+
+    def pop_count_rows(
+        self, end_date, count_field=None, cumulative_field=None, granularity='day'
+    ):
+        '''Yield the (count_row, cumulative_row) tuples of the time buckets
+        before `end_date`, like `iter_count_rows`, and remove their counts from
+        this node. The cumulative counts of later time buckets include the
+        counts that were removed.
+        '''
+        if self.first_date is None or self.first_date >= end_date:
+            return
+
+        dates = _get_dates_between_ranges(self.first_date, end_date, granularity)
+        date_strs = [
+            datetime.strftime(date, STANDARD_DATA_DATE_FORMAT) for date in dates
+        ]
+        if date_strs[-1] == end_date:
+            date_strs.pop()
+        rows = list(self._iter_rows(date_strs, count_field, cumulative_field))
+        for date_str in date_strs:
+            self.flushed_count += self.counts.pop(date_str, 0)
+        self.first_date = end_date
+        yield from rows
+
+    def _iter_rows(self, date_strs, count_field, cumulative_field):
+        dimension_path = self._get_dimension_path()
+        curr_count = self.flushed_count
         for date_str in date_strs:
+            count_row = None
+            cumulative_row = None
             if date_str in self.counts:
                 curr_count += self.counts[date_str]
 
@@ -172,7 +300,6 @@ class DimensionNode:
                     # attach dimension info
                     for (dim_id, dim_val) in dimension_path:
                         count_row[dim_id] = dim_val
-                    output_count_rows.append(count_row)
 
             if cumulative_field is not None:
                 cumulative_row = {
@@ -183,11 +310,177 @@ class DimensionNode:
                 # attach dimension info
                 for (dim_id, dim_val) in dimension_path:
                     cumulative_row[dim_id] = dim_val
-                output_cumulative_rows.append(cumulative_row)
 
+            yield (count_row, cumulative_row)
+
+    def generate_count_rows(
+        self, last_date, count_field=None, cumulative_field=None, granularity='day'
+    ):
+        '''Take the counts per date in this node and convert it into rows
+        representing the counts of cases per date, and the cumulative counts.
+
+        If either count_field or cumulative_field is None, it means we should ignore
+        adding rows for those fields.
+        '''
+        output_count_rows = []
+        output_cumulative_rows = []
+        for (count_row, cumulative_row) in self.iter_count_rows(
+            last_date, count_field, cumulative_field, granularity
+        ):
+            if count_row is not None:
+                output_count_rows.append(count_row)
+            if cumulative_row is not None:
+                output_cumulative_rows.append(cumulative_row)
         return (output_count_rows, output_cumulative_rows)
 
 
+class LinelistCounter:
+    '''Aggregate line-list rows one at a time into counts per dimension
+    combination and time bucket. Rows are not stored, so a line-list can be
+    streamed through the counter in a single pass.
+
+    With `add_rows`, the counts of every time bucket are kept until the output
+    rows are built. Line-lists sorted by date can use `iter_sorted_rows`
+    instead, which writes out the time buckets that the input has moved past.
+
+    Args:
+        See `convert_linelist_to_count_rows`.
+    '''
+
+    def __init__(
+        self,
+        count_field=None,
+        cumulative_field=None,
+        dimensions=None,
+        date_key='date',
+        val_key='val',
+        field_key='field',
+        field_to_aggregate=None,
+        granularity='day',
+    ):
+        self.count_field = count_field
+        self.cumulative_field = cumulative_field
+        self.date_key = date_key
+        self.val_key = val_key
+        self.field_key = field_key
+        self.field_to_aggregate = field_to_aggregate
+        self.granularity = granularity
+
+        # precompute the (dim_id, colname) pairs so they aren't rebuilt per row
+        self.dimensions = [
+            (dimension, dimension) if isinstance(dimension, str) else dimension
+            for dimension in (dimensions or [])
+        ]
+
+        self.root = DimensionNode()
+        self.last_date = None
+        self.rows_processed = 0
+        self._bucketer = DateBucketer(granularity)
+
+        # Start of the first time bucket that has not been written out yet.
+        # Earlier dates cannot be counted anymore.
+        self._flushed_until = None
+
+    def add_row(self, row):
+        self.rows_processed += 1
+
+        # skip this row if `field_to_aggregate` is set, and either the
+        # `field_key` doesn't exist, or it does not match `field_to_aggregate`
+        if self.field_to_aggregate and (
+            row.get(self.field_key) != self.field_to_aggregate
+        ):
+            return
+
+        date_str = self._bucketer.get_bucket(row[self.date_key])
+        if self._flushed_until is not None and date_str < self._flushed_until:
+            raise ValueError(
+                'Line-list is not sorted by date. Found %s after %s'
+                % (row[self.date_key], self._flushed_until)
+            )
+        curr_node = self.root
+
+        # build out the node tree down to the last dimension, or traverse
+        # the nodes if they've already been built
+        for (dim_id, colname) in self.dimensions:
+            dim_val = row[colname]
+            child_node = curr_node.children_dict.get(dim_val)
+            if child_node is None:
+                child_node = DimensionNode(dim_id, dim_val)
+                curr_node.add_child(child_node)
+            curr_node = child_node
+
+        # now that we're at the last node, let's add this date to
+        # the node's counts
+        curr_node.add_count(
+            date_str, int(row[self.val_key]) if self.val_key in row else 1
+        )
+
+        # track the global last date
+        if self.last_date is None or date_str > self.last_date:
+            self.last_date = date_str
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.add_row(row)
+
+    def iter_sorted_rows(self, rows):
+        '''Add the rows of a line-list sorted by date and yield the
+        (count_row, cumulative_row) tuples of each time bucket once the input
+        has moved past it, followed by the tuples of the last time bucket.
+        `count_row` is None on time buckets that have no cases or when
+        `count_field` is None, and `cumulative_row` is None when
+        `cumulative_field` is None.
+        '''
+        for row in rows:
+            previous_last_date = self.last_date
+            self.add_row(row)
+            if previous_last_date is not None and self.last_date != previous_last_date:
+                yield from self._flush_buckets(self.last_date)
+        yield from self._iter_leaf_rows(self.count_field, self.cumulative_field)
+
+    def _flush_buckets(self, end_date):
+        for leaf in self._iter_leaves():
+            yield from leaf.pop_count_rows(
+                end_date, self.count_field, self.cumulative_field, self.granularity
+            )
+        self._flushed_until = end_date
+
+    def _iter_leaves(self):
+        # traverse depth-first
+        nodes = [self.root]
+        while nodes:
+            curr_node = nodes.pop()
+            if curr_node.is_leaf:
+                yield curr_node
+            else:
+                nodes.extend(curr_node.children_dict.values())
+
+    def _iter_leaf_rows(self, count_field, cumulative_field):
+        if self.last_date is None:
+            return
+        for leaf in self._iter_leaves():
+            yield from leaf.iter_count_rows(
+                self.last_date, count_field, cumulative_field, self.granularity
+            )
+
+    def iter_count_rows(self):
+        '''Yield the rows storing the counts of cases per time bucket.'''
+        if self.count_field is None:
+            return
+        for (count_row, _) in self._iter_leaf_rows(self.count_field, None):
+            if count_row is not None:
+                yield count_row
+
+    def iter_cumulative_rows(self):
+        '''Yield the rows storing the cumulative counts of cases per time
+        bucket.
+        '''
+        if self.cumulative_field is None:
+            return
+        for (_, cumulative_row) in self._iter_leaf_rows(None, self.cumulative_field):
+            yield cumulative_row
+
+
 def convert_linelist_to_count_rows(
     rows,
     count_field=None,
@@ -197,16 +490,13 @@ def convert_linelist_to_count_rows(
     val_key='val',
     field_key='field',
     field_to_aggregate=None,
+    granularity='day',
 ):
     '''Convert rows representing a line-list into two sets of output rows that
     represent the case counts.
 
-    NOTE(pablo): at the moment, this script can only aggregate counts daily. This
-    script will need to be updated to support other time granularities (such as
-    weekly or monthly).
-
     Args:
-        rows: a list of dicts representing the linelist
+        rows: an iterable of dicts representing the linelist
         count_field: (optional) the field name to store the counts of each case.
             If None, we skip creating rows for this field.
         cumulative_field: (optional) the field name to store the cumulative
@@ -223,67 +513,27 @@ def convert_linelist_to_count_rows(
             Defaults to 'field', but is only used if `field_to_aggregate` is set.
         field_to_aggregate: (optional) if set, we only aggregate rows whose `field`
             value is equal to `field_to_aggregate`.
+        granularity: (optional) the time bucket to aggregate counts to. One of
+            'day', 'week', 'month' or 'quarter'. Defaults to 'day'.
 
     Returns:
         A tuple of rows ready to be ingested by our `process_csv` script:
             (count_rows, cumulative_count_rows)
-        count_rows: how many cases occurred per day
-        cumulative_count_rows: cumulative counts of cases per day
+        count_rows: how many cases occurred per time bucket
+        cumulative_count_rows: cumulative counts of cases per time bucket
     '''
-    root = DimensionNode()
-
-    last_date = None
-    for row in rows:
-        # skip this row if `field_to_aggregate` is set, and either the
-        # `field_key` doesn't exist, or it does not match `field_to_aggregate`
-        if field_to_aggregate and (
-            field_key not in row or row[field_key] != field_to_aggregate
-        ):
-            continue
-
-        date_str = row[date_key]
-        curr_node = root
-
-        # build out the node tree down to the last dimension, or traverse
-        # the nodes if they've already been built
-        if dimensions and dimensions != []:
-            for dimension in dimensions:
-                dim_id = dimension if isinstance(dimension, str) else dimension[0]
-                colname = dim_id if isinstance(dimension, str) else dimension[1]
-                dim_val = row[colname]
-
-                if not curr_node.has_dimension(dim_val):
-                    new_node = DimensionNode(dim_id, dim_val)
-                    curr_node.add_child(new_node)
-
-                curr_node = curr_node.get_child(dim_val)
-
-        # now that we're at the last node, let's add this date to
-        # the node's counts
-        curr_node.add_count(date_str, int(row[val_key]) if val_key in row else 1)
-
-        # track the global last date
-        if last_date is None or date_str > last_date:
-            last_date = date_str
-
-    # create the process_csv rows for counts and cumulative counts
-    output_count_rows = []
-    output_cumulative_rows = []
-
-    # traverse depth-first
-    nodes = [root]
-    while nodes != []:
-        curr_node = nodes.pop()
-        if curr_node.is_leaf:
-            (count_rows, cumulative_count_rows) = curr_node.generate_count_rows(
-                last_date, count_field, cumulative_field
-            )
-            output_count_rows.extend(count_rows)
-            output_cumulative_rows.extend(cumulative_count_rows)
-        else:
-            nodes.extend(curr_node.children)
-
-    return (output_count_rows, output_cumulative_rows)
+    counter = LinelistCounter(
+        count_field=count_field,
+        cumulative_field=cumulative_field,
+        dimensions=dimensions,
+        date_key=date_key,
+        val_key=val_key,
+        field_key=field_key,
+        field_to_aggregate=field_to_aggregate,
+        granularity=granularity,
+    )
+    counter.add_rows(rows)
+    return (list(counter.iter_count_rows()), list(counter.iter_cumulative_rows()))
 
 
 def main():
@@ -306,13 +556,13 @@ def main():
         '--count_field',
         type=str,
         required=False,
-        help='(Optional) The field name to store the counts. If none is provided, counts will not be generated per day.',
+        help='(Optional) The field name to store the counts. If none is provided, counts will not be generated per time bucket.',
     )
     Flags.PARSER.add_argument(
         '--cumulative_field',
         type=str,
         required=False,
-        help='(Optional) The field name to store the cumulative counts. If none is provided, cumulative counts will not be generated per day.',
+        help='(Optional) The field name to store the cumulative counts. If none is provided, cumulative counts will not be generated per time bucket.',
     )
     Flags.PARSER.add_argument(
         '--dimensions',
@@ -345,6 +595,19 @@ def main():
         required=False,
         help="(Optional) Only aggregate rows that have a `field` column equal to this value. Some linelists may combine several different fields (e.g. cholera, measles, malaria, etc). If we want to aggregate cases for only one of those fields (e.g. 'cholera'), we can set that here.",
     )
+    Flags.PARSER.add_argument(
+        '--granularity',
+        type=str,
+        choices=GRANULARITIES,
+        default='day',
+        help='(Optional) The time granularity to aggregate counts to. Each output row is dated with the first day of its time bucket. Defaults to \'day\'.',
+    )
+    Flags.PARSER.add_argument(
+        '--sorted_input',
+        action='store_true',
+        default=False,
+        help='(Optional) The linelist is sorted by date. The rows of each time bucket are written as soon as the input has moved past it, so the counts of earlier time buckets are not held in memory.',
+    )
     Flags.InitArgs()
     LOG.info('Begin processing linelist')
 
@@ -368,7 +631,6 @@ def main():
         Flags.ARGS.output_file, 'w'
     ) as output_file:
         reader = UnicodeDictReader(input_file)
-        all_rows = [*reader]
         dimensions = Flags.ARGS.dimensions or []
 
         if dimensions == []:
@@ -408,8 +670,7 @@ def main():
                     reformatted_dimensions.append((parts[0], parts[1]))
             dimensions = reformatted_dimensions
 
-        (count_rows, cumulative_rows) = convert_linelist_to_count_rows(
-            all_rows,
+        counter = LinelistCounter(
             count_field=count_field,
             cumulative_field=cumulative_field,
             dimensions=dimensions,
@@ -417,20 +678,37 @@ def main():
             val_key=valcol,
             field_key=fieldcol,
             field_to_aggregate=field_to_aggregate,
+            granularity=Flags.ARGS.granularity,
         )
-
         output_fieldnames = [d if isinstance(d, str) else d[0] for d in dimensions]
         output_fieldnames.extend(['field', 'date', 'val'])
 
-        output_rows = count_rows + cumulative_rows
+        # stream the output rows instead of building them all in memory
         writer = UnicodeDictWriter(output_file, fieldnames=output_fieldnames)
         writer.writeheader()
-        writer.writerows(output_rows)
+        num_count_rows = 0
+        num_cumulative_rows = 0
+        if Flags.ARGS.sorted_input:
+            for (count_row, cumulative_row) in counter.iter_sorted_rows(reader):
+                if count_row is not None:
+                    writer.writerow(count_row)
+                    num_count_rows += 1
+                if cumulative_row is not None:
+                    writer.writerow(cumulative_row)
+                    num_cumulative_rows += 1
+        else:
+            counter.add_rows(reader)
+            for row in counter.iter_count_rows():
+                writer.writerow(row)
+                num_count_rows += 1
+            for row in counter.iter_cumulative_rows():
+                writer.writerow(row)
+                num_cumulative_rows += 1
 
     LOG.info('Successfully processed linelist data')
-    LOG.info('Processed %s rows', len(all_rows))
-    LOG.info('Wrote %s %s rows', len(count_rows), count_field)
-    LOG.info('Wrote %s %s rows', len(cumulative_rows), cumulative_field)
+    LOG.info('Processed %s rows', counter.rows_processed)
+    LOG.info('Wrote %s %s rows', num_count_rows, count_field)
+    LOG.info('Wrote %s %s rows', num_cumulative_rows, cumulative_field)
     return 0
 
 
@@ -2,11 +2,15 @@
 # Standardized Druid output row writer to use in the
 # 90_shared/10_fill_dimensions process pipeline step.
 import csv
+import os
 import sys
 
+from functools import partial
+
 from pylib.base.flags import Flags
 
 from config.datatypes import BaseRowType, DimensionFactoryType
+from data.pipeline.io.base_row_binary import BaseRowFileReader, is_binary_row_file
 from data.pipeline.io.druid_writer import DruidWriter, ErrorHandler
 from util.file.compression.lz4 import LZ4Reader
 from util.file.compression.pigz import PigzWriter
@@ -18,27 +22,39 @@ def main():
     Flags.PARSER.add_argument(
         '--location_mapping_file',
         type=str,
-        required=True,
-        help='Canonical location mappings for the ' 'current source',
+        required=False,
+        help='Canonical location mappings for the current source. Required unless '
+        '--compiled_dimension_lookup_file is set.',
     )
     Flags.PARSER.add_argument(
         '--non_hierarchical_mapping_file',
         type=str,
-        required=bool(DimensionFactoryType.non_hierarchical_dimensions),
+        required=False,
         help='Canonical non-hierarchical dimension mapping, only required if the deployment'
         'uses non-hierarchical dimensions',
     )
     Flags.PARSER.add_argument(
         '--metadata_file',
         type=str,
-        required=True,
-        help='Location of metadata mapping file',
+        required=False,
+        help='Location of metadata mapping file. Required unless '
+        '--compiled_dimension_lookup_file is set.',
+    )
+    Flags.PARSER.add_argument(
+        '--compiled_dimension_lookup_file',
+        type=str,
+        required=False,
+        help='Lookup file built by compile_dimension_lookup.py. When set, it is '
+        'used instead of the location mapping, non-hierarchical mapping and '
+        'metadata files.',
     )
     Flags.PARSER.add_argument(
         '--input_file',
         type=str,
         required=True,
-        help='Source data file needing canonical ' 'locations and geocoding',
+        help='Source data file needing canonical '
+        'locations and geocoding. Rows can be stored as JSON or in the binary '
+        'row format.',
     )
     Flags.PARSER.add_argument(
         '--output_file_pattern',
@@ -102,19 +118,71 @@ def main():
         'have an entry in location_mapping_file '
         'will be skipped.',
     )
+    Flags.PARSER.add_argument(
+        '--num_workers',
+        type=int,
+        default=1,
+        help='Number of worker processes to convert rows with. When greater '
+        'than 1, each worker task writes its own set of output shards.',
+    )
     Flags.InitArgs()
 
+    compiled_lookup_file = Flags.ARGS.compiled_dimension_lookup_file
+    if not compiled_lookup_file:
+        missing_flags = [
+            flag
+            for flag, required in (
+                ('--location_mapping_file', True),
+                ('--metadata_file', True),
+                (
+                    '--non_hierarchical_mapping_file',
+                    bool(DimensionFactoryType.non_hierarchical_dimensions),
+                ),
+            )
+            if required and not getattr(Flags.ARGS, flag[2:])
+        ]
+        if missing_flags:
+            Flags.PARSER.error(
+                'The following arguments are required: %s' % ', '.join(missing_flags)
+            )
+
     file_pattern = FilePattern(Flags.ARGS.output_file_pattern)
-    with LZ4Reader(Flags.ARGS.input_file) as input_file, ShardWriter(
+
+    # Rows stored in the binary format are deserialized by the reader, so the
+    # JSON parsers are not needed.
+    parsed_input = is_binary_row_file(Flags.ARGS.input_file)
+    if parsed_input:
+        input_file_opener = BaseRowFileReader(Flags.ARGS.input_file, BaseRowType)
+    else:
+        input_file_opener = LZ4Reader(Flags.ARGS.input_file)
+
+    # Every worker compresses its own output shards, so the compression threads
+    # are split between the workers instead of each worker using one per CPU.
+    task_file_opener = partial(
+        PigzWriter,
+        processes=max((os.cpu_count() or 1) // max(Flags.ARGS.num_workers, 1), 1),
+    )
+
+    def build_task_output_writer(task_id):
+        # Output shards written by a task are numbered `<task_id>_<shard>`.
+        task_file_pattern = FilePattern(file_pattern.build('%s_#' % task_id))
+        return ShardWriter(task_file_pattern, Flags.ARGS.shard_size, task_file_opener)
+
+    with input_file_opener as input_file, ShardWriter(
         file_pattern, Flags.ARGS.shard_size, PigzWriter
     ) as output_writer, open(
         Flags.ARGS.metadata_digest_file, 'w'
     ) as metadata_digest_file:
-        metadata_collector = DimensionFactoryType.create_metadata_collector(
-            Flags.ARGS.metadata_file,
-            Flags.ARGS.location_mapping_file,
-            Flags.ARGS.non_hierarchical_mapping_file,
-        )
+        if compiled_lookup_file:
+            metadata_collector = DimensionFactoryType.load_compiled_metadata_collector(
+                compiled_lookup_file
+            )
+        else:
+            metadata_collector = DimensionFactoryType.create_metadata_collector(
+                Flags.ARGS.metadata_file,
+                Flags.ARGS.location_mapping_file,
+                Flags.ARGS.non_hierarchical_mapping_file,
+            )
         error_handler = ErrorHandler(
             allow_missing_date=Flags.ARGS.ignore_missing_date,
             allow_empty_data=Flags.ARGS.ignore_empty_data,
@@ -131,6 +199,9 @@ def main():
                 metadata_digest_file,
                 fieldnames=['indicator_id', 'count', 'start_date', 'end_date'],
             ),
+            Flags.ARGS.num_workers,
+            build_task_output_writer,
+            parsed_input=parsed_input,
         )
     return 0
 
@@ -16,6 +16,9 @@
                              --output_fields        fields.csv \
                              --output_indicators    indicators.csv
 
+    Pass `--engine columnar` to process the input in column batches with the
+    ColumnarAggregator. It produces the same output as the default row engine.
+
     If you are subclassing Aggregator or otherwise calling it from Python, you
     can register custom handlers for row and column processing.  Handlers work
     on raw CSV values.
@@ -40,17 +43,30 @@
 
 # NOTE(stephen): Lots of room for optimization in this file.
 '''
+
+import copy
 import csv
+import glob
+import heapq
 import json
 import gc
+import multiprocessing
+import os
 import re
+import shutil
 import sys
+import tempfile
 
 from builtins import next
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from contextlib import ExitStack
 from datetime import datetime
 from functools import partial
+from itertools import islice
+from operator import itemgetter
 
+import numpy as np
+import pandas as pd
 from dateutil.parser import parse as dateparse
 
 from pylib.base.flags import Flags
@@ -59,34 +75,217 @@ from slugify import slugify
 from config.aggregation import DIMENSIONS
 from config.datatypes import BaseRowType, DimensionFactoryType
 from config.system import STANDARD_DATA_DATE_FORMAT
+from data.pipeline.datatypes.compact_base_row import build_compact_row_type
 from data.pipeline.datatypes.dimension_collector_io import (
     write_hierarchical_dimensions,
     write_non_hierarchical_dimensions,
 )
+from data.pipeline.io.base_row_binary import (
+    ROW_FORMATS,
+    BaseRowFileWriter,
+    BaseRowJsonWriter,
+)
 
 from log import LOG
 from util.file.ambiguous_file import AmbiguousFile
-from util.file.compression.lz4 import LZ4Writer
+from util.file.compression.lz4 import LZ4Reader, LZ4Writer
 
 FIELD_WILDCARD = '*field_'
 SLUG_SEPARATOR = '_'
 UNPIVOTED_FIELD_COLUMN = 'field'
 UNPIVOTED_VALUE_COLUMN = 'val'
 
-_DATE_CACHE = {}
+# Maximum number of distinct input date strings to store parsed dates for.
+DEFAULT_DATE_CACHE_SIZE = 100000
+
+# Number of distinct date strings used to infer the format of a date column.
+DATE_FORMAT_SAMPLE_SIZE = 50
+
+# Minimum fraction of the sampled date strings that must match a strict format for
+# the format to be used.
+DATE_FORMAT_MIN_MATCH_RATIO = 0.9
+
+# Strict date formats that a date column can be inferred to use. A format is only
+# included if every value it can parse would be parsed to the same date by
+# `dateutil`, so that using the format never changes the output.
+# NOTE: Day first formats (like `%d/%m/%Y`) are not included since `dateutil`
+# parses ambiguous dates as month first.
+CANDIDATE_DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M:%S',
+)
 
 
-def _get_date(input_date_str):
-    if input_date_str not in _DATE_CACHE:
-        # TODO(ian): If the date is just a year, it sets the month and the
-        # day to the current date!
-        try:
-            date_str = dateparse(input_date_str).strftime(STANDARD_DATA_DATE_FORMAT)
-        except ValueError:
-            LOG.error('Could not parse date: %s', input_date_str)
-            date_str = None
-        _DATE_CACHE[input_date_str] = date_str
-    return _DATE_CACHE[input_date_str]
+def _parse_date_fallback(input_date_str):
+    # TODO(ian): If the date is just a year, it sets the month and the
+    # day to the current date!
+    try:
+        return dateparse(input_date_str).strftime(STANDARD_DATA_DATE_FORMAT)
+    except ValueError:
+        LOG.error('Could not parse date: %s', input_date_str)
+        return None
+
+
+def _parse_date_strict(input_date_str, date_format):
+    try:
+        return datetime.strptime(input_date_str, date_format).strftime(
+            STANDARD_DATA_DATE_FORMAT
+        )
+    except ValueError:
+        return None
+
+
+class DateParser:
+    '''Parse the values of a date column into output date strings.
+
+    The first distinct values seen are parsed with `dateutil` and used as a
+    sample to infer the format of the column. If most sampled values can be
+    parsed by one of the candidate strict formats, the column is locked onto
+    that format, and the remaining values are parsed with the strict format.
+    Values that do not match the format fall back to `dateutil`.
+
+    Parsed dates are stored in a bounded LRU cache so that high cardinality date
+    columns (like timestamps) do not grow memory without bound.
+    '''
+
+    def __init__(self, max_cache_size=DEFAULT_DATE_CACHE_SIZE):
+        self.max_cache_size = max_cache_size
+        self.date_format = None
+        self.stats = defaultdict(int)
+        self._cache = OrderedDict()
+        self._sample = []
+        self._format_inferred = False
+
+    def _store(self, input_date_str, date_str):
+        self._cache[input_date_str] = date_str
+        if len(self._cache) > self.max_cache_size:
+            self._cache.popitem(last=False)
+            self.stats['cache evictions'] += 1
+
+    def _infer_format(self):
+        self._format_inferred = True
+        best_match_count = 0
+        for date_format in CANDIDATE_DATE_FORMATS:
+            match_count = 0
+            for input_date_str, date_str in self._sample:
+                strict_date_str = _parse_date_strict(input_date_str, date_format)
+                if strict_date_str is None:
+                    continue
+                # Never use a format that disagrees with `dateutil`.
+                if strict_date_str != date_str:
+                    match_count = 0
+                    break
+                match_count += 1
+            if match_count > best_match_count:
+                self.date_format = date_format
+                best_match_count = match_count
+
+        # Outliers are allowed in the sample since they will fall back to
+        # `dateutil`, but most values must match the format for it to be useful.
+        if best_match_count < DATE_FORMAT_MIN_MATCH_RATIO * len(self._sample):
+            self.date_format = None
+            LOG.info('Could not infer a date format. Parsing dates with dateutil')
+        else:
+            LOG.info('Using date format: %s', self.date_format)
+        self._sample = []
+
+    def _parse_uncached(self, input_date_str):
+        if self.date_format:
+            date_str = _parse_date_strict(input_date_str, self.date_format)
+            if date_str is not None:
+                self.stats['strict parses'] += 1
+                return date_str
+
+        self.stats['fallback parses'] += 1
+        date_str = _parse_date_fallback(input_date_str)
+        if not self._format_inferred:
+            if date_str is not None:
+                self._sample.append((input_date_str, date_str))
+            if len(self._sample) >= DATE_FORMAT_SAMPLE_SIZE:
+                self._infer_format()
+        return date_str
+
+    def parse(self, input_date_str):
+        '''Parse a single non-empty date string. Return None if the date cannot
+        be parsed.
+        '''
+        cache = self._cache
+        if input_date_str in cache:
+            self.stats['cache hits'] += 1
+            cache.move_to_end(input_date_str)
+            return cache[input_date_str]
+
+        self.stats['cache misses'] += 1
+        date_str = self._parse_uncached(input_date_str)
+        self._store(input_date_str, date_str)
+        return date_str
+
+    def parse_many(self, input_date_strs):
+        '''Parse a list of distinct date strings at once. Empty values and dates
+        that cannot be parsed are returned as None.
+        '''
+        output = [None] * len(input_date_strs)
+        missing_idx = []
+        value_count = 0
+        cache = self._cache
+        for idx, input_date_str in enumerate(input_date_strs):
+            if not input_date_str:
+                continue
+            value_count += 1
+            if input_date_str in cache:
+                cache.move_to_end(input_date_str)
+                output[idx] = cache[input_date_str]
+            else:
+                missing_idx.append(idx)
+        self.stats['cache hits'] += value_count - len(missing_idx)
+        self.stats['cache misses'] += len(missing_idx)
+
+        # Parse values one at a time until the format of the column is known.
+        position = 0
+        while not self._format_inferred and position < len(missing_idx):
+            idx = missing_idx[position]
+            output[idx] = self._parse_uncached(input_date_strs[idx])
+            self._store(input_date_strs[idx], output[idx])
+            position += 1
+
+        remaining_idx = missing_idx[position:]
+        if not remaining_idx:
+            return output
+
+        remaining = [input_date_strs[idx] for idx in remaining_idx]
+        parsed = [None] * len(remaining)
+        if self.date_format:
+            # Parse all values matching the strict format in bulk. Values that do
+            # not match are parsed individually below.
+            dates = pd.to_datetime(
+                pd.Series(remaining, dtype=object),
+                format=self.date_format,
+                errors='coerce',
+            )
+            valid = dates.notna().to_numpy()
+            formatted = dates[valid].dt.strftime(STANDARD_DATA_DATE_FORMAT)
+            for remaining_pos, date_str in zip(np.flatnonzero(valid), formatted):
+                parsed[remaining_pos] = date_str
+            self.stats['strict parses'] += len(formatted)
+
+        for remaining_pos, idx in enumerate(remaining_idx):
+            date_str = parsed[remaining_pos]
+            if date_str is None:
+                self.stats['fallback parses'] += 1
+                date_str = _parse_date_fallback(input_date_strs[idx])
+            output[idx] = date_str
+            self._store(input_date_strs[idx], date_str)
+        return output
+
+    def merge_stats(self, stats):
+        for label, count in stats.items():
+            self.stats[label] += count
 
 
 _FIELD_CACHE = {}
@@ -138,6 +337,290 @@ def _parse_numeric_value(value_str: str, raise_error: bool):
         )
 
 
+def _find_input_files(input_path):
+    '''Expand the input path into the list of files to read. The input path can
+    be a glob pattern matching multiple CSVs that share the same format.
+    '''
+    if not glob.has_magic(input_path):
+        return [input_path]
+
+    filenames = sorted(glob.glob(input_path))
+    if not filenames:
+        raise ValueError('No input files match pattern: %s' % input_path)
+    return filenames
+
+
+def _build_shards(filenames, num_shards):
+    '''Split the input files into (filename, start, end) shards. Multiple input
+    files are sharded by file. A single uncompressed CSV is split into byte
+    ranges that end on line boundaries. A start and end of None means the whole
+    file should be read.
+
+    NOTE: Splitting by byte range assumes quoted values do not contain newlines.
+    '''
+    if len(filenames) > 1 or num_shards <= 1:
+        return [(filename, None, None) for filename in filenames]
+
+    filename = filenames[0]
+    if filename.endswith(('.gz', '.lz4')):
+        LOG.info('Compressed input cannot be split by byte range: %s', filename)
+        return [(filename, None, None)]
+
+    file_size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, 'rb') as input_file:
+        header_size = len(input_file.readline())
+        for shard_idx in range(1, num_shards):
+            # Move the boundary to the start of the next line.
+            offset = max(file_size * shard_idx // num_shards, header_size)
+            input_file.seek(offset - 1)
+            input_file.readline()
+            boundary = input_file.tell()
+            if boundaries[-1] < boundary < file_size:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+    return [(filename, start, end) for (start, end) in zip(boundaries, boundaries[1:])]
+
+
+def _read_byte_range(filename, start, end):
+    '''Yield the header line of the CSV followed by every line that begins
+    inside the [start, end) byte range.
+    '''
+    with open(filename, 'rb') as input_file:
+        header = input_file.readline()
+        yield header.decode('utf-8')
+
+        position = max(start, len(header))
+        input_file.seek(position)
+        while position < end:
+            line = input_file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+
+# Aggregator used by the shard workers. It is set by the parent process before
+# the worker pool is forked.
+_SHARD_AGGREGATOR = None
+
+
+def _process_shard(task):
+    '''Process a single input shard with a forked copy of the aggregator and
+    write its partial output to disk. Returns the partial state that needs to be
+    merged by the parent aggregator.
+    '''
+    filename, start, end, partial_path = task
+    # Each shard is processed by a copy of the parent's aggregator so that state
+    # does not leak between shards handled by the same worker.
+    aggregator = copy.deepcopy(_SHARD_AGGREGATOR)
+    unique_fields = set()
+    with open(partial_path, 'w') as partial_file:
+        # Rows are always stored as JSON in the partial output. The parent
+        # writes them in the requested output format.
+        f_out = BaseRowJsonWriter(partial_file)
+        if start is None:
+            with AmbiguousFile(filename) as f_in:
+                aggregator._read_input(f_in, f_out, unique_fields)
+        else:
+            aggregator._read_input(
+                _read_byte_range(filename, start, end), f_out, unique_fields
+            )
+
+        # Store the partial rollup keyed the same way as the single process
+        # rollup so that the parent can combine rows across shards.
+        for row_key, row in aggregator._pop_final_rows():
+            partial_file.write('%s\t%s' % (json.dumps(row_key), row.to_json(True)))
+        aggregator._release_interned_values()
+
+    dimension_collector = aggregator.dimension_cleaner.dimension_collector
+    return {
+        'partial_path': partial_path,
+        'counts': dict(aggregator.counts),
+        'errors': dict(aggregator.errors),
+        'date_parser_stats': dict(aggregator.date_parser.stats),
+        'unique_fields': unique_fields,
+        'hierarchical_combinations': dimension_collector.hierarchical_combinations,
+        'non_hierarchical_items': dict(dimension_collector.non_hierarchical_items),
+    }
+
+
+def _pop_rows(rows):
+    '''Yield the row key and BaseRow of each row stored in the dictionary. Rows
+    are removed from the dictionary as they are yielded.
+    '''
+    keys = list(rows.keys())
+    for key in keys:
+        # Remove the row from the rows collection since it is no longer used
+        # after being written to an output file. This will free up memory.
+        yield (key, rows.pop(key))
+
+
+def _combine_rows(rollup_row, row, tracer_field=None):
+    '''Roll up the values of a partially rolled up row into another partially
+    rolled up row for the same row key.
+    '''
+    # NOTE: Like the in-memory rollup, this assumes all fields can be combined
+    # by summing.
+    rollup_data = rollup_row.data
+    for key, value in row.data.items():
+        rollup_data[key] = value + rollup_data.get(key, 0)
+
+    # NOTE: The partial rows do not record which of their fields came from their
+    # first input row, so the tracer field can end up at a different position in
+    # the data than the in-memory rollup would put it. The values are the same.
+    if tracer_field:
+        rollup_data[tracer_field] = 1
+
+    # Compact rows return a copy of their data, so it must be assigned back.
+    rollup_row.data = rollup_data
+
+
+def _read_run(run_file):
+    for line in run_file:
+        row_info, row_str = line.split('\t', 1)
+        row_key, sequence = json.loads(row_info)
+        yield (row_key, sequence, row_str)
+
+
+class RollupSpiller:
+    '''Bound the number of rolled up rows held in memory by spilling them to
+    compressed runs on disk.
+
+    Each run is sorted by row key and records the position at which each row key
+    was first seen. Once all input is read, an external k-way merge combines the
+    partial rows for each row key across runs, and a second merge on first-seen
+    position restores the order the in-memory rollup would produce.
+
+    NOTE: The limit is a number of rows, not a memory budget. The memory used by
+    each row depends on the number of dimensions and fields it holds.
+
+    Args:
+        max_rows: Maximum number of rolled up rows to hold in memory. If unset,
+            rows are never spilled.
+        tracer_field: Field that is set to 1 when rows are combined.
+        temp_dir: Directory where run files are written. Defaults to the system
+            temp directory.
+    '''
+
+    def __init__(self, max_rows=None, tracer_field=None, temp_dir=None):
+        self.max_rows = max_rows
+        self.tracer_field = tracer_field
+        self.temp_dir = temp_dir
+        self._work_dir = None
+        self._runs = []
+        self._run_count = 0
+        self._spilled_count = 0
+
+    @property
+    def has_runs(self):
+        return bool(self._runs)
+
+    def should_spill(self, stored_row_count):
+        return bool(self.max_rows) and stored_row_count >= self.max_rows
+
+    def spill(self, keyed_rows):
+        '''Write the (row key, BaseRow) pairs to a new run sorted by row key.
+        Pairs must be provided in the order their row key was first seen.
+        '''
+        items = [
+            (row_key, self._spilled_count + idx, row)
+            for idx, (row_key, row) in enumerate(keyed_rows)
+        ]
+        if not items:
+            return
+
+        self._spilled_count += len(items)
+        items.sort(key=itemgetter(0))
+        self._runs.append(self._write_run(items))
+        LOG.info('Spilled %d rolled up rows to disk', len(items))
+
+        # Release the memory held by the spilled rows before continuing.
+        del items
+        gc.collect()
+
+    def pop_rows(self, keyed_rows):
+        '''Spill the remaining (row key, BaseRow) pairs and yield every rolled up
+        row across all runs in the order its row key was first seen. Run files
+        are removed once all rows have been yielded.
+        '''
+        self.spill(keyed_rows)
+        try:
+            yield from self._merge_by_sequence(self._merge_by_row_key())
+        finally:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+            self._runs = []
+            self._spilled_count = 0
+
+    def _write_run(self, items):
+        if not self._work_dir:
+            self._work_dir = tempfile.mkdtemp(prefix='rollup_', dir=self.temp_dir)
+
+        path = os.path.join(self._work_dir, 'run_%d.lz4' % self._run_count)
+        self._run_count += 1
+        with LZ4Writer(path) as run_file:
+            for row_key, sequence, row in items:
+                run_file.write(
+                    '%s\t%s' % (json.dumps([row_key, sequence]), row.to_json(True))
+                )
+        return path
+
+    def _merge_by_row_key(self):
+        '''Yield (row key, first seen position, BaseRow) for each distinct row
+        key across all runs, combining the partial rows for the row key.
+        '''
+        with ExitStack() as exit_stack:
+            runs = [
+                _read_run(exit_stack.enter_context(LZ4Reader(path)))
+                for path in self._runs
+            ]
+            # NOTE: heapq.merge yields equal row keys in run order, so partial
+            # rows are combined in the same order they were originally stored.
+            current = None
+            for row_key, sequence, row_str in heapq.merge(*runs, key=itemgetter(0)):
+                row = BaseRowType.from_json(row_str)
+                if current and current[0] == row_key:
+                    _combine_rows(current[2], row, self.tracer_field)
+                    continue
+
+                if current:
+                    yield current
+                current = (row_key, sequence, row)
+
+            if current:
+                yield current
+
+    def _merge_by_sequence(self, items):
+        '''Yield the (row key, BaseRow) pairs in the order their row key was
+        first seen, holding at most `max_rows` pairs in memory.
+        '''
+        buffer = []
+        ordered_runs = []
+        for item in items:
+            buffer.append(item)
+            if len(buffer) >= self.max_rows:
+                buffer.sort(key=itemgetter(1))
+                ordered_runs.append(self._write_run(buffer))
+                buffer = []
+
+        buffer.sort(key=itemgetter(1))
+        if not ordered_runs:
+            for row_key, _, row in buffer:
+                yield (row_key, row)
+            return
+
+        ordered_runs.append(self._write_run(buffer))
+        del buffer
+        with ExitStack() as exit_stack:
+            runs = [
+                _read_run(exit_stack.enter_context(LZ4Reader(path)))
+                for path in ordered_runs
+            ]
+            for row_key, _, row_str in heapq.merge(*runs, key=itemgetter(1)):
+                yield (row_key, BaseRowType.from_json(row_str))
+
+
 class WildcardReader:
     '''Read CSV file that uses the FIELD_WILDCARD prefix format for columns to
     provide unpivoted rows where the field + value is a field in the output row.
@@ -211,6 +694,12 @@ class Aggregator:
         val_clean_regex_str=None,
         delimiter=',',
         multi_value_dimensions=None,
+        num_workers=1,
+        max_rows_in_memory=None,
+        spill_dir=None,
+        output_format='json',
+        compact_rows=False,
+        date_cache_size=DEFAULT_DATE_CACHE_SIZE,
     ):
         self.dimensions = dimensions or []
         self.multi_value_dimensions = (
@@ -229,6 +718,7 @@ class Aggregator:
         self.fields = fields
 
         self.datecol = datecol
+        self.date_parser = DateParser(date_cache_size)
         self.valcol = valcol
         self.source = source
         self.tracer_field = tracer_field
@@ -245,6 +735,12 @@ class Aggregator:
             else None
         )
         self.delimiter = delimiter
+        self.num_workers = num_workers
+        self.output_format = output_format
+        # Type used for the rows held in memory during rollup.
+        self.row_cls = (
+            build_compact_row_type(BaseRowType) if compact_rows else BaseRowType
+        )
 
         self.counts = defaultdict(int)
         self.errors = defaultdict(int)
@@ -253,6 +749,7 @@ class Aggregator:
         self.col_handlers = {}
         self.row_handlers = []
         self._rows = {}
+        self._spiller = RollupSpiller(max_rows_in_memory, tracer_field, spill_dir)
 
     def register_col_handler(self, colname, fn):
         self.col_handlers[colname] = fn
@@ -321,7 +818,35 @@ class Aggregator:
             if output_row:
                 self._write_row(output_row, count, f_out, unique_fields)
         LOG.info('Finished reading file. Lines read: %d', count)
-        self.counts[self.ROWS_ROW_COUNT_LABEL] = count
+        self.counts[self.ROWS_ROW_COUNT_LABEL] += count
+
+    def _release_interned_values(self):
+        '''Release the values interned by the compact rows that were held in
+        memory. Rows that are still stored keep working but no longer share
+        values with new rows, so this should be called once all rows are popped.
+        '''
+        if self.row_cls is not BaseRowType:
+            self.row_cls.clear_intern_table()
+
+    def _spill_rows(self, keyed_rows):
+        self._spiller.spill(keyed_rows)
+        self._release_interned_values()
+
+    def _pop_stored_rows(self):
+        """
+        Yield the row key and BaseRow of each rolled up row held in memory. Rows are
+        removed from storage as they are yielded.
+        """
+        return _pop_rows(self._rows)
+
+    def _pop_final_rows(self):
+        """
+        Yield the row key and BaseRow of every rolled up row, including the rows that
+        were spilled to disk.
+        """
+        if not self._spiller.has_runs:
+            return self._pop_stored_rows()
+        return self._spiller.pop_rows(self._pop_stored_rows())
 
     def _write_remaining_rows(self, f_out, unique_fields):
         """
@@ -329,11 +854,7 @@ class Aggregator:
          is enabled.
         """
         written_count = 0
-        keys = list(self._rows.keys())
-        for key in keys:
-            # Remove the row from the rows collection since it is no longer used
-            # after being written to an output file. This will free up memory.
-            row = self._rows.pop(key)
+        for _, row in self._pop_final_rows():
             written_count += 1
             self._write_row(row, written_count, f_out, unique_fields, True)
         LOG.info('Finished writing output rows. Rows written: %d', written_count)
@@ -363,7 +884,7 @@ class Aggregator:
                 gc.collect()
 
         # Write to processed rows.
-        f_out.write(output_row.to_json(True))
+        f_out.write_row(output_row)
         unique_fields.update(set(output_row.data.keys()))
 
     def process(
@@ -376,29 +897,18 @@ class Aggregator:
         output_non_hierarchical_filename=None,
     ):
         unique_fields = set()
-        with AmbiguousFile(input_path) as f_in, LZ4Writer(output_rows) as f_out:
-
-            # If the CSV uses the wildcard field format AND the field value needs to be
-            # included as part of the output field ID, then we need to use the
-            # WildcardReader.
-            if self.enable_field_wildcards and self.flatten_string_categories:
-                reader = WildcardReader(f_in, delimiter=self.delimiter)
+        with BaseRowFileWriter(output_rows, self.output_format, BaseRowType) as f_out:
+            if self.num_workers > 1:
+                self._process_shards(input_path, f_out, unique_fields)
             else:
-                # Otherwise, we can use a normal DictReader.
-                reader = csv.DictReader(f_in, delimiter=self.delimiter)
-
-                # If the user is using the field wildcard format but the column does not
-                # contain category values, then this means the wildcard format indicates
-                # which columns should be included in the output. Use this knowledge to
-                # build the exact field list to use by inspecting the CSV header.
-                self._update_fields_with_wildcard_fields(reader)
+                for filename in _find_input_files(input_path):
+                    with AmbiguousFile(filename) as f_in:
+                        self._read_input(f_in, f_out, unique_fields)
 
-            # Set the fields to use if the user has specified ""
-            self._set_fields(reader, f_out, unique_fields)
-
-            # Write all remaining rows to the output file. There should be rows here if
-            # rollup is enabled.
-            self._write_remaining_rows(f_out, unique_fields)
+                # Write all remaining rows to the output file. There should be rows
+                # here if rollup is enabled.
+                self._write_remaining_rows(f_out, unique_fields)
+        self._release_interned_values()
 
         dimension_collector = self.dimension_cleaner.dimension_collector
 
@@ -429,6 +939,117 @@ class Aggregator:
         if output_indicators:
             self.write_indicators(unique_fields, output_indicators)
 
+    def _read_input(self, f_in, f_out, unique_fields):
+        '''Read all rows from the input file. Output rows are written immediately
+        if rollup is disabled, otherwise they are stored until all input is read.
+        '''
+        # If the CSV uses the wildcard field format AND the field value needs to be
+        # included as part of the output field ID, then we need to use the
+        # WildcardReader.
+        if self.enable_field_wildcards and self.flatten_string_categories:
+            reader = WildcardReader(f_in, delimiter=self.delimiter)
+        else:
+            # Otherwise, we can use a normal DictReader.
+            reader = csv.DictReader(f_in, delimiter=self.delimiter)
+
+            # If the user is using the field wildcard format but the column does not
+            # contain category values, then this means the wildcard format indicates
+            # which columns should be included in the output. Use this knowledge to
+            # build the exact field list to use by inspecting the CSV header.
+            self._update_fields_with_wildcard_fields(reader)
+
+        # Set the fields to use if the user has specified ""
+        self._set_fields(reader, f_out, unique_fields)
+
+    def _process_shards(self, input_path, f_out, unique_fields):
+        '''Split the input into shards that are processed by a pool of worker
+        processes. Each worker produces a partial rollup, and the partial rollups
+        are merged in shard order so that output rows are written in a
+        deterministic order.
+        '''
+        shards = _build_shards(_find_input_files(input_path), self.num_workers)
+        LOG.info(
+            'Processing %d input shards with %d workers', len(shards), self.num_workers
+        )
+
+        # Workers are forked from this process and inherit this aggregator's
+        # configuration, including any registered handlers.
+        # NOTE: All workers are forked when the pool is created, before this
+        # process starts merging results. Forking while the merge is running
+        # (like when workers are replaced after each task) can copy locks that
+        # are held by other threads and deadlock the new worker.
+        global _SHARD_AGGREGATOR  # pylint: disable=global-statement
+        _SHARD_AGGREGATOR = self
+        merged_rows = {}
+        context = multiprocessing.get_context('fork')
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir, context.Pool(
+                self.num_workers
+            ) as pool:
+                tasks = [
+                    (filename, start, end, os.path.join(temp_dir, 'shard_%d' % idx))
+                    for idx, (filename, start, end) in enumerate(shards)
+                ]
+                for result in pool.imap(_process_shard, tasks):
+                    self._merge_shard_result(
+                        result, merged_rows, f_out, unique_fields
+                    )
+        finally:
+            _SHARD_AGGREGATOR = None
+
+        merged_rows = _pop_rows(merged_rows)
+        if self._spiller.has_runs:
+            merged_rows = self._spiller.pop_rows(merged_rows)
+
+        written_count = 0
+        for _, row in merged_rows:
+            written_count += 1
+            self._write_row(row, written_count, f_out, unique_fields, True)
+        LOG.info('Finished writing output rows. Rows written: %d', written_count)
+        self.counts[self.OBJECTS_WRITTEN_COUNT_LABEL] = written_count
+
+    def _merge_shard_result(self, result, merged_rows, f_out, unique_fields):
+        '''Merge the partial result produced by a shard worker into this
+        aggregator's state.
+        '''
+        for label, count in result['counts'].items():
+            if label != self.OBJECTS_WRITTEN_COUNT_LABEL:
+                self.counts[label] += count
+        for label, count in result['errors'].items():
+            self.errors[label] += count
+        self.date_parser.merge_stats(result['date_parser_stats'])
+
+        # Dimension values are merged in shard order so that the first value
+        # seen wins, just like when the input is processed by a single process.
+        dimension_collector = self.dimension_cleaner.dimension_collector
+        for key, value in result['hierarchical_combinations'].items():
+            dimension_collector.hierarchical_combinations.setdefault(key, value)
+        for dimension, items in result['non_hierarchical_items'].items():
+            dimension_items = dimension_collector.non_hierarchical_items[dimension]
+            for input_value, output_value in items.items():
+                dimension_items.setdefault(input_value, output_value)
+
+        with open(result['partial_path']) as partial_file:
+            # Without rollup, the shard has already written its final output rows.
+            if not self.enable_rollup:
+                unique_fields.update(result['unique_fields'])
+                for line in partial_file:
+                    f_out.write_serialized_row(line)
+                return
+
+            for line in partial_file:
+                row_key_str, row_str = line.split('\t', 1)
+                row_key = json.loads(row_key_str)
+                row = self.row_cls.from_json(row_str)
+                merged_row = merged_rows.get(row_key)
+                if merged_row is not None:
+                    _combine_rows(merged_row, row, self.tracer_field)
+                    continue
+
+                merged_rows[row_key] = row
+                if self._spiller.should_spill(len(merged_rows)):
+                    self._spill_rows(_pop_rows(merged_rows))
+
     def process_row(self, orig_row):
         row = self._parse_row(orig_row)
 
@@ -443,7 +1064,7 @@ class Aggregator:
                 self.errors[self.EMPTY_DATE_ERROR_LABEL] += 1
                 return None
 
-            date_str = _get_date(input_date_str)
+            date_str = self.date_parser.parse(input_date_str)
             if not date_str:
                 self.errors[self.UNPARSEABLE_DATE_ERROR_LABEL] += 1
                 return None
@@ -488,7 +1109,10 @@ class Aggregator:
             output[key] = val
         return output
 
-    def _extract_field_value(self, raw_field: str, raw_value: str) -> tuple:
+    def _parse_field_value(self, raw_field: str, raw_value: str) -> tuple:
+        '''Convert the raw field name and value into the output field ID and
+        numeric value.
+        '''
         value_str = (
             raw_value
             if not self.val_clean_regex
@@ -503,6 +1127,10 @@ class Aggregator:
         field = _get_field_name(
             self.output_field_prefix, raw_field, self.enable_field_wildcards
         )
+        return (field, value)
+
+    def _extract_field_value(self, raw_field: str, raw_value: str) -> tuple:
+        field, value = self._parse_field_value(raw_field, raw_value)
 
         # Detect when the raw field name is not slugify-able.
         # NOTE(stephen): We can't just check `not raw_field` since trailing
@@ -624,7 +1252,7 @@ class Aggregator:
         return dimensions
 
     def _create_base_row(self, row, date_str, values):
-        output = BaseRowType(date=date_str, source=self.source)
+        output = self.row_cls(date=date_str, source=self.source)
         output.key = self._extract_dimensions(row)
         output.data = values
         return output
@@ -634,12 +1262,15 @@ class Aggregator:
         if row_key not in self._rows:
             baserow = self._create_base_row(row, date_str, values)
             self._rows[row_key] = baserow
+            if self._spiller.should_spill(len(self._rows)):
+                self._spill_rows(self._pop_stored_rows())
             return
 
         # Rollup new values into the existing baserow.
         # NOTE(stephen): This assumes that all fields can be combined by
         # summing. If that is not the case, this will need to be refactored.
-        baserow_data = self._rows[row_key].data
+        baserow = self._rows[row_key]
+        baserow_data = baserow.data
 
         for key, value in values.items():
             baserow_data[key] = value + baserow_data.get(key, 0)
@@ -647,6 +1278,9 @@ class Aggregator:
         if self.tracer_field:
             baserow_data[self.tracer_field] = 1
 
+        # Compact rows return a copy of their data, so it must be assigned back.
+        baserow.data = baserow_data
+
     def write_fields(self, unique_fields, path):
         '''Given a set of fields, write a list of fields containing data.'''
         with open(path, 'w') as fields_out:
@@ -673,6 +1307,592 @@ class Aggregator:
     def print_report(self):
         LOG.info('Counts: %s', json.dumps(self.counts, indent=2))
         LOG.info('Errors: %s', json.dumps(self.errors, indent=2))
+        LOG.info('Date parsing: %s', json.dumps(self.date_parser.stats, indent=2))
+
+
+# Number of CSV rows to transpose into columns and process at once by the
+# columnar engine.
+DEFAULT_BATCH_SIZE = 200000
+
+# Number of bits reserved for the field ID when packing a (row key, field) pair
+# into a single integer for the columnar rollup.
+_FIELD_ID_BITS = 24
+
+# Integer sums that can reach this magnitude are summed with python ints by the
+# columnar engine since they might not fit in an int64. The limit leaves room for
+# the rounding of the float bound used to detect them.
+_MAX_INT_SUM = 2.0 ** 62
+
+
+def _object_column(values):
+    '''Convert a column of values into a 1-D numpy object array.'''
+    if isinstance(values, np.ndarray):
+        return values
+    output = np.empty(len(values), dtype=object)
+    output[:] = values
+    return output
+
+
+def _factorize(values):
+    '''Encode a column as integer codes plus the list of distinct values it
+    contains, in the order they first appear.
+    '''
+    codes, uniques = pd.factorize(_object_column(values))
+    return (codes, uniques.tolist())
+
+
+def _factorize_rows(columns, num_rows):
+    '''Encode each row of the given columns as a single integer code, where
+    rows holding the same values share a code. Return the codes along with the
+    index of the first row using each code.
+    '''
+    row_codes = np.zeros(num_rows, dtype=np.int64)
+    for values in columns:
+        codes, uniques = _factorize(values)
+        row_codes, _ = pd.factorize(row_codes * len(uniques) + codes)
+    _, first_rows = np.unique(row_codes, return_index=True)
+    return (row_codes, first_rows)
+
+
+def _map_distinct(fn, values):
+    '''Apply `fn` once per distinct value in the column and return the mapped
+    column.
+    '''
+    codes, uniques = _factorize(values)
+    return _object_column([fn(value) for value in uniques])[codes]
+
+
+class ColumnarAggregator(Aggregator):
+    '''Aggregator that processes the input CSV in column batches instead of
+    row by row.
+
+    Each batch of CSV rows is transposed into columns. Column handlers, date
+    parsing, numeric parsing and field slugging run once per distinct value in
+    a column instead of once per row, and rollup is performed as a grouped
+    reduction over (row key, field) pairs. Dimension cleanup runs once per
+    output row. The output produced is identical to the row based Aggregator.
+
+    Row handlers created through `set_col_val` and `set_col_join` are applied
+    as column operations. Custom row handlers, disaggregations and the
+    WildcardReader format need the full row dictionary, so those configurations
+    fall back to the row based engine.
+
+    Rolled up values are held in columns, so `compact_rows` only changes the
+    type of the output rows built from them and of the rows merged from worker
+    shards. Integer sums that might not fit in an int64 are summed with python
+    ints, like the row based Aggregator does.
+    '''
+
+    def __init__(self, *args, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+
+        dimension_collector = self.dimension_cleaner.dimension_collector
+        dimension_mapping = dimension_collector.dimension_name_to_row_mapping
+        # Columns that are read when the output dimensions of a row are built.
+        self._dimension_input_columns = [
+            dimension_mapping.get(dimension, dimension)
+            for dimension in dimension_collector.all_dimensions
+        ] + self.unmapped_dimensions
+        for dimension_keys in self.multi_value_dimensions.values():
+            self._dimension_input_columns.extend(dimension_keys)
+
+        self._field_ids = {}
+        self._field_names = []
+        self._reset_groups()
+
+    def _reset_groups(self):
+        # Mapping from row key to group ID. Only used when rollup is enabled.
+        self._group_ids = {}
+        self._group_dimensions = []
+        self._group_dates = []
+
+        # Mapping from packed (group ID, field ID) pair to the slot holding the
+        # accumulated value for that pair. Slots are created in the order the
+        # pairs are first seen, which preserves the field order of each row.
+        self._pair_slots = {}
+        self._slot_gids = np.zeros(0, dtype=np.int64)
+        self._slot_fids = np.zeros(0, dtype=np.int64)
+        self._int_sums = np.zeros(0, dtype=np.int64)
+        self._float_sums = np.zeros(0, dtype=np.float64)
+        self._has_float = np.zeros(0, dtype=bool)
+
+        # Upper bound on the magnitude of the integer sum of each slot. Slots
+        # whose bound reaches `_MAX_INT_SUM` are summed with python ints in
+        # `_big_int_sums`, a mapping from slot to sum.
+        self._int_bounds = np.zeros(0, dtype=np.float64)
+        self._big_int_sums = {}
+
+    def _ensure_slot_capacity(self, size):
+        capacity = len(self._int_sums)
+        if size <= capacity:
+            return
+
+        capacity = max(size, capacity * 2, 1024)
+        for name in (
+            '_slot_gids',
+            '_slot_fids',
+            '_int_sums',
+            '_float_sums',
+            '_has_float',
+            '_int_bounds',
+        ):
+            current = getattr(self, name)
+            resized = np.zeros(capacity, dtype=current.dtype)
+            resized[: len(current)] = current
+            setattr(self, name, resized)
+
+    def _get_field_id(self, field):
+        field_id = self._field_ids.get(field)
+        if field_id is None:
+            field_id = len(self._field_names)
+            assert field_id < (1 << _FIELD_ID_BITS), 'Too many unique fields.'
+            self._field_ids[field] = field_id
+            self._field_names.append(field)
+        return field_id
+
+    def _unsupported_reason(self):
+        if self.disaggregations:
+            return 'disaggregations'
+        if self.enable_field_wildcards and self.flatten_string_categories:
+            return 'wildcard fields with string categories'
+        for fn in self.row_handlers:
+            if not isinstance(fn, partial) or fn.func not in (
+                Aggregator._row_handler_set_col_val,
+                Aggregator._row_handler_set_col_join,
+            ):
+                return 'custom row handlers'
+        return None
+
+    def _read_input(self, f_in, f_out, unique_fields):
+        unsupported_reason = self._unsupported_reason()
+        if unsupported_reason:
+            LOG.warning(
+                'Columnar engine does not support %s. Falling back to row engine.',
+                unsupported_reason,
+            )
+            super()._read_input(f_in, f_out, unique_fields)
+            return
+
+        reader = csv.reader(f_in, delimiter=self.delimiter)
+        header = next(reader, [])
+        if self.enable_field_wildcards:
+            self.fields = [
+                field for field in header if field.startswith(FIELD_WILDCARD)
+            ]
+            if not self.fields:
+                raise RuntimeError(
+                    'You enabled field wildcards but there are no columns '
+                    'beginning with %s' % FIELD_WILDCARD
+                )
+
+        count = 0
+        written_count = 0
+        while True:
+            raw_rows = list(islice(reader, self.batch_size))
+            if not raw_rows:
+                break
+
+            # DictReader skips blank lines, so they must be skipped here too.
+            rows = [row for row in raw_rows if row]
+            if (count + len(rows)) // 1000000 > count // 1000000:
+                LOG.info('Lines read:\t%d', count + len(rows))
+            count += len(rows)
+            if not rows:
+                continue
+
+            self._process_batch(header, rows)
+
+            # If rollup is disabled, every row is distinct and can be written
+            # immediately.
+            if not self.enable_rollup:
+                for output_row in self._build_output_rows():
+                    written_count += 1
+                    self._write_row(output_row, written_count, f_out, unique_fields)
+                self._reset_groups()
+            elif self._spiller.should_spill(len(self._group_dates)):
+                self._spill_rows(self._pop_stored_rows())
+
+        LOG.info('Finished reading file. Lines read: %d', count)
+        self.counts[self.ROWS_ROW_COUNT_LABEL] += count
+
+    def _pop_stored_rows(self):
+        row_keys = list(self._group_ids.keys())
+        for group_id, output_row in enumerate(self._build_output_rows()):
+            yield (row_keys[group_id], output_row)
+        self._reset_groups()
+
+    def _build_columns(self, header, rows):
+        '''Transpose the batch of rows into a dictionary mapping column name to
+        column values, applying the row handlers, column handlers and renames
+        that the row engine would apply to each row.
+        '''
+        num_columns = len(header)
+        num_rows = len(rows)
+        row_lengths = np.fromiter(map(len, rows), dtype=np.int64, count=num_rows)
+        extra_values_count = int(np.count_nonzero(row_lengths > num_columns))
+        if extra_values_count:
+            self.errors[self.EXTRA_VALS_ERROR_LABEL] += extra_values_count
+
+        # Extra values are dropped and missing values are treated as empty so
+        # that the batch can be stored as a single 2-D array.
+        for row_idx in np.flatnonzero(row_lengths != num_columns).tolist():
+            row = rows[row_idx]
+            rows[row_idx] = (row + [''] * num_columns)[:num_columns]
+
+        table = np.empty((num_rows, num_columns), dtype=object)
+        table[:] = rows
+        columns = {column: table[:, idx] for idx, column in enumerate(header)}
+        for fn in self.row_handlers:
+            if fn.func is Aggregator._row_handler_set_col_val:
+                column, value = fn.args
+                columns[column] = np.full(num_rows, value, dtype=object)
+                continue
+
+            old_columns, new_column, join_str = fn.args
+            join_values = [
+                columns[column] for column in old_columns if column in columns
+            ]
+            columns[new_column] = _object_column(
+                [
+                    join_str.join(value.strip() for value in values if value)
+                    for values in zip(*join_values)
+                ]
+                or [''] * num_rows
+            )
+
+        if not self.col_handlers and not self.col_rename:
+            return columns
+
+        output = {}
+        for key, values in columns.items():
+            if key in self.col_handlers:
+                values = _map_distinct(self.col_handlers[key], values)
+            output[self.col_rename.get(key, key)] = values
+        return output
+
+    def _parse_dates(self, columns, num_rows):
+        '''Parse the date column and return the indices of the rows that have a
+        valid date along with the output date string of each of those rows.
+        '''
+        if not self.datecol:
+            date_str = datetime.now().strftime(STANDARD_DATA_DATE_FORMAT)
+            return (np.arange(num_rows), _object_column([date_str] * num_rows))
+
+        if self.datecol not in columns:
+            self.errors[self.EMPTY_DATE_ERROR_LABEL] += num_rows
+            return (np.zeros(0, dtype=np.int64), _object_column([]))
+
+        codes, uniques = _factorize(columns[self.datecol])
+        empty_date = np.array([not value for value in uniques], dtype=bool)
+        dates = _object_column(self.date_parser.parse_many(uniques))
+        unparseable_date = (
+            np.array([date_str is None for date_str in dates], dtype=bool) & ~empty_date
+        )
+
+        empty_count = int(np.count_nonzero(empty_date[codes]))
+        if empty_count:
+            self.errors[self.EMPTY_DATE_ERROR_LABEL] += empty_count
+        unparseable_count = int(np.count_nonzero(unparseable_date[codes]))
+        if unparseable_count:
+            self.errors[self.UNPARSEABLE_DATE_ERROR_LABEL] += unparseable_count
+
+        valid_rows = np.flatnonzero(~(empty_date | unparseable_date)[codes])
+        return (valid_rows, dates[codes[valid_rows]])
+
+    def _parse_column(self, raw_field, raw_values):
+        '''Parse the values of a single field column. Each distinct value is
+        only parsed once.
+        '''
+        codes, uniques = _factorize(raw_values)
+        parsed = [self._parse_field_value(raw_field, value) for value in uniques]
+        return self._build_parsed_values(codes, parsed, self._should_exclude_value)
+
+    def _parse_unpivoted_columns(self, raw_fields, raw_values):
+        '''Parse the field and value columns of an unpivoted CSV. Each distinct
+        (field, value) pair is only parsed once.
+        '''
+        field_codes, field_uniques = _factorize(raw_fields)
+        value_codes, value_uniques = _factorize(raw_values)
+        num_values = len(value_uniques)
+        codes, pairs = pd.factorize(
+            field_codes.astype(np.int64) * num_values + value_codes
+        )
+        parsed = [
+            self._parse_field_value(
+                field_uniques[pair // num_values], value_uniques[pair % num_values]
+            )
+            for pair in pairs.tolist()
+        ]
+        # The row engine does not exclude zeros for unpivoted rows.
+        return self._build_parsed_values(codes, parsed, lambda value: value is None)
+
+    def _build_parsed_values(self, codes, parsed, exclude_value):
+        '''Expand the parsed (field, value) pairs for the distinct values of a
+        column back to the rows of that column. Returns the row indices that
+        have a value along with the field ID and value for each of those rows.
+        '''
+        bad_field = np.array(
+            [field == self.output_field_prefix for (field, _) in parsed], dtype=bool
+        )
+        bad_field_count = int(np.count_nonzero(bad_field[codes]))
+        if bad_field_count:
+            self.errors['bad fields'] += bad_field_count
+
+        included = np.array(
+            [
+                not is_bad and not exclude_value(value)
+                for (is_bad, (_, value)) in zip(bad_field.tolist(), parsed)
+            ],
+            dtype=bool,
+        )
+        field_ids = np.array(
+            [self._get_field_id(field) for (field, _) in parsed], dtype=np.int64
+        )
+        values = np.array(
+            [
+                value if is_included else 0
+                for (is_included, (_, value)) in zip(included.tolist(), parsed)
+            ],
+            dtype=np.float64,
+        )
+        rows = np.flatnonzero(included[codes])
+        return (rows, field_ids[codes[rows]], values[codes[rows]])
+
+    def _build_entries(self, columns, valid_rows):
+        '''Build the (row, field, value) entries for the rows with a valid date.
+        Entries are ordered the same way the row engine would insert them into
+        each row's data dictionary.
+        '''
+        entries = []
+        if self.fields:
+            for position, field in enumerate(self.fields):
+                rows, field_ids, values = self._parse_column(
+                    field, columns[field][valid_rows]
+                )
+                positions = np.full(len(rows), position, dtype=np.int64)
+                entries.append((rows, positions, field_ids, values))
+        else:
+            rows, field_ids, values = self._parse_unpivoted_columns(
+                columns[UNPIVOTED_FIELD_COLUMN][valid_rows],
+                columns[self.valcol][valid_rows],
+            )
+            positions = np.zeros(len(rows), dtype=np.int64)
+            entries.append((rows, positions, field_ids, values))
+
+        rows, positions, field_ids, values = (
+            np.concatenate(parts) for parts in zip(*entries)
+        )
+        order = np.lexsort((positions, rows))
+        rows, field_ids, values = (rows[order], field_ids[order], values[order])
+
+        # Multiple columns can produce the same output field for a single row.
+        # The row engine keeps the field's first position in the data
+        # dictionary but stores the last value seen.
+        row_field_keys = (rows << _FIELD_ID_BITS) | field_ids
+        is_first = ~pd.Series(row_field_keys).duplicated(keep='first').to_numpy()
+        if not is_first.all():
+            is_last = ~pd.Series(row_field_keys).duplicated(keep='last').to_numpy()
+            last_values = pd.Series(values[is_last], index=row_field_keys[is_last])
+            values = last_values.reindex(row_field_keys[is_first]).to_numpy()
+            rows, field_ids = (rows[is_first], field_ids[is_first])
+        return (rows, field_ids, values)
+
+    def _build_dimensions(self, columns, row_idx):
+        row = {column: values[row_idx] for column, values in columns.items()}
+        return self._extract_dimensions(row)
+
+    def _assign_groups(self, columns, num_rows, data_rows, dates):
+        '''Return the group ID for each row that holds data, creating new
+        groups as needed. Also return a mask of the rows that created a new
+        group.
+        '''
+
+        def _take(column):
+            if column not in columns:
+                return np.full(len(data_rows), '', dtype=object)
+            return columns[column][data_rows]
+
+        if not self.enable_rollup:
+            # Every row produces its own output row. Dimension cleanup only
+            # depends on a subset of columns, so output dimensions can be
+            # reused across rows with the same values.
+            codes, first_rows = _factorize_rows(
+                [_take(column) for column in self._dimension_input_columns],
+                len(data_rows),
+            )
+            dimensions = [
+                self._build_dimensions(columns, data_rows[first_row])
+                for first_row in first_rows.tolist()
+            ]
+            num_groups = len(self._group_dates)
+            self._group_dimensions.extend(dimensions[code] for code in codes.tolist())
+            self._group_dates.extend(dates.tolist())
+            return (
+                np.arange(num_groups, num_groups + len(data_rows)),
+                np.ones(len(data_rows), dtype=bool),
+            )
+
+        dimension_columns = [_take(dimension) for dimension in self.dimensions]
+        codes, first_rows = _factorize_rows(dimension_columns + [dates], len(data_rows))
+        group_ids = np.empty(len(first_rows), dtype=np.int64)
+        is_new_group = np.zeros(len(codes), dtype=bool)
+        for idx, first_row in enumerate(first_rows.tolist()):
+            # The row key is only built once per distinct dimensions + date
+            # combination in the batch.
+            dimension_key = u'__'.join(
+                values[first_row] for values in dimension_columns
+            )
+            row_key = u'%s__%s' % (dimension_key, dates[first_row])
+            group_id = self._group_ids.get(row_key)
+            if group_id is None:
+                group_id = len(self._group_dates)
+                self._group_ids[row_key] = group_id
+                self._group_dimensions.append(
+                    self._build_dimensions(columns, data_rows[first_row])
+                )
+                self._group_dates.append(dates[first_row])
+                is_new_group[first_row] = True
+            group_ids[idx] = group_id
+        return (group_ids[codes], is_new_group)
+
+    def _process_batch(self, header, rows):
+        columns = self._build_columns(header, rows)
+        valid_rows, dates = self._parse_dates(columns, len(rows))
+        if not len(valid_rows):
+            return
+
+        entry_rows, entry_field_ids, entry_values = self._build_entries(
+            columns, valid_rows
+        )
+        has_data = np.bincount(entry_rows, minlength=len(valid_rows)) > 0
+        empty_count = int(np.count_nonzero(~has_data))
+        if empty_count:
+            self.errors[self.EMPTY_DATA_ROW_ERROR_LABEL] += empty_count
+
+        data_idxs = np.flatnonzero(has_data)
+        if not len(data_idxs):
+            return
+        self.counts[self.ROWS_STORED_COUNT_LABEL] += len(data_idxs)
+
+        row_group_ids, is_new_group = self._assign_groups(
+            columns, len(rows), valid_rows[data_idxs], dates[data_idxs]
+        )
+        valid_row_group_ids = np.full(len(valid_rows), -1, dtype=np.int64)
+        valid_row_group_ids[data_idxs] = row_group_ids
+        entry_group_ids = valid_row_group_ids[entry_rows]
+
+        # The row engine sets the tracer field after each additional row is
+        # rolled up into an existing output row.
+        if self.tracer_field and not is_new_group.all():
+            rolled_up_rows = data_idxs[~is_new_group]
+            tracer_rows = np.concatenate([entry_rows, rolled_up_rows])
+            order = np.argsort(tracer_rows, kind='stable')
+            entry_group_ids = np.concatenate(
+                [entry_group_ids, row_group_ids[~is_new_group]]
+            )[order]
+            entry_field_ids = np.concatenate(
+                [
+                    entry_field_ids,
+                    np.full(
+                        len(rolled_up_rows),
+                        self._get_field_id(self.tracer_field),
+                        dtype=np.int64,
+                    ),
+                ]
+            )[order]
+            entry_values = np.concatenate(
+                [entry_values, np.zeros(len(rolled_up_rows))]
+            )[order]
+
+        self._accumulate(entry_group_ids, entry_field_ids, entry_values)
+
+    def _accumulate(self, group_ids, field_ids, values):
+        '''Sum the entry values into the slot for each (group, field) pair.'''
+        codes, pairs = pd.factorize((group_ids << _FIELD_ID_BITS) | field_ids)
+        pair_slots = self._pair_slots
+        first_new_slot = len(pair_slots)
+        slots = np.empty(len(pairs), dtype=np.int64)
+        for idx, pair in enumerate(pairs.tolist()):
+            slot = pair_slots.get(pair)
+            if slot is None:
+                slot = len(pair_slots)
+                pair_slots[pair] = slot
+            slots[idx] = slot
+
+        self._ensure_slot_capacity(len(pair_slots))
+        new_slots = slots >= first_new_slot
+        self._slot_gids[slots[new_slots]] = pairs[new_slots] >> _FIELD_ID_BITS
+        self._slot_fids[slots[new_slots]] = pairs[new_slots] & (
+            (1 << _FIELD_ID_BITS) - 1
+        )
+
+        # np.add.at is unbuffered and applies the additions in order, so float
+        # sums match the row engine's sequential summation.
+        entry_slots = slots[codes]
+        # Non-finite values (like inf) cannot be summed on the integer path.
+        is_int = np.isfinite(values) & (values == np.floor(values))
+        np.logical_or.at(self._has_float, entry_slots, ~is_int)
+        np.add.at(self._float_sums, entry_slots, values)
+
+        int_slots = entry_slots[is_int]
+        int_values = values[is_int]
+        np.add.at(self._int_bounds, int_slots, np.abs(int_values))
+        is_big = self._int_bounds[int_slots] >= _MAX_INT_SUM
+        if is_big.any():
+            big_int_sums = self._big_int_sums
+            for (slot, value) in zip(
+                int_slots[is_big].tolist(), int_values[is_big].tolist()
+            ):
+                if slot not in big_int_sums:
+                    big_int_sums[slot] = int(self._int_sums[slot])
+                big_int_sums[slot] += int(value)
+            int_slots = int_slots[~is_big]
+            int_values = int_values[~is_big]
+        np.add.at(self._int_sums, int_slots, int_values.astype(np.int64))
+
+    def _build_output_rows(self):
+        '''Yield a BaseRow for each stored group in the order groups were
+        created.
+        '''
+        num_slots = len(self._pair_slots)
+        if not num_slots:
+            return
+
+        slot_gids = self._slot_gids[:num_slots]
+        order = np.argsort(slot_gids, kind='stable')
+        group_bounds = np.flatnonzero(np.diff(slot_gids[order])) + 1
+        starts = [0] + group_bounds.tolist()
+        ends = group_bounds.tolist() + [num_slots]
+
+        field_names = [
+            self._field_names[fid] for fid in self._slot_fids[order].tolist()
+        ]
+        int_sums = self._int_sums[order].tolist()
+        if self._big_int_sums:
+            int_sums = [
+                self._big_int_sums.get(slot, int_sum)
+                for (slot, int_sum) in zip(order.tolist(), int_sums)
+            ]
+        values = [
+            float_sum if has_float else int_sum
+            for (float_sum, int_sum, has_float) in zip(
+                self._float_sums[order].tolist(),
+                int_sums,
+                self._has_float[order].tolist(),
+            )
+        ]
+        if self.tracer_field:
+            values = [
+                1 if field == self.tracer_field else value
+                for (field, value) in zip(field_names, values)
+            ]
+
+        for group_id, (start, end) in enumerate(zip(starts, ends)):
+            output = self.row_cls(date=self._group_dates[group_id], source=self.source)
+            output.key = self._group_dimensions[group_id]
+            output.data = dict(zip(field_names[start:end], values[start:end]))
+            yield output
 
 
 def setup_flags():
@@ -805,7 +2025,8 @@ def setup_flags():
         '--input',
         type=str,
         required=True,
-        help='Path to input CSV. File type can be: '
+        help='Path to input CSV or a glob pattern matching multiple CSVs. File '
+        'type can be: '
         'uncompressed (.csv), '
         'gzip compressed (.gz), '
         'or lz4 compressed (.lz4)',
@@ -854,6 +2075,79 @@ def setup_flags():
         '"dimGroupName:dim1,dim2,dim3". For example: sick:cold,fever,cough',
     )
 
+    Flags.PARSER.add_argument(
+        '--num_workers',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of worker processes to use. When greater than 1, the input is '
+        'split by file (for glob inputs) or by byte range (for a single '
+        'uncompressed CSV whose quoted values do not contain newlines) and the '
+        'partial results are merged.',
+    )
+    Flags.PARSER.add_argument(
+        '--output_format',
+        type=str,
+        required=False,
+        default='json',
+        choices=ROW_FORMATS,
+        help='Format to store output rows in. The binary format is faster to '
+        'read and write for the steps that consume the output rows.',
+    )
+    Flags.PARSER.add_argument(
+        '--compact_rows',
+        action='store_true',
+        default=False,
+        help='Hold rolled up rows in memory using a compact representation with '
+        'interned dimension values. This uses much less memory at the cost of '
+        'slightly slower rollup. The columnar engine already holds its rollup '
+        'state in columns and uses compact rows for the rows it outputs and '
+        'merges.',
+    )
+    Flags.PARSER.add_argument(
+        '--max_rows_in_memory',
+        type=int,
+        required=False,
+        default=None,
+        help='Maximum number of rolled up rows to hold in memory. This is a row '
+        'count, not a memory budget: the memory used per row depends on the number '
+        'of dimensions and fields it holds. When reached, rows are spilled to '
+        'sorted runs on disk and merged at the end. The columnar engine checks the '
+        'limit after each batch, so it can exceed it by up to --batch_size rows. '
+        'The output is the same as an in-memory rollup.',
+    )
+    Flags.PARSER.add_argument(
+        '--date_cache_size',
+        type=int,
+        required=False,
+        default=DEFAULT_DATE_CACHE_SIZE,
+        help='Maximum number of distinct input dates to store parsed values for',
+    )
+    Flags.PARSER.add_argument(
+        '--spill_dir',
+        type=str,
+        required=False,
+        default=None,
+        help='Directory to write spilled rollup runs to. Defaults to the system '
+        'temp directory.',
+    )
+    Flags.PARSER.add_argument(
+        '--engine',
+        type=str,
+        required=False,
+        default='row',
+        choices=('row', 'columnar'),
+        help='Execution engine to use. The columnar engine processes the input in '
+        'column batches and produces identical output much faster.',
+    )
+    Flags.PARSER.add_argument(
+        '--batch_size',
+        type=int,
+        required=False,
+        default=DEFAULT_BATCH_SIZE,
+        help='Number of input rows processed at once by the columnar engine.',
+    )
+
     Flags.InitArgs()
 
 
@@ -895,7 +2189,13 @@ def main():
         # which is less memorable.
         delimiter = delimiter.encode().decode('unicode_escape')
 
-    agg = Aggregator(
+    aggregator_kwargs = {}
+    aggregator_cls = Aggregator
+    if Flags.ARGS.engine == 'columnar':
+        aggregator_cls = ColumnarAggregator
+        aggregator_kwargs['batch_size'] = Flags.ARGS.batch_size
+
+    agg = aggregator_cls(
         dimensions=dimensions,
         fields=fields,
         datecol=datecol,
@@ -911,6 +2211,13 @@ def main():
         val_clean_regex_str=Flags.ARGS.val_clean_regex,
         delimiter=delimiter,
         multi_value_dimensions=multi_value_dimensions,
+        num_workers=Flags.ARGS.num_workers,
+        max_rows_in_memory=Flags.ARGS.max_rows_in_memory,
+        spill_dir=Flags.ARGS.spill_dir,
+        output_format=Flags.ARGS.output_format,
+        compact_rows=Flags.ARGS.compact_rows,
+        date_cache_size=Flags.ARGS.date_cache_size,
+        **aggregator_kwargs,
     )
     if rename_cols:
         agg.set_col_rename(rename_cols)
@@ -9,7 +9,7 @@ from config.druid import DIMENSIONS
 from config.druid_base import FIELD_NAME
 from config.system import STANDARD_DATA_DATE_FORMAT
 from data.pipeline.datatypes.base_row import BaseRow
-from data.pipeline.resampler import Resampler
+from data.pipeline.resampler import DEFAULT_MAX_ROWS_IN_MEMORY, StreamingResampler
 from log import LOG
 from util.file.compression.pigz import PigzReader, PigzWriter
 from util.file.file_config import FilePattern
@@ -113,6 +113,21 @@ def main():
         default='',
         help='File path to the closure/end dates for specific locations',
     )
+    Flags.PARSER.add_argument(
+        '--max_rows_in_memory',
+        type=int,
+        default=DEFAULT_MAX_ROWS_IN_MEMORY,
+        help='Maximum number of input rows to hold in memory. When reached, rows '
+        'are spilled to sorted runs on disk and merged when resampling.',
+    )
+    Flags.PARSER.add_argument(
+        '--spill_dir',
+        type=str,
+        required=False,
+        default=None,
+        help='Directory to write spilled runs to. Defaults to the system temp '
+        'directory.',
+    )
 
     Flags.InitArgs()
     LOG.info('Starting resampling')
@@ -135,7 +150,15 @@ def main():
     with ShardReader(input_file_pattern, PigzReader) as input_file, ShardWriter(
         output_file_pattern, Flags.ARGS.shard_size, PigzWriter
     ) as output_writer:
-        resampler = Resampler(fields, date_field, date_format, dimensions, last_date)
+        resampler = StreamingResampler(
+            fields,
+            date_field,
+            date_format,
+            dimensions,
+            last_date,
+            Flags.ARGS.max_rows_in_memory,
+            Flags.ARGS.spill_dir,
+        )
         resampler.read_lines(input_file)
         LOG.info('Finished reading input lines')
         alt_end_fn = lambda y, x: x
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+'''Run a pipeline step command, skipping it and restoring its previous outputs
+when its inputs and version have not changed since its last successful run.
+
+Usage:
+run_cached_step.py \
+  --name 'sim/convert_cid' \
+  --inputs "${PIPELINE_FEED_DIR}/cid9.csv" "${PIPELINE_FEED_DIR}/cid10_flat.csv" \
+  --outputs "${PIPELINE_FEED_DIR}/output_cid.csv" \
+  -- "${PIPELINE_BIN_DIR}/sim/convert_cid_csv.py" --input_cid9=...
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+
+from pylib.base.flags import Flags
+
+from util.pipeline.step_cache import StepCache, StepDefinition, run_cached_step
+
+
+def setup_flags():
+    Flags.PARSER.add_argument(
+        '--name', type=str, required=True, help='Unique name of the step'
+    )
+    Flags.PARSER.add_argument(
+        '--inputs',
+        type=str,
+        nargs='*',
+        default=[],
+        help='Input files, directories or glob patterns read by the step',
+    )
+    Flags.PARSER.add_argument(
+        '--outputs',
+        type=str,
+        nargs='+',
+        required=True,
+        help='Output files or glob patterns written by the step',
+    )
+    Flags.PARSER.add_argument(
+        '--version_files',
+        type=str,
+        nargs='*',
+        default=[],
+        help='Additional files that define the version of the step. The command '
+        'executable is always included, along with the repository modules that '
+        'python version files import.',
+    )
+    Flags.PARSER.add_argument(
+        '--cache_dir',
+        type=str,
+        default=os.getenv('PIPELINE_STEP_CACHE_DIR', ''),
+        help='Directory to store step outputs in. If unset, the step is always run.',
+    )
+    Flags.PARSER.add_argument(
+        'command', nargs=argparse.REMAINDER, help='Command to run for the step'
+    )
+    Flags.InitArgs()
+
+
+def main():
+    setup_flags()
+
+    command = Flags.ARGS.command
+    if command and command[0] == '--':
+        command = command[1:]
+    if not command:
+        raise ValueError('No command specified for step: %s' % Flags.ARGS.name)
+
+    version_files = list(Flags.ARGS.version_files)
+    if os.path.isfile(command[0]):
+        version_files.append(command[0])
+
+    step = StepDefinition(
+        name=Flags.ARGS.name,
+        command=command,
+        inputs=Flags.ARGS.inputs,
+        outputs=Flags.ARGS.outputs,
+        version_files=version_files,
+    )
+    if not Flags.ARGS.cache_dir:
+        os.execvp(command[0], command)
+
+    try:
+        run_cached_step(step, StepCache(Flags.ARGS.cache_dir))
+    except subprocess.CalledProcessError as e:
+        return e.returncode
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+'''Run a set of pipeline steps concurrently based on the files each step reads
+and writes, and report the critical path of the run.
+
+The steps file is a JSON list of step declarations. Environment variables in the
+command, inputs and outputs are expanded before the steps are run.
+
+[
+  {
+    "name": "sim/convert",
+    "command": ["${PIPELINE_BIN_DIR}/sim/convert_raw_sim.py", "..."],
+    "inputs": ["${PIPELINE_FEED_DIR}/sim_*.csv.lz4"],
+    "outputs": ["${PIPELINE_TMP_DIR}/sim_converted_*.csv.lz4"],
+    "cpus": 2,
+    "memory_mb": 4000
+  },
+  ...
+]
+
+A subset of the steps can be run by passing glob patterns of their names. Steps
+that were not selected are not run, and the selected steps do not wait on them.
+
+Usage:
+run_pipeline_dag.py --steps_file steps.json --max_cpus 8 --max_memory_mb 16000
+run_pipeline_dag.py --steps_file steps.json --steps 'sim/*'
+'''
+
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+
+from pylib.base.flags import Flags
+
+from log import LOG
+from util.pipeline.step_cache import StepCache
+from util.pipeline.step_scheduler import (
+    ScheduledStep,
+    StepScheduler,
+    compute_critical_path,
+)
+
+
+def _expand(value):
+    return os.path.expandvars(value)
+
+
+def load_steps(filename):
+    with open(filename) as input_file:
+        step_declarations = json.load(input_file)
+
+    steps = []
+    for declaration in step_declarations:
+        steps.append(
+            ScheduledStep(
+                name=declaration['name'],
+                command=[_expand(arg) for arg in declaration['command']],
+                inputs=[_expand(path) for path in declaration.get('inputs', [])],
+                outputs=[_expand(path) for path in declaration.get('outputs', [])],
+                depends_on=declaration.get('depends_on', []),
+                cpus=declaration.get('cpus', 1),
+                memory_mb=declaration.get('memory_mb', 0),
+                version_files=[
+                    _expand(path) for path in declaration.get('version_files', [])
+                ],
+            )
+        )
+    return steps
+
+
+def select_steps(steps, patterns):
+    '''Return the steps whose name matches one of the glob patterns. All steps
+    are returned if no patterns are provided.
+    '''
+    if not patterns:
+        return steps
+
+    selected_steps = [
+        step
+        for step in steps
+        if any(fnmatch.fnmatchcase(step.name, pattern) for pattern in patterns)
+    ]
+    if not selected_steps:
+        raise ValueError('No steps match the patterns: %s' % ', '.join(patterns))
+    return selected_steps
+
+
+def main():
+    Flags.PARSER.add_argument(
+        '--steps_file',
+        type=str,
+        required=True,
+        help='JSON file declaring the steps to run',
+    )
+    Flags.PARSER.add_argument(
+        '--steps',
+        type=str,
+        nargs='*',
+        default=[],
+        help='Glob patterns of the names of the steps to run. If unset, all steps '
+        'are run.',
+    )
+    Flags.PARSER.add_argument(
+        '--max_cpus',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Maximum number of CPUs used by the steps running at the same time',
+    )
+    Flags.PARSER.add_argument(
+        '--max_memory_mb',
+        type=int,
+        default=0,
+        help='Maximum memory in megabytes used by the steps running at the same '
+        'time. If 0, memory usage is not limited.',
+    )
+    Flags.PARSER.add_argument(
+        '--cache_dir',
+        type=str,
+        default=os.getenv('PIPELINE_STEP_CACHE_DIR', ''),
+        help='Directory to store step outputs in. If set, steps whose inputs have '
+        'not changed since their last successful run are skipped.',
+    )
+    Flags.InitArgs()
+
+    steps = select_steps(load_steps(Flags.ARGS.steps_file), Flags.ARGS.steps)
+    step_cache = StepCache(Flags.ARGS.cache_dir) if Flags.ARGS.cache_dir else None
+    scheduler = StepScheduler(Flags.ARGS.max_cpus, Flags.ARGS.max_memory_mb, step_cache)
+    try:
+        results = scheduler.run(steps)
+    except subprocess.CalledProcessError as e:
+        return e.returncode
+
+    if not results:
+        LOG.info('No steps to run')
+        return 0
+
+    (critical_path, duration) = compute_critical_path(steps, results)
+    start_time = min(result.start_time for result in results.values())
+    end_time = max(result.end_time for result in results.values())
+    LOG.info('Finished %s steps in %.1fs', len(results), end_time - start_time)
+    LOG.info('Critical path (%.1fs):', duration)
+    for name in critical_path:
+        LOG.info('    %s: %.1fs', name, results[name].duration)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+from datetime import datetime
+from unittest import TestCase
+
+from data.pipeline.scripts.count_linelist_data import (
+    DateBucketer,
+    LinelistCounter,
+    _get_bucket_start,
+    _get_next_bucket_start,
+    convert_linelist_to_count_rows,
+)
+
+
+def _date(date_str):
+    return datetime.strptime(date_str, '%Y-%m-%d')
+
+
+def _build_rows(date_strs, region='North'):
+    return [{'date': date_str, 'RegionName': region} for date_str in date_strs]
+
+
+class BucketTest(TestCase):
+    def test_get_next_bucket_start(self):
+        for (granularity, bucket_start, expected) in (
+            ('day', '2020-02-28', '2020-02-29'),
+            ('day', '2020-12-31', '2021-01-01'),
+            ('week', '2020-12-28', '2021-01-04'),
+            ('month', '2020-01-01', '2020-02-01'),
+            ('month', '2020-11-01', '2020-12-01'),
+            ('month', '2020-12-01', '2021-01-01'),
+            ('quarter', '2020-01-01', '2020-04-01'),
+            ('quarter', '2020-07-01', '2020-10-01'),
+            ('quarter', '2020-10-01', '2021-01-01'),
+        ):
+            self.assertEqual(
+                _date(expected),
+                _get_next_bucket_start(_date(bucket_start), granularity),
+                '%s %s' % (granularity, bucket_start),
+            )
+
+    def test_get_bucket_start(self):
+        for (granularity, date_str, expected) in (
+            ('day', '2020-12-31', '2020-12-31'),
+            # 2021-01-01 is a Friday.
+            ('week', '2021-01-01', '2020-12-28'),
+            ('week', '2021-01-04', '2021-01-04'),
+            ('month', '2020-12-31', '2020-12-01'),
+            ('month', '2021-01-01', '2021-01-01'),
+            ('quarter', '2020-03-31', '2020-01-01'),
+            ('quarter', '2020-04-01', '2020-04-01'),
+            ('quarter', '2020-12-31', '2020-10-01'),
+            ('quarter', '2021-02-15', '2021-01-01'),
+        ):
+            self.assertEqual(
+                _date(expected),
+                _get_bucket_start(_date(date_str), granularity),
+                '%s %s' % (granularity, date_str),
+            )
+            self.assertEqual(expected, DateBucketer(granularity).get_bucket(date_str))
+
+    def test_unsupported_granularity(self):
+        with self.assertRaises(ValueError):
+            DateBucketer('year')
+
+
+class LinelistCounterTest(TestCase):
+    def _convert(self, rows, granularity):
+        return convert_linelist_to_count_rows(
+            rows,
+            count_field='cases',
+            cumulative_field='cumulative_cases',
+            dimensions=['RegionName'],
+            granularity=granularity,
+        )
+
+    def test_month_buckets_across_year(self):
+        rows = _build_rows(['2020-11-30', '2020-12-01', '2020-12-31', '2021-02-01'])
+        (count_rows, cumulative_rows) = self._convert(rows, 'month')
+        self.assertEqual(
+            [('2020-11-01', 1), ('2020-12-01', 2), ('2021-02-01', 1)],
+            [(row['date'], row['val']) for row in count_rows],
+        )
+        self.assertEqual(
+            [
+                ('2020-11-01', 1),
+                ('2020-12-01', 3),
+                ('2021-01-01', 3),
+                ('2021-02-01', 4),
+            ],
+            [(row['date'], row['val']) for row in cumulative_rows],
+        )
+
+    def test_quarter_buckets_across_year(self):
+        rows = _build_rows(['2020-09-30', '2020-10-01', '2020-12-31', '2021-04-01'])
+        (count_rows, cumulative_rows) = self._convert(rows, 'quarter')
+        self.assertEqual(
+            [('2020-07-01', 1), ('2020-10-01', 2), ('2021-04-01', 1)],
+            [(row['date'], row['val']) for row in count_rows],
+        )
+        self.assertEqual(
+            [
+                ('2020-07-01', 1),
+                ('2020-10-01', 3),
+                ('2021-01-01', 3),
+                ('2021-04-01', 4),
+            ],
+            [(row['date'], row['val']) for row in cumulative_rows],
+        )
+
+    def test_sorted_rows_match_unsorted_rows(self):
+        rows = sorted(
+            _build_rows(['2020-11-30', '2020-12-15', '2021-01-02', '2021-03-01'])
+            + _build_rows(['2020-12-01', '2021-01-10', '2021-01-11'], 'South'),
+            key=lambda row: row['date'],
+        )
+        for granularity in ('day', 'week', 'month', 'quarter'):
+            (count_rows, cumulative_rows) = self._convert(rows, granularity)
+            counter = LinelistCounter(
+                count_field='cases',
+                cumulative_field='cumulative_cases',
+                dimensions=['RegionName'],
+                granularity=granularity,
+            )
+            sorted_count_rows = []
+            sorted_cumulative_rows = []
+            for (count_row, cumulative_row) in counter.iter_sorted_rows(rows):
+                if count_row is not None:
+                    sorted_count_rows.append(count_row)
+                sorted_cumulative_rows.append(cumulative_row)
+
+            def _sort_key(row):
+                return (row['RegionName'], row['date'])
+
+            self.assertEqual(
+                sorted(count_rows, key=_sort_key),
+                sorted(sorted_count_rows, key=_sort_key),
+            )
+            self.assertEqual(
+                sorted(cumulative_rows, key=_sort_key),
+                sorted(sorted_cumulative_rows, key=_sort_key),
+            )
+
+    def test_sorted_rows_are_flushed(self):
+        counter = LinelistCounter(
+            count_field='cases', dimensions=['RegionName'], granularity='month'
+        )
+        rows = iter(_build_rows(['2020-01-05', '2020-01-20', '2020-02-03']))
+        output_rows = counter.iter_sorted_rows(rows)
+
+        # The January rows are written once the input reaches February, and the
+        # January counts are no longer held by the counter.
+        (count_row, cumulative_row) = next(output_rows)
+        self.assertEqual(
+            {'date': '2020-01-01', 'field': 'cases', 'val': 2, 'RegionName': 'North'},
+            count_row,
+        )
+        self.assertIsNone(cumulative_row)
+        leaf = counter.root.get_child('North')
+        self.assertEqual({'2020-02-01': 1}, leaf.counts)
+        self.assertEqual(2, leaf.flushed_count)
+
+        self.assertEqual(
+            [('2020-02-01', 1)],
+            [(row['date'], row['val']) for (row, _) in output_rows],
+        )
+
+    def test_unsorted_input_raises(self):
+        counter = LinelistCounter(count_field='cases', granularity='month')
+        rows = [{'date': '2020-02-01'}, {'date': '2020-03-01'}, {'date': '2020-02-10'}]
+        with self.assertRaises(ValueError):
+            list(counter.iter_sorted_rows(rows))
+
+        # Dates inside the current time bucket can come in any order.
+        counter = LinelistCounter(count_field='cases', granularity='month')
+        rows = [{'date': '2020-02-20'}, {'date': '2020-02-01'}, {'date': '2020-03-01'}]
+        self.assertEqual(
+            [('2020-02-01', 2), ('2020-03-01', 1)],
+            [(row['date'], row['val']) for (row, _) in counter.iter_sorted_rows(rows)],
+        )
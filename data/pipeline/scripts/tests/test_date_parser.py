@@ -0,0 +1,132 @@
+from datetime import date, timedelta
+from unittest import TestCase
+
+from data.pipeline.scripts.process_csv import (
+    DATE_FORMAT_SAMPLE_SIZE,
+    DateParser,
+    _parse_date_fallback,
+)
+
+
+def _build_dates(date_format, count=DATE_FORMAT_SAMPLE_SIZE, start=date(2020, 1, 1)):
+    return [(start + timedelta(days=idx)).strftime(date_format) for idx in range(count)]
+
+
+# Values that the inferred formats can disagree with `dateutil` on, or that only
+# `dateutil` can parse.
+OUTLIERS = [
+    '13/02/2020',
+    '02/03/2020',
+    '2/3/2020',
+    '03/02/20',
+    '2020-02-30',
+    '2020-03-04T10:11:12',
+    '2020-03-05 10:11:12.123456',
+    '2020/03/06',
+    'Mar 7 2020',
+    '7 March 2020',
+    '20200308',
+    'garbage',
+]
+
+
+class DateParserTest(TestCase):
+    def _parse_all(self, parser, input_date_strs):
+        return [parser.parse(input_date_str) for input_date_str in input_date_strs]
+
+    def test_infer_format(self):
+        parser = DateParser()
+        self._parse_all(parser, _build_dates('%Y-%m-%d'))
+        self.assertEqual('%Y-%m-%d', parser.date_format)
+        self.assertEqual(DATE_FORMAT_SAMPLE_SIZE, parser.stats['fallback parses'])
+
+        values = _build_dates('%Y-%m-%d', 10, date(2021, 1, 1))
+        self.assertEqual(values, self._parse_all(parser, values))
+        self.assertEqual(10, parser.stats['strict parses'])
+
+        parser = DateParser()
+        self._parse_all(parser, _build_dates('%m/%d/%Y'))
+        self.assertEqual('%m/%d/%Y', parser.date_format)
+
+    def test_no_format_inferred(self):
+        # Day first dates are not a candidate format. Ambiguous dates are parsed
+        # as month first by `dateutil`.
+        parser = DateParser()
+        values = _build_dates('%d/%m/%Y', start=date(2020, 1, 13))
+        self.assertEqual(
+            [_parse_date_fallback(value) for value in values],
+            self._parse_all(parser, values),
+        )
+        self.assertEqual('2020-01-13', parser.parse('13/01/2020'))
+        self.assertEqual('2020-02-01', parser.parse('02/01/2020'))
+        self.assertIsNone(parser.date_format)
+        self.assertEqual(0, parser.stats['strict parses'])
+
+    def test_outliers_fall_back(self):
+        # A few outliers in the sample do not prevent a format from being used.
+        # Values that cannot be parsed are not part of the sample.
+        parser = DateParser()
+        values = _build_dates('%Y-%m-%d', DATE_FORMAT_SAMPLE_SIZE - 2)
+        self._parse_all(parser, ['Jan 3 2019', '2019/01/04', 'garbage'] + values)
+        self.assertEqual('%Y-%m-%d', parser.date_format)
+
+        fallback_count = parser.stats['fallback parses']
+        self.assertEqual(
+            [_parse_date_fallback(value) for value in OUTLIERS],
+            self._parse_all(parser, OUTLIERS),
+        )
+        self.assertGreater(parser.stats['fallback parses'], fallback_count)
+        self.assertEqual('2020-03-07', parser.parse('Mar 7 2020'))
+        self.assertIsNone(parser.parse('2020-02-30'))
+
+    def test_parse_many_matches_parse(self):
+        for (date_format, inferred_format) in (
+            ('%Y-%m-%d', '%Y-%m-%d'),
+            ('%m/%d/%Y', '%m/%d/%Y'),
+            ('%d/%m/%Y', None),
+        ):
+            values = _build_dates(date_format, 200) + OUTLIERS
+            values += _build_dates('%m/%d/%Y', 20, date(2020, 1, 1))
+            values += _build_dates('%d/%m/%Y', 20, date(2020, 1, 1))
+            expected = [_parse_date_fallback(value) for value in values]
+
+            parser = DateParser()
+            self.assertEqual(expected, self._parse_all(parser, values))
+
+            # Parse the values in batches of distinct values, with empty values
+            # and values that are already cached.
+            parser = DateParser()
+            result = []
+            for start in range(0, len(values), 30):
+                batch = list(dict.fromkeys(values[max(start - 5, 0) : start + 30]))
+                (*output, empty_output) = parser.parse_many(batch + [''])
+                self.assertIsNone(empty_output)
+                parsed = dict(zip(batch, output))
+                result.extend(parsed[value] for value in values[start : start + 30])
+            self.assertEqual(expected, result)
+            self.assertEqual(inferred_format, parser.date_format)
+
+    def test_cache_eviction(self):
+        values = _build_dates('%Y-%m-%d', 100)
+        parser = DateParser(max_cache_size=10)
+        self._parse_all(parser, values)
+        self.assertEqual(10, len(parser._cache))
+        self.assertEqual(90, parser.stats['cache evictions'])
+
+        # Evicted values are parsed again.
+        self.assertEqual(values[:20], self._parse_all(parser, values[:20]))
+        self.assertEqual(10, len(parser._cache))
+        self.assertEqual(0, parser.stats['cache hits'])
+
+        parser = DateParser(max_cache_size=10)
+        for start in range(0, len(values), 25):
+            self.assertEqual(
+                values[start : start + 25],
+                parser.parse_many(values[start : start + 25]),
+            )
+            self.assertLessEqual(len(parser._cache), 10)
+        self.assertEqual(90, parser.stats['cache evictions'])
+
+        # Recently used values stay in the cache.
+        self.assertEqual(values[-10:], parser.parse_many(values[-10:]))
+        self.assertEqual(10, parser.stats['cache hits'])
@@ -0,0 +1,301 @@
+import io
+import json
+import math
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from data.pipeline.scripts import process_csv
+from data.pipeline.scripts.process_csv import (
+    Aggregator,
+    ColumnarAggregator,
+    RollupSpiller,
+)
+
+HEADER = 'RegionName,StateName,Gender,date,f1,f2,!!,cold,fever,other'
+REGIONS = ['North', 'South', ' East ']
+STATES = ['A', 'B', '']
+DATES = ['2020-01-01', '2020/01/02', 'Jan 3 2020', '', 'garbage']
+VALUES = ['1', '2', '0', '', '1.5', '2.25', '-1', '1e3', '7', '']
+
+BASE_KWARGS = {
+    'datecol': 'date',
+    'source': 'test',
+    'output_field_prefix': 'test',
+    'dimensions': [
+        'RegionName',
+        'StateName',
+        'Gender',
+        'ComorbiditiesAndRiskFactors',
+    ],
+    'fields': ['f1', 'f2', '!!'],
+    'multi_value_dimensions': ['ComorbiditiesAndRiskFactors:cold,fever'],
+}
+
+
+def _build_csv(num_rows=400):
+    lines = [HEADER]
+    for idx in range(num_rows):
+        if idx % 53 == 0:
+            lines.append('')
+        row = [
+            REGIONS[idx % 3],
+            STATES[idx % 7 % 3],
+            'mf'[idx % 2],
+            DATES[idx % 11 % 5],
+            VALUES[idx % 10],
+            VALUES[idx % 13 % 10],
+            VALUES[idx % 4],
+            'cold' if idx % 3 else '',
+            'fever' if idx % 5 else '',
+            'x',
+        ]
+        if idx % 61 == 0:
+            row.append('extra')
+        lines.append(','.join(row))
+    return '\n'.join(lines) + '\n'
+
+
+def _setup_handlers(aggregator):
+    aggregator.set_col_rename(['other:Other'])
+    aggregator.set_col_join(['StateName+Gender:Joined'], ' - ')
+    aggregator.set_col_val(['Gender:z'])
+    aggregator.register_col_handler('f1', lambda value: value.replace('7', '3.5'))
+
+
+_write_run = RollupSpiller._write_run
+
+
+def _raise_error(value):
+    raise ValueError('Bad value: %s' % value)
+
+
+class ProcessCSVTestCase(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.temp_dir.name, 'input.csv')
+        with open(self.input_path, 'w') as input_file:
+            input_file.write(_build_csv())
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _process(self, aggregator_cls, setup_fn=None, input_path=None, **kwargs):
+        aggregator = aggregator_cls(**{**BASE_KWARGS, **kwargs})
+        if setup_fn:
+            setup_fn(aggregator)
+
+        output_dir = tempfile.mkdtemp(dir=self.temp_dir.name)
+        filenames = [
+            os.path.join(output_dir, filename)
+            for filename in ('rows.json', 'locations.csv', 'fields.txt')
+        ]
+        aggregator.process(input_path or self.input_path, *filenames, None)
+        outputs = []
+        for filename in filenames:
+            with open(filename) as output_file:
+                outputs.append(output_file.read())
+        return (outputs, dict(aggregator.counts), dict(aggregator.errors))
+
+
+class ColumnarAggregatorTest(ProcessCSVTestCase):
+
+    def _assert_same_output(self, setup_fn=None, **kwargs):
+        expected = self._process(Aggregator, setup_fn, **kwargs)
+        for batch_size in (7, 1000):
+            result = self._process(
+                ColumnarAggregator, setup_fn, batch_size=batch_size, **kwargs
+            )
+            self.assertEqual(expected, result)
+        return expected
+
+    def test_rollup(self):
+        (outputs, counts, errors) = self._assert_same_output()
+        self.assertIn('ComorbiditiesAndRiskFactors', outputs[0])
+        self.assertLess(
+            counts[Aggregator.OBJECTS_WRITTEN_COUNT_LABEL],
+            counts[Aggregator.ROWS_STORED_COUNT_LABEL],
+        )
+        for label in (
+            Aggregator.UNPARSEABLE_DATE_ERROR_LABEL,
+            Aggregator.EMPTY_DATE_ERROR_LABEL,
+            Aggregator.EMPTY_DATA_ROW_ERROR_LABEL,
+            Aggregator.EXTRA_VALS_ERROR_LABEL,
+            'bad fields',
+        ):
+            self.assertGreater(errors.get(label, 0), 0, label)
+
+    def test_no_rollup(self):
+        self._assert_same_output(enable_rollup=False, exclude_zeros=True)
+
+    def test_tracer_field(self):
+        (outputs, _, _) = self._assert_same_output(tracer_field='tracer')
+        self.assertIn('"tracer": 1', outputs[0])
+
+    def test_column_handlers(self):
+        self._assert_same_output(
+            _setup_handlers,
+            dimensions=['RegionName', 'Joined', 'Gender'],
+            flatten_string_categories=True,
+        )
+
+    def test_compact_rows(self):
+        self._assert_same_output(compact_rows=True, tracer_field='tracer')
+
+        # The values interned by the rows held during rollup are released once
+        # the rows are written.
+        aggregator = Aggregator(**BASE_KWARGS, compact_rows=True)
+        output_dir = self.temp_dir.name
+        aggregator.process(
+            self.input_path,
+            os.path.join(output_dir, 'rows.json'),
+            os.path.join(output_dir, 'locations.csv'),
+            os.path.join(output_dir, 'fields.txt'),
+            None,
+        )
+        self.assertFalse(aggregator.row_cls.INTERN_TABLE.values)
+
+    def test_large_integer_values(self):
+        # Integer sums that do not fit in an int64 are output as exact integers.
+        input_path = os.path.join(self.temp_dir.name, 'large_values.csv')
+        with open(input_path, 'w') as input_file:
+            input_file.write(
+                'RegionName,date,f1,f2\n'
+                'North,2020-01-01,1e300,9e18\n'
+                'North,2020-01-01,1,9e18\n'
+                'South,2020-01-01,-9e18,5e18\n'
+                'South,2020-01-01,-9e18,0.5\n'
+                'East,2020-01-01,4611686018427387904,3\n'
+            )
+        (outputs, _, _) = self._assert_same_output(
+            input_path=input_path, dimensions=['RegionName'], fields=['f1', 'f2']
+        )
+        rows = [json.loads(line)['data'] for line in outputs[0].splitlines()]
+        self.assertEqual(int(1e300) + 1, rows[0]['test_f1'])
+        self.assertEqual(int(9e18) * 2, rows[0]['test_f2'])
+        self.assertEqual(-int(9e18) * 2, rows[1]['test_f1'])
+        self.assertEqual(5e18 + 0.5, rows[1]['test_f2'])
+        self.assertEqual(2 ** 62, rows[2]['test_f1'])
+
+    def test_non_finite_values(self):
+        # Non-finite values cannot be serialized, so compare the rolled up rows.
+        def _build_rows(aggregator_cls, **kwargs):
+            aggregator = aggregator_cls(
+                datecol='date',
+                source='test',
+                output_field_prefix='test',
+                dimensions=['RegionName'],
+                fields=['f1', 'f2'],
+                **kwargs,
+            )
+            input_file = io.StringIO(
+                'RegionName,date,f1,f2\n'
+                'North,2020-01-01,inf,1\n'
+                'North,2020-01-01,2,-inf\n'
+                'South,2020-01-01,nan,3\n'
+            )
+            aggregator._read_input(input_file, None, set())
+            return [row.data for (_, row) in aggregator._pop_final_rows()]
+
+        expected = _build_rows(Aggregator)
+        result = _build_rows(ColumnarAggregator)
+        self.assertEqual(expected[0], result[0])
+        self.assertEqual(
+            {'test_f1': float('inf'), 'test_f2': float('-inf')}, result[0]
+        )
+        self.assertTrue(math.isnan(result[1]['test_f1']))
+        self.assertEqual(3, result[1]['test_f2'])
+
+
+class MergedRowsTestCase(ProcessCSVTestCase):
+    def _process(self, *args, **kwargs):
+        # The tracer field can be placed at a different position in the data of
+        # rows merged from multiple partial rollups, so rows are compared as
+        # dictionaries.
+        ((rows, *outputs), counts, errors) = super()._process(*args, **kwargs)
+        rows = [json.loads(line) for line in rows.splitlines()]
+        return ([rows, *outputs], counts, errors)
+
+
+class ShardedProcessingTest(MergedRowsTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.input_path) as input_file:
+            (header, *lines) = input_file.read().splitlines(True)
+
+        # Split the input into multiple files that are matched by a glob.
+        self.glob_path = os.path.join(self.temp_dir.name, 'part_*.csv')
+        for idx in range(8):
+            filename = os.path.join(self.temp_dir.name, 'part_%d.csv' % idx)
+            with open(filename, 'w') as part_file:
+                part_file.write(header + ''.join(lines[idx * 50 : (idx + 1) * 50]))
+
+    def _assert_same_output(self, aggregator_cls, input_path, **kwargs):
+        expected = self._process(aggregator_cls, input_path=input_path, **kwargs)
+        for num_workers in (2, 3):
+            result = self._process(
+                aggregator_cls,
+                input_path=input_path,
+                num_workers=num_workers,
+                **kwargs,
+            )
+            self.assertEqual(expected, result)
+            self.assertIsNone(process_csv._SHARD_AGGREGATOR)
+
+    def test_glob_input(self):
+        for aggregator_cls in (Aggregator, ColumnarAggregator):
+            self._assert_same_output(aggregator_cls, self.glob_path)
+            self._assert_same_output(
+                aggregator_cls, self.glob_path, enable_rollup=False
+            )
+
+    def test_byte_range_input(self):
+        for aggregator_cls in (Aggregator, ColumnarAggregator):
+            self._assert_same_output(
+                aggregator_cls, self.input_path, tracer_field='tracer'
+            )
+            self._assert_same_output(
+                aggregator_cls, self.input_path, enable_rollup=False
+            )
+
+    def test_shard_aggregator_reset_on_error(self):
+        with self.assertRaises(ValueError):
+            self._process(
+                Aggregator,
+                lambda aggregator: aggregator.register_col_handler('f1', _raise_error),
+                input_path=self.glob_path,
+                num_workers=2,
+            )
+        self.assertIsNone(process_csv._SHARD_AGGREGATOR)
+
+
+class SpilledRollupTest(MergedRowsTestCase):
+    def _assert_same_output(self, aggregator_cls, **kwargs):
+        expected = self._process(aggregator_cls, **kwargs)
+        for max_rows in (5, 20):
+            spill_dir = tempfile.mkdtemp(dir=self.temp_dir.name)
+            with mock.patch.object(
+                RollupSpiller, '_write_run', autospec=True, side_effect=_write_run
+            ) as write_run_mock:
+                result = self._process(
+                    aggregator_cls,
+                    max_rows_in_memory=max_rows,
+                    spill_dir=spill_dir,
+                    **kwargs,
+                )
+            self.assertEqual(expected, result)
+
+            # Multiple runs must have been spilled and merged, and the run files
+            # are removed once the rows have been written.
+            self.assertGreater(write_run_mock.call_count, 2)
+            self.assertEqual([], os.listdir(spill_dir))
+
+    def test_row_engine(self):
+        self._assert_same_output(Aggregator)
+        self._assert_same_output(Aggregator, tracer_field='tracer')
+
+    def test_columnar_engine(self):
+        self._assert_same_output(ColumnarAggregator, batch_size=7)
+        self._assert_same_output(
+            ColumnarAggregator, batch_size=7, tracer_field='tracer'
+        )
@@ -0,0 +1,76 @@
+import os
+from unittest import TestCase, mock
+
+from data.pipeline.scripts.run_pipeline_dag import load_steps, select_steps
+from util.pipeline.step_scheduler import build_step_graph
+
+BRAZIL_COVID_STEPS_FILE = os.path.join(
+    os.path.dirname(__file__), '../../../../pipeline/brazil_covid/process/steps.json'
+)
+
+PIPELINE_ENV = {
+    'PIPELINE_BIN_DIR': '/zen/pipeline/brazil_covid/bin',
+    'PIPELINE_DATE': '20200601',
+    'PIPELINE_OUT_ROOT': '/out/brazil_covid/process',
+}
+
+
+class RunPipelineDagTest(TestCase):
+    def setUp(self):
+        env_patch = mock.patch.dict(os.environ, PIPELINE_ENV)
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        self.steps = load_steps(BRAZIL_COVID_STEPS_FILE)
+
+    def test_load_brazil_covid_steps(self):
+        dependencies = build_step_graph(self.steps)
+        self.assertEqual(
+            {
+                'sim/convert': ['sim/convert_cid', 'sim/convert_occupation'],
+                'sim/convert_cid': [],
+                'sim/convert_occupation': [],
+                'sivep/convert': [],
+            },
+            {name: sorted(names) for (name, names) in dependencies.items()},
+        )
+
+        for step in self.steps:
+            self.assertNotIn('$', ' '.join(step.command + step.inputs + step.outputs))
+            self.assertGreater(step.memory_mb, 0)
+            self.assertEqual([step.command[0]], step.version_files)
+            self.assertTrue(
+                os.path.exists(
+                    step.command[0].replace(
+                        PIPELINE_ENV['PIPELINE_BIN_DIR'],
+                        os.path.join(
+                            os.path.dirname(BRAZIL_COVID_STEPS_FILE), '../bin'
+                        ),
+                    )
+                )
+            )
+        sim_step = self.steps[2]
+        self.assertEqual(
+            '--output_file_pattern=/out/brazil_covid/process/tmp/sim/20200601/'
+            'sim_converted_#.csv.lz4',
+            sim_step.command[2],
+        )
+
+    def test_select_steps(self):
+        self.assertEqual(self.steps, select_steps(self.steps, []))
+        self.assertEqual(
+            ['sim/convert_cid', 'sim/convert_occupation', 'sim/convert'],
+            [step.name for step in select_steps(self.steps, ['sim/*'])],
+        )
+        self.assertEqual(
+            ['sim/convert', 'sivep/convert'],
+            [step.name for step in select_steps(self.steps, ['*/convert'])],
+        )
+        with self.assertRaises(ValueError):
+            select_steps(self.steps, ['sinan/*'])
+
+        # Steps that were not selected are not dependencies of the selected
+        # steps.
+        self.assertEqual(
+            {'sim/convert': set()},
+            build_step_graph(select_steps(self.steps, ['sim/convert'])),
+        )
@@ -1,6 +1,10 @@
+import heapq
+
 from builtins import object
 from collections import defaultdict
 from enum import Enum
+from itertools import groupby
+from typing import Iterable, NamedTuple, Set
 
 from data.pipeline.datatypes.matching_row import MatchingRow
 from data.pipeline.row_merger import RowMerger
@@ -16,6 +20,34 @@ class Strategy(Enum):
     MAPPING_ID = 2
 
 
+def _iter_sorted_source_rows(source_idx, source, rows):
+    '''Yield (date, source index, row index, row) tuples for the rows of a
+    source, verifying that the rows are sorted by date.
+    '''
+    last_date = None
+    for row_idx, row in enumerate(rows):
+        date = row.date
+        if last_date is not None and date < last_date:
+            raise ValueError(
+                'Source rows must be sorted by date. Source: %s\tDate %s is '
+                'after %s' % (source, last_date, date)
+            )
+        last_date = date
+        yield (date, source_idx, row_idx, row)
+
+
+class SortedSource(NamedTuple):
+    '''A source to merge with `SourceMerger.merge_sorted_sources`. The rows of
+    sources merged with the JOIN_ID strategy must be sorted by date.
+    '''
+
+    source: str
+    source_rows: Iterable[dict]
+    source_data_fields: Set[str]
+    mapping_rows: Iterable[dict]
+    merge_strategy: Strategy = Strategy.JOIN_ID
+
+
 class SourceMerger(object):
     def __init__(self, row_class, value_merge_fn=_simple_add):
         self._row_class = row_class
@@ -38,28 +70,9 @@ class SourceMerger(object):
 
         # Process the matched location data
         canonical_mapping = self._build_canonical_mapping(mapping_rows)
+        self._add_data_fields(source, source_data_fields)
 
-        if self._detect_overlapping_fields:
-            # Ensure that this new source will not overwrite values from
-            # a previously processed source
-            overlapping_fields = self._output_data_fields & source_data_fields
-            assert len(overlapping_fields) == 0, (
-                'Current source has conflicting fields that will overwrite '
-                'data from previously processed source! '
-                'Current source: %s\tHeaders: %s' % (source, overlapping_fields)
-            )
-        self._output_data_fields |= source_data_fields
-
-        for row in source_rows:
-            base_row = self._row_class.from_dict(row)
-            mapping_id = base_row.mapping_id
-
-            if mapping_id not in canonical_mapping:
-                self._failed_mappings[mapping_id] += 1
-                continue
-
-            # Copy in canonical mapping for this row, preserving the date
-            base_row.key = canonical_mapping[mapping_id].key
+        for base_row in self._map_source_rows(source_rows, canonical_mapping):
             if merge_strategy is Strategy.JOIN_ID:
                 self._merge_in_row_on_join_id(base_row)
             elif merge_strategy is Strategy.MAPPING_ID:
@@ -71,6 +84,87 @@ class SourceMerger(object):
 
         print('################ %s END ################' % source)
 
+    def merge_sorted_sources(self, sorted_sources):
+        '''Merge the sources and yield the merged rows, ordered by date, without
+        holding every merged row in memory.
+
+        The rows of sources using the JOIN_ID strategy must be sorted by date.
+        They are combined with a k-way merge that reads one row at a time from
+        each source, so only the rows for a single date are held in memory.
+        Sources using the MAPPING_ID strategy apply to rows of every date, so
+        their rows are held in memory.
+
+        The merged rows are the same as processing the sources in order with
+        `process_source`, including which rows a MAPPING_ID source is merged
+        into and the order values are combined in. Within a date, rows are
+        yielded in the order they would be created by `process_source`.
+        '''
+        join_sources = []
+        # Mapping from mapping ID to a list of (source index, row) tuples for the
+        # rows of MAPPING_ID sources.
+        mapping_id_rows = defaultdict(list)
+        for source_idx, sorted_source in enumerate(sorted_sources):
+            self._add_data_fields(
+                sorted_source.source, sorted_source.source_data_fields
+            )
+            canonical_mapping = self._build_canonical_mapping(
+                sorted_source.mapping_rows
+            )
+            rows = self._map_source_rows(sorted_source.source_rows, canonical_mapping)
+            if sorted_source.merge_strategy is Strategy.JOIN_ID:
+                join_sources.append(
+                    _iter_sorted_source_rows(source_idx, sorted_source.source, rows)
+                )
+            elif sorted_source.merge_strategy is Strategy.MAPPING_ID:
+                for row in rows:
+                    mapping_id_rows[row.mapping_id].append((source_idx, row))
+            else:
+                assert False, (
+                    'Invalid merge strategy chosen! '
+                    'Strategy: %s' % sorted_source.merge_strategy
+                )
+
+        merged_mapping_ids = set()
+        merged_rows = heapq.merge(*join_sources)
+        for _, date_rows in groupby(merged_rows, key=lambda item: item[0]):
+            # Group the rows for this date by join ID. Rows are received in
+            # source order, so the groups are created in the same order as
+            # `process_source` would create them.
+            output = {}
+            for _, source_idx, _, row in date_rows:
+                row_id = row.row_id
+                if row_id not in output:
+                    output[row_id] = (source_idx, [(source_idx, row)])
+                else:
+                    output[row_id][1].append((source_idx, row))
+
+            for first_source_idx, rows in output.values():
+                mapping_id = rows[0][1].mapping_id
+                # MAPPING_ID rows are only merged into rows that were created by
+                # an earlier source.
+                mapping_rows = [
+                    item
+                    for item in mapping_id_rows.get(mapping_id, ())
+                    if item[0] > first_source_idx
+                ]
+                if mapping_rows:
+                    merged_mapping_ids.add(mapping_id)
+                    # NOTE: The sort is stable, so rows from the same source are
+                    # merged in their original order.
+                    rows = sorted(rows + mapping_rows, key=lambda item: item[0])
+
+                row_merger = RowMerger(rows[0][1], self._value_merge_fn)
+                for _, row in rows[1:]:
+                    row_merger.add_row(row)
+                yield row_merger.get_merged_row()
+
+        for mapping_id in mapping_id_rows:
+            if mapping_id not in merged_mapping_ids:
+                print(
+                    'Cannot merge in row on mapping id alone. '
+                    'Mapping ID is missing: %s' % mapping_id
+                )
+
     def prevent_overlapping_fields(self):
         self._detect_overlapping_fields = True
 
@@ -112,6 +206,34 @@ class SourceMerger(object):
         for join_id in self._stored_rows[mapping_id]:
             self._output[join_id].add_row(row_to_merge)
 
+    def _add_data_fields(self, source, source_data_fields):
+        if self._detect_overlapping_fields:
+            # Ensure that this new source will not overwrite values from
+            # a previously processed source
+            overlapping_fields = self._output_data_fields & source_data_fields
+            assert len(overlapping_fields) == 0, (
+                'Current source has conflicting fields that will overwrite '
+                'data from previously processed source! '
+                'Current source: %s\tHeaders: %s' % (source, overlapping_fields)
+            )
+        self._output_data_fields |= source_data_fields
+
+    def _map_source_rows(self, source_rows, canonical_mapping):
+        '''Convert the source rows into BaseRows with their canonical dimensions.
+        Rows without a canonical mapping are skipped.
+        '''
+        for row in source_rows:
+            base_row = self._row_class.from_dict(row)
+            mapping_id = base_row.mapping_id
+
+            if mapping_id not in canonical_mapping:
+                self._failed_mappings[mapping_id] += 1
+                continue
+
+            # Copy in canonical mapping for this row, preserving the date
+            base_row.key = canonical_mapping[mapping_id].key
+            yield base_row
+
     def _build_canonical_mapping(self, mapping_rows):
         canonical_mapping = {}
         for row in mapping_rows:
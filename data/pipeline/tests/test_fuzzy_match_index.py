@@ -0,0 +1,43 @@
+import random
+
+from unittest import TestCase
+
+from fuzzywuzzy import process
+
+from data.pipeline.fuzzy_match_index import FuzzyMatchIndex
+
+SYLLABLES = ['sao', 'pa', 'ulo', 'rio', 'de', 'ja', 'nei', 'ro', 'bel', 'ho', 'ção']
+
+
+def _random_name(rng):
+    words = [
+        ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+        for _ in range(rng.randint(1, 3))
+    ]
+    return ' '.join(words).title()
+
+
+class FuzzyMatchIndexTestCase(TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(0)
+        self.choices = list(dict.fromkeys(_random_name(rng) for _ in range(200)))
+        self.choices.extend(['', '!!', 'Posto de Saude', 'UBS Posto de Saude Central'])
+        self.queries = [_random_name(rng) for _ in range(20)]
+        self.queries.extend(['Posto', 'posto de saude', 'ubs', self.choices[0]])
+        self.index = FuzzyMatchIndex(self.choices)
+
+    def test_extract_matches_process_extract(self):
+        for query in self.queries:
+            self.assertEqual(
+                process.extract(query, self.choices, limit=5),
+                self.index.extract(query, limit=5),
+            )
+
+    def test_empty_query(self):
+        self.assertEqual(
+            process.extract('...', self.choices, limit=3),
+            self.index.extract('...', limit=3),
+        )
+
+    def test_no_choices(self):
+        self.assertEqual([], FuzzyMatchIndex([]).extract('test'))
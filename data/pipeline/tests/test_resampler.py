@@ -0,0 +1,72 @@
+import json
+
+from unittest import TestCase
+
+from data.pipeline.resampler import Resampler, StreamingResampler
+
+DIMENSIONS = ['StateName', 'MunicipalityName']
+
+
+def _build_lines():
+    lines = []
+    for idx in range(60):
+        row = {
+            'StateName': 'State %s' % (idx % 3),
+            'MunicipalityName': 'City %s' % (idx % 7),
+            'Real_Date': '2020-01-%02d' % (idx % 28 + 1),
+            'source': 'test',
+        }
+        if idx % 4:
+            lines.append(json.dumps({**row, 'field': 'cases', 'val': idx}))
+        else:
+            lines.append(json.dumps({**row, 'data': {'cases': 1, 'other': 2.5}}))
+    lines.append(
+        json.dumps({**row, 'Real_Date': '2020-02-05', 'field': ['cases'], 'val': 0})
+    )
+    return lines
+
+
+class StreamingResamplerTest(TestCase):
+    def _resample(self, resampler):
+        resampler.read_lines(_build_lines())
+        return list(resampler.build_output_rows())
+
+    def test_output_matches_resampler(self):
+        expected = self._resample(
+            Resampler(['cases'], 'Real_Date', '%Y-%m-%d', DIMENSIONS, '2020-02-01')
+        )
+        for max_rows in (1, 7, 1000):
+            resampler = StreamingResampler(
+                ['cases'],
+                'Real_Date',
+                '%Y-%m-%d',
+                DIMENSIONS,
+                '2020-02-01',
+                max_rows_in_memory=max_rows,
+            )
+            output = self._resample(resampler)
+            self.assertCountEqual(expected, output)
+            self.assertIsNone(resampler._work_dir)
+
+    def test_series_are_filled_in_date_order(self):
+        resampler = StreamingResampler(
+            ['cases'], 'Real_Date', '%Y-%m-%d', DIMENSIONS, '2020-01-05', 2
+        )
+        resampler.read_lines(
+            [
+                json.dumps({'Real_Date': '2020-01-03', 'field': 'cases', 'val': 3}),
+                json.dumps({'Real_Date': '2020-01-01', 'field': 'cases', 'val': 1}),
+                json.dumps({'Real_Date': '2020-01-01', 'field': 'cases', 'val': 1}),
+            ]
+        )
+        output = [json.loads(row) for row in resampler.build_output_rows()]
+        self.assertListEqual(
+            [
+                ('2020-01-01', 2),
+                ('2020-01-02', 2),
+                ('2020-01-03', 3),
+                ('2020-01-04', 3),
+                ('2020-01-05', 3),
+            ],
+            [(row['Real_Date'], row['val']) for row in output],
+        )
@@ -0,0 +1,88 @@
+import random
+
+from unittest import TestCase
+
+from data.pipeline.datatypes.base_row import BaseRow
+from data.pipeline.source_merger import SortedSource, SourceMerger, Strategy
+
+
+class _Row(BaseRow):
+    MAPPING_KEYS = ['RegionName', 'DistrictName']
+
+
+def _build_source(rng, source, fields, dates, mapping):
+    rows = []
+    for date in dates:
+        for _ in range(rng.randint(1, 6)):
+            (region, district) = rng.choice(list(mapping))
+            rows.append(
+                _Row(
+                    {'RegionName': region, 'DistrictName': district},
+                    {field: rng.randint(0, 5) for field in rng.sample(fields, 2)},
+                    date,
+                    source,
+                ).to_dict()
+            )
+    # Rows without a canonical mapping are skipped.
+    rows.append(
+        _Row({'RegionName': 'unknown'}, {fields[0]: 1}, dates[-1], source).to_dict()
+    )
+    mapping_rows = [
+        {
+            'RegionName': raw_location[0],
+            'DistrictName': raw_location[1],
+            'CanonicalRegionName': canonical_location[0],
+            'CanonicalDistrictName': canonical_location[1],
+        }
+        for raw_location, canonical_location in mapping.items()
+    ]
+    return SortedSource(source, rows, set(fields), mapping_rows)
+
+
+class SourceMergerTestCase(TestCase):
+    def _build_sources(self):
+        rng = random.Random(1)
+        # Multiple raw locations map to the same canonical location.
+        mapping = {
+            ('north', 'hill'): ('North', 'Hill'),
+            ('North', 'Hill'): ('North', 'Hill'),
+            ('north', 'valley'): ('North', 'Valley'),
+            ('south', ''): ('South', ''),
+        }
+        dates = ['2020-01-%02d' % day for day in range(1, 10)]
+        sources = [
+            _build_source(rng, 'a', ['a1', 'a2', 'shared'], dates, mapping),
+            _build_source(rng, 'b', ['b1', 'b2', 'shared'], dates[2:7], mapping),
+            _build_source(rng, 'c', ['c1', 'c2'], dates[:1], mapping)._replace(
+                merge_strategy=Strategy.MAPPING_ID
+            ),
+            _build_source(rng, 'd', ['d1', 'shared'], dates[5:], mapping),
+        ]
+        return sources
+
+    def test_merge_sorted_sources(self):
+        merger = SourceMerger(_Row)
+        merger.allow_overlapping_fields()
+        for sorted_source in self._build_sources():
+            merger.process_source(*sorted_source)
+        expected_rows = sorted(
+            [row.get_merged_row().to_dict() for row in merger.rows()],
+            key=lambda row: row[_Row.DATE_FIELD],
+        )
+
+        streaming_merger = SourceMerger(_Row)
+        streaming_merger.allow_overlapping_fields()
+        rows = [
+            row.to_dict()
+            for row in streaming_merger.merge_sorted_sources(self._build_sources())
+        ]
+        self.assertEqual(rows, expected_rows)
+        self.assertEqual(streaming_merger.get_data_fields(), merger.get_data_fields())
+
+    def test_unsorted_source(self):
+        (sorted_source, *_) = self._build_sources()
+        unsorted_source = sorted_source._replace(
+            source_rows=sorted_source.source_rows[::-1]
+        )
+        with self.assertRaises(ValueError):
+            list(SourceMerger(_Row).merge_sorted_sources([unsorted_source]))
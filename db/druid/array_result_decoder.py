@@ -0,0 +1,301 @@
+'''Decode array based druid groupBy responses directly into columnar buffers.
+
+The groupBy queries we issue request the array based result format, where each
+row is a list of values in a fixed column order. Parsing the full response with
+`json.loads` and converting each row into a dict (like `GroupByQueryBuilder.parse`
+does) creates several Python objects per value, which is slow and uses a lot of
+memory for large queries.
+
+The decoder instead reads the response incrementally and appends the values of
+each block of rows to a growable numpy buffer per column. Quirks of the druid
+response (quoted NaN/Infinity values, strict null fields and subtotal rows) are
+handled as the rows are decoded, and the final buffers are handed to pandas as a
+DataFrame matching the one built from the parsed result.
+'''
+import codecs
+import json
+import re
+
+import numpy as np
+
+from db.druid.errors import DruidQueryError
+from log import LOG
+
+NAN = float('NaN')
+POS_INFINITY = float('Infinity')
+NEG_INFINITY = -POS_INFINITY
+
+# Druid wraps Infinity, -Infinity, and NaN in quotes which makes it difficult for
+# the JSON parser to properly expand them into their correct type.
+_NUMERIC_STRINGS = {'NaN': NAN, 'Infinity': POS_INFINITY, '-Infinity': NEG_INFINITY}
+
+# Whitespace and commas between the rows of the result array.
+_ROW_SEPARATOR = re.compile(r'[\s,]*')
+
+DEFAULT_BUFFER_CAPACITY = 1024
+
+
+def iter_array_rows(chunks):
+    '''Decode a JSON array of arrays that is received in chunks of bytes. Yield
+    the list of complete rows decoded after each chunk is received.
+    '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    started = False
+    finished = False
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        rows = []
+        idx = 0
+        while not finished:
+            idx = _ROW_SEPARATOR.match(buffer, idx).end()
+            if idx == len(buffer):
+                break
+
+            if not started:
+                if buffer[idx] != '[':
+                    raise DruidQueryError('Druid response is not an array')
+                started = True
+                idx += 1
+                continue
+
+            if buffer[idx] == ']':
+                finished = True
+                break
+
+            # NOTE(stephen): Each row is an array, so a row can only be decoded once
+            # its closing bracket has been received. If decoding fails, the rest of
+            # the row is still in transit.
+            try:
+                (row, idx) = decoder.raw_decode(buffer, idx)
+            except json.JSONDecodeError:
+                break
+            rows.append(row)
+
+        buffer = buffer[idx:]
+        if rows:
+            yield rows
+
+    buffer += text_decoder.decode(b'', final=True)
+    if not finished or buffer.strip(' \t\r\n]'):
+        raise DruidQueryError('Druid response ended unexpectedly')
+
+
+def _parse_numeric_string(value):
+    if value in _NUMERIC_STRINGS:
+        return _NUMERIC_STRINGS[value]
+    LOG.error('Illegal value for a metric: %s', value)
+    return None
+
+
+def _to_numeric_array(values):
+    '''Convert the values of a numeric column into a numpy array. Integer columns
+    are kept as integers so that the resulting dtype matches what pandas would
+    infer from the values.
+    '''
+    value_types = set(map(type, values))
+    if value_types == {int}:
+        return np.array(values, dtype=np.int64)
+
+    if str in value_types:
+        values = [
+            _parse_numeric_string(value) if isinstance(value, str) else value
+            for value in values
+        ]
+    return np.array(values, dtype=np.float64)
+
+
+class ColumnBuffer:
+    '''Growable numpy array that values are appended to in blocks.'''
+
+    def __init__(self, dtype, capacity=DEFAULT_BUFFER_CAPACITY):
+        self._values = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+        # Positions of the values that were null in the response.
+        self.null_rows = []
+
+    @property
+    def dtype(self):
+        return self._values.dtype
+
+    @property
+    def values(self):
+        return self._values[: self.size]
+
+    def astype(self, dtype):
+        self._values = self._values.astype(dtype)
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self._values):
+            capacity = len(self._values)
+            while capacity < end:
+                capacity *= 2
+            new_values = np.empty(capacity, dtype=self._values.dtype)
+            new_values[: self.size] = self.values
+            self._values = new_values
+        self._values[self.size : end] = values
+        self.size = end
+
+
+class ArrayResultDecoder:
+    '''Decode the rows of an array based groupBy response into columns.
+
+    The rows contain the timestamp (unless the granularity is `all`), then the
+    dimensions, then the numeric fields in the order they were queried.
+    '''
+
+    def __init__(
+        self,
+        dimensions,
+        numeric_fields,
+        strict_field_map,
+        has_timestamp,
+        default_timestamp_ms,
+        timestamp_to_str,
+        subtotals=None,
+    ):
+        self.dimensions = dimensions
+        self.numeric_fields = numeric_fields
+        self.strict_field_map = strict_field_map
+        self.has_timestamp = has_timestamp
+        self.default_timestamp_ms = default_timestamp_ms
+        self.timestamp_to_str = timestamp_to_str
+        self.subtotals = subtotals
+        self.row_width = len(dimensions) + len(numeric_fields) + int(has_timestamp)
+
+        self.timestamps = ColumnBuffer(np.int64)
+        self.dimension_buffers = [ColumnBuffer(object) for _ in dimensions]
+        self.numeric_buffers = [ColumnBuffer(np.int64) for _ in numeric_fields]
+        self.row_count = 0
+        self._prev_subtotal_row = None
+
+    def _mark_subtotal_rows(self, timestamps, dimension_columns):
+        '''Replace the value of the subtotal dimension of each subtotal row with
+        the subtotal label. The dimension columns are modified in place.
+        '''
+        label = self.subtotals.subtotal_result_label
+        for idx, timestamp_ms in enumerate(timestamps):
+            event = {
+                dimension: column[idx]
+                for (dimension, column) in zip(self.dimensions, dimension_columns)
+            }
+            row = {'event': event, 'timestamp': self.timestamp_to_str(timestamp_ms)}
+            subtotal_dimension = self.subtotals.get_subtotal_dimension(
+                row, self._prev_subtotal_row
+            )
+            if subtotal_dimension:
+                event[subtotal_dimension] = label
+                dimension_columns[self.dimensions.index(subtotal_dimension)][
+                    idx
+                ] = label
+            self._prev_subtotal_row = row
+
+    def add_rows(self, rows):
+        if not rows:
+            return
+
+        columns = list(zip(*rows))
+        if len(rows[0]) != self.row_width or len(columns) != self.row_width:
+            raise DruidQueryError(
+                'Expected %s values per row but received %s'
+                % (self.row_width, len(rows[0]))
+            )
+
+        if self.has_timestamp:
+            timestamps = columns.pop(0)
+        else:
+            timestamps = [self.default_timestamp_ms] * len(rows)
+        dimension_count = len(self.dimensions)
+        dimension_columns = [list(column) for column in columns[:dimension_count]]
+        if self.subtotals:
+            self._mark_subtotal_rows(timestamps, dimension_columns)
+
+        self.timestamps.extend(timestamps)
+        for (buffer, column) in zip(self.dimension_buffers, dimension_columns):
+            buffer.extend(column)
+        for (buffer, column) in zip(self.numeric_buffers, columns[dimension_count:]):
+            values = _to_numeric_array(column)
+            if values.dtype != buffer.dtype:
+                buffer.astype(np.float64)
+            if None in column:
+                buffer.null_rows.extend(
+                    self.row_count + idx
+                    for (idx, value) in enumerate(column)
+                    if value is None
+                )
+            buffer.extend(values)
+        self.row_count += len(rows)
+
+    def _build_numeric_columns(self):
+        columns = {
+            field: buffer.values
+            for (field, buffer) in zip(self.numeric_fields, self.numeric_buffers)
+        }
+
+        # Since we use filtered aggregations on Druid, we lose the ability to
+        # differentiate null from 0. To overcome this, we track a count variable
+        # alongside each calculated field that we care about null values for. If a
+        # field has a zero count value, change the result value to null.
+        null_masks = {
+            field: columns[count_field] == 0
+            for (field, count_field) in self.strict_field_map.items()
+            if field in columns and count_field in columns
+        }
+
+        output = {}
+        for (field, buffer) in zip(self.numeric_fields, self.numeric_buffers):
+            values = columns[field]
+            null_mask = null_masks.get(field)
+            if null_mask is not None and null_mask.any():
+                values = values.astype(np.float64)
+                values[null_mask] = NAN
+                null_mask[buffer.null_rows] = True
+            else:
+                null_mask = None
+
+            # Match the behavior of pandas when a column only contains nulls. The
+            # values can be null in the response or be nulled by the strict null
+            # field, in any combination.
+            if len(buffer.null_rows) == self.row_count or (
+                null_mask is not None and null_mask.all()
+            ):
+                values = np.full(self.row_count, None, dtype=object)
+            output[field] = values
+        return output
+
+    def _build_timestamp_column(self):
+        # The range of possible timestamps is small, so only format each unique
+        # timestamp once.
+        (unique_timestamps, codes) = np.unique(
+            self.timestamps.values, return_inverse=True
+        )
+        date_strs = np.array(
+            [self.timestamp_to_str(int(t)) for t in unique_timestamps], dtype=object
+        )
+        return date_strs[codes]
+
+    def consume(self, chunks):
+        '''Decode the full response that is received in chunks of bytes.'''
+        for rows in iter_array_rows(chunks):
+            self.add_rows(rows)
+        return self
+
+    def to_dataframe(self):
+        # NOTE(stephen): Deferring pandas import since this is library code that might
+        # not get called by all users.
+        # pylint: disable=import-outside-toplevel
+        import pandas as pd
+
+        if not self.row_count:
+            return pd.DataFrame()
+
+        data = {
+            dimension: buffer.values
+            for (dimension, buffer) in zip(self.dimensions, self.dimension_buffers)
+        }
+        data.update(self._build_numeric_columns())
+        data['timestamp'] = self._build_timestamp_column()
+        return pd.DataFrame(data)
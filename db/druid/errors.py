@@ -14,3 +14,8 @@ class BadIndexingPathException(BaseDruidException):
 
 class DruidQueryError(BaseDruidException):
     pass
+
+
+# Exception to raise when a batch of queries does not finish before its deadline
+class DruidQueryTimeoutError(DruidQueryError):
+    pass
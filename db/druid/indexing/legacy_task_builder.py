@@ -8,7 +8,7 @@ from pylib.file.file_utils import FileUtils
 
 from db.druid.errors import BadIndexingPathException
 from db.druid.util import DRUID_DATE_FORMAT
-from util.file.directory_util import compute_file_hash
+from util.file.directory_util import compute_file_hashes
 from util.aws.status import RUNNING_IN_EC2
 
 # Default files for indexing, relative to the zenysis src root
@@ -149,7 +149,7 @@ class DruidIndexingTaskBuilder:
 
     # Create a list of file hashes for the set of files to be indexed
     def get_file_hashes(self):
-        return [compute_file_hash(p) for p in self._paths]
+        return compute_file_hashes(self._paths)
 
     # Print a human readable overview of what this indexing task will do
     def print_overview(self):
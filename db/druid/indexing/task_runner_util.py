@@ -14,7 +14,7 @@ from db.druid.datasource import SiteDruidDatasource
 from db.druid.errors import BadIndexingPathException, MissingDatasourceException
 from db.druid.metadata import DruidMetadata
 from log import LOG
-from util.file.directory_util import compute_file_hash
+from util.file.directory_util import compute_file_hashes
 
 
 def build_dimension_spec_dimensions(
@@ -97,7 +97,7 @@ def task_contains_new_data(
     # NOTE(stephen): Intentionally not using a set here since it's possible
     # for an indexing job to index the same file twice on purpose.
     cur_file_hash = sorted(FileUtils.FileContents(cur_hash_file).split('\n'))
-    new_file_hash = sorted(compute_file_hash(f) for f in files)
+    new_file_hash = sorted(compute_file_hashes(files))
     return cur_file_hash != new_file_hash
 
 
@@ -113,7 +113,7 @@ def store_task_hash(
     )
     pathlib.Path(os.path.dirname(hash_filename)).mkdir(parents=True, exist_ok=True)
     with open(hash_filename, 'w') as hash_file:
-        hash_file.write('\n'.join(sorted(compute_file_hash(f) for f in files)))
+        hash_file.write('\n'.join(sorted(compute_file_hashes(files))))
 
 
 def run_task(
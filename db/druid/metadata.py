@@ -20,6 +20,11 @@ ISO_8601_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 DEFAULT_DATASOURCE_LIST_PATH = 'druid/coordinator/v1/metadata/datasources'
 DEFAULT_DATASOURCE_LOAD_STATUS_PATH = 'druid/coordinator/v1/loadstatus'
 
+# Number of seconds to wait for the coordinator when retrieving the version of a
+# datasource. The version is checked while serving user queries, so a slow
+# coordinator should not hold up the request.
+DATASOURCE_VERSION_TIMEOUT = 5
+
 
 class AbstractDruidMetadata(ABC):
     @abstractmethod
@@ -129,7 +134,7 @@ class DruidMetadata_(AbstractDruidMetadata):
             self.datasource_list_path,
             datasource_name,
         )
-        r = requests.get(url)
+        r = requests.get(url, timeout=DATASOURCE_VERSION_TIMEOUT)
         if not r.ok:
             raise MissingDatasourceException(
                 'Cannot retrieve version for datasource. Datasource does not '
@@ -265,7 +270,7 @@ class DruidMetadata(AbstractDruidMetadata):
             cls.DATASOURCE_LIST_PATH,
             datasource_name,
         )
-        r = requests.get(url)
+        r = requests.get(url, timeout=DATASOURCE_VERSION_TIMEOUT)
         if not r.ok:
             raise MissingDatasourceException(
                 'Cannot retrieve version for datasource. Datasource does not '
@@ -1,3 +1,5 @@
+import re
+
 from datetime import datetime, timezone
 from typing import Dict
 
@@ -6,6 +8,7 @@ from pydruid.utils.dimensions import DimensionSpec
 from pydruid.utils.filters import Dimension, Filter
 
 from db.druid.aggregations.query_dependent_aggregation import QueryDependentAggregation
+from db.druid.array_result_decoder import ArrayResultDecoder
 from db.druid.aggregations.query_modifying_aggregation import QueryModifyingAggregation
 from db.druid.calculations.base_calculation import BaseCalculation
 from db.druid.query_builder_util.optimization import apply_optimizations
@@ -21,6 +24,44 @@ POS_INFINITY = float('Infinity')
 NEG_INFINITY = -POS_INFINITY
 
 
+# ISO 8601 period matching each simple druid granularity that can be filled when
+# exporting a result to pandas.
+# NOTE(stephen): Week starts on Monday for druid, and the first timestamp of the
+# result is used as the start of the range, so weeks line up.
+GRANULARITY_PERIODS = {
+    'day': 'P1D',
+    'week': 'P1W',
+    'month': 'P1M',
+    'quarter': 'P3M',
+    'year': 'P1Y',
+}
+
+# Date based ISO 8601 periods, like P1D or P2W. Periods with a time component are
+# not supported since result timestamps do not include the time.
+_PERIOD_PATTERN = re.compile(r'^P(\d+)([DWMY])$')
+_PERIOD_UNITS = {'D': 'days', 'W': 'weeks', 'M': 'months', 'Y': 'years'}
+
+
+def _period_to_date_offset(period):
+    '''Convert an ISO 8601 period into a pandas DateOffset. Return None if the
+    period is not supported.
+    '''
+    # NOTE(stephen): Deferring pandas import since this is library code that might
+    # not get called by all users.
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+
+    match = _PERIOD_PATTERN.match(period or '')
+    if not match:
+        return None
+
+    # NOTE(stephen): Fixed length periods are much faster to generate ranges for.
+    unit = _PERIOD_UNITS[match.group(2)]
+    if unit in ('days', 'weeks'):
+        return pd.Timedelta(**{unit: int(match.group(1))})
+    return pd.DateOffset(**{unit: int(match.group(1))})
+
+
 # NOTE(stephen): Parsing and formatting dates is a very slow operation in python. We
 # want to cache any date values seen so we can quickly return the date string. The
 # range of possible timestamps we will see is low, so this cache should not grow too
@@ -135,6 +176,12 @@ class GroupByQueryBuilder(BaseDruidQuery):
             else None
         )
 
+        # Keep the grouping options the query was built with so that equivalent
+        # queries can be detected and merged (see `db.druid.query_merger`).
+        self.subtotal_dimensions = subtotal_dimensions or []
+        self.subtotal_result_label = subtotal_result_label
+        self.filter_non_aggregated_rows = filter_non_aggregated_rows
+
         # Build a copy of the input calculation with the fully built
         # aggregations and post aggregations.
         self.calculation = BaseCalculation()
@@ -311,18 +358,70 @@ class GroupByQueryBuilder(BaseDruidQuery):
         query.query_dict['subtotalsSpec'] = self.subtotals.subtotal_spec
         return query
 
+    def _build_strict_field_map(self):
+        '''Build a mapping from field name to the count field that should be used to
+        detect if the field value should be null.
+        '''
+        return {
+            field: self.calculation.count_field_name(field)
+            for field in self.calculation.strict_null_fields
+        }
+
+    def _build_array_result_header(self):
+        '''Build the list of column names for each row of an array based result.'''
+        header = []
+        if self.granularity != 'all':
+            header.append('timestamp')
+
+        for dimension in self.dimensions:
+            if isinstance(dimension, DimensionSpec):
+                header.append(dimension._output_name)
+            else:
+                header.append(dimension)
+
+        header.extend(list(self.aggregations.keys()))
+        header.extend(list(self.post_aggregations.keys()))
+        return header
+
+    def _get_first_timestamp_ms(self):
+        # When the granularity is "all", there will be no timestamp returned in the
+        # Druid rows. For backwards compatibility reasons, we need to still populate
+        # a timestamp. Use the first date of the query intervals as the
+        # representative timestamp.
+        first_date = unpack_time_interval(self.intervals[0])[0]
+        return (
+            datetime(
+                first_date.year, first_date.month, first_date.day, tzinfo=timezone.utc
+            ).timestamp()
+            * 1000
+        )
+
+    # Decode an array based druid response, received in chunks of bytes, directly
+    # into a dataframe.
+    def decode_array_result(self, chunks):
+        header = self._build_array_result_header()
+        has_timestamp = self.granularity != 'all'
+        dimension_count = len(self.dimensions)
+        dimensions = header[int(has_timestamp) :][:dimension_count]
+        numeric_fields = header[int(has_timestamp) + dimension_count :]
+        decoder = ArrayResultDecoder(
+            dimensions,
+            numeric_fields,
+            self._build_strict_field_map(),
+            has_timestamp,
+            self._get_first_timestamp_ms(),
+            _timestamp_to_date_str,
+            self.subtotals,
+        )
+        return decoder.consume(chunks).to_dataframe()
+
     # Parse the raw druid response. Convert fields that should be null to None,
     # and handle quirks in the druid JSON encoding.
     def parse(self, result):
         if not result:
             return result
 
-        # Mapping from field name to the count field that should be used to
-        # detect if the field value should be null.
-        strict_field_map = {
-            field: self.calculation.count_field_name(field)
-            for field in self.calculation.strict_null_fields
-        }
+        strict_field_map = self._build_strict_field_map()
 
         numeric_fields = set(self.aggregations.keys())
         numeric_fields.update(iter(self.post_aggregations.keys()))
@@ -338,39 +437,15 @@ class GroupByQueryBuilder(BaseDruidQuery):
         # To work around this and provide a consistent interface, we have switched the
         # response format to array based rows. These rows will receive the full list
         # of values and nothing will be omitted.
-        # TODO(stephen): Eventually use this array result to improve performance of
-        # exporting to pandas.
+        # NOTE(stephen): Large results can be decoded directly into a dataframe
+        # with `decode_array_result` instead.
         array_based_result = isinstance(result[0], list)
         header = []
         first_timestamp_ms = None
         if array_based_result:
             key = 'event'
-
-            # When the granularity is "all", there will be no timestamp returned in the
-            # Druid rows. For backwards compatibility reasons, we need to still populate
-            # a timestamp. Use the first date of the query intervals as the
-            # representative timestamp.
-            first_date = unpack_time_interval(self.intervals[0])[0]
-            first_timestamp_ms = (
-                datetime(
-                    first_date.year,
-                    first_date.month,
-                    first_date.day,
-                    tzinfo=timezone.utc,
-                ).timestamp()
-                * 1000
-            )
-            if self.granularity != 'all':
-                header.append('timestamp')
-
-            for dimension in self.dimensions:
-                if isinstance(dimension, DimensionSpec):
-                    header.append(dimension._output_name)
-                else:
-                    header.append(dimension)
-
-            header.extend(list(self.aggregations.keys()))
-            header.extend(list(self.post_aggregations.keys()))
+            first_timestamp_ms = self._get_first_timestamp_ms()
+            header = self._build_array_result_header()
 
         # Create a copy of the result data with our modifications applied.
         output = []
@@ -636,6 +711,10 @@ class PydruidQueryWrapper(PydruidQuery):
     def __init__(self, pydruid_query):
         super().__init__(pydruid_query.query_dict, pydruid_query.query_type)
 
+        # Dataframe decoded directly from the druid response. When set, it is used
+        # instead of the parsed `result` when exporting to pandas.
+        self.result_df = None
+
     # pylint: disable=arguments-differ
     def export_pandas(self, fill_intermediate_dates=False):
         '''Export the query result as pandas. Optionally, add empty rows for the unique
@@ -655,12 +734,29 @@ class PydruidQueryWrapper(PydruidQuery):
         # NOTE(stephen): The event format is slightly tweaked from Druid's normal format
         # since the timestamp is stored directly on the event (during the `parse` method
         # of GroupByQueryBuilder).
-        df = pd.DataFrame(row['event'] for row in self.result)
-        granularity = self.query_dict.get('granularity')
+        df = (
+            self.result_df
+            if self.result_df is not None
+            else pd.DataFrame(row['event'] for row in self.result)
+        )
+        if not fill_intermediate_dates:
+            return df
+        return self.fill_intermediate_dates(df)
+
+    def fill_intermediate_dates(self, df):
+        '''Add empty rows to the exported dataframe so that each unique dimension
+        grouping has a row for every timestamp between the first and last timestamp
+        in the result.
+        '''
+        # NOTE(stephen): Deferring pandas import since this is library code that might
+        # not get called by all users.
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+        import pandas as pd
 
         # Don't try to fill in missing dates if we don't need to. Grouping by the
         # `all` granularity means there are no intermediary timestamps to fill.
-        if df.empty or not fill_intermediate_dates or granularity == 'all':
+        if df.empty or self.query_dict.get('granularity') == 'all':
             return df
 
         # Build a list of dates between the first reported value and the last reported
@@ -681,101 +777,92 @@ class PydruidQueryWrapper(PydruidQuery):
             d if isinstance(d, str) else d['outputName'] for d in dimensions
         ]
 
-        # Extract the unique combination of dimension values returned.
+        # Assign an ID to each unique combination of dimension values returned.
         if dimension_names:
-            unique_dimension_values = df[dimension_names].drop_duplicates()
-            unique_dimension_values['merge_key'] = 1
+            series_ids = (
+                df.groupby(dimension_names, sort=False, dropna=False)
+                .ngroup()
+                .to_numpy()
+            )
         else:
-            # If there are no dimensions being grouped on, we should only have a single
-            # length dataframe to merge on.
-            # NOTE(stephen): This dataframe must be constructed differently because
-            # slicing a df on an empty list causes issues.
-            unique_dimension_values = pd.DataFrame([1], columns=['merge_key'])
+            # If there are no dimensions being grouped on, there is a single series
+            # of timestamps to fill.
+            series_ids = np.zeros(len(df), dtype=np.int64)
+        series_count = series_ids.max() + 1
+        date_count = len(required_dates)
 
         # Quick check to see if the dataframe already has all possible timestamps for
         # all possible unique dimension values.
-        if len(df) == (len(unique_dimension_values) * len(required_dates)):
+        if len(df) == series_count * date_count:
             return df
 
-        # Build a dataframe containing the required dates that each unique dimension
-        # value should have a row for.
-        required_dates_df = pd.DataFrame(required_dates, columns=['timestamp'])
-        required_dates_df['merge_key'] = 1
-
-        # Perform a cross product (outer join) between these two dataframes to produce
-        # a dataframe containing a row for each unique dimension value combination and
-        # each required timestamp.
-        dimensions_by_timestamp_df = unique_dimension_values.merge(
-            required_dates_df, how='outer', copy=False
-        ).drop(columns=['merge_key'])
+        # Treat the required rows as a (series, date) index with a position for each
+        # unique dimension value combination and each required timestamp, and find
+        # the positions that the result does not have a row for.
+        required_dates = np.asarray(required_dates, dtype=object)
+        date_ids = pd.Index(required_dates).get_indexer(df['timestamp'])
+        in_range = date_ids >= 0
+        has_row = np.zeros(series_count * date_count, dtype=bool)
+        has_row[series_ids[in_range] * date_count + date_ids[in_range]] = True
+        missing_positions = np.flatnonzero(~has_row)
+        if not len(missing_positions):
+            return df
 
-        # Join the two dataframes together so that every possible unique dimension value
-        # set has every required timestamp.
-        return df.merge(dimensions_by_timestamp_df, how='outer', sort=False, copy=False)
+        # Append an empty row for each missing position. The rows already in the
+        # result are left untouched and in their original order.
+        (_, first_rows) = np.unique(series_ids, return_index=True)
+        missing_df = (
+            df[dimension_names]
+            .iloc[first_rows[missing_positions // date_count]]
+            .reset_index(drop=True)
+        )
+        missing_df['timestamp'] = required_dates[missing_positions % date_count]
+        return pd.concat([df, missing_df], ignore_index=True, sort=False)
 
     def _build_result_dates(self, df):
         '''Build a list of dates this dataset covers. This can be different than the
         *queried* date range because the query filter might have excluded certain dates
         from being returned.'''
+        # NOTE(stephen): Deferring pandas import since this is library code that might
+        # not get called by all users.
+        # pylint: disable=import-outside-toplevel
+        import pandas as pd
 
         # NOTE(stephen): Using the full timestamp format for date strings because that's
         # what Druid returns. We want to keep the final query result consistent.
-        first_timestamp = df.timestamp.min()
-        last_timestamp = df.timestamp.max()
+        # NOTE(stephen): There are far fewer unique timestamps than rows.
+        timestamps = df.timestamp.unique()
+        first_timestamp = min(timestamps)
+        last_timestamp = max(timestamps)
         granularity = self.query_dict['granularity']
         if isinstance(granularity, dict):
-            # NOTE(stephen): We can handle a limited set of period granularities right
-            # now. Currently week is the only one supported.
-            # TODO(stephen): It would be cool to have a generalized version of this one
-            # day. Right now it is not needed.
-            if granularity['type'] == 'period':
-                if granularity['period'] != 'P1W':
-                    return []
-
-                # Determine which day of the week the week starts on.
-                # HACK(stephen): Defining the lookup inline here as a tuple. This should
-                # ideally be defined as a constant somewhere else, however this file is
-                # growing way too large. It needs to be refactored!
-                # NOTE(stephen): These are the *anchored offsets* defined by Pandas for
-                # the week granularity. They represent the day that the week *ends*, not
-                # the day that the week *starts*. It's less intuitive.
-                # NOTE(stephen): Introspecting the dataframe first timestamp instead of
-                # parsing the granularity period's origin since it might not exist.
-                # https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#anchored-offsets
-                first_date = datetime.strptime(first_timestamp[:10], '%Y-%m-%d')
-                freq = ('W-SUN', 'W-MON', 'W-TUE', 'W-WED', 'W-THU', 'W-FRI', 'W-SAT')[
-                    first_date.weekday()
+            # Arbitrary granularities (like the Ethiopian calendar months) list each
+            # time bucket explicitly.
+            if granularity['type'] == 'arbitrary':
+                dates = [
+                    '%sT00:00:00.000Z' % i.split('/')[0][:10]
+                    for i in granularity['intervals']
                 ]
-                return self._build_date_range(first_timestamp, last_timestamp, freq)
+                if first_timestamp not in dates or last_timestamp not in dates:
+                    return []
+                start_idx = dates.index(first_timestamp)
+                last_idx = dates.index(last_timestamp)
+                return dates[start_idx : last_idx + 1]
 
-            # Can only handle `arbitrary` complex granularity type.
-            if granularity['type'] != 'arbitrary':
+            if granularity['type'] != 'period':
                 return []
+            period = granularity['period']
+        else:
+            period = GRANULARITY_PERIODS.get(granularity)
 
-            dates = [
-                '%sT00:00:00.000Z' % i.split('/')[0] for i in granularity['intervals']
-            ]
-            start_idx = dates.index(first_timestamp)
-            last_idx = dates.index(last_timestamp)
-            return dates[start_idx : last_idx + 1]
-
-        # We can only build date ranges for certain granularities with pandas.
-        if granularity not in ('day', 'week', 'month', 'quarter'):
+        # NOTE(stephen): Stepping from the first timestamp in the result instead of
+        # parsing the granularity period's origin since it might not exist. The first
+        # timestamp is always the start of a time bucket, so every step will be too.
+        offset = _period_to_date_offset(period)
+        if not offset:
             return []
-
-        # Convenience mapping to pandas frequency string.
-        # day -> d, week -> w, month -> m, quarter -> q
-        # NOTE(stephen): Week starts on Monday for both pandas and druid, so we are safe
-        # here.
-        return self._build_date_range(first_timestamp, last_timestamp, granularity[0])
-
-    def _build_date_range(self, first_timestamp, last_timestamp, freq):
-        # NOTE(stephen): Deferring pandas import since this is library code that might
-        # not get called by all users.
-        # pylint: disable=import-outside-toplevel
-        import pandas as pd
-
-        return [
-            d.start_time.strftime('%Y-%m-%dT00:00:00.000Z')
-            for d in pd.period_range(first_timestamp, last_timestamp, freq=freq)
-        ]
+        return (
+            pd.date_range(first_timestamp[:10], last_timestamp[:10], freq=offset)
+            .strftime('%Y-%m-%dT00:00:00.000Z')
+            .tolist()
+        )
@@ -0,0 +1,320 @@
+'''Cache for the results of druid queries.
+
+Queries are keyed by their canonical JSON representation (keys sorted, no
+insignificant whitespace) combined with the version of every datasource the
+query reads from. When a new version of a datasource is loaded into druid, the
+key of every query against that datasource changes, so stale results are never
+returned. Results for the old version are dropped from the local tier as soon as
+the new version is detected, and expire from the shared tier on their own.
+
+The cache has two tiers:
+    local: an in-process LRU cache holding the most recently used results, up
+        to a total size in bytes. Each web worker has its own local tier.
+    shared: an optional cache shared between processes (like Redis). Any client
+        providing `get(key)` and `set(key, value, ex=seconds)` can be used.
+
+Example usage:
+
+result_cache = QueryResultCache(druid_metadata, shared_cache=RedisClient.instance())
+query_client = CachingDruidQueryClient(druid_configuration, result_cache)
+'''
+import hashlib
+import json
+import threading
+import time
+
+from collections import OrderedDict
+
+import requests
+
+from db.druid.errors import MissingDatasourceException
+from db.druid.query_client import DEFAULT_RESPONSE_CHUNK_SIZE, DruidQueryClient_
+from log import LOG
+
+# Default total size in bytes of the serialized results kept in the local tier.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Default size in bytes of the largest serialized result that will be cached.
+# Larger results are not stored in either tier.
+DEFAULT_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+# Default number of seconds results are stored in the shared tier.
+DEFAULT_SHARED_CACHE_TTL = 24 * 60 * 60
+
+# Default number of seconds to wait before checking if a new version of a
+# datasource has been loaded.
+DEFAULT_VERSION_CHECK_INTERVAL = 60
+
+SHARED_CACHE_KEY_PREFIX = 'druid_query_result'
+
+
+def canonicalize_query(query_dict):
+    '''Serialize the query so that equivalent queries produce the same string
+    no matter the order their keys were added in.
+    '''
+    return json.dumps(query_dict, sort_keys=True, separators=(',', ':'))
+
+
+def get_query_datasources(datasource):
+    '''Return the names of all datasources referenced by the `dataSource`
+    property of a druid query.
+    '''
+    if isinstance(datasource, str):
+        return [datasource]
+
+    datasource_type = datasource.get('type')
+    if datasource_type == 'table':
+        return [datasource['name']]
+    if datasource_type == 'union':
+        return list(datasource['dataSources'])
+    if datasource_type == 'query':
+        return get_query_datasources(datasource['query']['dataSource'])
+    raise ValueError('Unsupported datasource type: %s' % datasource_type)
+
+
+class QueryResultCache:
+    '''Two tier cache of raw druid query results that is invalidated when a new
+    version of a datasource is loaded.
+    '''
+
+    def __init__(
+        self,
+        druid_metadata,
+        max_bytes=DEFAULT_MAX_BYTES,
+        max_entry_bytes=DEFAULT_MAX_ENTRY_BYTES,
+        shared_cache=None,
+        shared_cache_ttl=DEFAULT_SHARED_CACHE_TTL,
+        version_check_interval=DEFAULT_VERSION_CHECK_INTERVAL,
+    ):
+        self.druid_metadata = druid_metadata
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.shared_cache = shared_cache
+        self.shared_cache_ttl = shared_cache_ttl
+        self.version_check_interval = version_check_interval
+
+        # Mapping from cache key to the datasources the query reads from and the
+        # serialized query result. Results are stored serialized so that callers
+        # modifying a result (like BaseDruidQuery.parse) cannot change the
+        # cached value.
+        self._entries = OrderedDict()
+
+        # Total size in bytes of the serialized results in the local tier.
+        self._size = 0
+
+        # Mapping from datasource name to the current version of the datasource
+        # and the time the version was last checked.
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'oversized': 0,
+        }
+
+    def _pop_local(self, key):
+        (_, serialized_result) = self._entries.pop(key)
+        self._size -= len(serialized_result)
+
+    def _invalidate_datasource(self, datasource_name):
+        stale_keys = [
+            key
+            for (key, (datasources, _)) in self._entries.items()
+            if datasource_name in datasources
+        ]
+        for key in stale_keys:
+            self._pop_local(key)
+        self.stats['invalidations'] += 1
+        LOG.info(
+            'New version of datasource %s detected. Dropped %s cached results.',
+            datasource_name,
+            len(stale_keys),
+        )
+
+    def get_datasource_version(self, datasource_name):
+        '''Return the current version of the datasource, checking druid for a
+        new version at most once per version check interval.
+        '''
+        now = time.time()
+        with self._lock:
+            (version, checked_time) = self._versions.get(datasource_name, (None, 0))
+            if version and now - checked_time < self.version_check_interval:
+                return version
+
+        latest_version = self.druid_metadata.get_datasource_version(datasource_name)
+        with self._lock:
+            (version, _) = self._versions.get(datasource_name, (None, 0))
+            if version and version != latest_version:
+                self._invalidate_datasource(datasource_name)
+            self._versions[datasource_name] = (latest_version, now)
+        return latest_version
+
+    def build_key(self, query_dict):
+        '''Build the cache key for the query. Return None if the datasources the
+        query reads from cannot be determined, which means the query should not
+        be cached.
+        '''
+        try:
+            datasources = get_query_datasources(query_dict['dataSource'])
+            versions = [self.get_datasource_version(name) for name in datasources]
+        except (
+            KeyError,
+            ValueError,
+            MissingDatasourceException,
+            requests.exceptions.RequestException,
+        ) as e:
+            LOG.warning('Unable to determine datasource version for query: %s', e)
+            return None
+
+        version_key = ','.join(
+            '%s@%s' % (name, version) for (name, version) in zip(datasources, versions)
+        )
+        key_hash = hashlib.sha256(
+            ('%s|%s' % (version_key, canonicalize_query(query_dict))).encode('utf-8')
+        ).hexdigest()
+        return (tuple(datasources), key_hash)
+
+    def _get_shared(self, key):
+        if not self.shared_cache:
+            return None
+        try:
+            return self.shared_cache.get('%s:%s' % (SHARED_CACHE_KEY_PREFIX, key))
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning('Unable to read from shared query cache: %s', e)
+            return None
+
+    def _set_shared(self, key, serialized_result):
+        if not self.shared_cache:
+            return
+        try:
+            self.shared_cache.set(
+                '%s:%s' % (SHARED_CACHE_KEY_PREFIX, key),
+                serialized_result,
+                ex=self.shared_cache_ttl,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning('Unable to write to shared query cache: %s', e)
+
+    def _set_local(self, datasources, key, serialized_result):
+        if len(serialized_result) > self.max_entry_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._pop_local(key)
+            self._entries[key] = (datasources, serialized_result)
+            self._size += len(serialized_result)
+            while self._size > self.max_bytes:
+                self._pop_local(next(iter(self._entries)))
+
+    def _lookup(self, query_dict):
+        '''Return the cache key for the query and the serialized result stored
+        for it, or None if the result has not been cached.
+        '''
+        cache_key = self.build_key(query_dict)
+        if not cache_key:
+            return (None, None)
+
+        (datasources, key) = cache_key
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+        if entry:
+            return (cache_key, entry[1])
+
+        serialized_result = self._get_shared(key)
+        if serialized_result is not None:
+            self.stats['shared_hits'] += 1
+            self._set_local(datasources, key, serialized_result)
+            return (cache_key, serialized_result)
+
+        self.stats['misses'] += 1
+        return (cache_key, None)
+
+    def _store(self, cache_key, serialized_result):
+        # NOTE(stephen): Sizes are measured in characters for results serialized
+        # by `get_or_run`. This is close enough to the byte size since druid
+        # results are mostly ASCII.
+        if len(serialized_result) > self.max_entry_bytes:
+            self.stats['oversized'] += 1
+            return
+
+        (datasources, key) = cache_key
+        self._set_local(datasources, key, serialized_result)
+        self._set_shared(key, serialized_result)
+
+    def get_or_run(self, query_dict, run_query):
+        '''Return the cached result for the query. If the query has not been
+        cached, call `run_query(query_dict)` and store its result.
+        '''
+        (cache_key, serialized_result) = self._lookup(query_dict)
+        if serialized_result is not None:
+            return json.loads(serialized_result)
+
+        result = run_query(query_dict)
+        if cache_key:
+            self._store(cache_key, json.dumps(result, separators=(',', ':')))
+        return result
+
+    def get_or_stream(self, query_dict, stream_query):
+        '''Yield the cached result for the query as chunks of bytes. If the query
+        has not been cached, yield the chunks produced by `stream_query(query_dict)`
+        and store the full result once it has been received.
+
+        Chunks are only held onto while the response is smaller than the max
+        entry size. Once a response grows past it, the chunks received so far are
+        dropped and the result is not cached, so large responses can still be
+        decoded without holding the full response in memory.
+        '''
+        (cache_key, serialized_result) = self._lookup(query_dict)
+        if serialized_result is not None:
+            if isinstance(serialized_result, str):
+                serialized_result = serialized_result.encode('utf-8')
+            yield serialized_result
+            return
+
+        chunks = [] if cache_key else None
+        size = 0
+        for chunk in stream_query(query_dict):
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    self.stats['oversized'] += 1
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+
+        if chunks is not None:
+            self._store(cache_key, b''.join(chunks).decode('utf-8'))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._size = 0
+
+
+class CachingDruidQueryClient(DruidQueryClient_):
+    '''Druid query client that serves repeated queries from a QueryResultCache
+    instead of sending them to druid.
+    '''
+
+    def __init__(self, druid_configuration, result_cache, query_path='druid/v2'):
+        super().__init__(druid_configuration, query_path)
+        self.result_cache = result_cache
+
+    def run_raw_query(self, query_dict):
+        return self.result_cache.get_or_run(query_dict, super().run_raw_query)
+
+    def stream_raw_query(self, query_dict, chunk_size=DEFAULT_RESPONSE_CHUNK_SIZE):
+        return self.result_cache.get_or_stream(
+            query_dict,
+            lambda query: super(CachingDruidQueryClient, self).stream_raw_query(
+                query, chunk_size
+            ),
+        )
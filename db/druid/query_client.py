@@ -1,31 +1,50 @@
 import json
 import logging
 import os
+import threading
+import time
 
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Dict, Any
 
 import requests
-from db.druid.errors import DruidQueryError
+from db.druid.errors import DruidQueryError, DruidQueryTimeoutError
 from log import LOG
 from util.error_links import get_error_background_link_msg
 
 # Create a shared request session that provides connection pooling. Each worker
-# process should receive its own session/pool. This is because Request's
-# Session + HTTPAdapter pool is not thread safe. If multiple threads initiate a
-# request at the same time, meaning two requests are in transit simultaneously,
-# it is possible for data to corrupt in both threads.
+# process (and each thread within a process) should receive its own
+# session/pool. This is because Request's Session + HTTPAdapter pool is not
+# thread safe. If multiple threads initiate a request at the same time, meaning
+# two requests are in transit simultaneously, it is possible for data to corrupt
+# in both threads.
 # NOTE(stephen): This is a simple way to manage sessions across workers. This
 # does not account for workers that are killed by gunicorn (due to exceptions
 # or staleness), so multiple unused sessions could potentially accumulate.
 # TODO(david): fix this type
 _SESSIONS: Dict[Any, Any] = {}
 
+# Thread pool used to run concurrent queries. Each worker process has its own
+# pool. The threads are reused across batches so that their sessions (and the
+# connections held by them) are reused too.
+_EXECUTORS: Dict[int, ThreadPoolExecutor] = {}
+
+# Maximum number of queries a process can have in flight at the same time. This
+# matches the size of the connection pool of each session.
+MAX_QUERY_THREADS = 30
+
+# Default number of queries from a single batch that can run at the same time.
+DEFAULT_MAX_CONCURRENT_QUERIES = 8
+
+# Default number of bytes to read at a time when streaming a query response.
+DEFAULT_RESPONSE_CHUNK_SIZE = 1 << 16
+
 
 def _get_session(druid_configuration):
-    pid = os.getpid()
-    if pid in _SESSIONS:
-        return _SESSIONS[pid]
+    session_key = (os.getpid(), threading.get_ident())
+    if session_key in _SESSIONS:
+        return _SESSIONS[session_key]
 
     # Configure the connection pool settings for connections made to the
     # druid query endpoint
@@ -33,10 +52,67 @@ def _get_session(druid_configuration):
     adapter = requests.adapters.HTTPAdapter(pool_connections=30, pool_maxsize=30)
     session = requests.Session()
     session.mount(druid_configuration.query_endpoint(), adapter)
-    _SESSIONS[pid] = session
+    _SESSIONS[session_key] = session
     return session
 
 
+def _get_executor():
+    pid = os.getpid()
+    if pid not in _EXECUTORS:
+        _EXECUTORS[pid] = ThreadPoolExecutor(
+            max_workers=MAX_QUERY_THREADS, thread_name_prefix='druid-query'
+        )
+    return _EXECUTORS[pid]
+
+
+def run_concurrently(
+    run_fn, queries, max_concurrency=DEFAULT_MAX_CONCURRENT_QUERIES, timeout=None
+):
+    '''Call `run_fn` on each query, running at most `max_concurrency` queries at
+    the same time. Return the results in the same order as the queries.
+
+    If any query fails, no new queries are started and the error is raised. If
+    `timeout` is set and the batch has not finished after that many seconds, a
+    DruidQueryTimeoutError is raised. Queries that are already in flight when
+    the batch fails are allowed to finish in the background and their results
+    are discarded.
+    '''
+    queries = list(queries)
+    if timeout is None and (len(queries) <= 1 or max_concurrency <= 1):
+        return [run_fn(query) for query in queries]
+
+    deadline = time.time() + timeout if timeout is not None else None
+    executor = _get_executor()
+    results = [None] * len(queries)
+    pending = iter(enumerate(queries))
+    running = {}
+    completed = 0
+    try:
+        while True:
+            for (idx, query) in pending:
+                running[executor.submit(run_fn, query)] = idx
+                if len(running) >= max_concurrency:
+                    break
+
+            if not running:
+                return results
+
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            (finished, _) = wait(running, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not finished:
+                raise DruidQueryTimeoutError(
+                    'Query batch did not finish within %ss. %s of %s queries are '
+                    'incomplete.' % (timeout, len(queries) - completed, len(queries))
+                )
+
+            for future in finished:
+                results[running.pop(future)] = future.result()
+                completed += 1
+    finally:
+        for future in running:
+            future.cancel()
+
+
 def _is_connection_aborted_error(connection_error):
     '''Detect if exception is of the form:
     ConnectionError(
@@ -59,16 +135,16 @@ def _is_connection_aborted_error(connection_error):
     )
 
 
-def _post_query(session, url, query_dict, retry=True):
+def _post_query(session, url, query_dict, retry=True, stream=False):
     '''Send a post request to Druid. Retry the connection if the session was closed
     before the query was sent.
     '''
     try:
-        return session.post(url, json=query_dict)
+        return session.post(url, json=query_dict, stream=stream)
     except requests.exceptions.ConnectionError as e:
         if not retry or not _is_connection_aborted_error(e):
             raise
-        return _post_query(session, url, query_dict, False)
+        return _post_query(session, url, query_dict, False, stream)
 
 
 class DruidQueryRunner(ABC):
@@ -80,6 +156,30 @@ class DruidQueryRunner(ABC):
     def run_raw_query(self, query):
         pass
 
+    def run_queries(
+        self, queries, max_concurrency=DEFAULT_MAX_CONCURRENT_QUERIES, timeout=None
+    ):
+        '''Run a batch of queries in parallel. Return the results in the same
+        order as the queries.
+        '''
+        return run_concurrently(self.run_query, queries, max_concurrency, timeout)
+
+    def run_columnar_query(self, query):
+        '''Run a query whose result will only be exported to pandas. Query runners
+        that can decode the response directly into a dataframe should override this.
+        '''
+        return self.run_query(query)
+
+    def run_columnar_queries(
+        self, queries, max_concurrency=DEFAULT_MAX_CONCURRENT_QUERIES, timeout=None
+    ):
+        '''Run a batch of queries whose results will only be exported to pandas in
+        parallel. Return the results in the same order as the queries.
+        '''
+        return run_concurrently(
+            self.run_columnar_query, queries, max_concurrency, timeout
+        )
+
 
 class DruidQueryClient_(DruidQueryRunner):
     def __init__(self, druid_configuration, query_path='druid/v2'):
@@ -105,6 +205,41 @@ class DruidQueryClient_(DruidQueryRunner):
         pydruid_query.result = result
         return pydruid_query
 
+    # Run a query that inherits from db.druid.query_builder.BaseDruidQuery. If the
+    # query requests the array result format and can decode it (like
+    # GroupByQueryBuilder), the response is decoded directly into a dataframe as it
+    # is received. Only `export_pandas` can be used on the result.
+    def run_columnar_query(self, query):
+        pydruid_query = query.prepare()
+        context = pydruid_query.query_dict.get('context') or {}
+        if not context.get('resultAsArray') or not hasattr(
+            query, 'decode_array_result'
+        ):
+            raw_result = self.run_raw_query(pydruid_query.query_dict)
+            pydruid_query.result = query.parse(raw_result)
+            return pydruid_query
+
+        pydruid_query.result_df = query.decode_array_result(
+            self.stream_raw_query(pydruid_query.query_dict)
+        )
+        return pydruid_query
+
+    # Issue a fully formed query to druid and yield the raw response in chunks of
+    # bytes as it is received.
+    def stream_raw_query(self, query_dict, chunk_size=DEFAULT_RESPONSE_CHUNK_SIZE):
+        if LOG.level <= logging.DEBUG:
+            LOG.debug(json.dumps(query_dict, indent=2).replace('\\n', '\n'))
+
+        r = _post_query(
+            _get_session(self.druid_configuration),
+            self.query_url,
+            query_dict,
+            stream=True,
+        )
+        with r:
+            self._check_response(r, query_dict)
+            yield from r.iter_content(chunk_size)
+
     # Issue a fully formed query to druid
     def run_raw_query(self, query_dict):
         # If requested, log the input query before initiating the request
@@ -117,6 +252,15 @@ class DruidQueryClient_(DruidQueryRunner):
         r = _post_query(
             _get_session(self.druid_configuration), self.query_url, query_dict
         )
+        self._check_response(r, query_dict)
+
+        ret = r.json()
+        if LOG.level <= logging.DEBUG and os.getenv('LOG_DRUID_RESPONSES'):
+            LOG.debug('Received response: %s' % json.dumps(r.json(), indent=2))
+        return ret
+
+    @staticmethod
+    def _check_response(r, query_dict):
         # pylint: disable=no-member
         if r.status_code != requests.codes.ok:
             error_msg = 'Server response: %s' % r.content
@@ -136,11 +280,6 @@ class DruidQueryClient_(DruidQueryRunner):
 
             raise DruidQueryError(query_error)
 
-        ret = r.json()
-        if LOG.level <= logging.DEBUG and os.getenv('LOG_DRUID_RESPONSES'):
-            LOG.debug('Received response: %s' % json.dumps(r.json(), indent=2))
-        return ret
-
     def _post(self, pydruid_query):
         return self.run_pydruid_query(pydruid_query)
 
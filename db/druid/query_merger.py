@@ -0,0 +1,354 @@
+'''Merge compatible groupBy queries into a single druid query.
+
+Dashboards often issue many queries that only differ by the fields being
+calculated. When the datasource, intervals, granularity, dimensions and filter
+of two GroupByQueryBuilder queries are the same, their aggregations and post
+aggregations can be computed by one druid query instead. Identical aggregations
+are only computed once, even when different queries use a different name for
+them.
+
+Druid only returns rows that contribute to at least one of the aggregations of
+the query. A merged query can therefore return rows that one of its original
+queries would not have. To find the rows each original query would have
+returned, a row count filtered by the aggregation filter of the original query
+is added to the merged query.
+
+Example usage:
+
+merged_queries = merge_group_by_queries(queries)
+results = query_client.run_queries([merged.query for merged in merged_queries])
+for (merged, result) in zip(merged_queries, results):
+    df = result.export_pandas()
+    for member in merged.members:
+        member_df = split_merged_result(df, merged, member)
+'''
+import copy
+import json
+
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+
+from pydruid.utils.aggregators import filtered as filtered_aggregator, longsum
+from pydruid.utils.dimensions import DimensionSpec, build_dimension
+from pydruid.utils.filters import Filter
+
+from db.druid.calculations.base_calculation import BaseCalculation
+from db.druid.query_builder import GroupByQueryBuilder
+from db.druid.query_builder_util.optimization.sketch_optimizations import (
+    _hash_aggregator,
+)
+from db.druid.util import EmptyFilter, get_post_aggregation_fields
+
+# Prefix of the row count aggregations added to a merged query.
+ROW_COUNT_PREFIX = '__merged_rows'
+
+
+class MergedQueryMember(NamedTuple):
+    '''One of the original queries that is computed by a merged query.'''
+
+    # Position of the original query in the list of queries that were merged.
+    index: int
+
+    # Mapping from the column the original query would have returned to the
+    # column of the merged query result holding its value.
+    columns: Dict[str, str]
+
+    # Aggregation counting the rows that contribute to the original query. Rows
+    # with a count of zero would not have been returned by the original query.
+    row_count_field: Optional[str]
+
+
+class MergedQuery(NamedTuple):
+    query: GroupByQueryBuilder
+    members: List[MergedQueryMember]
+
+
+def _build_merge_key(query):
+    '''Build a key that is the same for all queries that can be merged together.
+    Return None if the query cannot be merged with other queries.
+    '''
+    if (
+        not isinstance(query, GroupByQueryBuilder)
+        or query.query_modifier
+        or query.having
+    ):
+        return None
+
+    try:
+        # Fields are compared by their serialized form, so the query can only be
+        # merged if all its fields can be serialized.
+        for aggregation in query.calculation.aggregations.values():
+            _hash_aggregator(aggregation)
+        for post_aggregation in query.calculation.post_aggregations.values():
+            _hash_aggregator(post_aggregation.post_aggregator)
+
+        return json.dumps(
+            {
+                'context': query.context,
+                'datasource': query.datasource,
+                'dimensionFilter': Filter.build_filter(query.dimension_filter),
+                'dimensions': [build_dimension(d) for d in query.dimensions],
+                'filterNonAggregatedRows': query.filter_non_aggregated_rows,
+                'granularity': query.granularity,
+                'intervals': query.intervals,
+                'optimize': query.optimize,
+                'subtotalDimensions': query.subtotal_dimensions,
+                'subtotalResultLabel': query.subtotal_result_label,
+            },
+            sort_keys=True,
+        )
+    except TypeError:
+        return None
+
+
+def _get_referenced_fields(post_aggregations):
+    '''Collect the fields referenced by the post aggregations. Also return the
+    serialized post aggregations since sketch post aggregations reference fields
+    in nested structures that are not found by `get_post_aggregation_fields`.
+    '''
+    output = set()
+    serialized_post_aggregations = []
+    for post_aggregation in post_aggregations.values():
+        output.update(get_post_aggregation_fields(post_aggregation))
+        serialized_post_aggregations.append(
+            _hash_aggregator(post_aggregation.post_aggregator)
+        )
+    return (output, ''.join(serialized_post_aggregations))
+
+
+class _MergeGroup:
+    '''Union of the aggregations and post aggregations of compatible queries.'''
+
+    def __init__(self, query):
+        self.query = query
+        self.aggregations = {}
+        self.post_aggregations = OrderedDict()
+        self.strict_null_fields = set()
+        self.members = []
+
+        # Mapping from field ID to the hash of its aggregation or post aggregation.
+        self._field_hashes = {}
+
+        # Mapping from aggregation hash (and whether it is strict) to the ID the
+        # aggregation is stored under.
+        self._aggregation_ids = {}
+
+    def _check_field(self, field_id, field_hash, strict):
+        '''Test if the field can be added to the group. A field can only be added
+        if its ID is not used yet, or if it is used by an identical field.
+        '''
+        if field_id not in self._field_hashes:
+            return True
+        return (
+            self._field_hashes[field_id] == field_hash
+            and (field_id in self.strict_null_fields) == strict
+        )
+
+    def add(self, index, query):
+        '''Add the query's fields to the group. Return False if the query has
+        fields that conflict with the fields already in the group.
+        '''
+        calculation = query.calculation
+        strict_null_fields = calculation.strict_null_fields
+        count_fields = {
+            calculation.count_field_name(field) for field in strict_null_fields
+        }
+        (referenced_fields, serialized_post_aggregations) = _get_referenced_fields(
+            calculation.post_aggregations
+        )
+
+        # Find which aggregations are new to the group and which can reuse an
+        # identical aggregation that already exists.
+        aliases = {}
+        new_aggregations = {}
+        new_aggregation_ids = {}
+        for (agg_id, aggregation) in calculation.aggregations.items():
+            # Count fields are rebuilt when the merged query is built.
+            if agg_id in count_fields:
+                continue
+
+            agg_hash = ('aggregation', _hash_aggregator(aggregation))
+            strict = agg_id in strict_null_fields
+            if agg_id in self._field_hashes:
+                if not self._check_field(agg_id, agg_hash, strict):
+                    return False
+                continue
+
+            # Only reuse an aggregation with a different ID when the original
+            # ID is not referenced by a post aggregation.
+            aggregation_key = (agg_hash, strict)
+            existing_id = self._aggregation_ids.get(
+                aggregation_key
+            ) or new_aggregation_ids.get(aggregation_key)
+            if (
+                existing_id
+                and agg_id not in referenced_fields
+                and '"%s"' % agg_id not in serialized_post_aggregations
+            ):
+                aliases[agg_id] = existing_id
+                continue
+
+            new_aggregations[agg_id] = (aggregation, agg_hash)
+            new_aggregation_ids.setdefault(aggregation_key, agg_id)
+
+        new_post_aggregations = OrderedDict()
+        for (post_agg_id, post_aggregation) in calculation.post_aggregations.items():
+            post_agg_hash = (
+                'post_aggregation',
+                _hash_aggregator(post_aggregation.post_aggregator),
+            )
+            strict = post_agg_id in strict_null_fields
+            if post_agg_id in new_aggregations or not self._check_field(
+                post_agg_id, post_agg_hash, strict
+            ):
+                return False
+            if post_agg_id not in self._field_hashes:
+                new_post_aggregations[post_agg_id] = (post_aggregation, post_agg_hash)
+
+        for (agg_id, (aggregation, agg_hash)) in new_aggregations.items():
+            self.aggregations[agg_id] = aggregation
+            self._field_hashes[agg_id] = agg_hash
+        for (aggregation_key, agg_id) in new_aggregation_ids.items():
+            self._aggregation_ids.setdefault(aggregation_key, agg_id)
+        for (post_agg_id, (post_aggregation, post_agg_hash)) in (
+            new_post_aggregations.items()
+        ):
+            self.post_aggregations[post_agg_id] = post_aggregation
+            self._field_hashes[post_agg_id] = post_agg_hash
+        self.strict_null_fields.update(
+            aliases.get(field, field) for field in strict_null_fields
+        )
+
+        columns = OrderedDict()
+        for agg_id in calculation.aggregations:
+            if agg_id not in count_fields:
+                columns[agg_id] = aliases.get(agg_id, agg_id)
+        for field in strict_null_fields:
+            columns[calculation.count_field_name(field)] = calculation.count_field_name(
+                aliases.get(field, field)
+            )
+        for post_agg_id in calculation.post_aggregations:
+            columns[post_agg_id] = post_agg_id
+
+        self.members.append((index, query, columns))
+        return True
+
+    def build(self):
+        '''Build the merged query computing the fields of every query in the
+        group.
+        '''
+        if len(self.members) == 1:
+            (index, query, columns) = self.members[0]
+            return MergedQuery(query, [MergedQueryMember(index, columns, None)])
+
+        base_query = self.query
+        query = GroupByQueryBuilder(
+            datasource=base_query.datasource,
+            granularity=base_query.granularity,
+            grouping_fields=list(base_query.dimensions),
+            intervals=list(base_query.intervals),
+            # NOTE(stephen): Copying the aggregations since query optimizations can
+            # modify them in-place and they are shared with the original queries.
+            calculation=BaseCalculation(
+                copy.deepcopy(self.aggregations),
+                self.post_aggregations,
+                self.strict_null_fields,
+            ),
+            dimension_filter=base_query.dimension_filter,
+            optimize=base_query.optimize,
+            subtotal_dimensions=base_query.subtotal_dimensions,
+            subtotal_result_label=base_query.subtotal_result_label,
+            filter_non_aggregated_rows=base_query.filter_non_aggregated_rows,
+        )
+        if base_query.context:
+            query.context = dict(base_query.context)
+
+        # When rows that do not contribute to the aggregations are filtered out,
+        # count the rows contributing to each original query so that rows the
+        # original query would not have returned can be removed.
+        row_count_ids = {}
+        members = []
+        for (index, member_query, columns) in self.members:
+            row_count_field = None
+            if base_query.filter_non_aggregated_rows:
+                row_count = longsum('count')
+                if not isinstance(member_query.aggregation_filter, EmptyFilter):
+                    row_count = filtered_aggregator(
+                        filter=member_query.aggregation_filter, agg=row_count
+                    )
+                row_count_hash = _hash_aggregator(row_count)
+                if row_count_hash not in row_count_ids:
+                    row_count_field = '%s_%s' % (ROW_COUNT_PREFIX, len(row_count_ids))
+                    row_count_ids[row_count_hash] = row_count_field
+                    query.aggregations[row_count_field] = row_count
+                row_count_field = row_count_ids[row_count_hash]
+            members.append(MergedQueryMember(index, columns, row_count_field))
+        return MergedQuery(query, members)
+
+
+def merge_group_by_queries(queries):
+    '''Merge the compatible queries into as few queries as possible. Every query
+    is computed by exactly one of the returned merged queries. Queries that
+    cannot be merged are returned unchanged.
+    '''
+    output = []
+    groups_by_key = {}
+    for (index, query) in enumerate(queries):
+        key = _build_merge_key(query)
+        if key is None:
+            output.append(MergedQuery(query, [MergedQueryMember(index, {}, None)]))
+            continue
+
+        # Queries with conflicting field definitions cannot be merged, so there
+        # can be multiple groups with the same key.
+        groups = groups_by_key.setdefault(key, [])
+        if not any(group.add(index, query) for group in groups):
+            group = _MergeGroup(query)
+            group.add(index, query)
+            groups.append(group)
+            output.append(group)
+
+    return [
+        group.build() if isinstance(group, _MergeGroup) else group for group in output
+    ]
+
+
+def _get_grouping_columns(query):
+    # pylint: disable=protected-access
+    return [
+        dimension._output_name if isinstance(dimension, DimensionSpec) else dimension
+        for dimension in query.dimensions
+    ]
+
+
+def split_merged_result(df, merged_query, member):
+    '''Extract the result of the original query from the dataframe exported from
+    the merged query's result.
+    '''
+    # NOTE(stephen): Deferring pandas import since this is library code that might
+    # not get called by all users.
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    # Queries that were not merged with any other query return their own result.
+    if len(merged_query.members) == 1:
+        return df
+
+    if member.row_count_field in df:
+        df = df[df[member.row_count_field].fillna(0) > 0]
+        if df.empty:
+            return pd.DataFrame()
+
+    grouping_columns = [
+        column for column in _get_grouping_columns(merged_query.query) if column in df
+    ]
+    output = {column: df[column] for column in grouping_columns}
+    for (column, merged_column) in member.columns.items():
+        if merged_column in df:
+            output[column] = df[merged_column]
+    if 'timestamp' in df:
+        output['timestamp'] = df['timestamp']
+    return pd.DataFrame(output).reset_index(drop=True)
@@ -0,0 +1,117 @@
+import copy
+import json
+
+from unittest import TestCase
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from db.druid.array_result_decoder import iter_array_rows
+from db.druid.calculations.calculation_merger import CalculationMerger
+from db.druid.calculations.simple_calculation import SumCalculation
+from db.druid.errors import DruidQueryError
+from db.druid.query_builder import GroupByQueryBuilder
+
+DAY_MS = 24 * 60 * 60 * 1000
+FIRST_TIMESTAMP_MS = 1577836800000
+
+
+def _build_query(granularity, dimensions, subtotal_dimensions=None):
+    calculation = CalculationMerger(
+        [SumCalculation('field', 'a'), SumCalculation('field', 'b')]
+    )
+    calculation.set_strict_null_fields(['a'])
+    query = GroupByQueryBuilder(
+        'covid',
+        granularity,
+        dimensions,
+        ['2020-01-01/2021-01-01'],
+        calculation,
+        optimize=False,
+        subtotal_dimensions=subtotal_dimensions,
+    )
+    query.prepare()
+    return query
+
+
+def _to_chunks(rows, chunk_size):
+    data = json.dumps(rows, ensure_ascii=False).encode('utf-8')
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+class ArrayResultDecoderTestCase(TestCase):
+    def _assert_matches_parsed_result(self, build_query, rows, chunk_size=7):
+        expected = pd.DataFrame(
+            row['event'] for row in build_query().parse(copy.deepcopy(rows))
+        )
+        result = build_query().decode_array_result(_to_chunks(rows, chunk_size))
+        assert_frame_equal(result, expected)
+
+    def test_decode_grouped_result(self):
+        rows = []
+        values = [1, 2.5, 'NaN', 'Infinity', '-Infinity', None, 7]
+        for idx in range(50):
+            rows.append(
+                [
+                    FIRST_TIMESTAMP_MS + (idx % 4) * DAY_MS,
+                    ['North', 'Sud', None, 'Região'][idx % 4],
+                    values[idx % len(values)],
+                    idx,
+                    idx % 3,
+                ]
+            )
+        self._assert_matches_parsed_result(
+            lambda: _build_query('day', ['RegionName']), rows
+        )
+
+    def test_decode_all_granularity(self):
+        rows = [[1, 2, 0], [3, 4.5, 2]]
+        self._assert_matches_parsed_result(lambda: _build_query('all', []), rows)
+
+    def test_decode_subtotals(self):
+        rows = [
+            ['North', 'Hill', 1, 2, 1],
+            ['North', 'Valley', 1, 2, 1],
+            ['South', 'Hill', 1, 2, 1],
+            ['North', None, 2, 4, 1],
+            ['South', None, 1, 2, 1],
+            [None, None, 3, 6, 1],
+        ]
+        self._assert_matches_parsed_result(
+            lambda: _build_query('all', ['RegionName', 'DistrictName'], ['RegionName']),
+            rows,
+        )
+
+    def test_decode_strict_null_with_null_values(self):
+        # Rows are split across blocks so that the null values and the rows
+        # nulled by the strict null field are added separately.
+        for rows in (
+            [[None, 2, 2], [3, 4.5, 0]],
+            [[3, 4.5, 0], [None, 2, 2], [None, 1, 0]],
+            [[None, 2, 0], [None, 4.5, 0]],
+            [[None, 2, 2], [3, 4.5, 0], [4, 1, 1]],
+            [['NaN', 2, 2], [3, 4.5, 0]],
+        ):
+            self._assert_matches_parsed_result(
+                lambda: _build_query('all', []), rows, chunk_size=3
+            )
+
+        rows = [[None, 2, 2], [3, 4.5, 0]]
+        result = _build_query('all', []).decode_array_result(_to_chunks(rows, 3))
+        self.assertEqual(result['a'].dtype, object)
+        self.assertEqual(result['a'].tolist(), [None, None])
+
+    def test_decode_empty_result(self):
+        result = _build_query('day', ['RegionName']).decode_array_result([b'[]'])
+        self.assertTrue(result.empty)
+
+    def test_iter_array_rows(self):
+        rows = [[idx, 'value %s' % idx, None] for idx in range(20)]
+        decoded_rows = []
+        for block in iter_array_rows(_to_chunks(rows, 3)):
+            decoded_rows.extend(block)
+        self.assertEqual(decoded_rows, rows)
+
+    def test_truncated_response(self):
+        with self.assertRaises(DruidQueryError):
+            list(iter_array_rows([b'[[1, 2], [3,']))
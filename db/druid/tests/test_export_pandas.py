@@ -0,0 +1,106 @@
+from unittest import TestCase
+
+from pydruid.query import Query
+
+from db.druid.query_builder import PydruidQueryWrapper
+
+
+def _date(date_str):
+    return '%sT00:00:00.000Z' % date_str
+
+
+def _export(granularity, dimensions, events):
+    query = PydruidQueryWrapper(
+        Query({'granularity': granularity, 'dimensions': dimensions}, 'groupBy')
+    )
+    query.result = [{'event': dict(event)} for event in events]
+    return query.export_pandas(fill_intermediate_dates=True)
+
+
+class ExportPandasFillDatesTestCase(TestCase):
+    def _assert_filled(self, granularity, dates, expected_dates):
+        events = [
+            {'RegionName': 'North', 'timestamp': _date(dates[0]), 'val': 1},
+            {'RegionName': 'South', 'timestamp': _date(dates[-1]), 'val': 2},
+            {'RegionName': None, 'timestamp': _date(dates[-1]), 'val': 3},
+        ]
+        df = _export(granularity, ['RegionName'], events)
+
+        # Existing rows are kept in their original order.
+        self.assertEqual(list(df['val'][:3]), [1, 2, 3])
+        self.assertEqual(len(df), 3 * len(expected_dates))
+        for _, group in df.groupby('RegionName', dropna=False):
+            self.assertEqual(
+                sorted(group['timestamp']), [_date(d) for d in expected_dates]
+            )
+
+    def test_fill_simple_granularities(self):
+        self._assert_filled(
+            'day',
+            ['2020-01-30', '2020-02-02'],
+            ['2020-01-30', '2020-01-31', '2020-02-01', '2020-02-02'],
+        )
+        self._assert_filled(
+            'week',
+            ['2020-01-06', '2020-01-20'],
+            ['2020-01-06', '2020-01-13', '2020-01-20'],
+        )
+        self._assert_filled(
+            'month',
+            ['2020-11-01', '2021-01-01'],
+            ['2020-11-01', '2020-12-01', '2021-01-01'],
+        )
+        self._assert_filled(
+            'quarter',
+            ['2020-07-01', '2021-01-01'],
+            ['2020-07-01', '2020-10-01', '2021-01-01'],
+        )
+        self._assert_filled(
+            'year',
+            ['2018-01-01', '2020-01-01'],
+            ['2018-01-01', '2019-01-01', '2020-01-01'],
+        )
+
+    def test_fill_period_granularity(self):
+        # Epi weeks starting on Sunday.
+        granularity = {'type': 'period', 'period': 'P1W', 'origin': '2020-01-05'}
+        self._assert_filled(
+            granularity,
+            ['2020-01-05', '2020-01-19'],
+            ['2020-01-05', '2020-01-12', '2020-01-19'],
+        )
+
+    def test_fill_arbitrary_granularity(self):
+        # Ethiopian calendar months.
+        granularity = {
+            'type': 'arbitrary',
+            'intervals': [
+                '2020-09-11/2020-10-11',
+                '2020-10-11/2020-11-10',
+                '2020-11-10/2020-12-10',
+                '2020-12-10/2021-01-09',
+            ],
+        }
+        self._assert_filled(
+            granularity,
+            ['2020-10-11', '2020-12-10'],
+            ['2020-10-11', '2020-11-10', '2020-12-10'],
+        )
+
+    def test_no_dimensions(self):
+        events = [
+            {'timestamp': _date('2020-01-01'), 'val': 1},
+            {'timestamp': _date('2020-01-03'), 'val': 3},
+        ]
+        df = _export('day', [], events)
+        self.assertEqual(
+            list(df['timestamp']),
+            [_date('2020-01-01'), _date('2020-01-03'), _date('2020-01-02')],
+        )
+
+    def test_unsupported_granularity_is_not_filled(self):
+        events = [
+            {'timestamp': _date('2020-01-01'), 'val': 1},
+            {'timestamp': _date('2020-01-03'), 'val': 3},
+        ]
+        self.assertEqual(len(_export('hour', [], events)), 2)
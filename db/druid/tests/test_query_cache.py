@@ -0,0 +1,218 @@
+import tracemalloc
+
+from unittest import TestCase, mock
+
+import requests
+
+from db.druid.query_builder import GroupByQueryBuilder
+from db.druid.query_cache import (
+    CachingDruidQueryClient,
+    QueryResultCache,
+    get_query_datasources,
+)
+from db.druid.query_client import DruidQueryClient_
+from db.druid.tests.test_array_result_decoder import _build_query as _build_groupby
+
+
+class FakeDruidMetadata:
+    def __init__(self):
+        self.versions = {'covid': 'v1', 'sivep': 'v1'}
+        self.error = None
+
+    def get_datasource_version(self, datasource_name):
+        if self.error:
+            raise self.error
+        return self.versions[datasource_name]
+
+
+class FakeSharedCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):  # pylint: disable=unused-argument
+        self.values[key] = value
+
+
+class FakeQueryRunner:
+    def __init__(self):
+        self.query_count = 0
+
+    def __call__(self, query_dict):
+        self.query_count += 1
+        return [{'event': {'count': self.query_count}}]
+
+
+def _build_query(datasource='covid', granularity='day'):
+    return {
+        'queryType': 'groupBy',
+        'dataSource': datasource,
+        'granularity': granularity,
+        'intervals': ['2020-01-01/2021-01-01'],
+    }
+
+
+class QueryResultCacheTestCase(TestCase):
+    def setUp(self):
+        self.metadata = FakeDruidMetadata()
+        self.run_query = FakeQueryRunner()
+
+    def test_equivalent_queries_are_cached(self):
+        cache = QueryResultCache(self.metadata)
+        result = cache.get_or_run(_build_query(), self.run_query)
+        reordered_query = dict(reversed(list(_build_query().items())))
+        self.assertEqual(cache.get_or_run(reordered_query, self.run_query), result)
+        self.assertEqual(self.run_query.query_count, 1)
+
+        cache.get_or_run(_build_query(granularity='month'), self.run_query)
+        self.assertEqual(self.run_query.query_count, 2)
+
+    def test_cached_result_cannot_be_modified(self):
+        cache = QueryResultCache(self.metadata)
+        cache.get_or_run(_build_query(), self.run_query)[0]['event']['count'] = 100
+        result = cache.get_or_run(_build_query(), self.run_query)
+        self.assertEqual(result[0]['event']['count'], 1)
+
+    def test_new_datasource_version_invalidates_results(self):
+        cache = QueryResultCache(self.metadata, version_check_interval=0)
+        cache.get_or_run(_build_query(), self.run_query)
+        cache.get_or_run(_build_query('sivep'), self.run_query)
+        self.metadata.versions['covid'] = 'v2'
+
+        result = cache.get_or_run(_build_query(), self.run_query)
+        self.assertEqual(result[0]['event']['count'], 3)
+        self.assertEqual(cache.stats['invalidations'], 1)
+
+        # Results for other datasources are not affected.
+        cache.get_or_run(_build_query('sivep'), self.run_query)
+        self.assertEqual(self.run_query.query_count, 3)
+
+    def test_least_recently_used_results_are_evicted(self):
+        # Each serialized result is 23 bytes, so only two results fit.
+        cache = QueryResultCache(self.metadata, max_bytes=50)
+        for granularity in ('day', 'week', 'day', 'month'):
+            cache.get_or_run(_build_query(granularity=granularity), self.run_query)
+        self.assertEqual(self.run_query.query_count, 3)
+
+        cache.get_or_run(_build_query(granularity='day'), self.run_query)
+        self.assertEqual(self.run_query.query_count, 3)
+        cache.get_or_run(_build_query(granularity='week'), self.run_query)
+        self.assertEqual(self.run_query.query_count, 4)
+        self.assertEqual(cache._size, 46)
+
+    def test_oversized_results_are_not_cached(self):
+        shared_cache = FakeSharedCache()
+        cache = QueryResultCache(
+            self.metadata, max_entry_bytes=10, shared_cache=shared_cache
+        )
+        for _ in range(2):
+            result = cache.get_or_run(_build_query(), self.run_query)
+        self.assertEqual(result[0]['event']['count'], 2)
+        self.assertEqual(cache.stats['oversized'], 2)
+        self.assertEqual(cache._size, 0)
+        self.assertEqual(shared_cache.values, {})
+
+    def test_version_check_error_is_a_cache_miss(self):
+        cache = QueryResultCache(self.metadata)
+        self.metadata.error = requests.exceptions.Timeout('Timed out')
+        for _ in range(2):
+            cache.get_or_run(_build_query(), self.run_query)
+        self.assertEqual(self.run_query.query_count, 2)
+        self.assertEqual(cache._size, 0)
+
+        # Results are cached again once the version can be retrieved.
+        self.metadata.error = None
+        for _ in range(2):
+            cache.get_or_run(_build_query(), self.run_query)
+        self.assertEqual(self.run_query.query_count, 3)
+
+    def test_shared_cache_is_used_between_processes(self):
+        shared_cache = FakeSharedCache()
+        first_cache = QueryResultCache(self.metadata, shared_cache=shared_cache)
+        second_cache = QueryResultCache(self.metadata, shared_cache=shared_cache)
+        result = first_cache.get_or_run(_build_query(), self.run_query)
+        self.assertEqual(second_cache.get_or_run(_build_query(), self.run_query), result)
+        self.assertEqual(self.run_query.query_count, 1)
+        self.assertEqual(second_cache.stats['shared_hits'], 1)
+
+    def test_get_query_datasources(self):
+        self.assertEqual(get_query_datasources('covid'), ['covid'])
+        self.assertEqual(
+            get_query_datasources(
+                {
+                    'type': 'query',
+                    'query': {'dataSource': {'type': 'table', 'name': 'covid'}},
+                }
+            ),
+            ['covid'],
+        )
+        self.assertEqual(
+            get_query_datasources({'type': 'union', 'dataSources': ['a', 'b']}),
+            ['a', 'b'],
+        )
+
+    def test_streamed_results_are_cached(self):
+        cache = QueryResultCache(self.metadata)
+
+        def _stream_query(query_dict):  # pylint: disable=unused-argument
+            self.run_query.query_count += 1
+            return [b'[[1,', b'2]]']
+
+        for _ in range(2):
+            chunks = cache.get_or_stream(_build_query(), _stream_query)
+            self.assertEqual(b''.join(chunks), b'[[1,2]]')
+        self.assertEqual(self.run_query.query_count, 1)
+        self.assertEqual(cache.get_or_run(_build_query(), self.run_query), [[1, 2]])
+
+    def test_large_streamed_results_are_not_buffered(self):
+        cache = QueryResultCache(self.metadata, max_entry_bytes=100)
+        chunks = [b'[[1,', b'2]', b' ' * 200, b']']
+        for _ in range(2):
+            result = cache.get_or_stream(_build_query(), lambda query: iter(chunks))
+            self.assertEqual(b''.join(result), b''.join(chunks))
+        self.assertEqual(cache.stats['misses'], 2)
+        self.assertEqual(cache.stats['oversized'], 2)
+        self.assertEqual(cache._size, 0)
+
+
+class FakeDruidConfiguration:
+    def query_endpoint(self):
+        return 'http://druid'
+
+
+# Size of each chunk of the streamed response and the number of chunks streamed.
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_CHUNK_COUNT = 32
+
+
+# pylint: disable=unused-argument
+def _stream_large_response(query_client, query_dict, chunk_size):
+    yield b'[[1,2,1],'
+    for _ in range(STREAM_CHUNK_COUNT):
+        yield b' ' * STREAM_CHUNK_SIZE
+    yield b'[3,4,1]]'
+
+
+class CachingDruidQueryClientTestCase(TestCase):
+    @mock.patch.object(DruidQueryClient_, 'stream_raw_query', _stream_large_response)
+    def test_large_response_is_not_kept_whole(self):
+        result_cache = QueryResultCache(
+            FakeDruidMetadata(), max_entry_bytes=STREAM_CHUNK_SIZE
+        )
+        query_client = CachingDruidQueryClient(FakeDruidConfiguration(), result_cache)
+        query = _build_groupby('all', [])
+        self.assertIsInstance(query, GroupByQueryBuilder)
+
+        tracemalloc.start()
+        try:
+            result = query_client.run_columnar_query(query)
+            (_, peak_size) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(result.result_df['b'].tolist(), [2, 4])
+        self.assertLess(peak_size, 8 * STREAM_CHUNK_SIZE)
+        self.assertEqual(result_cache.stats['oversized'], 1)
+        self.assertEqual(result_cache._size, 0)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from unittest import TestCase
+
+from pydruid.query import Query
+
+from db.druid.errors import DruidQueryError, DruidQueryTimeoutError
+from db.druid.query_client import DruidQueryClient_, run_concurrently
+
+
+class RunConcurrentlyTestCase(TestCase):
+    def test_results_are_in_input_order(self):
+        delays = [0.05, 0.01, 0.03, 0, 0.02]
+        results = run_concurrently(
+            lambda delay: time.sleep(delay) or delay, delays, max_concurrency=3
+        )
+        self.assertEqual(results, delays)
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def _run(query):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return query
+
+        results = run_concurrently(_run, range(10), max_concurrency=3)
+        self.assertEqual(results, list(range(10)))
+        self.assertEqual(max_running[0], 3)
+
+    def test_batch_runs_in_parallel(self):
+        start_time = time.time()
+        run_concurrently(lambda query: time.sleep(0.1), range(5), max_concurrency=5)
+        self.assertLess(time.time() - start_time, 0.3)
+
+    def test_deadline(self):
+        with self.assertRaises(DruidQueryTimeoutError):
+            run_concurrently(lambda delay: time.sleep(delay), [0, 0.5], timeout=0.05)
+
+    def test_query_error_is_raised(self):
+        def _run(query):
+            if query == 2:
+                raise DruidQueryError('Bad query')
+            return query
+
+        with self.assertRaises(DruidQueryError):
+            run_concurrently(_run, range(5))
+
+
+class FakeDruidConfiguration:
+    def query_endpoint(self):
+        return 'http://druid'
+
+
+class RowQueryClient(DruidQueryClient_):
+    def __init__(self):
+        super().__init__(FakeDruidConfiguration())
+
+    def run_raw_query(self, query_dict):
+        return [{'event': {'count': 1}, 'timestamp': '2020-01-01T00:00:00.000Z'}]
+
+    def stream_raw_query(self, query_dict, chunk_size=None):
+        raise AssertionError('Response should not be streamed')
+
+
+class ArrayResultQuery:
+    '''Query requesting the array result format that cannot decode it.'''
+
+    def prepare(self):
+        return Query({'context': {'resultAsArray': True}}, 'timeseries')
+
+    def parse(self, result):  # pylint: disable=no-self-use
+        return result
+
+
+class RunColumnarQueryTestCase(TestCase):
+    def test_query_without_array_decoding_uses_row_path(self):
+        result = RowQueryClient().run_columnar_query(ArrayResultQuery())
+        self.assertEqual(result.result[0]['event'], {'count': 1})
@@ -0,0 +1,156 @@
+from unittest import TestCase
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from db.druid.calculations.base_calculation import BaseCalculation
+from db.druid.calculations.calculation_merger import CalculationMerger
+from db.druid.calculations.simple_calculation import (
+    AverageCalculation,
+    SumCalculation,
+)
+from db.druid.query_builder import GroupByQueryBuilder
+from db.druid.query_merger import merge_group_by_queries, split_merged_result
+
+INTERVALS = ['2020-01-01/2021-01-01']
+
+
+def _build_query(calculations, dimensions=('RegionName',), granularity='month'):
+    return GroupByQueryBuilder(
+        'covid',
+        granularity,
+        list(dimensions),
+        INTERVALS,
+        CalculationMerger(calculations),
+        optimize=False,
+    )
+
+
+def _date(date_str):
+    return '%sT00:00:00.000Z' % date_str
+
+
+class QueryMergerTestCase(TestCase):
+    def test_merge_compatible_queries(self):
+        queries = [
+            _build_query([SumCalculation('field', 'a')]),
+            _build_query([SumCalculation('field', 'b'), SumCalculation('field', 'a')]),
+            _build_query([AverageCalculation('field', 'c')]),
+        ]
+        merged_queries = merge_group_by_queries(queries)
+        self.assertEqual(len(merged_queries), 1)
+
+        (merged,) = merged_queries
+        self.assertEqual([member.index for member in merged.members], [0, 1, 2])
+        self.assertEqual(merged.members[1].columns, {'b': 'b', 'a': 'a'})
+        self.assertEqual(merged.members[2].columns['c'], 'c')
+
+        # Each original query receives a row count limited to the rows that
+        # contribute to its aggregations.
+        row_count_fields = [member.row_count_field for member in merged.members]
+        self.assertEqual(len(set(row_count_fields)), 3)
+        for row_count_field in row_count_fields:
+            self.assertIn(row_count_field, merged.query.aggregations)
+
+        query_dict = merged.query.prepare().query_dict
+        aggregation_names = [
+            agg['aggregator']['name'] for agg in query_dict['aggregations']
+        ]
+        self.assertEqual(aggregation_names.count('a'), 1)
+        self.assertEqual(
+            [post_agg['name'] for post_agg in query_dict['postAggregations']], ['c']
+        )
+
+    def test_incompatible_queries_are_not_merged(self):
+        queries = [
+            _build_query([SumCalculation('field', 'a')]),
+            _build_query([SumCalculation('field', 'b')], dimensions=['DistrictName']),
+            _build_query([SumCalculation('field', 'c')], granularity='day'),
+            # Same field ID with a different definition.
+            _build_query([SumCalculation('other_field', 'a')]),
+        ]
+        merged_queries = merge_group_by_queries(queries)
+        self.assertEqual(len(merged_queries), 4)
+        for (idx, merged) in enumerate(merged_queries):
+            self.assertIs(merged.query, queries[idx])
+            self.assertEqual(len(merged.members), 1)
+            self.assertIsNone(merged.members[0].row_count_field)
+
+    def test_deduplicate_identical_aggregations(self):
+        sum_calculation = SumCalculation('field', 'a')
+        renamed_calculation = BaseCalculation(
+            aggregations={'renamed_a': dict(sum_calculation.aggregations['a'])}
+        )
+        renamed_calculation.set_strict_null_fields(['renamed_a'])
+        sum_calculation.set_strict_null_fields(['a'])
+        queries = [
+            _build_query([sum_calculation]),
+            _build_query([renamed_calculation, SumCalculation('field', 'b')]),
+        ]
+        (merged,) = merge_group_by_queries(queries)
+        self.assertNotIn('renamed_a', merged.query.aggregations)
+        self.assertEqual(
+            merged.members[1].columns,
+            {'renamed_a': 'a', 'b': 'b', 'renamed_a__count': 'a__count'},
+        )
+
+        # Aggregations referenced by a post aggregation keep their own ID.
+        average_calculation = AverageCalculation('field', 'a')
+        copied_calculation = BaseCalculation(
+            aggregations={
+                'copy': dict(average_calculation.aggregations['a_for_average'])
+            }
+        )
+        (merged,) = merge_group_by_queries(
+            [_build_query([copied_calculation]), _build_query([average_calculation])]
+        )
+        self.assertIn('a_for_average', merged.query.aggregations)
+        self.assertEqual(merged.members[1].columns['a_for_average'], 'a_for_average')
+
+    def test_split_merged_result(self):
+        queries = [
+            _build_query([SumCalculation('field', 'a')]),
+            _build_query([SumCalculation('field', 'b')]),
+        ]
+        (merged,) = merge_group_by_queries(queries)
+        (a_rows, b_rows) = [member.row_count_field for member in merged.members]
+        df = pd.DataFrame(
+            {
+                'RegionName': ['North', 'North', 'South', 'South'],
+                'a': [1.0, 0.0, 3.0, 0.0],
+                'b': [0.0, 2.0, 4.0, 5.0],
+                a_rows: [1, 0, 2, 0],
+                b_rows: [0, 3, 1, 1],
+                'timestamp': [
+                    _date('2020-01-01'),
+                    _date('2020-03-01'),
+                    _date('2020-01-01'),
+                    _date('2020-02-01'),
+                ],
+            }
+        )
+
+        a_df = split_merged_result(df, merged, merged.members[0])
+        expected_a_df = pd.DataFrame(
+            {
+                'RegionName': ['North', 'South'],
+                'a': [1.0, 3.0],
+                'timestamp': [_date('2020-01-01'), _date('2020-01-01')],
+            }
+        )
+        assert_frame_equal(a_df, expected_a_df)
+
+        b_df = split_merged_result(df, merged, merged.members[1])
+        self.assertEqual(list(b_df.columns), ['RegionName', 'b', 'timestamp'])
+        self.assertEqual(list(b_df['b']), [2.0, 4.0, 5.0])
+
+        # Intermediate dates are filled from the dates of the split result only.
+        result = merged.query.prepare()
+        filled_a_df = result.fill_intermediate_dates(a_df)
+        assert_frame_equal(filled_a_df, expected_a_df)
+        filled_b_df = result.fill_intermediate_dates(b_df)
+        self.assertEqual(len(filled_b_df), 6)
+
+        self.assertTrue(
+            split_merged_result(pd.DataFrame(), merged, merged.members[0]).empty
+        )
@@ -3,7 +3,11 @@
 # canonical hierarchy based on the Municipality Code that is stored in the Municipality
 # column for that source.
 import csv
+import itertools
+import os
+import shutil
 import sys
+import tempfile
 
 from pylib.base.flags import Flags
 
@@ -14,9 +18,53 @@ from util.file.file_config import FileConfig, FilePattern, validate_file_configs
 MUNICIPALITY_COLUMN = f'{DimensionFactoryType.clean_prefix}{Dimension.MUNICIPALITY}'
 
 
-def build_municipality_code_lookup(filename):
-    '''Build a mapping from municipality code to the location dict that should be used
-    for that code.
+# Number of rows to write to the output file at once.
+DEFAULT_CHUNK_SIZE = 10000
+
+
+class MunicipalityCodeIndex:
+    '''Index from municipality code to the location dict that should be used for
+    that code. Codes that do not match directly are resolved using the treatment rules
+    for unmatched municipalities. The resolved location for every code seen is stored
+    so that each distinct code is only resolved once.
+    '''
+
+    def __init__(self, short_code_mapping, long_code_mapping):
+        self.short_code_mapping = short_code_mapping
+        self.long_code_mapping = long_code_mapping
+        self._resolved_locations = {}
+
+    def _resolve_location(self, municipality_code):
+        location = self.short_code_mapping.get(
+            municipality_code
+        ) or self.long_code_mapping.get(municipality_code)
+        # applying treatment rules for unmatched municipalities
+        if not location:
+            municipality_code = str(municipality_code[:6])
+            if municipality_code.startswith("53"):
+                municipality_code = "530010"
+            else:
+                municipality_code = municipality_code[:2] + "0000"
+            location = self.short_code_mapping.get(municipality_code)
+        if not location:
+            LOG.warning(
+                'Cannot find location data for municipality code: %s',
+                municipality_code,
+            )
+            location = {}
+        return location
+
+    def get_location(self, municipality_code):
+        location = self._resolved_locations.get(municipality_code)
+        if location is None:
+            location = self._resolve_location(municipality_code)
+            self._resolved_locations[municipality_code] = location
+        return location
+
+
+def build_municipality_code_index(filename):
+    '''Build an index from municipality code to the location dict that should be
+    used for that code.
     '''
     # NOTE(stephen): BR has two municipality codes that we need to test for.
     short_code_mapping = {}
@@ -32,40 +80,42 @@ def build_municipality_code_lookup(filename):
             }
             short_code_mapping[row['MunicipalityCodeShort']] = locations
             long_code_mapping[row['MunicipalityCodeLong']] = locations
-    return (short_code_mapping, long_code_mapping)
+    return MunicipalityCodeIndex(short_code_mapping, long_code_mapping)
 
 
-def process_source(filename, short_code_mapping, long_code_mapping):
-    output_rows = []
-    header = []
-    with open(filename) as input_file:
-        reader = csv.DictReader(input_file)
-        header = reader.fieldnames
-        for row in reader:
-            municipality_code = row[MUNICIPALITY_COLUMN]
-            location = short_code_mapping.get(
-                municipality_code
-            ) or long_code_mapping.get(municipality_code)
-            # applying treatment rules for unmatched municipalities
-            if not location:
-                municipality_code = str(municipality_code[:6])
-                if municipality_code.startswith("53"):
-                    municipality_code = "530010"
-                else:
-                    municipality_code = municipality_code[:2] + "0000"
-                location = short_code_mapping.get(municipality_code)
-            if not location:
-                LOG.warning(
-                    'Cannot find location data for municipality code: %s',
-                    municipality_code,
+def process_source(filename, municipality_code_index, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Match the municipality code of every row in the file and replace the file
+    with the matched rows. Rows are streamed to a temporary file in the same
+    directory that is renamed over the original file once it is complete, so the
+    original file is never left partially written.
+    '''
+    (output_dir, output_filename) = os.path.split(os.path.abspath(filename))
+    (fd, tmp_filename) = tempfile.mkstemp(
+        prefix=f'.{output_filename}.', suffix='.tmp', dir=output_dir
+    )
+    try:
+        with open(filename) as input_file, open(fd, 'w') as output_file:
+            reader = csv.DictReader(input_file)
+            writer = csv.DictWriter(output_file, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            while True:
+                rows = list(itertools.islice(reader, chunk_size))
+                if not rows:
+                    break
+                writer.writerows(
+                    {
+                        **row,
+                        **municipality_code_index.get_location(
+                            row[MUNICIPALITY_COLUMN]
+                        ),
+                    }
+                    for row in rows
                 )
-                location = {}
-            output_rows.append({**row, **location})
-
-    with open(filename, 'w') as output_file:
-        writer = csv.DictWriter(output_file, fieldnames=header)
-        writer.writeheader()
-        writer.writerows(output_rows)
+        shutil.copymode(filename, tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
 
 
 def main():
@@ -94,15 +144,13 @@ def main():
     # NOTE(stephen): The original locations.csv file will be overwritten *in place* for
     # the sources provided.
     input_pattern = FilePattern(Flags.ARGS.input_basedir_pattern)
-    (short_code_mapping, long_code_mapping) = build_municipality_code_lookup(
+    municipality_code_index = build_municipality_code_index(
         Flags.ARGS.municipality_code_mapping_file
     )
 
     for source in Flags.ARGS.sources:
         LOG.info('Processing %s', source)
-        process_source(
-            input_pattern.build(source), short_code_mapping, long_code_mapping
-        )
+        process_source(input_pattern.build(source), municipality_code_index)
     LOG.info('Finished processing sources')
 
     return 0
@@ -2,15 +2,19 @@
 import math
 import os
 import sys
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
 
 from pylib.base.flags import Flags
 
 from config.br_covid.datatypes import Dimension
 from log import LOG
-from pipeline.brazil_covid.bin.sim.convert_cid_csv import ID_COL as CAUSE_OF_DEATH_CODE
+from pipeline.brazil_covid.bin.sim.convert_cid_csv import (
+    CATEGORY_1_COL as CAUSE_OF_DEATH_CATEGORY_1,
+    ID_COL as CAUSE_OF_DEATH_CODE,
+)
 from pipeline.brazil_covid.bin.sim.convert_occupation_codes import (
     CODE_COLUMN as OCCUPATION_CODE_COLUMN,
 )
@@ -40,6 +44,9 @@ from util.file.file_config import FilePattern
 # Only read in 5 million lines at a time.
 LINE_THRESHOLD = 5000000
 
+# Input columns in the order they are stored in each chunk in chunked mode.
+INPUT_COLUMN_ORDER = sorted(INPUT_REQUIRED_COLUMNS)
+
 OUTPUT_DEATHS_FIELD = '*field_obitos'
 
 
@@ -91,7 +98,65 @@ def convert_numerical_columns(
     df[column_name] = pd.to_numeric(df[column_name], errors='coerce').astype('Int64')
 
 
-# TODO(abby): Can this be faster?
+def recode_categories(
+    codes: pd.Series, category_values: List[Optional[str]]
+) -> pd.Series:
+    '''Replace each category of the categorical series with the value at the
+    same position in `category_values`. Missing values, and categories replaced
+    with None, are missing in the output.
+    '''
+    (category_indices, categories) = pd.factorize(
+        np.array(category_values, dtype=object)
+    )
+    row_indices = codes.cat.codes.to_numpy()
+    new_codes = np.full(len(row_indices), -1, dtype=category_indices.dtype)
+    has_value = row_indices >= 0
+    new_codes[has_value] = category_indices[row_indices[has_value]]
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, categories), index=codes.index
+    )
+
+
+def map_categories(
+    codes: pd.Series, map_fn: Callable[[str], Optional[str]]
+) -> pd.Series:
+    '''Apply the function to each distinct value of the categorical series
+    instead of to each row.
+    '''
+    return recode_categories(
+        codes, [map_fn(category) for category in codes.cat.categories.tolist()]
+    )
+
+
+def lookup_codes(codes: pd.Series, lookup_df: pd.DataFrame) -> pd.DataFrame:
+    '''Look up the row of `lookup_df` for each code. This is equivalent to a
+    left merge of the codes with the lookup index, but each distinct code is
+    only looked up once. Codes missing from the lookup produce NaN values.
+    '''
+    if not lookup_df.index.is_unique:
+        lookup_df = lookup_df[~lookup_df.index.duplicated()]
+
+    codes = codes.astype('category')
+    lookup = lookup_df.reindex(codes.cat.categories).reset_index(drop=True)
+    # Missing codes have a category code of -1, which is not in the lookup index
+    # and will be filled with NaN.
+    output = lookup.reindex(codes.cat.codes.to_numpy())
+    output.index = codes.index
+    return output
+
+
+def _get_known_code(
+    codes: List[str], position: int, known_codes: Set[str]
+) -> Optional[str]:
+    if position >= len(codes):
+        return None
+
+    # For unmatched causes of death, try using only the first 3 digits to match
+    # the parent.
+    code = codes[position]
+    return code if code in known_codes else code[:3]
+
+
 def process_cause_of_death(
     df: pd.DataFrame,
     cause_of_death_df: pd.DataFrame,
@@ -100,64 +165,52 @@ def process_cause_of_death(
 ) -> pd.DataFrame:
     LOG.info('Processing cause of death column %s', column_name)
     # There may be multiple causes of death in each column, split them out into new columns.
-    split_columns_rename = {
-        i: f'{column_name}{i}'
-        for i in range(MAX_NUMBER_OF_CODES_PER_CAUSE_OF_DEATH_COL[column_name])
-    }
+    num_codes = MAX_NUMBER_OF_CODES_PER_CAUSE_OF_DEATH_COL[column_name]
 
     # Post 1996, the codes are prefixed with a '*', remove only the first one
     # so they can be used to split the codes into different columns. Strip out
     # the period to convert codes like 'A00.0' -> 'A000' to match the formatting
     # of the lookup file. Uppercase the text to match lookup file.
-    df[column_name] = (
-        df[column_name]
-        .str.replace('*', '', regex=False, n=1)
-        .str.replace('.', '', regex=False)
-        .str.upper()
+    # NOTE: Most deaths share a small number of distinct values, so the column is
+    # converted to a categorical and all string processing is done once per
+    # distinct value instead of once per row.
+    codes = map_categories(
+        df[column_name].astype('category'),
+        lambda value: value.replace('*', '', 1).replace('.', '').upper(),
     )
-    df = df.merge(
-        df[column_name]
-        .str.split('*', expand=True)
-        .apply(lambda col: col.str.strip())
-        .rename(columns=split_columns_rename),
-        left_index=True,
-        right_index=True,
-    ).drop(columns=[column_name])
 
     known_codes = set(cause_of_death_df.index)
-    for i, column in split_columns_rename.items():
-        # If no rows have the maximum number of codes for any input column, then
-        # some of these columns may not be present in the dataframe.
-        if column not in df.columns:
-            LOG.info('Skipping column %s', column)
-            continue
-
-        # For unmatched causes of death, try using only the first 3 digits to match
-        # the parent.
-        df.loc[~df[column].isin(known_codes), column] = df[column].str[:3]
+    split_codes = [
+        [code.strip() for code in value.split('*')]
+        for value in codes.cat.categories.tolist()
+    ]
+    output_dfs = [df.drop(columns=[column_name])]
+    for i in range(num_codes):
+        # NOTE: The columns for every possible code are always built, even if no
+        # rows have the maximum number of codes, so that the output columns do
+        # not depend on which rows are converted.
+        split_column = recode_categories(
+            codes, [_get_known_code(value, i, known_codes) for value in split_codes]
+        )
         remaining_unmatched_count = (
-            ~df[column].isna() & (df[column] != '') & ~df[column].isin(known_codes)
+            ~split_column.isna()
+            & (split_column != '')
+            & ~split_column.isin(known_codes)
         ).sum()
         if remaining_unmatched_count > 0:
             LOG.info(
                 'Remaining rows with unmatched CID IDs: %s', remaining_unmatched_count
             )
 
-        df = (
-            df.merge(
-                cause_of_death_df,
-                left_on=column,
-                right_index=True,
-                how='left',
-            ).drop(columns=[column])
-            # Rename the merged columns to be unique since the input column is split into
-            # multiple columns as a multi value dimension.
-            .rename(
+        # Rename the looked up columns to be unique since the input column is split
+        # into multiple columns as a multi value dimension.
+        output_dfs.append(
+            lookup_codes(split_column, cause_of_death_df).rename(
                 columns={key: f'{value}_{i}' for key, value in columns_rename.items()}
             )
         )
 
-    return df
+    return pd.concat(output_dfs, axis=1)
 
 
 def clean_and_replace_occupation_column(
@@ -180,12 +233,7 @@ def clean_and_replace_occupation_column(
     df.loc[unmatched_rows, input_column] = df.loc[unmatched_rows, input_column].str[:3]
 
     # Use the occupation lookup file to convert from occupation code to title.
-    df = df.merge(
-        occupation_df,
-        left_on=input_column,
-        right_index=True,
-        how='left',
-    )
+    df = pd.concat([df, lookup_codes(df[input_column], occupation_df)], axis=1)
     # For rows that have an occupation but it can't be matched, log the values then
     # set the value to "unknown occupation".
     title_column = column_list[0]
@@ -203,12 +251,11 @@ def clean_and_replace_occupation_column(
     return df
 
 
-def process_dataframe(
+def convert_dataframe(
     df: pd.DataFrame,
     cause_of_death_df: pd.DataFrame,
     occupation_df: pd.DataFrame,
-    output_file_name: str,
-) -> None:
+) -> pd.DataFrame:
     LOG.info('Number of rows in input: %s', len(df))
 
     # Add any columns that might be missing, but expected
@@ -356,8 +403,20 @@ def process_dataframe(
             pivoted_fields, fill_value=0
         )
 
-    cause_of_death_fields_df = cause_of_death_fields_df.clip(upper=1).rename(
-        columns=lambda col: f'*field_cause_of_death_category1 - {col}'
+    # Include a field for every category in the lookup so that the output columns
+    # do not depend on which rows are converted.
+    cause_of_death_categories = sorted(
+        cause_of_death_df[CAUSE_OF_DEATH_CATEGORY_1].dropna().unique()
+    )
+    cause_of_death_fields_df = (
+        cause_of_death_fields_df.reindex(
+            columns=cause_of_death_fields_df.columns.union(
+                cause_of_death_categories, sort=True
+            ),
+            fill_value=0,
+        )
+        .clip(upper=1)
+        .rename(columns=lambda col: f'*field_cause_of_death_category1 - {col}')
     )
     df = df.merge(
         cause_of_death_fields_df,
@@ -369,6 +428,16 @@ def process_dataframe(
     LOG.info('Renaming columns')
     df = df.rename(columns=RENAME_DIMENSIONS)
     LOG.info('Finished renaming columns')
+    return df
+
+
+def process_dataframe(
+    df: pd.DataFrame,
+    cause_of_death_df: pd.DataFrame,
+    occupation_df: pd.DataFrame,
+    output_file_name: str,
+) -> None:
+    df = convert_dataframe(df, cause_of_death_df, occupation_df)
 
     LOG.info('Writing the output CSV')
     # Since these are large files, use high compression
@@ -377,6 +446,105 @@ def process_dataframe(
     LOG.info('Finished writing output CSV')
 
 
+def read_input_chunks(input_folder: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    '''Read the raw SIM files in the input folder in chunks of at most
+    `chunk_size` rows. Every chunk has the same columns in the same order.
+    '''
+    for input_file_name in sorted(os.listdir(input_folder)):
+        # There are other files in the feed directory, filter to just data files.
+        if not input_file_name.endswith('.csv.lz4'):
+            continue
+
+        LOG.info('Processing file %s', input_file_name)
+        file_name = os.path.join(input_folder, input_file_name)
+        # NOTE(abby): The fetal deaths files are delimited by a comma and the
+        # others use a semicolon.
+        sep = ',' if 'DOFET' in file_name else ';'
+        row_count = 0
+        with LZ4Reader(file_name) as input_file:
+            for input_df in pd.read_csv(
+                input_file,
+                sep=sep,
+                dtype=str,
+                keep_default_na=False,
+                usecols=lambda col: col in INPUT_REQUIRED_COLUMNS
+                or col in PRE_1996_COLUMNS_RENAME.keys(),
+                chunksize=chunk_size,
+            ):
+                # Pre 1996, some columns had different names
+                if INPUT_DATE_COLUMN_BEFORE_1996 in input_df.columns:
+                    input_df = input_df.rename(columns=PRE_1996_COLUMNS_RENAME)
+
+                row_count += len(input_df)
+                yield input_df.reindex(columns=INPUT_COLUMN_ORDER, fill_value='')
+        assert row_count > 0, f'Input file {input_file_name} has no rows'
+
+
+class ConvertedFileWriter:
+    '''Append converted dataframes to LZ4 compressed CSV files. A new output
+    file is started once the current file has at least `max_rows_per_file`
+    rows, and all output files have the same columns.
+    '''
+
+    def __init__(self, output_file_pattern: FilePattern, max_rows_per_file: int):
+        self.output_file_pattern = output_file_pattern
+        self.max_rows_per_file = max_rows_per_file
+        self._columns: Optional[List[str]] = None
+        self._output_file = None
+        self._file_count = 0
+        self._row_count = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self._columns is None:
+            self._columns = list(df.columns)
+        assert len(df.columns) == len(self._columns) and set(df.columns) == set(
+            self._columns
+        ), 'Converted chunk has different columns than previous chunks'
+
+        if self._output_file and self._row_count >= self.max_rows_per_file:
+            self.close()
+
+        write_header = self._output_file is None
+        if write_header:
+            output_file_name = self.output_file_pattern.build(str(self._file_count))
+            LOG.info('Writing output CSV %s', output_file_name)
+            # Since these are large files, use high compression
+            self._output_file = LZ4Writer(output_file_name, level=9)
+            self._file_count += 1
+            self._row_count = 0
+
+        df[self._columns].to_csv(self._output_file, index=False, header=write_header)
+        self._row_count += len(df)
+
+    def close(self) -> None:
+        if self._output_file:
+            self._output_file.close()
+            self._output_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def convert_in_chunks(
+    input_folder: str,
+    output_file_pattern: FilePattern,
+    cause_of_death_df: pd.DataFrame,
+    occupation_df: pd.DataFrame,
+    chunk_size: int,
+    max_rows_per_file: int,
+) -> None:
+    '''Convert the raw SIM files `chunk_size` rows at a time so that memory use
+    does not depend on the size of the input files.
+    '''
+    with ConvertedFileWriter(output_file_pattern, max_rows_per_file) as writer:
+        for input_df in read_input_chunks(input_folder, chunk_size):
+            writer.write(convert_dataframe(input_df, cause_of_death_df, occupation_df))
+    LOG.info('Finished writing output CSVs')
+
+
 def main():
     Flags.PARSER.add_argument(
         '--input_folder',
@@ -399,6 +567,20 @@ def main():
         required=True,
         help='File path for occupation codes lookup',
     )
+    Flags.PARSER.add_argument(
+        '--chunk_size',
+        type=int,
+        default=0,
+        help='Number of input rows to convert at a time. If unset, all input files '
+        'are read into memory and converted up to %s rows at a time.' % LINE_THRESHOLD,
+    )
+    Flags.PARSER.add_argument(
+        '--max_rows_per_output_file',
+        type=int,
+        default=LINE_THRESHOLD,
+        help='When converting in chunks, start a new output file once this many rows '
+        'have been written to the current one.',
+    )
     Flags.InitArgs()
 
     output_file_pattern = FilePattern(Flags.ARGS.output_file_pattern)
@@ -417,6 +599,17 @@ def main():
     occupation_df.set_index(OCCUPATION_CODE_COLUMN, inplace=True)
     LOG.info(occupation_df.head(10))
 
+    if Flags.ARGS.chunk_size > 0:
+        convert_in_chunks(
+            Flags.ARGS.input_folder,
+            output_file_pattern,
+            cause_of_death_df,
+            occupation_df,
+            Flags.ARGS.chunk_size,
+            Flags.ARGS.max_rows_per_output_file,
+        )
+        return 0
+
     LOG.info('Reading in input files into dataframe')
     df = pd.DataFrame()
     total_file_line_counter = 0
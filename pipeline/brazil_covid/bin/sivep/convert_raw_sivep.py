@@ -6,6 +6,8 @@
 import datetime
 import sys
 
+from typing import Callable
+
 import numpy as np
 import pandas as pd
 
@@ -166,55 +168,193 @@ REQUIRED_INPUT_COLUMNS = [
 ]
 
 
-def build_age_group(value: str) -> str:
-    '''Convert the raw age value string into an age range. Ages that are less than 0
-    will be placed into the 0-9 bucket, and ages that are greater than 80 (sometimes are
-    greater than 100) will be placed into the 80+ bucket.
+# Age groups and the lower bound of each age group. Ages that are less than 0 will be
+# placed into the 0-9 bucket, and ages that are greater than 80 (sometimes are greater
+# than 100) will be placed into the 80+ bucket.
+AGE_GROUP_LABELS = [
+    '0-9',
+    '10-19',
+    '20-29',
+    '30-39',
+    '40-49',
+    '50-59',
+    '60-69',
+    '70-79',
+    '80+',
+]
+AGE_GROUP_BINS = [-np.inf, 10, 20, 30, 40, 50, 60, 70, 80, np.inf]
+
+# Only values that are integers (like '42' or ' -1') are valid ages.
+VALID_AGE_PATTERN = r'[+-]?\d+'
+
+RACE_MAPPING = {
+    '1': 'branca',
+    '2': 'preta',
+    '3': 'amarela',
+    '4': 'parda',
+    '5': 'indígena',
+    '9': 'ignorado',
+}
+# All other values fall under "no information". Possible values seen are nan.
+UNKNOWN_RACE = 's/informação'
+
+# Optional dates are only valid if they are in this range of years.
+VALID_OPTIONAL_DATE_SUFFIXES = ('/2019', '/2020', '/2021')
+
+# Default number of input rows converted at a time.
+DEFAULT_CHUNK_SIZE = 500000
+
+
+def convert_distinct_values(
+    values: pd.Series, convert_fn: Callable[[pd.Series], pd.Series]
+) -> pd.Series:
+    '''Apply the vectorized conversion to only the distinct values of the column and
+    use the result as a lookup table for every row. The raw columns have a small number
+    of distinct values (like dates or ages), so this avoids converting the same value
+    many times.
     '''
+    (codes, distinct_values) = pd.factorize(values)
+    lookup = convert_fn(pd.Series(distinct_values)).reset_index(drop=True)
+    # Missing values have a code of -1, which is not in the lookup index and will be
+    # filled with a missing value.
+    output = lookup.reindex(codes)
+    output.index = values.index
+    return output
+
+
+def build_age_groups(values: pd.Series) -> pd.Series:
+    '''Convert the raw age value strings into age ranges.'''
     # NOTE(stephen): Safeguarding against unparseable age values. Defaulting to an age
     # of 0 when this happens.
-    try:
-        age = int(value)
-    except:
-        age = 0
-
-    if age < 10:
-        return '0-9'
-    if age < 20:
-        return '10-19'
-    if age < 30:
-        return '20-29'
-    if age < 40:
-        return '30-39'
-    if age < 50:
-        return '40-49'
-    if age < 60:
-        return '50-59'
-    if age < 70:
-        return '60-69'
-    if age < 80:
-        return '70-79'
-    return '80+'
-
-
-def build_race(value: str) -> str:
-    if value == '1':
-        return 'branca'
-    if value == '2':
-        return 'preta'
-    if value == '3':
-        return 'amarela'
-    if value == '4':
-        return 'parda'
-    if value == '5':
-        return 'indígena'
-    if value == '9':
-        return 'ignorado'
-    # All other values fall under "no information". Possible values seen are nan.
-    return 's/informação'
-
-
-def write_csv_by_date_of_evaluation(df: pd.DataFrame, output_filename: str):
+    values = values.str.strip()
+    ages = pd.to_numeric(
+        values.where(values.str.fullmatch(VALID_AGE_PATTERN, na=False)),
+        errors='coerce',
+    ).fillna(0)
+    return pd.cut(ages, AGE_GROUP_BINS, right=False, labels=AGE_GROUP_LABELS)
+
+
+def build_races(values: pd.Series) -> pd.Series:
+    return values.map(RACE_MAPPING).fillna(UNKNOWN_RACE)
+
+
+def parse_optional_dates(values: pd.Series) -> pd.Series:
+    '''Parse the optional date column values. Invalid dates are date values that
+    are outside the valid time range OR are later than today, and are replaced with
+    NaT.
+    '''
+    valid_date_slice = values.str.endswith(VALID_OPTIONAL_DATE_SUFFIXES, na=False)
+    dates = pd.to_datetime(values.where(valid_date_slice), format=INPUT_DATE_FORMAT)
+    return dates.where(dates <= pd.Timestamp(TODAY))
+
+
+def convert_records(df: pd.DataFrame) -> pd.DataFrame:
+    '''Convert the raw SIVEP records into the output dimension and field columns.
+    All columns are built from whole column operations and are added to the output
+    at once. The output also includes the parsed `DT_EVOLUCA` column that is needed
+    for the date of evaluation output.
+    '''
+    # Mapping from field ID to the field values.
+    fields = {}
+
+    # Track total number of cases.
+    fields['total_number_of_cases_seen'] = pd.Series(1, index=df.index)
+
+    # Simple indicators just check if the column value in the input dataset is '1'.
+    for column, field_id in SIMPLE_INDICATORS.items():
+        fields[field_id] = (df[column] == '1').astype(int)
+
+    # NOTE(stephen): Number of people hospitalized requires looking at two different
+    # columns. I am not sure why, but that was the original specification.
+    fields['number_of_people_hospitalized'] = (
+        (df['HOSPITAL'] == '1') | (df['EVOLUCAO'] == '2')
+    ).astype(int)
+
+    # Track hospital outcome. The hospitalized indicators stores a mapping from EVOLUCAO
+    # code to the field ID for that specific code.
+    for hospitalization_code, field_id in HOSPITALIZED_INDICATORS.items():
+        fields[field_id] = (df['EVOLUCAO'] == hospitalization_code).astype(int)
+
+    srag_match_slices = []
+    srag_dimension_values = []
+    is_sars2 = df['PCR_SARS2'] == '1'
+    for code, (field_id, dimension_value) in SRAG_CLASSIFICATION_INDICATORS.items():
+        # NOTE(stephen): Special case for COVID-19 indicator since it can be found in
+        # both the SRAG classification column AND a special SARS column.
+        if field_id == 'srag_covid19':
+            srag_match_slice = (df['CLASSI_FIN'] == code) | is_sars2
+        # NOTE(abby): Special case for investigation indicator since it can be
+        # represented by the code or by a missing value.
+        elif field_id == 'srag_em_investigacao':
+            srag_match_slice = (df['CLASSI_FIN'] == code) | (df['CLASSI_FIN'] == '')
+        else:
+            srag_match_slice = (df['CLASSI_FIN'] == code) & ~is_sars2
+        fields[field_id] = srag_match_slice.astype(int)
+        srag_match_slices.append(srag_match_slice)
+        srag_dimension_values.append(dimension_value)
+
+    # Parse the primary date column. In testing, there were no invalid values found.
+    date_series = convert_distinct_values(
+        df['DT_SIN_PRI'],
+        lambda values: pd.to_datetime(values, format=INPUT_DATE_FORMAT),
+    )
+    dates = {'DT_SIN_PRI': date_series}
+    for date_column in INPUT_OPTIONAL_DATE_COLUMNS:
+        dates[date_column] = convert_distinct_values(
+            df[date_column], parse_optional_dates
+        )
+
+    for field_id, (start_date, end_date) in DATE_DIFF_INDICATORS.items():
+        # Rows where either date is missing have a value of 0. Negative values are
+        # also replaced with 0.
+        fields[field_id] = (
+            (dates[end_date] - dates[start_date])
+            .dt.days.fillna(0)
+            .clip(lower=0)
+            .astype(int)
+        )
+
+    columns = {
+        'date': date_series.dt.strftime(STANDARD_DATA_DATE_FORMAT),
+        Dimension.STATE: df['SG_UF'],
+        Dimension.MUNICIPALITY: df['CO_MUN_RES'],
+        Dimension.AGE_GROUP: convert_distinct_values(
+            df['NU_IDADE_N'], build_age_groups
+        ),
+        Dimension.GENDER: df['CS_SEXO'],
+        Dimension.RACE: build_races(df['CS_RACA']),
+        # The `dead` dimension is built off the hospitalization indicators that
+        # indicate a patient died. If the patient has died, then we mark the death
+        # column with a string value indicating death.
+        Dimension.DEAD: np.where(
+            np.logical_or.reduce(
+                [fields[field_id] == 1 for field_id in HOSPITALIZATION_DEATH_INDICATORS]
+            ),
+            'Óbito',
+            '',
+        ),
+        # When a row matches multiple classifications, the last one is used.
+        Dimension.FINAL_CLASSIFICATION_OF_CASE: np.select(
+            srag_match_slices[::-1], srag_dimension_values[::-1], ''
+        ),
+    }
+
+    # The comorbidity dimension that process_csv will create is a multi-valued dimension
+    # that takes on the values of all these columns.
+    for comorbidity_id, (field_id, dimension_value) in sorted(
+        COMORBIDITY_MAPPING.items()
+    ):
+        columns[comorbidity_id] = np.where(fields[field_id] == 1, dimension_value, '')
+
+    # Rename fields to wildcard format that process_csv will use.
+    for field_id in sorted(fields):
+        columns[f'*field_{field_id}'] = fields[field_id]
+
+    columns['DT_EVOLUCA'] = dates['DT_EVOLUCA']
+    return pd.DataFrame(columns, index=df.index)
+
+
+def write_csv_by_date_of_evaluation(df: pd.DataFrame, output_file, write_header: bool):
     ''' HACK(stephen): Write a condensed version of the dataframe using the date of
     evaluation as the primary date column for specific indicators. See T8643.
     It was easier to write a separate CSV than to figure out how to align the
@@ -240,9 +380,9 @@ def write_csv_by_date_of_evaluation(df: pd.DataFrame, output_filename: str):
     )
 
     # Replace the date column for the valid rows.
-    df.loc[date_of_evaluation_slice, 'date'] = pd.to_datetime(
-        df[date_of_evaluation_slice]['DT_EVOLUCA']
-    ).dt.strftime(STANDARD_DATA_DATE_FORMAT)
+    df.loc[date_of_evaluation_slice, 'date'] = df.loc[
+        date_of_evaluation_slice, 'DT_EVOLUCA'
+    ].dt.strftime(STANDARD_DATA_DATE_FORMAT)
 
     # Rename the SRAG fields.
     df.rename(columns=srag_field_rename, inplace=True)
@@ -263,11 +403,9 @@ def write_csv_by_date_of_evaluation(df: pd.DataFrame, output_filename: str):
     ]
 
     # Write the slice of the dataframe to CSV.
-    LOG.info('Writing output CSV for date of evaluation fields')
-    with LZ4Writer(output_filename) as output_file:
-        df[date_of_evaluation_slice].to_csv(
-            output_file, columns=output_columns, index=False
-        )
+    df[date_of_evaluation_slice].to_csv(
+        output_file, columns=output_columns, index=False, header=write_header
+    )
 
 
 def main():
@@ -283,6 +421,12 @@ def main():
         required=True,
         help='Output SRAG indicator rows by date of evaluation',
     )
+    Flags.PARSER.add_argument(
+        '--chunk_size',
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help='Number of input rows to convert at a time',
+    )
     Flags.InitArgs()
 
     # Read the CSV files with all columns as strings. This allows us to perform a more
@@ -292,161 +436,37 @@ def main():
     # NOTE(stephen): Only a subset of columns from the original raw dataset are read in.
     # If you are introducing new indicators to build, or need access to additional
     # columns in the dataframe, you should modify `REQUIRED_INPUT_COLUMNS`.
-    df = pd.read_csv(
+    reader = pd.read_csv(
         Flags.ARGS.input_file,
         sep=';',
         usecols=REQUIRED_INPUT_COLUMNS,
         dtype=str,
         keep_default_na=False,
+        chunksize=Flags.ARGS.chunk_size,
     )
 
-    LOG.info('Finished reading data. Row count: %s', len(df))
-
-    # Keep track of all the field IDs created.
-    field_ids = set()
-
-    # Track total number of cases.
-    df['total_number_of_cases_seen'] = 1
-    field_ids.add('total_number_of_cases_seen')
-
-    # Simple indicators just check if the column value in the input dataset is '1'.
-    for column, field_id in SIMPLE_INDICATORS.items():
-        df[field_id] = 0
-        df.loc[df[column] == '1', field_id] = 1
-        field_ids.add(field_id)
-
-    LOG.info('Building hospitalization fields')
-    df['number_of_people_hospitalized'] = 0
-
-    # NOTE(stephen): Number of people hospitalized requires looking at two different
-    # columns. I am not sure why, but that was the original specification.
-    df.loc[
-        (df['HOSPITAL'] == '1') | (df['EVOLUCAO'] == '2'),
-        'number_of_people_hospitalized',
-    ] = 1
-    field_ids.add('number_of_people_hospitalized')
-
-    # Track hospital outcome. The hospitalized indicators stores a mapping from EVOLUCAO
-    # code to the field ID for that specific code.
-    for hospitalization_code, field_id in HOSPITALIZED_INDICATORS.items():
-        df[field_id] = 0
-        df.loc[df['EVOLUCAO'] == hospitalization_code, field_id] = 1
-        field_ids.add(field_id)
-
-    LOG.info('Building SRAG classification fields')
-    df[Dimension.FINAL_CLASSIFICATION_OF_CASE] = ''
-
-    for code, (field_id, dimension_value) in SRAG_CLASSIFICATION_INDICATORS.items():
-        df[field_id] = 0
-        # NOTE(stephen): Special case for COVID-19 indicator since it can be found in
-        # both the SRAG classification column AND a special SARS column.
-        if field_id == 'srag_covid19':
-            srag_match_slice = (df['CLASSI_FIN'] == code) | (df['PCR_SARS2'] == '1')
-        # NOTE(abby): Special case for investigation indicator since it can be
-        # represented by the code or by a missing value.
-        elif field_id == 'srag_em_investigacao':
-            srag_match_slice = (df['CLASSI_FIN'] == code) | (df['CLASSI_FIN'] == '')
-        else:
-            srag_match_slice = (df['CLASSI_FIN'] == code) & (df['PCR_SARS2'] != '1')
-        df.loc[srag_match_slice, field_id] = 1
-        df.loc[
-            srag_match_slice, Dimension.FINAL_CLASSIFICATION_OF_CASE
-        ] = dimension_value
-        field_ids.add(field_id)
-
-    # The `dead` dimension is built off the hospitalization indicators that indicate a
-    # patient died. If the patient has died, then we mark the death column with a string
-    # value indicating death.
-    df[Dimension.DEAD] = ''
-    df.loc[
-        df[HOSPITALIZATION_DEATH_INDICATORS].any(axis='columns'), Dimension.DEAD
-    ] = 'Óbito'
-
-    # Parse the primary date column. In testing, there were no invalid values found.
-    LOG.info('Parsing dates')
-
-    # NOTE(stephen): Having to do some weird things with `.dt.date` because pandas
-    # inexplicably would return a Timestamp OR a datetime64 date type depending on usage
-    # and I could not figure out how to get it to always return a Timestamp.
-    date_series = pd.to_datetime(df['DT_SIN_PRI'], format=INPUT_DATE_FORMAT)
-
-    # Set up the output date column.
-    df['date'] = date_series.dt.strftime(STANDARD_DATA_DATE_FORMAT)
-
-    # Replace the input date column with the parsed value so it can be used for date
-    # diff calculations later.
-    df['DT_SIN_PRI'] = date_series.dt.date
-
-    for date_column in INPUT_OPTIONAL_DATE_COLUMNS:
-        # Ignore any dates that are not in the date range 2019-2021.
-        valid_date_slice = df[date_column].str.endswith(
-            ('/2019', '/2020', '/2021'), na=False
-        )
-
-        # Parse the valid dates and set them in the same column in place.
-        df.loc[valid_date_slice, date_column] = pd.to_datetime(
-            df[valid_date_slice][date_column], format=INPUT_DATE_FORMAT
-        ).dt.date
-
-        # Replace all invalid dates with nan. Invalid dates are date values that are
-        # outside the valid time range OR are later than today.
-        df.loc[
-            ~valid_date_slice | (df[valid_date_slice][date_column] > TODAY), date_column
-        ] = np.nan
-
-    LOG.info('Building date diff fields')
-    for field_id, (start_date, end_date) in DATE_DIFF_INDICATORS.items():
-        df[field_id] = 0
-
-        valid_date_slice = df[start_date].notna() & df[end_date].notna()
-        valid_date_df = df[valid_date_slice]
-
-        df.loc[valid_date_slice, field_id] = (
-            valid_date_df[end_date].subtract(valid_date_df[start_date]).dt.days
-        )
-
-        # Handle negative values.
-        df[field_id].clip(lower=0, inplace=True)
-        field_ids.add(field_id)
-
-    # The comorbidity dimension that process_csv will create is a multi-valued dimension
-    # that takes on the values of all these columns.
-    LOG.info('Building comorbidity multi-value dimension columns')
-    for comorbidity_id, (field_id, dimension_value) in COMORBIDITY_MAPPING.items():
-        df[comorbidity_id] = ''
-        df.loc[df[field_id] == 1, comorbidity_id] = dimension_value
-
-    # Setup dimension columns for output.
-    LOG.info('Building output dimension columns')
-    df[Dimension.STATE] = df['SG_UF']
-    df[Dimension.MUNICIPALITY] = df['CO_MUN_RES']
-    df[Dimension.GENDER] = df['CS_SEXO']
-    df[Dimension.AGE_GROUP] = df['NU_IDADE_N'].apply(build_age_group)
-    df[Dimension.RACE] = df['CS_RACA'].apply(build_race)
-
-    # Rename fields to wildcard format that process_csv will use.
-    field_column_rename = {field_id: f'*field_{field_id}' for field_id in field_ids}
-    df.rename(columns=field_column_rename, inplace=True)
-
-    output_columns = [
-        'date',
-        Dimension.STATE,
-        Dimension.MUNICIPALITY,
-        Dimension.AGE_GROUP,
-        Dimension.GENDER,
-        Dimension.RACE,
-        Dimension.DEAD,
-        Dimension.FINAL_CLASSIFICATION_OF_CASE,
-        *sorted(COMORBIDITY_MAPPING.keys()),
-        *sorted(field_column_rename.values()),
-    ]
-
-    LOG.info('Writing output CSV')
-    with LZ4Writer(Flags.ARGS.output_file) as output_file:
-        df.to_csv(output_file, columns=output_columns, index=False)
-
-    write_csv_by_date_of_evaluation(df, Flags.ARGS.output_file_by_evaluation_date)
-    LOG.info('Successfully wrote converted CSVs')
+    row_count = 0
+    with LZ4Writer(Flags.ARGS.output_file) as output_file, LZ4Writer(
+        Flags.ARGS.output_file_by_evaluation_date
+    ) as evaluation_date_output_file:
+        for df in reader:
+            LOG.info('Converting rows %s to %s', row_count, row_count + len(df))
+            output_df = convert_records(df)
+
+            # Only write the header with the first chunk.
+            write_header = row_count == 0
+            row_count += len(df)
+            output_df.to_csv(
+                output_file,
+                columns=output_df.columns.drop('DT_EVOLUCA'),
+                index=False,
+                header=write_header,
+            )
+            write_csv_by_date_of_evaluation(
+                output_df, evaluation_date_output_file, write_header
+            )
+
+    LOG.info('Successfully wrote converted CSVs. Row count: %s', row_count)
     return 0
 
 
@@ -1,8 +1,24 @@
+import io
 import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from typing import NamedTuple, Optional
 
 from util.unix import BackgroundProcess, NamedPipe
 
+# Size of the uncompressed blocks that are compressed independently by the
+# BlockCompressedWriter.
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Number of compressed bytes read from a file at once by the readers.
+READ_SIZE = 256 * 1024
+
+# Maximum number of decompressed chunks waiting to be read by the caller.
+MAX_PENDING_CHUNKS = 8
+
 # The command line compressor and decompressors make it easy to expose system
 # compression binaries in python. A named pipe is created and exposed as a
 # normal file object, and a background process handles compression or
@@ -64,6 +80,208 @@ def CommandLineDecompressor(decompression_command, mode='r'):
             bg.wait()
 
 
+class BlockCompressedWriter(io.RawIOBase):
+    '''A binary file object that compresses the data written to it in-process.
+
+    Data is split into fixed size blocks that are compressed independently by a
+    pool of threads (the compression libraries release the GIL while
+    compressing) and written to the output file in the order they were received.
+    When `threads` is 0, blocks are compressed synchronously by the caller.
+
+    Args:
+        filename: The output file to write to.
+        codec: Object describing the compressed format. It must provide:
+            - header(block_size) -> bytes written at the start of the file
+            - compress_block(block, is_last) -> compressed bytes for the block.
+                This is called from worker threads and must be thread safe.
+            - update(block) called in order for each uncompressed block
+            - trailer() -> bytes written at the end of the file
+        block_size: Number of uncompressed bytes in each block.
+        threads: Number of threads used to compress blocks.
+    '''
+
+    def __init__(self, filename, codec, block_size=DEFAULT_BLOCK_SIZE, threads=1):
+        super().__init__()
+        self._codec = codec
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(threads) if threads > 0 else None
+
+        # Limit the number of blocks waiting to be written so that memory stays
+        # bounded when the caller produces data faster than it is compressed.
+        self._max_pending = max(threads, 1) * 2
+        self._pending = deque()
+        self._output_file = open(filename, 'wb')
+        self._output_file.write(codec.header(block_size))
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        block_size = self._block_size
+        while len(self._buffer) >= block_size:
+            block = bytes(self._buffer[:block_size])
+            del self._buffer[:block_size]
+            self._submit(block, False)
+        return len(data)
+
+    def _submit(self, block, is_last):
+        self._codec.update(block)
+        if not self._executor:
+            self._output_file.write(self._codec.compress_block(block, is_last))
+            return
+
+        self._pending.append(
+            self._executor.submit(self._codec.compress_block, block, is_last)
+        )
+        while len(self._pending) > self._max_pending:
+            self._output_file.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            self._submit(bytes(self._buffer), True)
+            self._buffer = bytearray()
+            while self._pending:
+                self._output_file.write(self._pending.popleft().result())
+            self._output_file.write(self._codec.trailer())
+        finally:
+            if self._executor:
+                self._executor.shutdown()
+            self._output_file.close()
+            super().close()
+
+
+def open_block_compressed_file(filename, codec, mode, threads):
+    '''Open a BlockCompressedWriter for the codec and wrap it the same way the
+    builtin `open` would for the write mode provided.
+    '''
+    if not mode or mode[0] != 'w' or '+' in mode:
+        raise ValueError('Unsupported file write mode: %s' % mode)
+
+    file_obj = io.BufferedWriter(
+        BlockCompressedWriter(filename, codec, threads=threads), DEFAULT_BLOCK_SIZE
+    )
+    if 'b' in mode:
+        return file_obj
+    return io.TextIOWrapper(file_obj)
+
+
+class BlockInfo(NamedTuple):
+    '''Location of an independently compressed block of a file.'''
+
+    # Offset of the compressed block in the file and its compressed size.
+    offset: int
+    size: int
+
+    # Size of the block once decompressed, if it is known.
+    uncompressed_size: Optional[int]
+
+
+def read_compressed_block(filename, block):
+    '''Read the compressed bytes of the block from the file.'''
+    with open(filename, 'rb') as input_file:
+        input_file.seek(block.offset)
+        data = input_file.read(block.size)
+    if len(data) != block.size:
+        raise ValueError(
+            'Block at offset %s is truncated: %s' % (block.offset, filename)
+        )
+    return data
+
+
+class DecompressingReader(io.RawIOBase):
+    '''A binary file object that reads the decompressed data produced by a
+    generator of chunks.
+
+    The generator runs on a background thread (the decompression libraries
+    release the GIL while decompressing) so that decompression overlaps with the
+    caller processing the data, like the decompression process of the
+    CommandLineDecompressor did. Errors raised by the generator are raised to
+    the caller when it reads the data that could not be decompressed.
+    '''
+
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunk = memoryview(b'')
+        self._position = 0
+        self._finished = False
+        self._queue = queue.Queue(MAX_PENDING_CHUNKS)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._produce, args=(chunks,), daemon=True
+        )
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def _put(self, item):
+        # Stop waiting for the caller to read the chunks once the file is closed.
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, chunks):
+        try:
+            for chunk in chunks:
+                if chunk and not self._put(chunk):
+                    return
+            self._put(None)
+        except Exception as e:  # pylint: disable=broad-except
+            self._put(e)
+        finally:
+            chunks.close()
+
+    def readinto(self, buffer):
+        while self._position >= len(self._chunk):
+            if self._finished:
+                return 0
+
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._finished = True
+                raise item
+            if item is None:
+                self._finished = True
+                return 0
+            self._chunk = memoryview(item)
+            self._position = 0
+
+        size = min(len(buffer), len(self._chunk) - self._position)
+        buffer[:size] = self._chunk[self._position : self._position + size]
+        self._position += size
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        super().close()
+
+
+def open_decompressed_file(chunks, mode):
+    '''Open a DecompressingReader for the chunks and wrap it the same way the
+    builtin `open` would for the read mode provided.
+    '''
+    if not mode or mode[0] != 'r' or '+' in mode:
+        raise ValueError('Unsupported file read mode: %s' % mode)
+
+    file_obj = io.BufferedReader(DecompressingReader(chunks), DEFAULT_BLOCK_SIZE)
+    if 'b' in mode:
+        return file_obj
+    return io.TextIOWrapper(file_obj)
+
+
 def assert_file_exists(filename):
     if not os.path.exists(filename):
         raise IOError('File does not exist: %s' % filename)
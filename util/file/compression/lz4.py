@@ -1,6 +1,6 @@
-# This LZ4 utility uses the system provided LZ4 library for compression
-# and decompression. Each command returns a context managed object that
-# exposes a normal python file for reading/writing.
+# This LZ4 utility compresses and decompresses LZ4 files in-process using the
+# LZ4 frame format. Each command returns a normal python file object for
+# reading/writing that can be used as a context manager.
 # Example usage:
 #
 # rows = ['hello', 'world']
@@ -12,26 +12,186 @@
 # with LZ4Reader('/tmp/test_file.lz4') as input_file:
 #     for line in input_file:
 #         print line
+#
+# The writer stores each block of data as an independent LZ4 frame. The output
+# is readable by the system `lz4` binary, and each frame can be decompressed on
+# its own:
+#
+# for block in get_lz4_blocks('/tmp/test_file.lz4'):
+#     data = read_lz4_block('/tmp/test_file.lz4', block)
+import os
+import struct
+
+import lz4.frame
 
 from util.file.compression.common import (
-    CommandLineCompressor,
-    CommandLineDecompressor,
+    DEFAULT_BLOCK_SIZE,
+    READ_SIZE,
+    BlockInfo,
     assert_file_exists,
+    open_block_compressed_file,
+    open_decompressed_file,
+    read_compressed_block,
 )
 
-# Use the system provided LZ4 binary for reading compressed LZ4 files.
-# NOTE(stephen): Since a named pipe is used, seeking is not supported.
+_FRAME_MAGIC = 0x184D2204
+
+# Skippable frames use any magic number from 0x184D2A50 to 0x184D2A5F.
+_SKIPPABLE_FRAME_MAGIC = 0x184D2A50
+_SKIPPABLE_FRAME_MASK = 0xFFFFFFF0
+
+# Frame descriptor flags.
+_FLAG_DICT_ID = 0x01
+_FLAG_CONTENT_CHECKSUM = 0x04
+_FLAG_CONTENT_SIZE = 0x08
+_FLAG_BLOCK_CHECKSUM = 0x10
+
+# The highest bit of a block size marks blocks that are stored uncompressed.
+_BLOCK_SIZE_MASK = 0x7FFFFFFF
+
+_UINT32 = struct.Struct('<I')
+
+
+class LZ4FrameCodec:
+    '''Codec for the BlockCompressedWriter that stores each block as an LZ4
+    frame.
+    '''
+
+    def __init__(self, level):
+        self.level = level
+        self.has_data = False
+
+    def header(self, block_size):  # pylint: disable=unused-argument
+        return b''
+
+    def update(self, block):
+        self.has_data = self.has_data or bool(block)
+
+    def compress_block(self, block, is_last):
+        # Only write an empty frame when the file would otherwise be empty.
+        if is_last and not block and self.has_data:
+            return b''
+        return lz4.frame.compress(block, compression_level=self.level)
+
+    def trailer(self):
+        return b''
+
+
+def _iter_lz4_chunks(filename):
+    '''Decompress the frames of the LZ4 file in chunks of at most
+    DEFAULT_BLOCK_SIZE bytes.
+    '''
+    with open(filename, 'rb') as input_file:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        has_input = False
+        while True:
+            data = input_file.read(READ_SIZE)
+            if not data:
+                break
+
+            has_input = True
+            while data is not None:
+                yield decompressor.decompress(data, DEFAULT_BLOCK_SIZE)
+                if decompressor.eof:
+                    # Files can hold multiple concatenated frames.
+                    data = decompressor.unused_data or None
+                    decompressor = lz4.frame.LZ4FrameDecompressor()
+                    has_input = data is not None
+                elif decompressor.needs_input:
+                    data = None
+                else:
+                    data = b''
+
+    if has_input:
+        raise EOFError('LZ4 file ended in the middle of a frame: %s' % filename)
+
+
+def _read_exactly(input_file, size, filename):
+    data = input_file.read(size)
+    if len(data) != size:
+        raise ValueError('LZ4 file is truncated: %s' % filename)
+    return data
+
+
+def get_lz4_blocks(filename):
+    '''Return the location of each frame of the LZ4 file. The frames are found
+    from the frame headers, without decompressing the file. Files written by
+    LZ4Writer store one frame per block of data, while the system `lz4` binary
+    stores the whole file in a single frame.
+    '''
+    blocks = []
+    with open(filename, 'rb') as input_file:
+        offset = 0
+        while True:
+            magic_bytes = input_file.read(_UINT32.size)
+            if not magic_bytes:
+                return blocks
+            if len(magic_bytes) != _UINT32.size:
+                raise ValueError('LZ4 file is truncated: %s' % filename)
+
+            (magic,) = _UINT32.unpack(magic_bytes)
+            if magic & _SKIPPABLE_FRAME_MASK == _SKIPPABLE_FRAME_MAGIC:
+                (size,) = _UINT32.unpack(_read_exactly(input_file, 4, filename))
+                offset = input_file.seek(size, os.SEEK_CUR)
+                continue
+            if magic != _FRAME_MAGIC:
+                raise ValueError(
+                    'Invalid LZ4 frame at offset %s: %s' % (offset, filename)
+                )
+
+            descriptor = _read_exactly(input_file, 2, filename)
+            flags = descriptor[0]
+            header_size = (
+                7
+                + (8 if flags & _FLAG_CONTENT_SIZE else 0)
+                + (4 if flags & _FLAG_DICT_ID else 0)
+            )
+            frame_info = lz4.frame.get_frame_info(
+                magic_bytes
+                + descriptor
+                + _read_exactly(input_file, header_size - 6, filename)
+            )
+
+            # Skip over the data blocks until the end mark.
+            block_checksum_size = 4 if flags & _FLAG_BLOCK_CHECKSUM else 0
+            while True:
+                (block_size,) = _UINT32.unpack(_read_exactly(input_file, 4, filename))
+                if not block_size:
+                    break
+                input_file.seek(
+                    (block_size & _BLOCK_SIZE_MASK) + block_checksum_size,
+                    os.SEEK_CUR,
+                )
+            if flags & _FLAG_CONTENT_CHECKSUM:
+                input_file.seek(4, os.SEEK_CUR)
+
+            end = input_file.tell()
+            if end > os.fstat(input_file.fileno()).st_size:
+                raise ValueError('LZ4 file is truncated: %s' % filename)
+            uncompressed_size = (
+                frame_info['content_size'] if flags & _FLAG_CONTENT_SIZE else None
+            )
+            blocks.append(BlockInfo(offset, end - offset, uncompressed_size))
+            offset = end
+
+
+def read_lz4_block(filename, block):
+    '''Decompress a single frame of the LZ4 file.'''
+    return lz4.frame.decompress(read_compressed_block(filename, block))
+
+
+# Read a compressed LZ4 file. The file is decompressed by a background thread
+# while the caller reads it.
 def LZ4Reader(filename, mode='r'):  # pylint: disable=invalid-name
     assert_file_exists(filename)
-    decompression_command = 'lz4cat "%s"' % filename
-    return CommandLineDecompressor(decompression_command, mode)
+    return open_decompressed_file(_iter_lz4_chunks(filename), mode)
 
 
-# Use the system provided LZ4 binary for writing compressed LZ4 files.
+# Write a compressed LZ4 file. Blocks are compressed by `threads` background
+# threads while the caller continues writing.
 # NOTE(stephen): Level 3 compression seemed like a good default to have for
 # our system. There was a very small performance hit in testing vs a
 # significant improvement in compression over level 1 compression (the
 # default recommended by LZ4).
-def LZ4Writer(filename, level=3, mode='w'):  # pylint: disable=invalid-name
-    compression_command = 'lz4 -%d' % level
-    return CommandLineCompressor(filename, compression_command, mode)
+def LZ4Writer(filename, level=3, mode='w', threads=1):  # pylint: disable=invalid-name
+    return open_block_compressed_file(filename, LZ4FrameCodec(level), mode, threads)
@@ -1,26 +1,246 @@
 # Pigz provides parallel compression of gzip files and is a drop-in replacement
 # for gzip. The output file produced is a normal gzip file and doesn't need
-# a special decompressor.
+# a special decompressor. These utilities follow the same approach in-process:
+# blocks are compressed in parallel as raw deflate streams that are joined into
+# a single gzip member.
+#
+# Each block is compressed independently, and the size of the blocks is stored
+# in the gzip header, so the blocks of files written by PigzWriter can also be
+# decompressed on their own:
+#
+# for block in get_gzip_blocks('/tmp/test_file.gz'):
+#     data = read_gzip_block('/tmp/test_file.gz', block)
+import os
+import struct
+import time
+import zlib
+
 from util.file.compression.common import (
-    CommandLineCompressor,
-    CommandLineDecompressor,
+    DEFAULT_BLOCK_SIZE,
+    READ_SIZE,
+    BlockInfo,
     assert_file_exists,
+    open_block_compressed_file,
+    open_decompressed_file,
+    read_compressed_block,
 )
 
-# Use the system provided pigz binary for decompression of gzip files.
-# NOTE(stephen): This doesn't provide much of a speedup over the system gzip
-# binary, but it is a lot faster than Python's gzip library.
+# Window bits used by zlib to decompress a gzip member or a raw deflate stream.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_RAW_WBITS = -zlib.MAX_WBITS
+
+# Header flags.
+_FLAG_HEADER_CRC = 0x02
+_FLAG_EXTRA = 0x04
+_FLAG_NAME = 0x08
+_FLAG_COMMENT = 0x10
+
+# ID of the subfield of the gzip header's extra field that stores the
+# uncompressed size of the independently compressed blocks.
+BLOCK_SIZE_SUBFIELD_ID = b'ZB'
+
+# Marker of the empty stored block that ends a block compressed with a sync
+# flush.
+_SYNC_FLUSH_MARKER = b'\x00\x00\xff\xff'
+
+# Maximum number of bytes between the end of the decompressed data of a block
+# and the end of its sync flush marker. These bytes hold the codes for the last
+# value and the end of the compressed block, and the header of the empty stored
+# block.
+_MAX_MARKER_DISTANCE = 16
+
+
+class GzipCodec:
+    '''Codec for the BlockCompressedWriter that produces a single gzip member.
+    Each block is deflated independently and ends on a byte boundary so that the
+    compressed blocks can be concatenated into one deflate stream.
+    '''
+
+    def __init__(self, level):
+        self.level = level
+        self.crc = 0
+        self.size = 0
+
+    def header(self, block_size):
+        # Magic, deflate method, extra field flag, modification time, no extra
+        # flags, unknown OS, then the extra field holding the block size.
+        subfield = BLOCK_SIZE_SUBFIELD_ID + struct.pack('<HI', 4, block_size)
+        return b'\x1f\x8b\x08%c%s\x00\xff%s%s' % (
+            _FLAG_EXTRA,
+            struct.pack('<I', int(time.time())),
+            struct.pack('<H', len(subfield)),
+            subfield,
+        )
+
+    def update(self, block):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+
+    def compress_block(self, block, is_last):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _RAW_WBITS)
+        flush_mode = zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH
+        return compressor.compress(block) + compressor.flush(flush_mode)
+
+    def trailer(self):
+        return struct.pack('<II', self.crc & 0xFFFFFFFF, self.size & 0xFFFFFFFF)
+
+
+def _iter_gzip_chunks(filename):
+    '''Decompress the gzip file in chunks of at most DEFAULT_BLOCK_SIZE bytes.
+    Concatenated gzip members are read as one stream, like gzip does.
+    '''
+    with open(filename, 'rb') as input_file:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        has_input = False
+        while True:
+            data = input_file.read(READ_SIZE)
+            if not data:
+                break
+
+            has_input = True
+            while data:
+                yield decompressor.decompress(data, DEFAULT_BLOCK_SIZE)
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(_GZIP_WBITS)
+                    has_input = bool(data)
+                else:
+                    data = decompressor.unconsumed_tail
+
+    if has_input:
+        raise EOFError('Gzip file ended in the middle of a member: %s' % filename)
+
+
+def _read_gzip_header(input_file, filename):
+    '''Read the gzip header at the start of the file. Return the size of the
+    header and the block size stored in it, or None if the file was not written
+    in independent blocks.
+    '''
+
+    def _read(size):
+        data = input_file.read(size)
+        if len(data) != size:
+            raise ValueError('Gzip file is truncated: %s' % filename)
+        return data
+
+    (magic, method, flags) = struct.unpack('<2sBB6x', _read(10))
+    if magic != b'\x1f\x8b' or method != 8:
+        raise ValueError('Not a gzip file: %s' % filename)
+
+    block_size = None
+    if flags & _FLAG_EXTRA:
+        (extra_size,) = struct.unpack('<H', _read(2))
+        extra = _read(extra_size)
+        position = 0
+        while position + 4 <= extra_size:
+            subfield_id = extra[position : position + 2]
+            (subfield_size,) = struct.unpack_from('<H', extra, position + 2)
+            if subfield_id == BLOCK_SIZE_SUBFIELD_ID and subfield_size == 4:
+                (block_size,) = struct.unpack_from('<I', extra, position + 4)
+            position += 4 + subfield_size
+    for flag in (_FLAG_NAME, _FLAG_COMMENT):
+        if flags & flag:
+            while _read(1) != b'\x00':
+                pass
+    if flags & _FLAG_HEADER_CRC:
+        _read(2)
+    return (input_file.tell(), block_size)
+
+
+def get_gzip_blocks(filename):
+    '''Return the location of each independently compressed block of a gzip
+    file written by PigzWriter.
+
+    Deflate streams do not store where their blocks end, so the blocks are found
+    by decompressing the file once. Each block holds the block size stored in
+    the header, except for the last block which holds the rest of the data. The
+    blocks end with a sync flush marker that follows right after the end of
+    their data.
+    '''
+    blocks = []
+    with open(filename, 'rb') as input_file:
+        (offset, block_size) = _read_gzip_header(input_file, filename)
+        if not block_size:
+            raise ValueError(
+                'Gzip file was not written in independent blocks: %s' % filename
+            )
+
+        # Compressed data of the file starting at `offset`.
+        data = b''
+        while True:
+            # Decompress all but the last byte of the block so that only the
+            # codes for the end of the block come before the marker.
+            decompressor = zlib.decompressobj(_RAW_WBITS)
+            remaining = block_size - 1
+            consumed = 0
+            while remaining and not decompressor.eof:
+                if consumed == len(data):
+                    chunk = input_file.read(READ_SIZE)
+                    if not chunk:
+                        raise ValueError('Gzip file is truncated: %s' % filename)
+                    data += chunk
+                output = decompressor.decompress(data[consumed:], remaining)
+                remaining -= len(output)
+                consumed = (
+                    len(data)
+                    - len(decompressor.unconsumed_tail)
+                    - len(decompressor.unused_data)
+                )
+
+            # The last block is smaller than the block size and ends the deflate
+            # stream.
+            is_last = decompressor.eof
+            if not is_last:
+                data += input_file.read(_MAX_MARKER_DISTANCE)
+                probe = decompressor.copy()
+                last_output = probe.decompress(data[consumed:], 1)
+                if probe.eof:
+                    is_last = True
+                    consumed = len(data) - len(probe.unused_data)
+                    remaining -= len(last_output)
+                elif not last_output:
+                    raise ValueError('Gzip file is truncated: %s' % filename)
+
+            if is_last:
+                blocks.append(BlockInfo(offset, consumed, block_size - 1 - remaining))
+                return blocks
+
+            marker_position = data.find(
+                _SYNC_FLUSH_MARKER, consumed, consumed + _MAX_MARKER_DISTANCE
+            )
+            if marker_position < 0:
+                raise ValueError(
+                    'Block at offset %s is not independent: %s' % (offset, filename)
+                )
+            size = marker_position + len(_SYNC_FLUSH_MARKER)
+            blocks.append(BlockInfo(offset, size, block_size))
+            offset += size
+            data = data[size:]
+
+
+def read_gzip_block(filename, block):
+    '''Decompress a single block of a gzip file written by PigzWriter.'''
+    decompressor = zlib.decompressobj(_RAW_WBITS)
+    output = decompressor.decompress(read_compressed_block(filename, block))
+    output += decompressor.flush()
+    if len(output) != block.uncompressed_size:
+        raise ValueError(
+            'Block at offset %s could not be decompressed: %s'
+            % (block.offset, filename)
+        )
+    return output
+
+
+# Decompress gzip files in-process. The file is decompressed by a background
+# thread while the caller reads it, like the pigz process used to.
 # pylint: disable=invalid-name
 def PigzReader(filename, mode='r'):
     assert_file_exists(filename)
-    decompression_command = 'pigz -d -c "%s"' % filename
-    return CommandLineDecompressor(decompression_command, mode)
+    return open_decompressed_file(_iter_gzip_chunks(filename), mode)
 
 
-# Use the system provided pigz binary for parallel compression of gzip files.
+# Compress gzip files in parallel. By default, one thread is used per CPU.
 # pylint: disable=invalid-name
 def PigzWriter(filename, level=5, processes=-1, mode='w'):
-    compression_command = 'pigz -%d' % level
-    if processes > 0:
-        compression_command = '%s -p %s' % (compression_command, processes)
-    return CommandLineCompressor(filename, compression_command, mode)
+    threads = processes if processes > 0 else os.cpu_count()
+    return open_block_compressed_file(filename, GzipCodec(level), mode, threads)
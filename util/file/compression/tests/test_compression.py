@@ -0,0 +1,250 @@
+import gzip
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase, skipUnless
+
+import lz4.frame
+
+from util.file.compression.common import DEFAULT_BLOCK_SIZE, BlockCompressedWriter
+from util.file.compression.lz4 import (
+    LZ4Reader,
+    LZ4Writer,
+    get_lz4_blocks,
+    read_lz4_block,
+)
+from util.file.compression.pigz import (
+    PigzReader,
+    PigzWriter,
+    get_gzip_blocks,
+    read_gzip_block,
+)
+
+# Data sizes around the block size boundaries.
+DATA_SIZES = (
+    0,
+    10,
+    DEFAULT_BLOCK_SIZE - 1,
+    DEFAULT_BLOCK_SIZE,
+    2 * DEFAULT_BLOCK_SIZE - 1,
+    3 * DEFAULT_BLOCK_SIZE + 12345,
+)
+
+
+def _build_data(size):
+    rng = random.Random(size)
+    pattern = bytes(rng.getrandbits(7) for _ in range(5000))
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def _build_lines(count=50000):
+    return [
+        '%d,Region %d,%s\n' % (idx, idx % 50, 'é' * (idx % 3)) for idx in range(count)
+    ]
+
+
+class PrefixCodec:
+    '''Codec that stores blocks uncompressed with a prefix to track the order
+    blocks are written in.
+    '''
+
+    def __init__(self):
+        self.blocks = []
+        self.block_size = None
+
+    def header(self, block_size):
+        self.block_size = block_size
+        return b'header|'
+
+    def update(self, block):
+        self.blocks.append(block)
+
+    def compress_block(self, block, is_last):
+        return b'%s%s|' % (b'last:' if is_last else b'block:', block)
+
+    def trailer(self):
+        return b'trailer'
+
+
+class BlockCompressedWriterTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, 'output')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_blocks_written_in_order(self):
+        for threads in (0, 1, 3):
+            codec = PrefixCodec()
+            writer = BlockCompressedWriter(self.filename, codec, 4, threads)
+            for value in (b'ab', b'cdefghij', b'', b'klmnopq'):
+                writer.write(value)
+            writer.close()
+            writer.close()
+
+            with open(self.filename, 'rb') as input_file:
+                self.assertEqual(
+                    b'header|block:abcd|block:efgh|block:ijkl|block:mnop|last:q|'
+                    b'trailer',
+                    input_file.read(),
+                )
+            self.assertEqual(4, codec.block_size)
+            self.assertEqual([b'abcd', b'efgh', b'ijkl', b'mnop', b'q'], codec.blocks)
+
+
+class CompressionTestCase(TestCase):
+    EXTENSION = ''
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, 'test%s' % self.EXTENSION)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, data, mode='wb'):
+        with self.WRITER(self.filename, mode=mode) as output_file:
+            output_file.write(data)
+
+    def _read(self, mode='rb'):
+        with self.READER(self.filename, mode) as input_file:
+            return input_file.read()
+
+    def _assert_round_trip(self):
+        for size in DATA_SIZES:
+            data = _build_data(size)
+            self._write(data)
+            self.assertEqual(data, self._read())
+            self.assertEqual(data, self.decompress_file())
+
+            blocks = self.get_blocks(self.filename)
+            self.assertEqual(
+                data,
+                b''.join(self.read_block(self.filename, block) for block in blocks),
+            )
+            if size > DEFAULT_BLOCK_SIZE:
+                self.assertEqual(size // DEFAULT_BLOCK_SIZE + 1, len(blocks))
+                self.assertEqual(DEFAULT_BLOCK_SIZE, blocks[0].uncompressed_size)
+
+            # Blocks can be read in any order.
+            for block in reversed(blocks if size else []):
+                start = sum(
+                    previous.uncompressed_size
+                    for previous in blocks
+                    if previous.offset < block.offset
+                )
+                self.assertEqual(
+                    data[start : start + block.uncompressed_size],
+                    self.read_block(self.filename, block),
+                )
+
+    def _assert_text_round_trip(self):
+        lines = _build_lines()
+        self._write(''.join(lines), 'w')
+        with self.READER(self.filename) as input_file:
+            self.assertEqual(lines, list(input_file))
+
+    def _assert_closed_early(self):
+        self._write(_build_data(3 * DEFAULT_BLOCK_SIZE))
+        with self.READER(self.filename, 'rb') as input_file:
+            self.assertEqual(
+                _build_data(3 * DEFAULT_BLOCK_SIZE)[:10], input_file.read(10)
+            )
+
+    def _assert_truncated(self):
+        self._write(_build_data(2 * DEFAULT_BLOCK_SIZE))
+        with open(self.filename, 'rb') as input_file:
+            data = input_file.read()
+        with open(self.filename, 'wb') as output_file:
+            output_file.write(data[:-10])
+
+        with self.assertRaises(EOFError):
+            self._read()
+        with self.assertRaises(ValueError):
+            self.get_blocks(self.filename)
+
+
+class LZ4Test(CompressionTestCase):
+    EXTENSION = '.lz4'
+    READER = staticmethod(LZ4Reader)
+    WRITER = staticmethod(LZ4Writer)
+    get_blocks = staticmethod(get_lz4_blocks)
+    read_block = staticmethod(read_lz4_block)
+
+    def decompress_file(self):
+        with lz4.frame.open(self.filename, 'rb') as input_file:
+            return input_file.read()
+
+    def test_round_trip(self):
+        self._assert_round_trip()
+
+    def test_text_round_trip(self):
+        self._assert_text_round_trip()
+
+    def test_closed_early(self):
+        self._assert_closed_early()
+
+    def test_truncated(self):
+        self._assert_truncated()
+
+    def test_read_single_frame(self):
+        # Files written by the system `lz4` binary have a single frame.
+        data = _build_data(2 * DEFAULT_BLOCK_SIZE)
+        with open(self.filename, 'wb') as output_file:
+            output_file.write(lz4.frame.compress(data, store_size=False))
+        self.assertEqual(data, self._read())
+        blocks = get_lz4_blocks(self.filename)
+        self.assertEqual(1, len(blocks))
+        self.assertIsNone(blocks[0].uncompressed_size)
+        self.assertEqual(data, read_lz4_block(self.filename, blocks[0]))
+
+    @skipUnless(shutil.which('lz4'), 'lz4 is not installed')
+    def test_system_lz4(self):
+        data = _build_data(2 * DEFAULT_BLOCK_SIZE + 10)
+        self._write(data)
+        self.assertEqual(data, subprocess.check_output(['lz4', '-dc', self.filename]))
+
+
+class PigzTest(CompressionTestCase):
+    EXTENSION = '.gz'
+    READER = staticmethod(PigzReader)
+    WRITER = staticmethod(PigzWriter)
+    get_blocks = staticmethod(get_gzip_blocks)
+    read_block = staticmethod(read_gzip_block)
+
+    def decompress_file(self):
+        with gzip.open(self.filename, 'rb') as input_file:
+            return input_file.read()
+
+    def test_round_trip(self):
+        self._assert_round_trip()
+
+    def test_text_round_trip(self):
+        self._assert_text_round_trip()
+
+    def test_closed_early(self):
+        self._assert_closed_early()
+
+    def test_truncated(self):
+        self._assert_truncated()
+
+    def test_read_concatenated_members(self):
+        data = _build_data(DEFAULT_BLOCK_SIZE + 10)
+        with open(self.filename, 'wb') as output_file:
+            output_file.write(gzip.compress(data[:100]))
+            output_file.write(gzip.compress(data[100:]))
+        self.assertEqual(data, self._read())
+
+        # The blocks of files that were not written by PigzWriter depend on each
+        # other.
+        with self.assertRaises(ValueError):
+            get_gzip_blocks(self.filename)
+
+    @skipUnless(shutil.which('gzip'), 'gzip is not installed')
+    def test_system_gzip(self):
+        data = _build_data(2 * DEFAULT_BLOCK_SIZE + 10)
+        self._write(data)
+        self.assertEqual(data, subprocess.check_output(['gzip', '-dc', self.filename]))
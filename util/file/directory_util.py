@@ -1,13 +1,35 @@
+import hashlib
+import json
 import os
-import subprocess
+import struct
+
+from concurrent.futures import ThreadPoolExecutor
 
 from pylib.file.file_utils import FileUtils
 
-FILE_HASH_COMMAND = 'shasum "%s" | cut -f1 -d" "'
+# Number of bytes read from a file at a time when hashing.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Default number of files hashed in parallel.
+# NOTE: hashlib releases the GIL while hashing large chunks, so threads are
+# enough to hash multiple files in parallel.
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# Directory where the hashes of files are cached. Each directory containing
+# hashed files has its own cache file, named by the hash of the directory's
+# absolute path. Hashed directories are never written to.
+DEFAULT_HASH_CACHE_DIR = os.getenv(
+    'FILE_HASH_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'zenysis', 'file_hashes'),
+)
 
-# Compute a reasonably accurate file hash for gzip files by combining
-# the CRC-32 hash and the uncompressed file size
-GZIP_HASH_COMMAND = 'gzip -lv "%s" | awk \'BEGIN {OFS="|"} (NR==2) { print $2,$7 }\''
+# Increment when the hash format changes so that existing cache entries are no
+# longer used.
+HASH_CACHE_VERSION = 1
+
+# The gzip trailer stores the CRC-32 and the uncompressed size (modulo 2^32) of
+# the file's contents in the last 8 bytes of the file.
+_GZIP_TRAILER = struct.Struct('<II')
 
 
 def _validate_dir_path(path):
@@ -20,21 +42,156 @@ def _validate_dir_path(path):
     )
 
 
-def compute_file_hash(filename):
-    '''
-    Compute a reliable hash for the given file.
-    '''
-    assert os.path.isfile(filename), 'Invalid file: %s' % filename
-    base_cmd = FILE_HASH_COMMAND
+def _compute_gzip_hash(filename):
     # Special case for gzip files since two gzip files with the same content
     # will have different sha hashes. Use the internal CRC hash computed during
-    # gzipping
+    # gzipping combined with the uncompressed file size. This matches the
+    # output of `gzip -lv`.
+    with open(filename, 'rb') as input_file:
+        input_file.seek(-_GZIP_TRAILER.size, os.SEEK_END)
+        (crc, size) = _GZIP_TRAILER.unpack(input_file.read(_GZIP_TRAILER.size))
+    return '%08x|%d' % (crc, size)
+
+
+def _compute_sha_hash(filename):
+    # NOTE: This matches the output of `shasum`, which uses SHA-1 by default.
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as input_file:
+        chunk = input_file.read(HASH_CHUNK_SIZE)
+        while chunk:
+            sha.update(chunk)
+            chunk = input_file.read(HASH_CHUNK_SIZE)
+    return sha.hexdigest()
+
+
+def _hash_file_contents(filename):
     if filename[-3:] == '.gz':
-        base_cmd = GZIP_HASH_COMMAND
-    return subprocess.check_output(base_cmd % filename, shell=True, text=True).strip()
+        return _compute_gzip_hash(filename)
+    return _compute_sha_hash(filename)
+
+
+def _cache_key(stat_result):
+    return [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+
+
+class _HashCache:
+    '''Cache of file hashes stored in the cache directory, with one cache file
+    per directory of hashed files. Entries are keyed by the file's size,
+    modification time and inode so that unchanged files are never read again.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._entries = {}
+        self._dirty_dirs = set()
+
+    def _cache_path(self, directory):
+        directory_hash = hashlib.sha1(directory.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '%s.json' % directory_hash)
+
+    def _load(self, directory):
+        entries = self._entries.get(directory)
+        if entries is not None:
+            return entries
+
+        entries = {}
+        try:
+            with open(self._cache_path(directory)) as cache_file:
+                stored = json.load(cache_file)
+            if (
+                stored.get('version') == HASH_CACHE_VERSION
+                and stored.get('directory') == directory
+            ):
+                entries = stored['files']
+        except (OSError, ValueError, KeyError, AttributeError):
+            # A missing or corrupt cache just means all hashes are recomputed.
+            pass
+        self._entries[directory] = entries
+        return entries
+
+    def get(self, filename, stat_result):
+        (directory, name) = os.path.split(filename)
+        entry = self._load(directory).get(name)
+        if entry and entry[:3] == _cache_key(stat_result):
+            return entry[3]
+        return None
+
+    def set(self, filename, stat_result, file_hash):
+        (directory, name) = os.path.split(filename)
+        self._load(directory)[name] = _cache_key(stat_result) + [file_hash]
+        self._dirty_dirs.add(directory)
+
+    def flush(self):
+        for directory in self._dirty_dirs:
+            cache_path = self._cache_path(directory)
+            tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(tmp_path, 'w') as cache_file:
+                    json.dump(
+                        {
+                            'version': HASH_CACHE_VERSION,
+                            'directory': directory,
+                            'files': self._entries[directory],
+                        },
+                        cache_file,
+                    )
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                # The cache is an optimization. If the cache directory is not
+                # writable, hashes will be recomputed next time.
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self._dirty_dirs.clear()
+
+
+def compute_file_hashes(
+    filenames, num_workers=DEFAULT_HASH_WORKERS, use_cache=True, cache_dir=None
+):
+    '''
+    Compute a reliable hash for each of the given files, in the order provided.
+    Files are hashed in parallel and file hashes are cached in `cache_dir`
+    (defaults to DEFAULT_HASH_CACHE_DIR) so that unchanged files are not read
+    again.
+    '''
+    filenames = [os.path.abspath(filename) for filename in filenames]
+    for filename in filenames:
+        assert os.path.isfile(filename), 'Invalid file: %s' % filename
+
+    cache = _HashCache(cache_dir or DEFAULT_HASH_CACHE_DIR) if use_cache else None
+    hashes = {}
+    stat_results = {}
+    for filename in filenames:
+        if filename in stat_results:
+            continue
+        stat_results[filename] = stat_result = os.stat(filename)
+        cached_hash = cache.get(filename, stat_result) if cache else None
+        if cached_hash is not None:
+            hashes[filename] = cached_hash
+
+    missing = [filename for filename in stat_results if filename not in hashes]
+    if len(missing) > 1 and num_workers > 1:
+        with ThreadPoolExecutor(min(num_workers, len(missing))) as executor:
+            hashes.update(zip(missing, executor.map(_hash_file_contents, missing)))
+    else:
+        hashes.update((filename, _hash_file_contents(filename)) for filename in missing)
+
+    if cache and missing:
+        for filename in missing:
+            cache.set(filename, stat_results[filename], hashes[filename])
+        cache.flush()
+
+    return [hashes[filename] for filename in filenames]
+
+
+def compute_file_hash(filename, use_cache=True):
+    '''
+    Compute a reliable hash for the given file.
+    '''
+    return compute_file_hashes([filename], use_cache=use_cache)[0]
 
 
-def compute_dir_hash(selected_dir):
+def compute_dir_hash(selected_dir, num_workers=DEFAULT_HASH_WORKERS):
     '''
     Returns a string representing the hash of the contents of the directory.
     Note: The resulting hash is solely based on the hash of the contents
@@ -42,12 +199,14 @@ def compute_dir_hash(selected_dir):
     date, etc..).
     '''
     _validate_dir_path(selected_dir)
+    dir_files = FileUtils.GetFilesInDir(selected_dir)
+    file_hashes = compute_file_hashes(dir_files, num_workers)
     res = []
-    for dir_file in FileUtils.GetFilesInDir(selected_dir):
+    for dir_file, file_hash in zip(dir_files, file_hashes):
         rel_path = os.path.relpath(dir_file, selected_dir)
         # Include relative file path as part of hash string since multiple
         # files in a directory could compute to the same hash.
-        res.append('%s\t%s' % (rel_path, compute_file_hash(dir_file)))
+        res.append('%s\t%s' % (rel_path, file_hash))
     # Sort the computed hashes so that the directory hash is
     # stable and doesn't rely on the order the system returns files.
     return ''.join(sorted(res))
@@ -0,0 +1,115 @@
+import gzip
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase, mock, skipUnless
+
+from util.file import directory_util
+from util.file.directory_util import compute_dir_hash, compute_file_hashes
+
+# Commands used by the original shell based implementation.
+FILE_HASH_COMMAND = 'shasum "%s" | cut -f1 -d" "'
+GZIP_HASH_COMMAND = 'gzip -lv "%s" | awk \'BEGIN {OFS="|"} (NR==2) { print $2,$7 }\''
+
+
+def _write(path, contents):
+    with open(path, 'w') as output_file:
+        output_file.write(contents)
+
+
+class ComputeFileHashesTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = os.path.join(self.temp_dir.name, 'data')
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+        os.makedirs(self.data_dir)
+        self.filenames = [
+            os.path.join(self.data_dir, filename) for filename in ('a.csv', 'b.csv')
+        ]
+        for filename in self.filenames:
+            _write(filename, 'contents of %s' % filename)
+
+        # Hashes computed without the cache.
+        self.expected = compute_file_hashes(self.filenames, use_cache=False)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _compute_hashes(self):
+        with mock.patch.object(
+            directory_util,
+            '_hash_file_contents',
+            wraps=directory_util._hash_file_contents,
+        ) as hash_mock:
+            hashes = compute_file_hashes(self.filenames, cache_dir=self.cache_dir)
+        return (hashes, sorted(call[0][0] for call in hash_mock.call_args_list))
+
+    def test_unchanged_files_are_not_read(self):
+        self.assertEqual((self.expected, self.filenames), self._compute_hashes())
+        self.assertEqual((self.expected, []), self._compute_hashes())
+
+        # The cache is stored in the cache directory, not in the directory of
+        # the hashed files.
+        self.assertEqual(['a.csv', 'b.csv'], sorted(os.listdir(self.data_dir)))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    def test_size_change_invalidates_hash(self):
+        self._compute_hashes()
+        _write(self.filenames[0], 'new and longer contents')
+        (hashes, hashed_files) = self._compute_hashes()
+        self.assertEqual([self.filenames[0]], hashed_files)
+        self.assertNotEqual(self.expected[0], hashes[0])
+        self.assertEqual(self.expected[1], hashes[1])
+
+    def test_mtime_change_invalidates_hash(self):
+        self._compute_hashes()
+
+        # Same size, different contents and modification time.
+        stat_result = os.stat(self.filenames[1])
+        _write(self.filenames[1], 'CONTENTS OF %s' % self.filenames[1])
+        os.utime(
+            self.filenames[1],
+            ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9),
+        )
+        (hashes, hashed_files) = self._compute_hashes()
+        self.assertEqual([self.filenames[1]], hashed_files)
+        self.assertEqual(self.expected[0], hashes[0])
+        self.assertNotEqual(self.expected[1], hashes[1])
+
+    def test_moved_directory_is_not_cached(self):
+        self._compute_hashes()
+        moved_dir = os.path.join(self.temp_dir.name, 'moved')
+        shutil.move(self.data_dir, moved_dir)
+        self.filenames = [
+            os.path.join(moved_dir, os.path.basename(filename))
+            for filename in self.filenames
+        ]
+        self.assertEqual((self.expected, self.filenames), self._compute_hashes())
+
+    @skipUnless(shutil.which('shasum'), 'shasum is not installed')
+    def test_sha_hash_matches_shell_implementation(self):
+        expected = subprocess.check_output(
+            FILE_HASH_COMMAND % self.filenames[0], shell=True, text=True
+        ).strip()
+        self.assertEqual(expected, self.expected[0])
+
+    @skipUnless(shutil.which('gzip'), 'gzip is not installed')
+    def test_gzip_hash_matches_shell_implementation(self):
+        gzip_filename = os.path.join(self.data_dir, 'c.csv.gz')
+        with gzip.open(gzip_filename, 'wt') as gzip_file:
+            gzip_file.write('line\n' * 1000)
+
+        expected = subprocess.check_output(
+            GZIP_HASH_COMMAND % gzip_filename, shell=True, text=True
+        ).strip()
+        self.assertEqual(
+            [expected], compute_file_hashes([gzip_filename], use_cache=False)
+        )
+
+    def test_dir_hash(self):
+        with mock.patch.object(
+            directory_util, 'DEFAULT_HASH_CACHE_DIR', self.cache_dir
+        ):
+            dir_hash = compute_dir_hash(self.data_dir)
+        self.assertEqual('a.csv\t%sb.csv\t%s' % tuple(self.expected), dir_hash)
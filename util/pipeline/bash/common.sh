@@ -277,6 +277,22 @@ WaitMultipleThreads () {
   done
 }
 
+# Run a pipeline step command through the step cache. If the step's inputs,
+# command, script and the repository modules it imports are unchanged since its
+# last successful run, the command is skipped and the outputs of that run are
+# restored. Caching is only enabled when
+# PIPELINE_STEP_CACHE_DIR is set, otherwise the command is always run.
+# Usage: RunCachedStep STEP_NAME --inputs INPUT... --outputs OUTPUT... -- COMMAND...
+RunCachedStep () {
+  local step_name="$1"
+  shift
+
+  "${PIPELINE_SRC_ROOT}/data/pipeline/scripts/run_cached_step.py" \
+    --name "${step_name}" \
+    --version_files "$0" \
+    "$@"
+}
+
 # Check if the contents of two directories are the same
 DirectoriesAreEquivalent () {
   local cur_out_dir="$1"
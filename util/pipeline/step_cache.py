@@ -0,0 +1,357 @@
+'''Content-addressed cache for pipeline steps.
+
+Pipeline steps are re-run on every pipeline invocation even if their inputs have
+not changed since the previous run. A cached step declares the input files it
+reads, the output files it writes and the command that it runs. Before the
+command is run, a fingerprint is computed from the contents of the inputs, the
+command, and the contents of the files that define the step's version (like
+the script being run). Python version files also include every module of the
+repository that they import, directly or through other repository modules, so
+editing a shared library module changes the fingerprint of the steps using it.
+If a previous successful run of the step had the same fingerprint, the recorded
+outputs are restored instead of running the command.
+
+Since each pipeline run uses new date specific directories, paths are not part
+of the fingerprint directly. Input files are identified by their position in
+the step's input list and their filename, and the values of the pipeline
+directory environment variables are replaced with the variable names inside the
+command.
+
+Only the most recent successful run of each step is kept in the cache.
+
+Example usage:
+
+step = StepDefinition(
+    name='sim/convert_cid',
+    command=['convert_cid_csv.py', '--input=/feed/cid9.csv', '--out=/feed/out.csv'],
+    inputs=['/feed/cid9.csv'],
+    outputs=['/feed/out.csv'],
+    version_files=['convert_cid_csv.py'],
+)
+run_cached_step(step, StepCache('/data/step_cache'))
+'''
+
+import ast
+import functools
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from typing import List, NamedTuple, Optional, Tuple
+
+from log import LOG
+from util.file.directory_util import compute_dir_hash, compute_file_hashes
+
+# Environment variables holding the directories used by a pipeline run. The
+# values change between runs, so they are replaced by the variable name when
+# fingerprinting a step's command.
+PIPELINE_PATH_ENV_VARS = (
+    'PIPELINE_BIN_DIR',
+    'PIPELINE_FEED_DIR',
+    'PIPELINE_OUT_DIR',
+    'PIPELINE_OUT_ROOT',
+    'PIPELINE_SRC_ROOT',
+    'PIPELINE_TMP_DIR',
+    'PIPELINE_UTILS_DIR',
+)
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# Increment when the fingerprint computation or the cache layout changes so that
+# existing cache entries are no longer used.
+CACHE_FORMAT_VERSION = 3
+
+# Root directory of the repository that imported python modules are resolved
+# against when PIPELINE_SRC_ROOT is not set.
+DEFAULT_SRC_ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+_GLOB_CHARS = re.compile(r'[*?[]')
+
+
+class StepDefinition(NamedTuple):
+    # Unique name of the step, like `sim/convert_cid`.
+    name: str
+
+    # Command to run, as a list of arguments.
+    command: List[str]
+
+    # Input files, directories or glob patterns read by the step.
+    inputs: List[str]
+
+    # Output files or glob patterns written by the step.
+    outputs: List[str]
+
+    # Files that define the version of the step, like the script being run.
+    version_files: List[str] = []
+
+
+def _normalize_path_str(value: str, env: dict) -> str:
+    '''Replace the values of the pipeline directory environment variables with
+    the variable names so that the string is stable across pipeline runs.
+    '''
+    replacements = sorted(
+        ((env[var], var) for var in PIPELINE_PATH_ENV_VARS if env.get(var)),
+        key=lambda replacement: len(replacement[0]),
+        reverse=True,
+    )
+    for path, var in replacements:
+        value = value.replace(path, '${%s}' % var)
+    return value
+
+
+def _match_files(pattern: str) -> List[str]:
+    '''Return the sorted list of paths that match the (possibly glob) pattern.'''
+    return sorted(glob.glob(pattern))
+
+
+def _get_pattern_root(pattern: str) -> str:
+    '''Return the directory that contains every path matched by the pattern.
+    This is the leading part of the pattern's directory without glob characters.
+    '''
+    root = os.path.dirname(pattern)
+    while _GLOB_CHARS.search(root):
+        root = os.path.dirname(root)
+    return root or os.curdir
+
+
+def _is_python_file(path: str) -> bool:
+    if path.endswith('.py'):
+        return True
+    try:
+        with open(path, 'rb') as input_file:
+            first_line = input_file.readline(200)
+    except OSError:
+        return False
+    return first_line.startswith(b'#!') and b'python' in first_line
+
+
+def _resolve_module(src_root: str, module_name: str) -> List[str]:
+    '''Return the files inside the source root that are loaded when importing
+    the module: the `__init__.py` files of its packages and the module itself.
+    '''
+    files = []
+    path = src_root
+    for part in module_name.split('.'):
+        path = os.path.join(path, part)
+        if os.path.isfile('%s.py' % path):
+            files.append('%s.py' % path)
+            break
+        init_path = os.path.join(path, '__init__.py')
+        if not os.path.isfile(init_path):
+            break
+        files.append(init_path)
+    return files
+
+
+@functools.lru_cache(maxsize=None)
+def _get_direct_imports(path: str, src_root: str, mtime_ns: int) -> Tuple[str, ...]:
+    '''Return the files inside the source root imported by the python file.
+    Modules that are not part of the repository (like the standard library)
+    are ignored.
+    '''
+    # pylint: disable=unused-argument
+    with open(path, 'rb') as input_file:
+        try:
+            tree = ast.parse(input_file.read(), path)
+        except SyntaxError:
+            return ()
+
+    # Relative imports are resolved from the file's package. They are ignored
+    # for files outside of the source root.
+    package_dir = os.path.relpath(os.path.dirname(path), src_root)
+    package_parts = [] if package_dir == os.curdir else package_dir.split(os.sep)
+    module_names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            module_names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                if os.pardir in package_parts:
+                    continue
+                base_parts = package_parts[: len(package_parts) - node.level + 1]
+                base = '.'.join(base_parts + ([node.module] if node.module else []))
+            else:
+                base = node.module
+            module_names.append(base)
+            # Imported names can be submodules of the package.
+            module_names.extend('%s.%s' % (base, alias.name) for alias in node.names)
+
+    files = set()
+    for module_name in module_names:
+        files.update(_resolve_module(src_root, module_name))
+    files.discard(path)
+    return tuple(sorted(files))
+
+
+def get_imported_files(path: str, src_root: str) -> List[str]:
+    '''Return the sorted list of files inside the source root that the python
+    file imports, directly or through other imported files. Modules loaded
+    dynamically (like with `importlib`) are not found and should be listed in
+    the step's version files instead.
+    '''
+    src_root = os.path.abspath(src_root)
+    pending = [os.path.abspath(path)]
+    seen = set(pending)
+    while pending:
+        current_path = pending.pop()
+        mtime_ns = os.stat(current_path).st_mtime_ns
+        for imported_path in _get_direct_imports(current_path, src_root, mtime_ns):
+            if imported_path not in seen:
+                seen.add(imported_path)
+                pending.append(imported_path)
+    seen.discard(os.path.abspath(path))
+    return sorted(seen)
+
+
+def compute_step_fingerprint(step: StepDefinition, env: Optional[dict] = None) -> str:
+    '''Compute a fingerprint for the step that changes whenever the contents of
+    its inputs, its command or its version files change.
+    '''
+    env = os.environ if env is None else env
+    fingerprint = hashlib.sha256()
+
+    def _update(*values):
+        for value in values:
+            fingerprint.update(value.encode('utf-8'))
+            fingerprint.update(b'\0')
+
+    _update('format', str(CACHE_FORMAT_VERSION), 'name', step.name)
+    _update('command', *[_normalize_path_str(arg, env) for arg in step.command])
+
+    for idx, pattern in enumerate(step.inputs):
+        paths = _match_files(pattern)
+        if not paths:
+            raise ValueError('Step input does not exist: %s' % pattern)
+
+        files = [path for path in paths if not os.path.isdir(path)]
+        path_hashes = dict(zip(files, compute_file_hashes(files)))
+        for path in paths:
+            path_hash = path_hashes.get(path) or compute_dir_hash(path)
+            _update('input', str(idx), os.path.basename(path), path_hash)
+
+    version_files = sorted(step.version_files)
+    for path, file_hash in zip(version_files, compute_file_hashes(version_files)):
+        _update('version', os.path.basename(path), file_hash)
+
+    src_root = env.get('PIPELINE_SRC_ROOT') or DEFAULT_SRC_ROOT
+    module_files = set()
+    for path in version_files:
+        if _is_python_file(path):
+            module_files.update(get_imported_files(path, src_root))
+    module_files = sorted(module_files)
+    for path, file_hash in zip(module_files, compute_file_hashes(module_files)):
+        _update('module', os.path.relpath(path, src_root), file_hash)
+
+    return fingerprint.hexdigest()
+
+
+class StepCache:
+    '''Store and restore the outputs of successful pipeline step runs.
+
+    Each step has a directory inside the cache directory that contains the
+    outputs of the step's most recent successful run, along with a manifest
+    recording the fingerprint of that run.
+    '''
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _step_dir(self, step: StepDefinition) -> str:
+        # Step names can contain slashes. Flatten them into a single directory.
+        return os.path.join(self.cache_dir, step.name.replace('/', '__'))
+
+    def _read_manifest(self, step: StepDefinition) -> Optional[dict]:
+        manifest_path = os.path.join(self._step_dir(step), MANIFEST_FILENAME)
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def restore(self, step: StepDefinition, fingerprint: str) -> bool:
+        '''Restore the outputs recorded for the step if the step was previously
+        run successfully with the same fingerprint. Return whether the outputs
+        were restored.
+        '''
+        manifest = self._read_manifest(step)
+        if not manifest or manifest['fingerprint'] != fingerprint:
+            return False
+
+        if len(manifest['outputs']) != len(step.outputs):
+            return False
+
+        step_dir = self._step_dir(step)
+        for pattern, stored_files in zip(step.outputs, manifest['outputs']):
+            output_root = _get_pattern_root(pattern)
+            for relative_path, stored_name in stored_files:
+                output_path = os.path.join(output_root, relative_path)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                shutil.copy2(os.path.join(step_dir, stored_name), output_path)
+        return True
+
+    def store(self, step: StepDefinition, fingerprint: str) -> None:
+        '''Record the outputs of a successful run of the step.'''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Build the new entry in a temporary directory and swap it in once it is
+        # complete so that an interrupted store never leaves a partial entry.
+        new_dir = tempfile.mkdtemp(prefix='.tmp_', dir=self.cache_dir)
+        try:
+            outputs = []
+            for idx, pattern in enumerate(step.outputs):
+                paths = _match_files(pattern)
+                if not paths:
+                    raise ValueError('Step output was not created: %s' % pattern)
+
+                # Paths are recorded relative to the pattern's root directory
+                # since a glob can match files in different subdirectories.
+                output_root = _get_pattern_root(pattern)
+                stored_files = []
+                for path_idx, path in enumerate(paths):
+                    stored_name = '%d_%d_%s' % (idx, path_idx, os.path.basename(path))
+                    shutil.copy2(path, os.path.join(new_dir, stored_name))
+                    stored_files.append(
+                        (os.path.relpath(path, output_root), stored_name)
+                    )
+                outputs.append(stored_files)
+
+            manifest = {
+                'fingerprint': fingerprint,
+                'name': step.name,
+                'outputs': outputs,
+            }
+            with open(os.path.join(new_dir, MANIFEST_FILENAME), 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+
+            step_dir = self._step_dir(step)
+            old_dir = None
+            if os.path.exists(step_dir):
+                old_dir = '%s.old' % new_dir
+                os.rename(step_dir, old_dir)
+            os.rename(new_dir, step_dir)
+            if old_dir:
+                shutil.rmtree(old_dir)
+        except Exception:
+            shutil.rmtree(new_dir, ignore_errors=True)
+            raise
+
+
+def run_cached_step(step: StepDefinition, cache: StepCache) -> bool:
+    '''Run the step's command unless the outputs of a previous successful run
+    with the same fingerprint can be restored. Return whether the command was
+    run.
+    '''
+    fingerprint = compute_step_fingerprint(step)
+    if cache.restore(step, fingerprint):
+        LOG.info('Step %s is unchanged. Restored outputs from cache.', step.name)
+        return False
+
+    LOG.info('Running step %s', step.name)
+    subprocess.run(step.command, check=True)
+    cache.store(step, fingerprint)
+    return True
@@ -0,0 +1,363 @@
+'''Dependency-aware parallel scheduler for pipeline steps.
+
+Pipeline steps normally run one at a time, in the order of their priority
+prefix, even when they do not depend on each other (like converting the SIM and
+SIVEP sources). The scheduler instead derives a dependency graph from the files
+each step declares it reads and writes: a step depends on the steps that write
+one of its inputs, and steps using the same file run in the order they were
+declared. Steps whose dependencies have finished are run concurrently,
+as long as the CPU and memory they declare fit inside the scheduler's budget.
+
+When all steps have finished, the critical path (the chain of dependent steps
+with the longest total runtime) is reported. This is the lower bound on the
+runtime of the pipeline no matter how many steps run in parallel, so it shows
+which steps are worth optimizing.
+
+Example usage:
+
+steps = [
+    ScheduledStep(
+        name='sim/convert',
+        command=['convert_raw_sim.py', '--output_file_pattern=/tmp/sim_#.csv.lz4'],
+        inputs=['/feed/sim_*.csv.lz4'],
+        outputs=['/tmp/sim_*.csv.lz4'],
+        cpus=2,
+        memory_mb=4000,
+    ),
+    ...
+]
+results = StepScheduler(max_cpus=8, max_memory_mb=16000).run(steps)
+(critical_path, duration) = compute_critical_path(steps, results)
+'''
+
+import fnmatch
+import os
+import re
+import subprocess
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from log import LOG
+from util.pipeline.step_cache import StepCache, StepDefinition, run_cached_step
+
+_GLOB_CHARS = re.compile(r'[*?[]')
+
+
+class ScheduledStep(NamedTuple):
+    # Unique name of the step, like `sim/convert`.
+    name: str
+
+    # Command to run, as a list of arguments.
+    command: List[str]
+
+    # Input files, directories or glob patterns read by the step.
+    inputs: List[str] = []
+
+    # Output files or glob patterns written by the step.
+    outputs: List[str] = []
+
+    # Names of steps that must finish before this step can start, in addition to
+    # the steps that write this step's inputs.
+    depends_on: List[str] = []
+
+    # Number of CPUs and megabytes of memory the step needs while running.
+    cpus: int = 1
+    memory_mb: int = 0
+
+    # Files that define the version of the step, like the script being run. Only
+    # used when the step is run through the step cache.
+    version_files: List[str] = []
+
+
+class StepResult(NamedTuple):
+    name: str
+    start_time: float
+    end_time: float
+
+    # Whether the command was run. False if the outputs were restored from the
+    # step cache.
+    ran: bool
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+
+def _has_glob(component: str) -> bool:
+    return bool(_GLOB_CHARS.search(component))
+
+
+def _components_overlap(component_a: str, component_b: str) -> bool:
+    '''Return whether two path components can match the same name.'''
+    if not _has_glob(component_b):
+        return fnmatch.fnmatchcase(component_b, component_a)
+    if not _has_glob(component_a):
+        return fnmatch.fnmatchcase(component_a, component_b)
+
+    # NOTE(stephen): Testing if two glob patterns can match the same name is not
+    # worth doing exactly. Assume they overlap unless their fixed prefixes or
+    # suffixes are different.
+    (prefix_a, suffix_a) = _get_fixed_parts(component_a)
+    (prefix_b, suffix_b) = _get_fixed_parts(component_b)
+    return (prefix_a.startswith(prefix_b) or prefix_b.startswith(prefix_a)) and (
+        suffix_a.endswith(suffix_b) or suffix_b.endswith(suffix_a)
+    )
+
+
+def _get_fixed_parts(component: str) -> Tuple[str, str]:
+    '''Return the text before the first and after the last glob character.'''
+    matches = list(_GLOB_CHARS.finditer(component))
+    suffix_start = matches[-1].end()
+    # The last glob character can be the start of a `[...]` set.
+    if component[matches[-1].start()] == '[':
+        suffix_start = component.find(']', suffix_start + 1) + 1 or len(component)
+    return (component[: matches[0].start()], component[suffix_start:])
+
+
+def _patterns_overlap(pattern_a: str, pattern_b: str) -> bool:
+    '''Return whether the two paths (which can contain glob patterns) can refer
+    to the same file. A directory overlaps with every path inside it.
+    '''
+    components_a = os.path.normpath(pattern_a).split(os.sep)
+    components_b = os.path.normpath(pattern_b).split(os.sep)
+    for (component_a, component_b) in zip(components_a, components_b):
+        # A recursive glob can match any number of directories.
+        if component_a == '**' or component_b == '**':
+            return True
+        if not _components_overlap(component_a, component_b):
+            return False
+
+    # All components of the shorter path match, so one path is equal to or
+    # inside of the other.
+    return True
+
+
+def _any_overlap(patterns_a: List[str], patterns_b: List[str]) -> bool:
+    return any(
+        _patterns_overlap(pattern_a, pattern_b)
+        for pattern_a in patterns_a
+        for pattern_b in patterns_b
+    )
+
+
+def _sort_steps(steps: List[ScheduledStep], dependencies: Dict[str, Set[str]]):
+    '''Return the step names in an order where every step comes after all of its
+    dependencies. Steps are otherwise kept in their original order.
+    '''
+    ordered = []
+    visited = set()
+    in_progress = set()
+
+    def _visit(name, path):
+        if name in visited:
+            return
+        if name in in_progress:
+            cycle = path[path.index(name) :] + [name]
+            raise ValueError('Pipeline steps have a cycle: %s' % ' -> '.join(cycle))
+
+        in_progress.add(name)
+        for dependency in sorted(dependencies[name]):
+            _visit(dependency, path + [name])
+        in_progress.remove(name)
+        visited.add(name)
+        ordered.append(name)
+
+    for step in steps:
+        _visit(step.name, [])
+    return ordered
+
+
+def build_step_graph(steps: List[ScheduledStep]) -> Dict[str, Set[str]]:
+    '''Build a mapping from step name to the names of the steps it depends on.
+
+    A step depends on the steps declared before it that write one of its inputs.
+    When no earlier step writes the input, the step depends on the later steps
+    that produce it instead. Steps writing the same file run in the order they
+    were declared, and a step that writes a file waits for the steps declared
+    before it that read the file. This lets a step rewrite a file in place
+    without racing the other steps using the file.
+
+    Steps also depend on the steps they explicitly depend on.
+    '''
+    step_names = set()
+    for step in steps:
+        if step.name in step_names:
+            raise ValueError('Duplicate pipeline step: %s' % step.name)
+        step_names.add(step.name)
+
+    # Dependencies on the steps producing each step's inputs.
+    dependencies = {}
+    for (idx, step) in enumerate(steps):
+        step_dependencies = set()
+        for name in step.depends_on:
+            if name not in step_names:
+                raise ValueError(
+                    'Step %s depends on unknown step: %s' % (step.name, name)
+                )
+            step_dependencies.add(name)
+
+        for input_pattern in step.inputs:
+            writers = [
+                (writer_idx, writer)
+                for (writer_idx, writer) in enumerate(steps)
+                if writer_idx != idx and _any_overlap([input_pattern], writer.outputs)
+            ]
+            earlier_writers = [
+                writer.name for (writer_idx, writer) in writers if writer_idx < idx
+            ]
+            if earlier_writers:
+                step_dependencies.update(earlier_writers)
+                continue
+
+            # A step rewriting the input in place does not produce it.
+            step_dependencies.update(
+                writer.name
+                for (_, writer) in writers
+                if not _any_overlap([input_pattern], writer.inputs)
+            )
+        dependencies[step.name] = step_dependencies
+
+    # Order the steps writing a file after the earlier steps reading or writing
+    # it, unless the earlier step already depends on the writer.
+    for (idx, step) in enumerate(steps):
+        for previous in steps[:idx]:
+            if step.name not in dependencies[previous.name] and _any_overlap(
+                step.outputs, previous.inputs + previous.outputs
+            ):
+                dependencies[step.name].add(previous.name)
+
+    # Validate that the steps can be run in some order.
+    _sort_steps(steps, dependencies)
+    return dependencies
+
+
+def compute_critical_path(
+    steps: List[ScheduledStep], results: Dict[str, StepResult]
+) -> Tuple[List[str], float]:
+    '''Find the chain of dependent steps with the longest total runtime. Return
+    the step names in the chain, in the order they were run, and the total
+    runtime of the chain in seconds.
+    '''
+    dependencies = build_step_graph(steps)
+    # Longest total runtime of any chain ending with the step, and the previous
+    # step in that chain.
+    path_durations = {}
+    previous_steps = {}
+    for name in _sort_steps(steps, dependencies):
+        previous = max(
+            dependencies[name],
+            key=lambda dependency: path_durations[dependency],
+            default=None,
+        )
+        previous_steps[name] = previous
+        path_durations[name] = results[name].duration + (
+            path_durations[previous] if previous else 0
+        )
+
+    if not path_durations:
+        return ([], 0)
+
+    last_step = max(path_durations, key=lambda name: path_durations[name])
+    critical_path = []
+    name = last_step
+    while name:
+        critical_path.append(name)
+        name = previous_steps[name]
+    return (critical_path[::-1], path_durations[last_step])
+
+
+class StepScheduler:
+    '''Run pipeline steps concurrently while respecting the dependencies between
+    steps and a budget on the CPUs and memory used by the running steps.
+
+    A step that needs more than the whole budget is run by itself.
+    '''
+
+    def __init__(
+        self,
+        max_cpus: Optional[int] = None,
+        max_memory_mb: int = 0,
+        step_cache: Optional[StepCache] = None,
+    ):
+        self.max_cpus = max_cpus or os.cpu_count() or 1
+        # A memory budget of 0 means memory usage is not limited.
+        self.max_memory_mb = max_memory_mb
+        self.step_cache = step_cache
+
+    def _fits_budget(self, step, used_cpus, used_memory_mb):
+        # Always allow a step to run when nothing else is running so that steps
+        # larger than the budget can still make progress.
+        if not used_cpus and not used_memory_mb:
+            return True
+        if used_cpus + step.cpus > self.max_cpus:
+            return False
+        return (
+            not self.max_memory_mb
+            or used_memory_mb + step.memory_mb <= self.max_memory_mb
+        )
+
+    def _run_step(self, step: ScheduledStep) -> StepResult:
+        LOG.info('Starting step %s', step.name)
+        start_time = time.time()
+        ran = True
+        if self.step_cache:
+            cache_step = StepDefinition(
+                name=step.name,
+                command=step.command,
+                inputs=step.inputs,
+                outputs=step.outputs,
+                version_files=step.version_files,
+            )
+            ran = run_cached_step(cache_step, self.step_cache)
+        else:
+            subprocess.run(step.command, check=True)
+        end_time = time.time()
+        LOG.info('Finished step %s in %.1fs', step.name, end_time - start_time)
+        return StepResult(step.name, start_time, end_time, ran)
+
+    def run(self, steps: List[ScheduledStep]) -> Dict[str, StepResult]:
+        '''Run all steps and return the result of each step by name. If a step
+        fails, no new steps are started. The steps that are already running are
+        allowed to finish, and then the failure is raised.
+        '''
+        dependencies = build_step_graph(steps)
+        steps_by_name = {step.name: step for step in steps}
+        # Steps that are not running yet, in the order they were provided.
+        pending = [steps_by_name[name] for name in _sort_steps(steps, dependencies)]
+        results = {}
+        running = {}
+        used_cpus = 0
+        used_memory_mb = 0
+        error = None
+        with ThreadPoolExecutor(max_workers=max(len(steps), 1)) as executor:
+            while pending or running:
+                if not error:
+                    for step in list(pending):
+                        if not dependencies[step.name].issubset(results):
+                            continue
+                        if not self._fits_budget(step, used_cpus, used_memory_mb):
+                            continue
+                        pending.remove(step)
+                        running[executor.submit(self._run_step, step)] = step
+                        used_cpus += step.cpus
+                        used_memory_mb += step.memory_mb
+
+                if not running:
+                    break
+
+                (finished, _) = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    used_cpus -= step.cpus
+                    used_memory_mb -= step.memory_mb
+                    try:
+                        results[step.name] = future.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        LOG.error('Step %s failed: %s', step.name, e)
+                        error = error or e
+
+        if error:
+            raise error
+        return results
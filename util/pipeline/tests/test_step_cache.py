@@ -0,0 +1,155 @@
+import os
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+from util.file import directory_util
+from util.pipeline.step_cache import (
+    StepCache,
+    StepDefinition,
+    compute_step_fingerprint,
+    run_cached_step,
+)
+
+# Script that writes the line count of the input file into each output file and
+# records that it was run.
+STEP_SCRIPT = '''
+import os
+import sys
+
+(input_path, output_dir, run_log) = sys.argv[1:]
+with open(input_path) as input_file:
+    line_count = len(input_file.readlines())
+for name in ('a', 'b'):
+    os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+    with open(os.path.join(output_dir, name, 'rows.json'), 'w') as output_file:
+        output_file.write('%s %s' % (name, line_count))
+with open(run_log, 'a') as log_file:
+    log_file.write('run\\n')
+'''
+
+
+def _write(path, contents):
+    with open(path, 'w') as output_file:
+        output_file.write(contents)
+
+
+def _read(path):
+    with open(path) as input_file:
+        return input_file.read()
+
+
+class StepCacheTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = self.temp_dir.name
+        self.cache = StepCache(os.path.join(root, 'cache'))
+        hash_cache_patch = mock.patch.object(
+            directory_util, 'DEFAULT_HASH_CACHE_DIR', os.path.join(root, 'hashes')
+        )
+        hash_cache_patch.start()
+        self.addCleanup(hash_cache_patch.stop)
+        self.input_path = os.path.join(root, 'input.csv')
+        self.script_path = os.path.join(root, 'step.py')
+        self.output_dir = os.path.join(root, 'out')
+        self.run_log = os.path.join(root, 'runs.log')
+        _write(self.input_path, 'a\nb\n')
+        _write(self.script_path, STEP_SCRIPT)
+        self.step = StepDefinition(
+            name='test/step',
+            command=[
+                sys.executable,
+                self.script_path,
+                self.input_path,
+                self.output_dir,
+                self.run_log,
+            ],
+            inputs=[self.input_path],
+            outputs=[os.path.join(self.output_dir, '*', 'rows.json')],
+            version_files=[self.script_path],
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _run_count(self):
+        if not os.path.exists(self.run_log):
+            return 0
+        return len(_read(self.run_log).splitlines())
+
+    def test_cache_hit(self):
+        self.assertTrue(run_cached_step(self.step, self.cache))
+        self.assertFalse(run_cached_step(self.step, self.cache))
+        self.assertEqual(1, self._run_count())
+
+    def test_input_change_misses(self):
+        run_cached_step(self.step, self.cache)
+        _write(self.input_path, 'a\nb\nc\n')
+        self.assertTrue(run_cached_step(self.step, self.cache))
+        self.assertEqual(2, self._run_count())
+        self.assertEqual('a 3', _read(os.path.join(self.output_dir, 'a', 'rows.json')))
+
+    def test_version_file_change_misses(self):
+        run_cached_step(self.step, self.cache)
+        _write(self.script_path, STEP_SCRIPT + '\n# New version.\n')
+        self.assertTrue(run_cached_step(self.step, self.cache))
+        self.assertEqual(2, self._run_count())
+
+    def test_imported_module_change_misses(self):
+        # Build a source root with a package used by the step script.
+        src_root = os.path.join(self.temp_dir.name, 'src')
+        package_dir = os.path.join(src_root, 'pkg')
+        os.makedirs(package_dir)
+        _write(os.path.join(package_dir, '__init__.py'), '')
+        _write(os.path.join(package_dir, 'helper.py'), 'from . import shared\n')
+        _write(os.path.join(package_dir, 'shared.py'), 'VALUE = 1\n')
+        _write(os.path.join(package_dir, 'unused.py'), 'VALUE = 1\n')
+        _write(self.script_path, 'import json\nfrom pkg import helper\n' + STEP_SCRIPT)
+        env = {'PIPELINE_SRC_ROOT': src_root}
+
+        fingerprint = compute_step_fingerprint(self.step, env)
+        _write(os.path.join(package_dir, 'unused.py'), 'VALUE = 2\n')
+        self.assertEqual(fingerprint, compute_step_fingerprint(self.step, env))
+
+        # Modules imported through other modules are part of the fingerprint.
+        _write(os.path.join(package_dir, 'shared.py'), 'VALUE = 2\n')
+        new_fingerprint = compute_step_fingerprint(self.step, env)
+        self.assertNotEqual(fingerprint, new_fingerprint)
+
+        _write(os.path.join(package_dir, '__init__.py'), 'VALUE = 2\n')
+        self.assertNotEqual(new_fingerprint, compute_step_fingerprint(self.step, env))
+
+    def test_command_paths_are_normalized(self):
+        env = {'PIPELINE_TMP_DIR': self.temp_dir.name}
+        other_step = self.step._replace(
+            command=[
+                arg.replace(self.temp_dir.name, '/other/tmp')
+                for arg in self.step.command
+            ]
+        )
+        self.assertEqual(
+            compute_step_fingerprint(self.step, env),
+            compute_step_fingerprint(other_step, {'PIPELINE_TMP_DIR': '/other/tmp'}),
+        )
+        self.assertNotEqual(
+            compute_step_fingerprint(self.step, env),
+            compute_step_fingerprint(other_step, env),
+        )
+
+    def test_restore_glob_output(self):
+        run_cached_step(self.step, self.cache)
+
+        # Restore the outputs into a new output directory, like a new pipeline
+        # run would.
+        new_output_dir = os.path.join(self.temp_dir.name, 'new_out')
+        new_step = self.step._replace(
+            outputs=[os.path.join(new_output_dir, '*', 'rows.json')]
+        )
+        fingerprint = compute_step_fingerprint(self.step)
+        self.assertTrue(self.cache.restore(new_step, fingerprint))
+        self.assertEqual(['a', 'b'], sorted(os.listdir(new_output_dir)))
+        for name in ('a', 'b'):
+            self.assertEqual(
+                '%s 2' % name, _read(os.path.join(new_output_dir, name, 'rows.json'))
+            )
+        self.assertFalse(self.cache.restore(new_step, 'other fingerprint'))
@@ -0,0 +1,280 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from util.pipeline.step_scheduler import (
+    ScheduledStep,
+    StepResult,
+    StepScheduler,
+    build_step_graph,
+    compute_critical_path,
+)
+
+
+def _python_step(name, code, **kwargs):
+    return ScheduledStep(name=name, command=[sys.executable, '-c', code], **kwargs)
+
+
+def _graph(*steps):
+    dependencies = build_step_graph(list(steps))
+    return {name: sorted(names) for (name, names) in dependencies.items()}
+
+
+class BuildStepGraphTest(TestCase):
+    def test_input_written_by_other_step(self):
+        self.assertEqual(
+            {'convert': ['fetch'], 'fetch': [], 'other': []},
+            _graph(
+                ScheduledStep('fetch', [], outputs=['/t/raw.csv']),
+                ScheduledStep('convert', [], inputs=['/t/raw.csv']),
+                ScheduledStep('other', [], inputs=['/t/other.csv']),
+            ),
+        )
+
+    def test_later_producer(self):
+        self.assertEqual(
+            {'convert': ['fetch'], 'fetch': []},
+            _graph(
+                ScheduledStep('convert', [], inputs=['/t/raw.csv']),
+                ScheduledStep('fetch', [], outputs=['/t/raw.csv']),
+            ),
+        )
+
+    def test_glob_overlap(self):
+        self.assertEqual(
+            {'read': ['write'], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/sim_*.csv']),
+                ScheduledStep('read', [], inputs=['/t/*_x.csv']),
+            ),
+        )
+        self.assertEqual(
+            {'read': [], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/sim_*.csv']),
+                ScheduledStep('read', [], inputs=['/t/sivep_*.csv']),
+            ),
+        )
+        self.assertEqual(
+            {'read': [], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/sim_*.csv']),
+                ScheduledStep('read', [], inputs=['/t/*.json']),
+            ),
+        )
+        self.assertEqual(
+            {'read': ['write'], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/f[0-9].csv']),
+                ScheduledStep('read', [], inputs=['/t/f*1.csv']),
+            ),
+        )
+
+    def test_directory_input(self):
+        self.assertEqual(
+            {'read': ['write'], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/out/f.csv']),
+                ScheduledStep('read', [], inputs=['/t/out']),
+            ),
+        )
+        self.assertEqual(
+            {'read': ['write'], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/*/rows.json']),
+                ScheduledStep('read', [], inputs=['/t/out/']),
+            ),
+        )
+        self.assertEqual(
+            {'read': [], 'write': []},
+            _graph(
+                ScheduledStep('write', [], outputs=['/t/out_2/f.csv']),
+                ScheduledStep('read', [], inputs=['/t/out']),
+            ),
+        )
+
+    def test_in_place_rewriters(self):
+        self.assertEqual(
+            {'fetch': [], 'rewrite_1': ['fetch'], 'rewrite_2': ['fetch', 'rewrite_1']},
+            _graph(
+                ScheduledStep('fetch', [], outputs=['/t/f.csv']),
+                ScheduledStep(
+                    'rewrite_1', [], inputs=['/t/f.csv'], outputs=['/t/f.csv']
+                ),
+                ScheduledStep(
+                    'rewrite_2', [], inputs=['/t/f.csv'], outputs=['/t/f.csv']
+                ),
+            ),
+        )
+
+        # Files that are not produced by any step.
+        self.assertEqual(
+            {'rewrite_1': [], 'rewrite_2': ['rewrite_1']},
+            _graph(
+                ScheduledStep(
+                    'rewrite_1', [], inputs=['/t/f.csv'], outputs=['/t/f.csv']
+                ),
+                ScheduledStep(
+                    'rewrite_2', [], inputs=['/t/f.csv'], outputs=['/t/f.csv']
+                ),
+            ),
+        )
+
+    def test_reader_before_rewriter(self):
+        self.assertEqual(
+            {
+                'fetch': [],
+                'read_after': ['fetch', 'rewrite'],
+                'read_before': ['fetch'],
+                'rewrite': ['fetch', 'read_before'],
+            },
+            _graph(
+                ScheduledStep('fetch', [], outputs=['/t/f.csv']),
+                ScheduledStep('read_before', [], inputs=['/t/f.csv']),
+                ScheduledStep('rewrite', [], inputs=['/t/f.csv'], outputs=['/t/f.csv']),
+                ScheduledStep('read_after', [], inputs=['/t/f.csv']),
+            ),
+        )
+        self.assertEqual(
+            {'read_before': [], 'rewrite': ['read_before']},
+            _graph(
+                ScheduledStep('read_before', [], inputs=['/t/f.csv']),
+                ScheduledStep('rewrite', [], inputs=['/t/f.csv'], outputs=['/t/f.csv']),
+            ),
+        )
+
+    def test_same_file_writers(self):
+        self.assertEqual(
+            {'write_1': [], 'write_2': ['write_1']},
+            _graph(
+                ScheduledStep('write_1', [], outputs=['/t/f.csv']),
+                ScheduledStep('write_2', [], outputs=['/t/*.csv']),
+            ),
+        )
+
+    def test_explicit_dependencies(self):
+        self.assertEqual(
+            {'a': [], 'b': ['a']},
+            _graph(ScheduledStep('a', []), ScheduledStep('b', [], depends_on=['a'])),
+        )
+        with self.assertRaises(ValueError):
+            _graph(ScheduledStep('a', [], depends_on=['missing']))
+        with self.assertRaises(ValueError):
+            _graph(ScheduledStep('a', []), ScheduledStep('a', []))
+
+    def test_cycle(self):
+        with self.assertRaisesRegex(ValueError, 'cycle'):
+            _graph(
+                ScheduledStep('a', [], depends_on=['b']),
+                ScheduledStep('b', [], depends_on=['a']),
+            )
+
+
+class StepSchedulerTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def _copy_step(self, name, input_name, output_name, **kwargs):
+        code = 'import shutil, sys, time; time.sleep(0.2); shutil.copy(*sys.argv[1:])'
+        step = _python_step(
+            name,
+            code,
+            inputs=[self._path(input_name)],
+            outputs=[self._path(output_name)],
+            **kwargs,
+        )
+        return step._replace(
+            command=step.command + [self._path(input_name), self._path(output_name)]
+        )
+
+    def _build_steps(self, **kwargs):
+        with open(self._path('a.txt'), 'w') as input_file:
+            input_file.write('a')
+        with open(self._path('b.txt'), 'w') as input_file:
+            input_file.write('b')
+        return [
+            self._copy_step('copy_a', 'a.txt', 'a_1.txt', **kwargs),
+            self._copy_step('copy_b', 'b.txt', 'b_1.txt', **kwargs),
+            self._copy_step('copy_a_1', 'a_1.txt', 'a_2.txt', **kwargs),
+        ]
+
+    def test_run(self):
+        results = StepScheduler(max_cpus=4).run(self._build_steps())
+        self.assertEqual({'copy_a', 'copy_b', 'copy_a_1'}, set(results))
+        self.assertTrue(os.path.exists(self._path('a_2.txt')))
+
+        # Independent steps run concurrently, dependent steps run after the step
+        # producing their input.
+        self.assertLess(results['copy_b'].start_time, results['copy_a'].end_time)
+        self.assertGreaterEqual(
+            results['copy_a_1'].start_time, results['copy_a'].end_time
+        )
+
+    def test_budget_admission(self):
+        # Only one step fits in the CPU budget at a time.
+        results = StepScheduler(max_cpus=3).run(self._build_steps(cpus=2))
+        intervals = sorted(
+            (result.start_time, result.end_time) for result in results.values()
+        )
+        for (previous, current) in zip(intervals, intervals[1:]):
+            self.assertGreaterEqual(current[0], previous[1])
+
+        scheduler = StepScheduler(max_cpus=4, max_memory_mb=1000)
+        step = ScheduledStep('step', [], cpus=2, memory_mb=600)
+        self.assertTrue(scheduler._fits_budget(step, 2, 400))
+        self.assertFalse(scheduler._fits_budget(step, 3, 0))
+        self.assertFalse(scheduler._fits_budget(step, 1, 500))
+
+        # Steps larger than the budget run when nothing else is running.
+        large_step = ScheduledStep('large', [], cpus=8, memory_mb=2000)
+        self.assertTrue(scheduler._fits_budget(large_step, 0, 0))
+        self.assertFalse(scheduler._fits_budget(large_step, 1, 0))
+
+    def test_failure(self):
+        steps = self._build_steps()
+        steps[0] = steps[0]._replace(
+            command=[sys.executable, '-c', 'import sys; sys.exit(3)']
+        )
+        steps.append(
+            self._copy_step('copy_b_1', 'b_1.txt', 'b_2.txt', depends_on=['copy_a'])
+        )
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            StepScheduler(max_cpus=4).run(steps)
+        self.assertEqual(3, context.exception.returncode)
+
+        # The step that was already running finished, but no new steps were
+        # started after the failure.
+        self.assertTrue(os.path.exists(self._path('b_1.txt')))
+        self.assertFalse(os.path.exists(self._path('a_2.txt')))
+        self.assertFalse(os.path.exists(self._path('b_2.txt')))
+
+
+class CriticalPathTest(TestCase):
+    def test_critical_path(self):
+        steps = [
+            ScheduledStep('fetch', [], outputs=['/t/raw_*.csv']),
+            ScheduledStep('sim', [], inputs=['/t/raw_sim.csv'], outputs=['/t/sim']),
+            ScheduledStep('sivep', [], inputs=['/t/raw_sivep.csv'], outputs=['/t/sv']),
+            ScheduledStep('other', []),
+            ScheduledStep('index', [], inputs=['/t/sim', '/t/sv']),
+        ]
+        durations = {'fetch': 2, 'sim': 5, 'sivep': 3, 'other': 7, 'index': 1}
+        results = {
+            name: StepResult(name, 100, 100 + duration, True)
+            for (name, duration) in durations.items()
+        }
+        self.assertEqual(
+            (['fetch', 'sim', 'index'], 8), compute_critical_path(steps, results)
+        )
+
+        results['other'] = StepResult('other', 100, 110, True)
+        self.assertEqual((['other'], 10), compute_critical_path(steps, results))
+        self.assertEqual(([], 0), compute_critical_path([], {}))
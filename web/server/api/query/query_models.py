@@ -20,6 +20,7 @@ from web.server.query.data_quality.reporting_completeness_line_graph import (
     ReportingCompletenessLineGraph,
 )
 from web.server.query.visualizations.bar_graph import BarGraphVisualization
+from web.server.query.visualizations.batch import get_batch_response
 from web.server.query.visualizations.hierarchy import HierarchyVisualization
 from web.server.query.visualizations.line_graph import LineGraphVisualization
 from web.server.query.visualizations.map import Map
@@ -43,6 +44,49 @@ OUTLIERS_VISUALIZATION_REQUEST = fields.Object(
     properties={'queryRequest': QUERY_REQUEST, 'outlierType': fields.String()}
 )
 
+BATCH_VISUALIZATION_TYPES = ['bar_graph', 'hierarchy', 'line_graph', 'map', 'table']
+
+BATCH_QUERY_REQUEST = fields.Object(
+    properties={
+        'queries': fields.Array(
+            fields.Object(
+                properties={
+                    'type': fields.String(enum=BATCH_VISUALIZATION_TYPES),
+                    'request': QUERY_REQUEST,
+                }
+            )
+        )
+    }
+)
+
+
+def build_visualization(visualization_type, raw_request):
+    request = related.to_model(QueryRequest, raw_request)
+    query_client = current_app.query_client
+    datasource = current_app.druid_context.current_datasource
+    if visualization_type == 'bar_graph':
+        return BarGraphVisualization(request, query_client, datasource)
+    if visualization_type == 'hierarchy':
+        return HierarchyVisualization(request, query_client, datasource)
+    if visualization_type == 'line_graph':
+        return LineGraphVisualization(request, query_client, datasource)
+    if visualization_type == 'table':
+        return TableVisualization(request, query_client, datasource)
+
+    assert visualization_type == 'map', (
+        'Unsupported visualization type: %s' % visualization_type
+    )
+    configuration_module = current_app.zen_config
+    return Map(
+        request,
+        query_client,
+        datasource,
+        configuration_module.aggregation.DIMENSION_PARENTS,
+        configuration_module.aggregation.GEO_TO_LATLNG_FIELD,
+        configuration_module.aggregation.GEO_FIELD_ORDERING,
+        configuration_module.general.NATION_NAME,
+    )
+
 
 class QueryResource(PrincipalResource):
     class Meta:
@@ -112,6 +156,18 @@ class QueryResource(PrincipalResource):
             current_app.druid_context.current_datasource,
         ).get_response()
 
+    # Run the queries for many visualizations (like the tiles of a dashboard) at
+    # once. Compatible queries are merged into a single druid query. The responses
+    # are returned in the same order as the queries.
+    # pylint: disable=no-member
+    @Route.POST('/batch', schema=BATCH_QUERY_REQUEST, response_schema=fields.Any())
+    def batch(self, raw_request):  # pylint: disable=no-self-use
+        visualizations = [
+            build_visualization(query['type'], query['request'])
+            for query in raw_request['queries']
+        ]
+        return get_batch_response(visualizations, current_app.query_client)
+
     # NOTE(stephen, david): Right now, data quality uses the query endpoint and
     # models to run its queries and build results.
     # TODO(stephen, david): Move to a data quality specific resource when
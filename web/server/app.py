@@ -14,6 +14,7 @@ from log import LOG
 from config.loader import import_configuration_module
 from data.query.mock import generate_query_mock_data
 from db.druid.datasource import SiteDruidDatasource
+from db.druid.query_cache import CachingDruidQueryClient, QueryResultCache
 from db.druid.query_client import DruidQueryClient_
 from db.druid.metadata import DruidMetadata_
 from db.druid.config import construct_druid_configuration
@@ -46,6 +47,7 @@ from web.server.routes.views.authentication import authentication_required
 from web.server.routes.views.query_policy import AuthorizedQueryClient
 from web.server.routes.views.locations import LocationHierarchy
 from web.server.routes.webpack_dev_proxy import webpack_dev_proxy
+from web.server.redis.client import create_instance as create_redis_instance
 from web.server.security.signal_handlers import register_for_signals
 from web.server.security.jwt_manager import JWTManager
 from web.server.util.dev.static_data_query_client import StaticDataQueryClient
@@ -215,6 +217,25 @@ def _fail_if_schema_upgrade_needed():
     LOG.info('Database schema version is: %s', status.current_revision)
 
 
+def _build_query_client(app, druid_configuration, druid_metadata):
+    '''Build the query client used for user queries. Results are cached until a
+    new version of the queried datasource is loaded.
+    '''
+    shared_cache = None
+    if app.config.get('QUERY_CACHE_USE_REDIS'):
+        shared_cache = create_redis_instance(
+            app.config.get('REDIS_HOST', 'redis'),
+            int(app.config.get('REDIS_PORT', '6379')),
+        )
+    result_cache = QueryResultCache(
+        druid_metadata,
+        max_bytes=app.config['QUERY_CACHE_MAX_BYTES'],
+        max_entry_bytes=app.config['QUERY_CACHE_MAX_ENTRY_BYTES'],
+        shared_cache=shared_cache,
+    )
+    return CachingDruidQueryClient(druid_configuration, result_cache)
+
+
 def _initialize_druid_context(app):
     zen_configuration = app.zen_config
     # Pulling Data from Zen_Config Module
@@ -328,7 +349,11 @@ def _initialize_druid_context(app):
         datasource,
     )
 
-    app.query_client = AuthorizedQueryClient(system_query_client)
+    app.query_client = AuthorizedQueryClient(
+        _build_query_client(app, druid_configuration, druid_metadata)
+        if app.config.get('QUERY_CACHE_ENABLED') and not OFFLINE_MODE
+        else system_query_client
+    )
     app.system_query_client = system_query_client
     app.druid_context = druid_context
 
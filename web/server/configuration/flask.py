@@ -112,6 +112,20 @@ class FlaskConfiguration:
         self.ASYNC_NOTIFICATIONS_ENABLED = False
 
         self.REDIS_HOST = getenv('REDIS_HOST', global_config.REDIS_HOST)
+
+        # Druid query result cache settings. Results are cached in-process and,
+        # if enabled, in Redis so that they are shared between workers. Every
+        # gunicorn worker holds its own in-process cache, so the byte budget is
+        # per worker. Results larger than QUERY_CACHE_MAX_ENTRY_BYTES are never
+        # cached.
+        self.QUERY_CACHE_ENABLED = getenv('QUERY_CACHE_ENABLED', '0') == '1'
+        self.QUERY_CACHE_MAX_BYTES = int(
+            getenv('QUERY_CACHE_MAX_BYTES', str(32 * 1024 * 1024))
+        )
+        self.QUERY_CACHE_MAX_ENTRY_BYTES = int(
+            getenv('QUERY_CACHE_MAX_ENTRY_BYTES', str(2 * 1024 * 1024))
+        )
+        self.QUERY_CACHE_USE_REDIS = getenv('QUERY_CACHE_USE_REDIS', '0') == '1'
         self.HASURA_HOST = getenv(
             'HASURA_HOST',
             global_config.HASURA_HOST if IS_PRODUCTION else 'http://localhost:8088',
@@ -265,7 +265,7 @@ class DataQualityReport(QueryBase):
 
         return output
 
-    def get_no_date_filter_df(self) -> pd.DataFrame:
+    def build_no_date_filter_query(self) -> GroupByQueryBuilder:
         intervals = [
             current_app.druid_context.data_time_boundary.get_full_time_interval()
         ]
@@ -280,7 +280,7 @@ class DataQualityReport(QueryBase):
         druid_grouping_selection = parse_groups_for_query(
             self.request.groups, intervals
         )
-        query = GroupByQueryBuilder(
+        return GroupByQueryBuilder(
             datasource=self.datasource.name,
             granularity=druid_grouping_selection.granularity,
             grouping_fields=druid_grouping_selection.dimensions,
@@ -288,10 +288,7 @@ class DataQualityReport(QueryBase):
             calculation=self.request.build_calculation(),
         )
 
-        raw_df = self.query_client.run_query(query).export_pandas()
-        return self.build_df(raw_df)
-
-    def get_no_geo_filter_df(self) -> pd.DataFrame:
+    def build_no_geo_filter_query(self) -> GroupByQueryBuilder:
         # TODO(david): Work out a way of removing dimension filters from the
         # calculation as extra filters can be added to individual fields in
         # insights.
@@ -299,7 +296,7 @@ class DataQualityReport(QueryBase):
         druid_grouping_selection = parse_groups_for_query(
             self.request.groups, intervals
         )
-        query = GroupByQueryBuilder(
+        return GroupByQueryBuilder(
             datasource=self.datasource.name,
             granularity=druid_grouping_selection.granularity,
             grouping_fields=druid_grouping_selection.dimensions,
@@ -307,15 +304,24 @@ class DataQualityReport(QueryBase):
             calculation=self.request.build_calculation(),
         )
 
-        raw_df = self.query_client.run_query(query).export_pandas()
-        return self.build_df(raw_df)
-
     # pylint: disable=arguments-differ
     def get_response(self, include_outliers=False):
         outliers_response = None
+
+        # Issue all queries the report needs at the same time so that the
+        # report only waits for the slowest query.
+        query = self.build_query() if self._can_run_query() else None
+        queries = [self.build_no_date_filter_query(), self.build_no_geo_filter_query()]
+        if query:
+            queries.append(query)
+        results = self.query_client.run_queries(queries)
+
+        df = pd.DataFrame()
+        if query:
+            df = self._process_query_result(query, results.pop())
+        (no_date_filter_df, no_geo_filter_df) = [
+            self.build_df(result.export_pandas()) for result in results
+        ]
         return self.build_response(
-            self.get_df(),
-            self.get_no_date_filter_df(),
-            self.get_no_geo_filter_df(),
-            outliers_response,
+            self.build_df(df), no_date_filter_df, no_geo_filter_df, outliers_response
         )
@@ -1,7 +1,7 @@
 # mypy: disallow_untyped_defs=True
 from abc import ABC, abstractmethod
 from http.client import INTERNAL_SERVER_ERROR
-from typing import List, Optional, Union
+from typing import Any, List, Optional, Union
 
 import numpy as np
 import pandas as pd
@@ -77,24 +77,41 @@ class QueryBase(ABC):
         self.datasource = datasource
         self.fill_intermediate_dates = fill_intermediate_dates
 
-    def _run_query(self) -> pd.DataFrame:
-        '''Run the built query and return the results in a dataframe.'''
-        df = None
-
+    def _can_run_query(self) -> bool:
+        '''Test if the request can be converted into a Druid query that will
+        return results.'''
         if self.request.filter and not self.request.filter.is_valid():
             LOG.info(
                 'Encountered invalid filter, returning empty dataframe: %s',
                 self.request.filter,
             )
-            return pd.DataFrame()
+            return False
 
         # Cowardly refuse to issue a query if no fields have been selected since
         # druid won't be able to return results.
-        if self.request.fields:
-            query = self.build_query()
-            result = self.query_client.run_query(query)
-            df = result.export_pandas(self.fill_intermediate_dates)
+        return bool(self.request.fields)
+
+    def _run_query(self) -> pd.DataFrame:
+        '''Run the built query and return the results in a dataframe.'''
+        if not self._can_run_query():
+            return pd.DataFrame()
 
+        query = self.build_query()
+        result = self.query_client.run_columnar_query(query)
+        return self._process_query_result(query, result)
+
+    def _process_query_result(
+        self, query: GroupByQueryBuilder, result: Any
+    ) -> pd.DataFrame:
+        '''Convert the result of the built query into a dataframe.'''
+        df = result.export_pandas(self.fill_intermediate_dates)
+        return self._process_query_df(query, df)
+
+    def _process_query_df(
+        self, query: GroupByQueryBuilder, df: Optional[pd.DataFrame]
+    ) -> pd.DataFrame:
+        '''Clean up the dataframe exported from the built query's result and
+        apply the calculations that are computed after the query is run.'''
         # pydruid doesn't return a DataFrame if the result is empty
         # TODO(stephen): Handle empty results more cleanly. Potentially show
         # error messages
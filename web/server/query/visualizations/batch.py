@@ -0,0 +1,69 @@
+# mypy: disallow_untyped_defs=True
+from http.client import INTERNAL_SERVER_ERROR
+from typing import List
+
+import pandas as pd
+from werkzeug.exceptions import abort
+
+from db.druid.errors import DruidQueryError
+from db.druid.query_merger import merge_group_by_queries, split_merged_result
+from web.server.query.visualizations.base import QueryBase
+from web.server.query.visualizations.util import clean_df_for_json_export
+from web.server.routes.views.query_policy import AuthorizedQueryClient
+
+
+def build_batch_dataframes(
+    visualizations: List[QueryBase], query_client: AuthorizedQueryClient
+) -> List[pd.DataFrame]:
+    '''Run the queries of all visualizations and return the raw query result
+    dataframe for each visualization.
+
+    Compatible queries (like the tiles of a dashboard querying different fields for
+    the same geography and date range) are merged into a single druid query, and the
+    merged queries are run in parallel.
+    '''
+    # pylint: disable=protected-access
+    raw_dfs = [pd.DataFrame() for _ in visualizations]
+    runnable_indices = [
+        idx
+        for (idx, visualization) in enumerate(visualizations)
+        if visualization._can_run_query()
+    ]
+    if not runnable_indices:
+        return raw_dfs
+
+    merged_queries = merge_group_by_queries(
+        [visualizations[idx].build_query() for idx in runnable_indices]
+    )
+    results = query_client.run_columnar_queries(
+        [merged.query for merged in merged_queries]
+    )
+    for (merged, result) in zip(merged_queries, results):
+        # NOTE(stephen): Intermediate dates must be filled after the result is split
+        # since each visualization only has values for a subset of the merged rows.
+        df = result.export_pandas()
+        for member in merged.members:
+            idx = runnable_indices[member.index]
+            visualization = visualizations[idx]
+            member_df = split_merged_result(df, merged, member)
+            if visualization.fill_intermediate_dates:
+                member_df = result.fill_intermediate_dates(member_df)
+            raw_dfs[idx] = visualization._process_query_df(merged.query, member_df)
+    return raw_dfs
+
+
+def get_batch_response(
+    visualizations: List[QueryBase], query_client: AuthorizedQueryClient
+) -> List[object]:
+    '''Return the formatted query response of each visualization to send to the
+    frontend.'''
+    try:
+        raw_dfs = build_batch_dataframes(visualizations, query_client)
+        return [
+            visualization.build_response(
+                clean_df_for_json_export(visualization.build_df(raw_df))
+            )
+            for (visualization, raw_df) in zip(visualizations, raw_dfs)
+        ]
+    except DruidQueryError:
+        abort(INTERNAL_SERVER_ERROR, 'Druid query error')
@@ -337,5 +337,25 @@ class AuthorizedQueryClient:
     def run_query(self, query):
         return self.query_client.run_query(query)
 
+    @apply_authorization_filters()
+    def run_columnar_query(self, query):
+        return self.query_client.run_columnar_query(query)
+
+    @apply_authorization_filters()
+    def authorize_query(self, query):  # pylint: disable=no-self-use
+        return query
+
+    def run_queries(self, queries, **kwargs):
+        # NOTE: Authorization filters depend on the current request context, so
+        # they must be applied before the queries are sent to other threads.
+        return self.query_client.run_queries(
+            [self.authorize_query(query) for query in queries], **kwargs
+        )
+
+    def run_columnar_queries(self, queries, **kwargs):
+        return self.query_client.run_columnar_queries(
+            [self.authorize_query(query) for query in queries], **kwargs
+        )
+
     def run_raw_query(self, query):
         return self.query_client.run_raw_query(query)